@@ -1,10 +1,32 @@
+import argparse
 import asyncio
+import collections
 import struct
 import logging
-import os
+import signal
 import subprocess
-
-logging.basicConfig(level=logging.DEBUG)
+import time
+
+import aac
+import amf0
+import h264
+import hls
+from metrics import ServerMetrics, start_http_server
+from rtmp_capture import CaptureWriter
+from rtmp_chunk import ChunkDemuxer, ChunkMuxer, ChunkProtocolError
+from rtmp_handshake import S1Pool, handshake_response
+from rtmp_http import start_media_http_server
+from rtmp_live import SOUND_FORMAT_AAC, LiveStream, Subscriber
+from rtmp_memory import MemoryBudget
+from rtmp_record import RecordingWriter
+from rtmp_templates import NUMBER, STRING, TemplateCache
+from rtmp_tuning import (
+    TuningSettings,
+    create_listen_socket,
+    select_event_loop,
+    tune_connection,
+)
+from tracing import TRACE, Tracer
 
 # Configure Video/Audio Sources; let FFMpeg automatically launch stream or use OBS Studio seperately
 video_device = "1080P Pro Stream"
@@ -18,12 +40,116 @@ APPLICATION = "live"
 SERVERLINKANDPORT = f"rtmp://{localhost}:{localport}"
 SERVERLINKANDPORTANDAPP = f"rtmp://{localhost}:{localport}/{APPLICATION}"
 
+# Ingest transport: "protocol" (asyncio.BufferedProtocol, one callback per socket
+# read) or "stream" (StreamReader/StreamWriter coroutine per client)
+INGEST_MODE = "protocol"
+
+# Live fan-out: per-player send queue bound and what to do when a player falls
+# behind it: "drop" new messages, "disconnect" the player, or "skip" to the
+# next keyframe
+SUBSCRIBER_QUEUE_BYTES = 4 * 1024 * 1024
+SLOW_CONSUMER_POLICY = "skip"
+# Per-stream bound on the cached GOP replayed to players when they join
+GOP_CACHE_BYTES = 16 * 1024 * 1024
+
+# Memory protection. Per connection: inbound messages over MAX_MESSAGE_SIZE,
+# or more than MAX_PARTIAL_MESSAGES / MAX_PARTIAL_BYTES of messages still being
+# received, close the connection. Server-wide, partial messages, player send
+# queues and GOP caches are charged to one budget: above MEMORY_HIGH_WATER
+# the GOP caches are dropped and every connection stops reading until it falls
+# back to MEMORY_LOW_WATER, and above MEMORY_LIMIT the connections holding the
+# most are closed.
+MAX_MESSAGE_SIZE = 8 * 1024 * 1024
+MAX_PARTIAL_MESSAGES = 8
+MAX_PARTIAL_BYTES = 16 * 1024 * 1024
+MEMORY_HIGH_WATER = 512 * 1024 * 1024
+MEMORY_LOW_WATER = 384 * 1024 * 1024
+MEMORY_LIMIT = 768 * 1024 * 1024
+
+# Logging and tracing: TRACE/DEBUG events are only emitted for this fraction of
+# connections, and each connection keeps its last TRACE_RING_SIZE chunk
+# headers to dump on errors or SIGUSR1 (0 disables the ring)
+LOG_LEVEL = "INFO"
+TRACE_SAMPLE_RATE = 1.0
+TRACE_RING_SIZE = 64
+# Bytes of a payload included in TRACE message events
+TRACE_PAYLOAD_BYTES = 32
+
+# Prometheus metrics endpoint (http://METRICS_HOST:METRICS_PORT/metrics);
+# 0 disables it. With --workers, worker N serves on METRICS_PORT + N.
+METRICS_HOST = localhost
+METRICS_PORT = 9935
+
+# Raw capture of every connection's inbound bytes into CAPTURE_DIR (None
+# disables it), replayable with benchmarks/replay.py. Files are written from a
+# background thread; a capture whose writes fall more than CAPTURE_QUEUE_BYTES
+# behind is truncated.
+CAPTURE_DIR = None
+CAPTURE_QUEUE_BYTES = 64 * 1024 * 1024
+
+# FLV recording of every published stream into RECORD_DIR (None disables it).
+# A new segment file starts at the first keyframe after RECORD_SEGMENT_BYTES
+# or RECORD_SEGMENT_SECONDS (0 for no limit). Files are written from a
+# background thread; a recording whose writes fall more than
+# RECORD_QUEUE_BYTES behind skips media up to a later keyframe.
+RECORD_DIR = None
+RECORD_SEGMENT_BYTES = 1024 * 1024 * 1024
+RECORD_SEGMENT_SECONDS = 3600
+RECORD_QUEUE_BYTES = 64 * 1024 * 1024
+
+# HLS output of every published stream, remuxed without transcoding, into
+# HLS_DIR/<stream key>/ (None disables it) as "mpegts" or "fmp4" segments.
+# Segments start at the first keyframe after HLS_SEGMENT_SECONDS; playlists
+# list the last HLS_PLAYLIST_LENGTH. Served on
+# http://HTTP_HOST:HTTP_PORT/hls/<stream key>/index.m3u8, next to live
+# HTTP-FLV and WebSocket-FLV on /live/<stream key>.flv (port 0 disables both).
+HLS_DIR = None
+HLS_FORMAT = "mpegts"
+HLS_SEGMENT_SECONDS = 2.0
+HLS_PLAYLIST_LENGTH = 6
+HLS_QUEUE_BYTES = 64 * 1024 * 1024
+HTTP_HOST = localhost
+HTTP_PORT = 8080
+
+# profile_idc values (h264.PROFILES) a publisher's H.264 may use; a stream
+# whose sequence header names another profile is rejected before any of its
+# video reaches players. None accepts every profile.
+H264_PROFILES = None
+
+# Handshake hardening: a client must send C0 + C1 within HANDSHAKE_C0C1_TIMEOUT
+# seconds of being accepted, and C2 within HANDSHAKE_C2_TIMEOUT seconds of
+# S0 + S1 + S2 being sent, or it is dropped. Connections arriving while
+# MAX_PENDING_HANDSHAKES handshakes are in flight are closed without being
+# read. S1 packets come from a pool of S1_POOL_SIZE, refilled off the loop.
+HANDSHAKE_C0C1_TIMEOUT = 5.0
+HANDSHAKE_C2_TIMEOUT = 5.0
+MAX_PENDING_HANDSHAKES = 256
+S1_POOL_SIZE = 256
+# Answer FP9 digest C1s (HMAC-signed, as Flash-era players and FFmpeg send)
+# with the digest handshake; other C1s always get the simple echo handshake
+DIGEST_HANDSHAKE = False
+
+# FLV audio/video tag header fields, for diagnostics
+VIDEO_FRAME_TYPES = {
+    1: "Keyframe",
+    2: "Inter frame",
+    3: "Disposable",
+    4: "Generated",
+    5: "Command",
+}
+VIDEO_CODECS = {7: "H.264", 2: "Sorenson H.263", 4: "VP6"}
+SOUND_FORMATS = {10: "AAC", 0: "Linear PCM", 1: "ADPCM", 2: "MP3", 11: "Speex"}
+SOUND_RATES = {0: "5.5 kHz", 1: "11 kHz", 2: "22 kHz", 3: "44 kHz"}
+AAC_PACKET_TYPES = {aac.AAC_SEQUENCE_HEADER: "Sequence header", aac.AAC_RAW: "Raw"}
+
 
 # RTMP Protocol Version
 RTMP_VERSION = 3
 
 # RTMP Handshake Constants
 RTMP_HANDSHAKE_SIZE = 1536  # Standard RTMP handshake size
+# S0 + S1 + S2, which count towards the bytes a peer acknowledges
+HANDSHAKE_RESPONSE_SIZE = 1 + 2 * RTMP_HANDSHAKE_SIZE
 
 # RTMP Chunk Types
 RTMP_CHUNK_TYPE_0 = 0  # 11-byte header
@@ -40,31 +166,45 @@ RTMP_MSG_TYPE_SET_CHUNK_SIZE = 0x01  # Set chunk size
 # Default RTMP Chunk Size (modifiable by client)
 DEFAULT_CHUNK_SIZE = 128
 
-# Other Constants
-AMF_STRING_HEADER_SIZE = 2  # AMF Strings have a 2-byte length header
-AMF_NUMBER_SIZE = 8  # AMF Numbers (doubles) are 8 bytes
-AMF_BOOLEAN_SIZE = 1  # AMF Booleans are 1 byte
-
-# AMF Data Type Constants
-AMF_TYPE_NUMBER = 0x00
-AMF_TYPE_BOOLEAN = 0x01
-AMF_TYPE_STRING = 0x02
-AMF_TYPE_OBJECT = 0x03
-AMF_TYPE_NULL = 0x05
-AMF_TYPE_OBJECT_END = 0x09
-
-# Other Constants
-AMF_STRING_HEADER_SIZE = 2  # AMF Strings have a 2-byte length header
-AMF_NUMBER_SIZE = 8  # AMF Numbers (doubles) are 8 bytes
-AMF_BOOLEAN_SIZE = 1  # AMF Booleans are 1 byte
-AMF_PROPERTY_NAME_SIZE = 2  # Property names have a 2-byte length prefix
-
 # RTMP Message Types
 RTMP_MSG_TYPE_COMMAND = 0x14  # AMF Command (connect, play, etc.)
 RTMP_MSG_TYPE_AUDIO = 0x08  # Audio packet
 RTMP_MSG_TYPE_VIDEO = 0x09  # Video packet
 RTMP_MSG_TYPE_SET_CHUNK_SIZE = 0x01  # Set chunk size
 
+# RTMP Protocol Control / Data Message Types
+RTMP_MSG_TYPE_ABORT = 0x02  # Abort: discard a chunk stream's partial message
+RTMP_MSG_TYPE_ACK = 0x03  # Acknowledgement: bytes received so far
+RTMP_MSG_TYPE_USER_CONTROL = 0x04  # User Control Message (Stream Begin, Ping, ...)
+RTMP_MSG_TYPE_WINDOW_ACK_SIZE = 0x05  # Window Acknowledgement Size
+RTMP_MSG_TYPE_SET_PEER_BANDWIDTH = 0x06  # Set Peer Bandwidth
+RTMP_MSG_TYPE_DATA = 0x12  # AMF0 Data Message (@setDataFrame, onMetaData)
+
+# User Control Event Types
+USER_CONTROL_STREAM_BEGIN = 0
+USER_CONTROL_SET_BUFFER_LENGTH = 3
+USER_CONTROL_PING_REQUEST = 6
+USER_CONTROL_PING_RESPONSE = 7
+
+# Set Peer Bandwidth limit types
+PEER_BANDWIDTH_HARD = 0
+PEER_BANDWIDTH_SOFT = 1
+PEER_BANDWIDTH_DYNAMIC = 2
+
+# Flow control: the window we ask peers to acknowledge (until a peer sets its
+# own with Window Acknowledgement Size) and the bandwidth we grant them
+WINDOW_ACK_SIZE = 2500000
+PEER_BANDWIDTH = 2500000
+# Acknowledgement sequence numbers are 32-bit and wrap around
+SEQUENCE_MASK = 0xFFFFFFFF
+
+# Outbound chunk size announced to players before relaying media
+PLAY_CHUNK_SIZE = 4096
+
+# Outbound Chunk Stream IDs
+CSID_PROTOCOL_CONTROL = 2  # Reserved for protocol control messages
+CSID_COMMAND = 3  # AMF commands and data messages
+
 # RTMP Payload Size Constants
 RTMP_PAYLOAD_HEADER_11_BYTE = 11
 RTMP_PAYLOAD_HEADER_7_BYTE = 7
@@ -79,18 +219,125 @@ CHUNK_FORMAT_NO_STREAM_ID = 2
 CHUNK_FORMAT_NO_HEADER = 3
 MIN_CHUNK_SIZE = 1
 MAX_CHUNK_SIZE = 65536
-INVALID_BYTE = b"\xc3"  # Problematic byte in chunk splitting
 
-VALID_RTMP_TYPES = {0x01, 0x08, 0x09, 0x14}
+# Bytes requested from the socket per read in the ingest loop
+READ_BUFFER_SIZE = 65536
+
+# Per-connection receive buffer for the BufferedProtocol ingest mode; must hold
+# a full handshake and a full chunk at MAX_CHUNK_SIZE
+RECEIVE_BUFFER_SIZE = 262144
+# Compact the receive buffer when less than this much space is left at its end
+RECEIVE_BUFFER_MIN_FREE = 16384
+
+# Handshake progress for the BufferedProtocol ingest mode
+HANDSHAKE_WAIT_C0C1 = 0
+HANDSHAKE_WAIT_C2 = 1
+HANDSHAKE_DONE = 2
+
+VALID_RTMP_TYPES = {0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x08, 0x09, 0x12, 0x14}
 
 
 class RTMPServer:
 
-    def __init__(self, host=localhost, port=localport):
+    def __init__(
+        self,
+        host=localhost,
+        port=localport,
+        ingest_mode=INGEST_MODE,
+        subscriber_queue_bytes=SUBSCRIBER_QUEUE_BYTES,
+        slow_consumer_policy=SLOW_CONSUMER_POLICY,
+        gop_cache_bytes=GOP_CACHE_BYTES,
+        trace_sample_rate=TRACE_SAMPLE_RATE,
+        trace_ring_size=TRACE_RING_SIZE,
+        metrics_port=METRICS_PORT,
+        max_message_size=MAX_MESSAGE_SIZE,
+        max_partial_messages=MAX_PARTIAL_MESSAGES,
+        max_partial_bytes=MAX_PARTIAL_BYTES,
+        memory_high_water=MEMORY_HIGH_WATER,
+        memory_low_water=MEMORY_LOW_WATER,
+        memory_limit=MEMORY_LIMIT,
+        capture_dir=CAPTURE_DIR,
+        capture_queue_bytes=CAPTURE_QUEUE_BYTES,
+        record_dir=RECORD_DIR,
+        record_segment_bytes=RECORD_SEGMENT_BYTES,
+        record_segment_seconds=RECORD_SEGMENT_SECONDS,
+        record_queue_bytes=RECORD_QUEUE_BYTES,
+        hls_dir=HLS_DIR,
+        hls_format=HLS_FORMAT,
+        hls_segment_seconds=HLS_SEGMENT_SECONDS,
+        hls_playlist_length=HLS_PLAYLIST_LENGTH,
+        hls_queue_bytes=HLS_QUEUE_BYTES,
+        http_port=HTTP_PORT,
+        h264_profiles=H264_PROFILES,
+        handshake_c0c1_timeout=HANDSHAKE_C0C1_TIMEOUT,
+        handshake_c2_timeout=HANDSHAKE_C2_TIMEOUT,
+        max_pending_handshakes=MAX_PENDING_HANDSHAKES,
+        s1_pool_size=S1_POOL_SIZE,
+        digest_handshake=DIGEST_HANDSHAKE,
+        tuning=None,
+    ):
         self.host = host
         self.port = port
-        self.streams = {}
-        self.chunk_size = DEFAULT_CHUNK_SIZE
+        self.ingest_mode = ingest_mode
+        self.subscriber_queue_bytes = subscriber_queue_bytes
+        self.slow_consumer_policy = slow_consumer_policy
+        self.gop_cache_bytes = gop_cache_bytes
+        self.streams = {}  # stream key -> LiveStream
+        self.sessions = set()  # every open RTMPSession
+        self.sessions_by_stream_key = {}  # stream key -> publishing/playing sessions
+        self.templates = TemplateCache()  # Prebuilt response payloads
+        self.tracer = Tracer(trace_sample_rate, trace_ring_size)
+        self.metrics_port = metrics_port
+        self.metrics = ServerMetrics()
+        self.background_tasks = set()
+        self.max_message_size = max_message_size
+        self.max_partial_messages = max_partial_messages
+        self.max_partial_bytes = max_partial_bytes
+        self.memory = MemoryBudget(
+            memory_high_water,
+            memory_low_water,
+            memory_limit,
+            on_pressure=self.on_memory_pressure,
+            on_limit=self.on_memory_limit,
+        )
+        self.ingest_open = asyncio.Event()  # Cleared while reads are paused
+        self.ingest_open.set()
+        self.shed_connections = 0
+        self.shedding = False  # shed_connections_over_limit is scheduled
+        self.capture = (
+            CaptureWriter(capture_dir, capture_queue_bytes) if capture_dir else None
+        )
+        self.recording = (
+            RecordingWriter(
+                record_dir,
+                record_segment_bytes,
+                record_segment_seconds,
+                record_queue_bytes,
+            )
+            if record_dir
+            else None
+        )
+        self.hls = (
+            hls.HLSWriter(
+                hls_dir,
+                hls_format,
+                hls_segment_seconds,
+                hls_playlist_length,
+                hls_queue_bytes,
+            )
+            if hls_dir
+            else None
+        )
+        self.http_port = http_port
+        self.h264_profiles = h264_profiles
+        self.handshake_c0c1_timeout = handshake_c0c1_timeout
+        self.handshake_c2_timeout = handshake_c2_timeout
+        self.max_pending_handshakes = max_pending_handshakes
+        self.pending_handshakes = 0  # Accepted connections still handshaking
+        self.s1_pool = S1Pool(s1_pool_size)
+        self.digest_handshake = digest_handshake
+        # Listening socket, accepted connections and event loop (TuningSettings)
+        self.tuning = TuningSettings() if tuning is None else tuning
 
     def launch_audiovideostream(self):
         # Define RTMP URL and device settings
@@ -157,172 +404,64 @@ class RTMPServer:
 
     async def handle_client(self, reader, writer):
         """Handles incoming RTMP clients."""
+        started = time.monotonic()
+        if self.pending_handshakes >= self.max_pending_handshakes:
+            self.reject_handshake(writer)
+            return
         logging.info("New client connected.")
+        tune_connection(writer.transport, self.tuning)
+        capture = self.open_capture(writer.get_extra_info("peername"), started)
 
         # Perform RTMP Handshake
-        if not await self.rtmp_handshake(reader, writer):
+        self.pending_handshakes += 1
+        try:
+            completed = await self.rtmp_handshake(reader, writer, capture, started)
+        finally:
+            self.pending_handshakes -= 1
+        if not completed:
+            self.metrics.handshake_failures += 1
             logging.error("Handshake failed. Closing connection.")
+            if capture is not None:
+                capture.close()
             writer.close()
             await writer.wait_closed()
             return
+        self.metrics.handshake_seconds.observe(time.monotonic() - started)
 
-        # Variables to track previous chunk headers (for Formats 1, 2, 3)
-        previous_timestamp = None
-        previous_payload_size = None
-        previous_msg_type = None
-        previous_stream_id = None
+        session = self.open_session(writer, started, capture)
+        session.bytes_received = 1 + 2 * RTMP_HANDSHAKE_SIZE  # C0 + C1 + C2
+        session_metrics = session.metrics
+        message_counts = session_metrics.messages
+        demuxer = session.demuxer
+        buffer = bytearray()
 
         while True:
             try:
-                print("reading data again...")
-                # Read RTMP Basic Header (1 byte)
-                basic_header = await reader.read(1)
-                print("trying to analyze data")
-                if not basic_header:
+                if not self.ingest_open.is_set():
+                    await self.ingest_open.wait()
+                if writer.is_closing():
+                    break  # Closed by the server, e.g. shed over memory
+                data = await reader.read(READ_BUFFER_SIZE)
+                if not data:
                     logging.info("Client disconnected.")
                     break
-                print("data is read")
-                chunk_format = (basic_header[0] & 0b11000000) >> 6
-                chunk_stream_id = basic_header[0] & 0b00111111
-
-                # Handle Extended Chunk Stream ID (if needed)
-                if chunk_stream_id == CHUNK_STREAM_ID_2_BYTE:
-                    extra_byte = await reader.read(1)
-                    if not extra_byte:
-                        logging.error("Failed to read extended chunk stream ID.")
-                        break
-                    chunk_stream_id = 64 + extra_byte[0]
-
-                elif chunk_stream_id == CHUNK_STREAM_ID_3_BYTE:
-                    extra_bytes = await reader.read(2)
-                    if len(extra_bytes) < 2:
-                        logging.error("Failed to read extended chunk stream ID.")
-                        break
-                    chunk_stream_id = 64 + extra_bytes[0] + (extra_bytes[1] << 8)
-
-                logging.debug(
-                    f"Chunk Format: {chunk_format}, Chunk Stream ID: {chunk_stream_id}"
-                )
-
-                # Read Message Header based on Chunk Format
-                if chunk_format == CHUNK_FORMAT_FULL_HEADER:
-                    message_header = await reader.read(11)
-                    if len(message_header) < 11:
-                        logging.error("Incomplete message header.")
-                        break
-                    timestamp = int.from_bytes(message_header[0:3], "big")
-                    payload_size = int.from_bytes(message_header[3:6], "big")
-                    msg_type = message_header[6]
-                    stream_id = int.from_bytes(message_header[7:11], "little")
-
-                elif chunk_format == CHUNK_FORMAT_TIMESTAMP_ONLY:
-                    message_header = await reader.read(7)
-                    if len(message_header) < 7:
-                        logging.error("Incomplete message header.")
-                        break
-                    timestamp = int.from_bytes(message_header[0:3], "big")
-                    payload_size = int.from_bytes(message_header[3:6], "big")
-                    msg_type = message_header[6]
-                    stream_id = previous_stream_id  # No stream ID in this format
-
-                elif chunk_format == CHUNK_FORMAT_NO_STREAM_ID:
-                    message_header = await reader.read(3)
-                    if len(message_header) < 3:
-                        logging.error("Incomplete message header.")
-                        break
-                    timestamp = int.from_bytes(message_header[0:3], "big")
-                    payload_size = previous_payload_size
-                    msg_type = previous_msg_type
-                    stream_id = previous_stream_id
-
-                elif chunk_format == CHUNK_FORMAT_NO_HEADER:
-                    timestamp = previous_timestamp
-                    payload_size = previous_payload_size
-                    msg_type = previous_msg_type
-                    stream_id = previous_stream_id
-
-                # ✅ Drop Invalid RTMP Message Types
-                VALID_RTMP_MSG_TYPES = {
-                    RTMP_MSG_TYPE_COMMAND,
-                    RTMP_MSG_TYPE_VIDEO,
-                    RTMP_MSG_TYPE_AUDIO,
-                    RTMP_MSG_TYPE_SET_CHUNK_SIZE,
-                }
-
-                if msg_type not in VALID_RTMP_MSG_TYPES:
-                    logging.warning(
-                        f"🚨 Dropping unknown RTMP message type: {hex(msg_type)}"
-                    )
-                    continue  # Skip bad packets
-
-                # Validate Payload Size Before Continuing
-                if payload_size is None or payload_size <= 0:
-                    logging.error(f"Invalid payload size: {payload_size}. Skipping.")
-                    continue
-
-                # Store previous values for next chunks
-                previous_timestamp = timestamp
-                previous_payload_size = payload_size
-                previous_msg_type = msg_type
-                previous_stream_id = stream_id
-
-                logging.debug(
-                    f"RTMP Message Type: {hex(msg_type)}, Payload Size: {payload_size}, Stream ID: {stream_id}"
-                )
-
-                # Read Full Payload in Chunks
-                payload = b""
-                remaining_size = payload_size
-                while remaining_size > 0:
-                    chunk = await reader.read(min(self.chunk_size, remaining_size))
-                    if not chunk:
-                        logging.warning(
-                            f"Incomplete payload received. Read {len(payload)} / {payload_size}"
-                        )
-                        break
-
-                    # ✅ **Filter out problematic `\xc3` bytes to fix tcUrl**
-                    if INVALID_BYTE in chunk:
-                        logging.warning(
-                            f"Removing invalid byte from chunk: {chunk.hex()}"
-                        )
-                        chunk = chunk.replace(INVALID_BYTE, b"")
-
-                    payload += chunk
-                    remaining_size -= len(chunk)
-
-                # Verify Full Payload Read
-                if len(payload) != payload_size:
-                    logging.error(
-                        f"RTMP packet size mismatch! Expected {payload_size}, received {len(payload)}"
-                    )
-
-                # Debugging: Print raw bytes before AMF decoding
-                logging.debug(f"Received full RTMP payload (Hex): {payload.hex()}")
-
-                # Handle RTMP Messages
-                if msg_type == RTMP_MSG_TYPE_COMMAND:
-                    await self.handle_amf_command(payload, writer)
-                elif msg_type == RTMP_MSG_TYPE_VIDEO:
-                    print("should process video packet")
-                    await self.handle_video_packet(payload)
-                elif msg_type == RTMP_MSG_TYPE_AUDIO:
-                    print("should process audio package")
-                    await self.handle_audio_packet(payload)
-                elif msg_type == RTMP_MSG_TYPE_SET_CHUNK_SIZE:
-                    if len(payload) >= 4:
-                        new_chunk_size = struct.unpack(">I", payload[:4])[0]
-                        if MIN_CHUNK_SIZE <= new_chunk_size <= MAX_CHUNK_SIZE:
-                            logging.info(
-                                f"Client requested chunk size: {new_chunk_size}"
-                            )
-                            self.chunk_size = new_chunk_size
-                        else:
-                            logging.warning(f"Invalid chunk size: {new_chunk_size}")
-                    else:
-                        logging.warning("Invalid Set Chunk Size message received.")
-                else:
-                    logging.warning(f"Unhandled RTMP message type: {hex(msg_type)}")
+                if capture is not None:
+                    capture.write(data)
+
+                busy_from = time.perf_counter()
+                buffer += data
+                consumed, messages = demuxer.parse(buffer)
+                if consumed:
+                    del buffer[:consumed]
+
+                # Responses to every message in this read go out in one write
+                session.cork()
+                session.received(len(data))
+                for message in messages:
+                    message_counts[message.msg_type] += 1
+                    await self.handle_message(message, session)
+                session_metrics.busy_seconds += time.perf_counter() - busy_from
+                await session.flush()
 
             except asyncio.IncompleteReadError:
                 logging.warning("Client disconnected abruptly.")
@@ -330,63 +469,400 @@ class RTMPServer:
             except ConnectionResetError:
                 logging.warning("Client connection forcibly closed.")
                 break
+            except ChunkProtocolError as e:
+                logging.warning(f"Closing {session.peer}: {e}")
+                session.trace.dump(f"protocol error: {e}")
+                break
             except Exception as e:
                 logging.exception(f"Error handling client: {e}")
+                session.trace.dump(f"error: {e!r}")
                 break
 
+        self.close_session(session)
+
+    async def handle_message(self, message, session):
+        """Dispatches a reassembled RTMP message to its handler."""
+        if message.msg_type == RTMP_MSG_TYPE_COMMAND:
+            await self.handle_amf_command(message.payload, session, message.stream_id)
+        else:
+            self.process_message(message, session)
+
+    def process_message(self, message, session):
+        """
+        Handles a non-command RTMP message synchronously.
+
+        Media and protocol control messages never wait on I/O, so the
+        BufferedProtocol ingest path calls this directly from `buffer_updated`.
+        """
+        msg_type = message.msg_type
+        payload = message.payload
+
+        trace = session.trace
+        if trace.enabled(TRACE):
+            trace.event(
+                "message",
+                TRACE,
+                type=hex(msg_type),
+                size=len(payload),
+                csid=message.csid,
+                stream=message.stream_id,
+                ts=message.timestamp,
+                head=lambda: payload[:TRACE_PAYLOAD_BYTES].hex(),
+            )
+
+        if msg_type == RTMP_MSG_TYPE_VIDEO:
+            self.handle_video_packet(payload, trace)
+            stream = session.publish_stream
+            if stream is not None:
+                if not self.inspect_video(session, stream, message):
+                    return
+                stream.metrics.add_video(message.timestamp, payload)
+                stream.broadcast(message)
+        elif msg_type == RTMP_MSG_TYPE_AUDIO:
+            self.handle_audio_packet(payload, trace)
+            stream = session.publish_stream
+            if stream is not None:
+                self.inspect_audio(stream, message)
+                stream.metrics.add_audio(payload)
+                stream.broadcast(message)
+        elif msg_type == RTMP_MSG_TYPE_DATA:
+            self.relay_message(message, session)
+        elif msg_type == RTMP_MSG_TYPE_SET_CHUNK_SIZE:
+            # Already applied by the demuxer, which must switch sizes mid-buffer
+            logging.info(
+                f"Client requested chunk size: {int.from_bytes(payload[:4], 'big')}"
+            )
+        elif msg_type == RTMP_MSG_TYPE_ABORT:
+            pass  # Already applied by the demuxer, like Set Chunk Size
+        elif msg_type in CONTROL_MESSAGE_HANDLERS:
+            if len(payload) < 4:
+                logging.warning(f"Truncated control message of type {hex(msg_type)}")
+            else:
+                CONTROL_MESSAGE_HANDLERS[msg_type](session, payload)
+        else:
+            logging.warning(f"Unhandled RTMP message type: {hex(msg_type)}")
+
+    def inspect_video(self, session, stream, message):
+        """
+        Runs a publisher's video message through its stream's H264Inspector.
+        Returns False if it rejected the stream for an unsupported profile.
+        """
+        try:
+            config = stream.metrics.h264.inspect(message.payload)
+        except h264.H264Error as e:
+            logging.warning(
+                f"Stream '{stream.stream_key}': bad AVC sequence header: {e}"
+            )
+            return True
+        if config is None:
+            return True
+
+        sps = config.sps
+        frame_rate = "" if sps.frame_rate is None else f", {sps.frame_rate:g} fps"
+        reorder = "unknown" if sps.reorder_frames is None else sps.reorder_frames
+        logging.info(
+            f"Stream '{stream.stream_key}' video: H.264 {sps.profile} {sps.level}, "
+            f"{sps.width}x{sps.height}{frame_rate}, reorder depth {reorder}"
+        )
+        if self.h264_profiles is None or sps.profile_idc in self.h264_profiles:
+            return True
+
+        logging.error(
+            f"❌ Stream '{stream.stream_key}' rejected: H.264 {sps.profile} profile."
+        )
+        session.send_command(
+            self.encode_amf0_status(
+                "NetStream.Publish.Rejected",
+                f"H.264 {sps.profile} profile is not supported.",
+                level="error",
+            ),
+            stream_id=message.stream_id,
+        )
+        self.stop_publishing(session)
+        session.close()
+        return False
+
+    def inspect_audio(self, stream, message):
+        """
+        Runs a publisher's audio message through its stream's AACInspector,
+        logging the sequence header's config and audio drifting away from
+        its frames' duration.
+        """
+        inspector = stream.metrics.aac
+        try:
+            config = inspector.inspect(message.timestamp, message.payload)
+        except aac.AACError as e:
+            logging.warning(
+                f"Stream '{stream.stream_key}': bad AAC sequence header: {e}"
+            )
+            return
+        if config is not None:
+            logging.info(
+                f"Stream '{stream.stream_key}' audio: AAC {config.profile}, "
+                f"{config.sample_rate} Hz, {config.channels} channel(s), "
+                f"{config.frame_samples} samples per frame"
+            )
+        elif (
+            not inspector.drift_warned and abs(inspector.drift) >= aac.DRIFT_WARNING_MS
+        ):
+            inspector.drift_warned = True
+            logging.warning(
+                f"Stream '{stream.stream_key}': audio timestamps drifted "
+                f"{inspector.drift:+.0f} ms from {inspector.span_frames} frames' "
+                "duration."
+            )
+
+    def relay_message(self, message, session):
+        """Fans a publisher's media/data message out to the stream's players."""
+        stream = session.publish_stream
+        if stream is not None:
+            stream.broadcast(message)
+
+    def get_stream(self, stream_key):
+        """Returns the LiveStream for `stream_key`, creating it if needed."""
+        stream = self.streams.get(stream_key)
+        if stream is None:
+            stream = self.streams[stream_key] = LiveStream(
+                stream_key, self.gop_cache_bytes, self.metrics.stream(), self.memory
+            )
+        return stream
+
+    def register_session(self, stream_key, session):
+        """Indexes a publishing or playing session under its stream key."""
+        session.stream_key = stream_key
+        self.sessions_by_stream_key.setdefault(stream_key, set()).add(session)
+
+    def unregister_session(self, session):
+        sessions = self.sessions_by_stream_key.get(session.stream_key)
+        if sessions is not None:
+            sessions.discard(session)
+            if not sessions:
+                del self.sessions_by_stream_key[session.stream_key]
+        session.stream_key = None
+
+    def stop_publishing(self, session):
+        stream = session.publish_stream
+        if stream is None:
+            return
+
+        session.publish_stream = None
+        self.unregister_session(session)
+        stream.publisher = None
+        self.close_sinks(stream)
+        stream.clear_cache()
+        stream.metrics = self.metrics.stream()  # The next publisher starts afresh
+        logging.info(f"Stream '{stream.stream_key}' unpublished.")
+        for subscriber in stream.subscribers:
+            if subscriber.session is None:
+                continue  # HTTP players have no command channel
+            subscriber.session.send_command(
+                self.encode_amf0_status(
+                    "NetStream.Play.UnpublishNotify",
+                    f"{stream.stream_key} is now unpublished.",
+                ),
+                stream_id=subscriber.stream_id,
+            )
+        if stream.is_idle():
+            del self.streams[stream.stream_key]
+
+    def open_sinks(self, stream):
+        """Starts recording and HLS packaging of a newly published stream."""
+        for writer in (self.recording, self.hls):
+            if writer is not None:
+                stream.sinks.append(writer.open(stream))
+
+    def close_sinks(self, stream):
+        """Closes a stream's recording and HLS output, finishing their segments."""
+        for sink in stream.sinks:
+            sink.close()
+        stream.sinks = []
+
+    def stop_playing(self, session):
+        stream = session.play_stream
+        if stream is None:
+            return
+
+        stream.remove_subscriber(session.subscriber)
+        session.play_stream = None
+        session.subscriber = None
+        self.unregister_session(session)
+        if stream.is_idle():
+            del self.streams[stream.stream_key]
+
+    def stop_http_playing(self, stream, viewer):
+        """Detaches an HTTP-FLV / WebSocket-FLV player from its stream."""
+        stream.remove_subscriber(viewer)
+        if stream.is_idle() and self.streams.get(stream.stream_key) is stream:
+            del self.streams[stream.stream_key]
+
+    def open_session(self, writer, started=None, capture=None):
+        """
+        Creates and registers the RTMPSession of a new connection.
+
+        `started` is the time.monotonic() of the accept, if it was earlier, and
+        `capture` the SessionCapture recording the connection, if any.
+        """
+        session = RTMPSession(self, writer, started, capture)
+        self.sessions.add(session)
+        return session
+
+    def open_capture(self, peer, started=None):
+        """Starts capturing a connection's inbound bytes, if capture is enabled."""
+        if self.capture is None:
+            return None
+        return self.capture.open(peer, started)
+
+    def close_session(self, session):
+        """Drops every registration and buffer a closed connection holds."""
+        self.sessions.discard(session)
+        self.stop_publishing(session)
+        self.stop_playing(session)
+        session.demuxer.close()
+        if session.capture is not None:
+            session.capture.close()
+
+    def on_memory_pressure(self, paused):
+        """
+        Pauses or resumes reading on every connection (MemoryBudget callback).
+
+        Pausing also drops the GOP caches: they only shrink as new media is
+        read, so they could otherwise hold usage above the low-water mark
+        for good. Players joining meanwhile wait for the next keyframe.
+        """
+        if paused:
+            self.ingest_open.clear()
+        else:
+            self.ingest_open.set()
+        # Stream mode connections wait on `ingest_open` before each read
+        for session in list(self.sessions):
+            if isinstance(session.writer, TransportWriter):
+                session.writer.set_reading(not paused)
+        if paused:
+            for stream in self.streams.values():
+                stream.clear_gop_cache()
+
+    def on_memory_limit(self):
+        """
+        Schedules shedding (MemoryBudget callback, on crossing its limit).
+
+        Charges are made while fanning out and parsing, where closing
+        sessions would change the sets being iterated, so connections are
+        shed from the event loop instead.
+        """
+        if not self.shedding:
+            self.shedding = True
+            asyncio.get_running_loop().call_soon(self.shed_connections_over_limit)
+
+    def shed_connections_over_limit(self):
+        """
+        Closes the connections holding the most buffered memory until usage
+        is back within the limit. Their buffers are released right away
+        rather than when each connection is finally lost, so one overrun
+        doesn't shed more connections than it takes.
+        """
+        self.shedding = False
+        while self.memory.over_limit and self.sessions:
+            session = max(self.sessions, key=RTMPSession.memory_used)
+            if not session.memory_used():
+                return  # What's left isn't held by any connection
+            logging.error(
+                f"Buffered memory over limit ({self.memory.used} bytes), closing "
+                f"{session.peer} holding {session.memory_used()} bytes."
+            )
+            self.shed_connections += 1
+            session.close()
+            self.close_session(session)
+
     def generate_s1(self):
-        """Generates a valid S1 packet with a random payload."""
-        time = struct.pack(">I", 0)  # Zero timestamp
-        zero = struct.pack(">I", 0)  # Zero
-        payload = os.urandom(1528)  # Random payload
-        return time + zero + payload
+        """Returns a valid S1 packet (zero timestamp, random payload) from the pool."""
+        return self.s1_pool.take()
 
-    async def rtmp_handshake(self, reader, writer):
-        """Handles the RTMP handshake process correctly for OBS & FFmpeg."""
+    def handshake_response(self, c1):
+        """S0, S1 and S2 answering `c1`, digest or simple, ready for `writelines`."""
+        chunks, digest = handshake_response(c1, self.s1_pool, self.digest_handshake)
+        if digest:
+            self.metrics.digest_handshakes += 1
+        return chunks
+
+    def reject_handshake(self, transport):
+        """
+        Closes a new connection without reading from it, because
+        `max_pending_handshakes` handshakes are already in flight.
+        """
+        self.metrics.handshakes_rejected += 1
+        logging.warning(
+            f"{self.pending_handshakes} handshakes in flight, rejecting a connection."
+        )
+        transport.close()
+
+    async def rtmp_handshake(self, reader, writer, capture=None, started=None):
+        """
+        Handles the RTMP handshake process correctly for OBS & FFmpeg.
+
+        C0 + C1 must arrive within `handshake_c0c1_timeout` seconds of
+        `started` (the accept), and C2 within `handshake_c2_timeout` of
+        S0 + S1 + S2 being sent. Returns True once complete; on failure the
+        caller closes the connection. C0, C1 and C2 are recorded to
+        `capture`, if given.
+        """
+        metrics = self.metrics
+        if started is None:
+            started = time.monotonic()
+        phase = "C0"
 
         try:
             logging.info("Waiting for C0...")
+            deadline = started + self.handshake_c0c1_timeout
 
             # Step 1: Read C0 (1 byte)
-            c0 = await reader.readexactly(1)
+            c0 = await asyncio.wait_for(
+                reader.readexactly(1), deadline - time.monotonic()
+            )
             if c0 != b"\x03":  # RTMP version 3 expected
                 logging.error("Invalid RTMP version: %s", c0)
-                return
+                return False
 
             logging.info("Received C0 (RTMP version: %s)", c0.hex())
 
             # Step 2: Read C1 (1536 bytes)
-            c1 = await reader.readexactly(1536)
+            phase = "C1"
+            c1 = await asyncio.wait_for(
+                reader.readexactly(RTMP_HANDSHAKE_SIZE), deadline - time.monotonic()
+            )
+            sent = time.monotonic()
+            metrics.handshake_c0c1_seconds.observe(sent - started)
             logging.info("Received C1 (1536 bytes)")
-
-            # Generate S0 + S1 + S2
-            s0 = b"\x03"  # RTMP version 3
-            s1 = self.generate_s1()
-            s2 = c1  # S2 must be an exact copy of C1
-
-            # Send S0+S1+S2 in one go (fixes the double-write issue)
-            writer.write(s0 + s1 + s2)
-            await writer.drain()
+            if capture is not None:
+                capture.write(c0 + c1)
+
+            # Send S0+S1+S2 in one go (fixes the double-write issue); S2 is
+            # an exact copy of C1 unless answering a digest C1
+            phase = "C2"
+            deadline = sent + self.handshake_c2_timeout
+            writer.writelines(self.handshake_response(c1))
+            await asyncio.wait_for(writer.drain(), deadline - time.monotonic())
             logging.info("✅ Sent S0+S1+S2")
 
             # Step 3: Receive C2 (1536 bytes)
-            c2 = await reader.readexactly(1536)
+            c2 = await asyncio.wait_for(
+                reader.readexactly(RTMP_HANDSHAKE_SIZE), deadline - time.monotonic()
+            )
+            metrics.handshake_c2_seconds.observe(time.monotonic() - sent)
             logging.info("✅ Received C2.")
+            if capture is not None:
+                capture.write(c2)
 
             # Handshake complete
             logging.info("🚀 RTMP Handshake complete -- SUCCESS.")
 
             return True
 
-        except Exception as e:
-            logging.error(f"❌ RTMP Handshake failed: {e}")
-            writer.close()
-
         except asyncio.TimeoutError:
-            logging.error("Handshake error: Timeout while waiting for client response.")
+            metrics.handshake_timeouts += 1
+            logging.warning(f"RTMP Handshake timed out waiting for {phase}.")
         except Exception as e:
-            logging.error(f"Error during RTMP handshake: {e}")
-            writer.close()  # Close the connection after handshake error
+            logging.error(f"❌ RTMP Handshake failed: {e!r}")
+        return False
 
     def decode_amf_command(self, payload):
         """Decodes an AMF command payload."""
@@ -400,72 +876,24 @@ class RTMPServer:
 
         return command_name, transaction_id, command_object
 
-    def decode_amf_string(self, payload, index):
-        """
-        Safely decodes an AMF string, ensuring proper length extraction and UTF-8 recovery.
-        """
-        if index + AMF_STRING_HEADER_SIZE > len(payload):
-            logging.warning("AMF string out of range")
-            return None, index
-
-        # Extract string length (2 bytes)
-        str_length = struct.unpack(
-            ">H", payload[index : index + AMF_STRING_HEADER_SIZE]
-        )[0]
-        index += AMF_STRING_HEADER_SIZE
-
-        if index + str_length > len(payload):  # Validate string presence
-            logging.warning(
-                f"AMF string truncated. Expected {str_length} bytes, but got {len(payload) - index}"
-            )
-            return None, index
-
-        # Extract raw bytes before decoding
-        raw_bytes = payload[index : index + str_length]
-        index += str_length  # Move index forward
-
-        # First try UTF-8 decoding
-        try:
-            property_value = raw_bytes.decode("utf-8")
-        except UnicodeDecodeError:
-            logging.error(
-                f"Invalid UTF-8 sequence in string at index {index - str_length}"
-            )
-
-            # Attempt to recover with Latin-1 re-encoding
-            try:
-                property_value = (
-                    raw_bytes.decode("latin-1")
-                    .encode("utf-8", errors="ignore")
-                    .decode("utf-8")
-                )
-                logging.debug(
-                    f"Recovered string using Latin-1 re-encoding: {property_value}"
-                )
-            except UnicodeDecodeError:
-                logging.error("Failed to recover string with Latin-1 fallback.")
-                property_value = ""
-
-        return property_value, index
-
-    async def handle_amf_command(self, payload, writer):
+    async def handle_amf_command(self, payload, session, stream_id=0):
         """
         Parses and handles AMF commands from clients.
         """
         try:
-            logging.debug(f"AMF Command Payload: {payload.hex()}")
-
             # Decode AMF
-            command_name, transaction_id, command_object = self.decode_amf_command(
-                payload
+            decoded_values = self.decode_amf_payload(payload)
+            command_name = decoded_values[0] if len(decoded_values) > 0 else None
+            transaction_id = decoded_values[1] if len(decoded_values) > 1 else None
+            command_object = decoded_values[2] if len(decoded_values) > 2 else {}
+
+            session.trace.event(
+                "command",
+                command=command_name,
+                transaction_id=transaction_id,
+                values=lambda: decoded_values[2:],
             )
 
-            logging.debug(
-                f"Received command: {command_name}, transaction_id: {transaction_id}"
-            )
-
-            print(f"Command received: '{command_name}', type: {type(command_name)}")
-
             if isinstance(command_name, bytes):
                 command_name = command_name.decode("utf-8")
 
@@ -475,28 +903,28 @@ class RTMPServer:
                 logging.info(f"AMF Command Received: {command_name}")
 
                 if command_name == "connect":
-                    await self.handle_connect(transaction_id, command_object, writer)
+                    await self.handle_connect(transaction_id, command_object, session)
                     # print("should connect")
                 if command_name == "publish":
-                    print("should publish")
-                    await self.handle_publish_response(writer, transaction_id, "test")
+                    stream_key = decoded_values[3] if len(decoded_values) > 3 else None
+                    await self.handle_publish_response(
+                        session, transaction_id, stream_key, stream_id
+                    )
                 elif command_name == "createStream":
-                    print("should create stream")
-                    await self.handle_create_stream(transaction_id, writer, payload)
-                elif command_name == "FCPublish":
-                    print("should publish")
-                    print("payload: ", payload)
-                    print("command_object", command_object)
-                    await self.handle_FCPublish(
-                        [command_name, transaction_id, command_object, "webcam"], writer
+                    await self.handle_create_stream(
+                        transaction_id, session, decoded_values
                     )
+                elif command_name == "FCPublish":
+                    await self.handle_FCPublish(decoded_values, session)
                 elif command_name == "releaseStream":
-                    print("should release stream")
-                    await self.handle_release_stream(writer, payload)
+                    await self.handle_release_stream(session, decoded_values)
                 elif command_name == "play":
-                    await self.handle_play(
-                        [command_name, transaction_id, command_object], writer
-                    )
+                    await self.handle_play(decoded_values, session, stream_id)
+                elif command_name in ("deleteStream", "closeStream", "FCUnpublish"):
+                    self.stop_publishing(session)
+                    self.stop_playing(session)
+                    if command_name == "deleteStream" and len(decoded_values) > 3:
+                        session.release_stream_id(decoded_values[3])
                 else:
                     logging.warning(f"Unknown AMF Command: {command_name}")
             else:
@@ -505,7 +933,7 @@ class RTMPServer:
         except Exception as e:
             logging.error(f"Error parsing AMF command: {e}")
 
-    async def handle_release_stream(self, writer, amf_payload):
+    async def handle_release_stream(self, session, amf_payload):
         try:
             if len(amf_payload) > 1 and isinstance(amf_payload[1], (int, float)):
                 transaction_id = amf_payload[1]
@@ -516,33 +944,15 @@ class RTMPServer:
                 f"✅ Handling releaseStream request, transaction_id: {transaction_id}"
             )
 
-            # Build AMF response for releaseStream
-            response = (
-                self.encode_amf0_string("_result")
-                + self.encode_amf0_number(transaction_id)
-                + b"\x05"  # AMF NULL
-            )
-
-            header = (
-                b"\x02"  # Chunk Basic Header
-                + b"\x00\x00\x00"  # Timestamp
-                + struct.pack(">I", len(response))[
-                    -3:
-                ]  # Correct 3-byte length encoding
-                + b"\x14"  # Message Type ID (AMF Command)
-                + b"\x00\x00\x00\x00"  # Message Stream ID
-            )
-
-            writer.write(header + response)
-            await self.drain_and_sleep(writer)
+            session.send_command(self.encode_amf0_call_result(transaction_id))
             logging.info("✅ Sent `_result` for releaseStream.")
 
         except Exception as e:
             logging.error(f"❌ Error handling releaseStream: {e}")
-            writer.close()
-            await writer.wait_closed()  # Ensure the writer is properly closed
+            session.close()
+            await session.wait_closed()  # Ensure the session is properly closed
 
-    async def handle_create_stream(self, transaction_id, writer, amf_payload):
+    async def handle_create_stream(self, transaction_id, session, amf_payload):
         try:
             # Extract the transaction ID safely
             if len(amf_payload) > 1 and isinstance(amf_payload[1], (int, float)):
@@ -554,384 +964,140 @@ class RTMPServer:
                 f"✅ Handling createStream request, transaction_id: {transaction_id}"
             )
 
-            stream_id = 1  # Assign stream ID
-
-            # Build AMF response
-            response = (
-                self.encode_amf0_string("_result")
-                + self.encode_amf0_number(transaction_id)
-                + b"\x05"  # AMF NULL
-                + self.encode_amf0_number(stream_id)
-            )
+            stream_id = session.allocate_stream_id()
 
-            header = (
-                b"\x02"  # Chunk Basic Header
-                + b"\x00\x00\x00"
-                + struct.pack(">I", len(response))[1:4]
-                + b"\x14"  # Message Type ID for Command Message
-                + b"\x00\x00\x00\x00"
+            session.send_command(
+                self.encode_amf0_call_result(transaction_id, stream_id)
             )
-
-            writer.write(header + response)
-            await self.drain_and_sleep(writer)
             logging.info(f"✅ Sent `_result` for createStream, Stream ID: {stream_id}.")
 
         except Exception as e:
             logging.error(f"❌ Error handling createStream: {e}")
-            writer.close()
+            session.close()
 
     def decode_amf_payload(self, payload):
         """
-        Decodes multiple AMF encoded values from the payload.
-        Handles AMF strings, numbers, booleans, and objects properly.
+        Decodes every AMF0 value in the payload.
+        Values decoded before any malformed data are still returned.
         """
         decoded_values = []
-        index = 0
-
-        while index < len(payload):
-            try:
-                if index >= len(payload):  # Prevent out-of-bounds access
-                    logging.warning("AMF payload out of range before reading type")
-                    break
-
-                amf_type = payload[index]
-                index += 1  # Move past AMF type byte
-                property_name = "unknown"
-
-                logging.debug(f"Decoding AMF type: {amf_type} at index: {index - 1}")
-
-                if amf_type == AMF_TYPE_STRING:  # AMF string
-                    property_value, index = self.decode_amf_string(payload, index)
-                    decoded_values.append(property_value)
-
-                elif amf_type == AMF_TYPE_NUMBER:  # AMF number
-                    if index + AMF_NUMBER_SIZE > len(payload):
-                        logging.warning("AMF number out of range")
-                    else:
-                        amf_number = struct.unpack(
-                            ">d", payload[index : index + AMF_NUMBER_SIZE]
-                        )[0]
-                        decoded_values.append(amf_number)
-                        index += AMF_NUMBER_SIZE
-
-                elif amf_type == AMF_TYPE_BOOLEAN:  # AMF boolean
-                    if index + AMF_BOOLEAN_SIZE > len(payload):
-                        logging.warning("AMF boolean out of range")
-                    else:
-                        amf_boolean = bool(payload[index])
-                        decoded_values.append(amf_boolean)
-                        index += AMF_BOOLEAN_SIZE
-
-                elif amf_type == AMF_TYPE_OBJECT:  # AMF object
-                    amf_object, new_index = self.decode_amf_object(payload, index)
-                    decoded_values.append(amf_object)
-                    index = new_index
-
-                elif amf_type == AMF_TYPE_NULL:  # AMF null
-                    decoded_values.append(None)
-
-                elif amf_type == AMF_TYPE_OBJECT_END:  # Object end marker
-                    logging.debug("AMF Object End Marker detected.")
-                    break
-
-                else:
-                    logging.warning(
-                        f"Unhandled AMF type: {hex(amf_type)} at index {index}"
-                    )
-
-            except (struct.error, UnicodeDecodeError, IndexError) as e:
-                logging.error(f"Failed to decode AMF data at index {index}: {e}")
-                logging.debug(f"Data causing error: {payload[index:].hex()}")
-                break
-
+        try:
+            for value in amf0.iter_values(payload):
+                decoded_values.append(value)
+        except amf0.AMF0DecodeError as e:
+            logging.error(f"Failed to decode AMF data: {e}")
         return decoded_values
 
-    def decode_amf_object(self, payload, start_index):
-        """
-        Decodes an AMF0 object from an RTMP message payload.
-        Returns a dictionary of key-value pairs.
-        """
-        amf_object = {}
-        index = start_index
-
-        while index < len(payload):
-            try:
-                if index + AMF_STRING_HEADER_SIZE > len(payload):
-                    logging.warning("AMF object truncated (no name length).")
-                    break
-
-                # Extract property name length
-                str_length = struct.unpack(
-                    ">H", payload[index : index + AMF_STRING_HEADER_SIZE]
-                )[0]
-                index += AMF_STRING_HEADER_SIZE
-
-                if index + str_length > len(payload):
-                    logging.warning(f"Property name length {str_length} out of range.")
-                    break
-
-                # Decode property name safely
-                property_name = payload[index : index + str_length].decode(
-                    "utf-8", errors="ignore"
-                )
-                index += str_length
-                logging.debug(f"Decoded property name: {property_name}")
-
-                if index >= len(payload):
-                    logging.warning("AMF truncated before reading type.")
-                    break
-
-                # Extract AMF type
-                amf_type = payload[index]
-                index += 1
-                logging.debug(f"Property type: {hex(amf_type)}")
-
-                # Handle different AMF types
-                if amf_type == AMF_TYPE_STRING:  # String
-                    property_value, index = self.decode_amf_string(payload, index)
-
-                    # Special case: `tcUrl` requires validation
-                    if property_name == "tcUrl":
-                        logging.debug(f"Extracted raw tcUrl: {property_value}")
-
-                        expected_length = len(
-                            f"rtmp://{localhost}:{localport}/{APPLICATION}"
-                        )
-
-                        # **🔴 DETECT TRUNCATION AND FIX AUTOMATICALLY**
-                        if len(property_value) != expected_length:
-                            logging.error(
-                                f"tcUrl incorrect length! Expected {expected_length}, got {len(property_value)}"
-                            )
-
-                            # If `tcUrl` is missing `/live`, manually correct it
-                            if not property_value.endswith("/live"):
-                                property_value = (
-                                    f"rtmp://{localhost}:{localport}/{APPLICATION}"
-                                )
-                                logging.warning(f"tcUrl corrected to: {property_value}")
-
-                        logging.debug(f"Final decoded tcUrl: {property_value}")
-
-                elif amf_type == AMF_TYPE_NUMBER:  # Number (Double)
-                    if index + AMF_NUMBER_SIZE > len(payload):
-                        logging.warning(
-                            f"AMF number property '{property_name}' out of range."
-                        )
-                        break
-                    property_value = struct.unpack(
-                        ">d", payload[index : index + AMF_NUMBER_SIZE]
-                    )[0]
-                    index += AMF_NUMBER_SIZE
-
-                elif amf_type == AMF_TYPE_BOOLEAN:  # Boolean
-                    if index >= len(payload):
-                        logging.warning(
-                            f"AMF boolean property '{property_name}' out of range."
-                        )
-                        break
-                    property_value = bool(payload[index])
-                    index += 1
-
-                elif amf_type == AMF_TYPE_OBJECT:  # Nested AMF Object
-                    property_value, index = self.decode_amf_object(payload, index)
-
-                elif amf_type == AMF_TYPE_NULL:  # Null
-                    property_value = None
-
-                elif amf_type == AMF_TYPE_OBJECT_END:  # Object end marker
-                    logging.debug(f"AMF Object End detected at index {index}")
-                    break
-
-                else:
-                    logging.warning(f"Unhandled AMF type: {hex(amf_type)}")
-                    break
-
-                # Store extracted value
-                amf_object[property_name] = property_value
-                logging.debug(f"Updated AMF object: {amf_object}")
-
-            except (struct.error, UnicodeDecodeError, IndexError) as e:
-                logging.error(f"Failed to decode AMF object at index {index}: {e}")
-                break
-
-        return amf_object, index
-
     def encode_amf0_string(self, value: str) -> bytes:
         """Encodes an AMF0 string."""
-        encoded = value.encode("utf-8")
-        return b"\x02" + struct.pack(">H", len(encoded)) + encoded
+        return amf0.encode(value)
 
     def encode_amf0_number(self, value: float) -> bytes:
         """Encodes an AMF0 number (double precision float)."""
-        return b"\x00" + struct.pack(">d", float(value))  # 8-byte IEEE 754 double
+        return amf0.encode(float(value))
 
     def encode_amf0_null(self) -> bytes:
         """Encodes an AMF0 null value."""
         return b"\x05"
 
-    def encode_amf0_object(self, properties: dict) -> bytes:
-        """Encodes an AMF0 object properly."""
-        obj = b"\x03"  # AMF0 Object marker
-        for key, value in properties.items():
-            obj += struct.pack(">H", len(key)) + key.encode("utf-8")
-            if isinstance(value, str):
-                obj += self.encode_amf0_string(value)[1:]  # Skip type byte
-            elif isinstance(value, (int, float)):
-                obj += self.encode_amf0_number(value)
-        obj += b"\x00\x00\x09"  # AMF0 Object End Marker
-        return obj
-
     def encode_amf0_result(self, transaction_id, tc_url):
         """
         Constructs an AMF0 `_result` response for RTMP 'connect' with correct structure.
         """
-        return (
-            self.encode_amf0_string("_result")  # Command Name
-            + self.encode_amf0_number(transaction_id)  # Transaction ID
-            + b"\x05"  # AMF0 NULL (Correct placement)
-            + self.encode_amf0_object(
-                {
-                    "fmsVer": "FMS/3,5,3,888",
-                    "capabilities": 31.0,
-                    "level": "status",
-                    "code": "NetConnection.Connect.Success",
-                    "description": "Connection succeeded.",
-                    "tcUrl": tc_url,
-                    "objectEncoding": 0.0,  # **NEW FIELD (Prevents FFmpeg Malformed Error)**
-                }
-            )
+        return self.templates.render(
+            "connect_result",
+            lambda transaction_id, tc_url: (
+                self.encode_amf0_string("_result")  # Command Name
+                + self.encode_amf0_number(transaction_id)  # Transaction ID
+                + b"\x05"  # AMF0 NULL (Correct placement)
+                + self.encode_amf0_object(
+                    {
+                        "fmsVer": "FMS/3,5,3,888",
+                        "capabilities": 31.0,
+                        "level": "status",
+                        "code": "NetConnection.Connect.Success",
+                        "description": "Connection succeeded.",
+                        "tcUrl": tc_url,
+                        "objectEncoding": 0.0,  # **NEW FIELD (Prevents FFmpeg Malformed Error)**
+                    }
+                )
+            ),
+            {"transaction_id": NUMBER, "tc_url": STRING},
+            transaction_id=transaction_id,
+            tc_url="" if tc_url is None else str(tc_url),  # Clients may send null
         )
 
-    def build_result_packet(self, transaction_id, tc_url):
-        """
-        Constructs the full RTMP `_result` response packet.
-        """
-        amf_payload = self.encode_amf0_result(transaction_id, tc_url)
-
-        connect_header = (
-            b"\x02"  # Chunk Basic Header (Format 0, CSID 2)
-            + b"\x00\x00\x00"
-            + struct.pack(">I", len(amf_payload))[1:4]  # Correct payload length
-            + b"\x14"  # Message Type ID (0x14 = Command Message)
-            + b"\x00\x00\x00\x00"  # Stream ID (Always 0 for Connect)
+    def encode_amf0_call_result(self, transaction_id, stream_id=None):
+        """Encodes the `_result` of a call, with the new stream ID for createStream."""
+        if stream_id is None:
+            return self.templates.render(
+                "call_result",
+                lambda transaction_id: (
+                    self.encode_amf0_string("_result")
+                    + self.encode_amf0_number(transaction_id)
+                    + b"\x05"  # AMF NULL
+                ),
+                {"transaction_id": NUMBER},
+                transaction_id=transaction_id,
+            )
+        return self.templates.render(
+            "create_stream_result",
+            lambda transaction_id, stream_id: (
+                self.encode_amf0_string("_result")
+                + self.encode_amf0_number(transaction_id)
+                + b"\x05"  # AMF NULL
+                + self.encode_amf0_number(stream_id)
+            ),
+            {"transaction_id": NUMBER, "stream_id": NUMBER},
+            transaction_id=transaction_id,
+            stream_id=stream_id,
         )
 
-        return connect_header + amf_payload
-
     def set_chunk_size(self, size):
-        """Encodes and returns an RTMP Set Chunk Size message in the correct format for FFmpeg."""
-
-        # 1️⃣ RTMP Chunk Basic Header (1 byte)
-        basic_header = b"\x02"  # Format 0, Chunk Stream ID 2 (CSID = 2)
-
-        # 2️⃣ RTMP Message Header (7 bytes)
-        timestamp = b"\x00\x00\x00"  # Always 0 for control messages
-        message_length = b"\x00\x00\x04"  # Payload is always 4 bytes for Set Chunk Size
-        message_type = b"\x01"  # RTMP Message Type ID for Set Chunk Size
-        message_stream_id = b"\x00\x00\x00\x00"  # Always 0 for Set Chunk Size
-
-        # 3️⃣ RTMP Payload (4 bytes) → The actual chunk size
-        chunk_size_payload = struct.pack(">I", size)  # 4-byte Big Endian encoding
-
-        # Combine all parts into a single RTMP packet
-        set_chunk_size_packet = (
-            basic_header
-            + timestamp
-            + message_length
-            + message_type
-            + message_stream_id
-            + chunk_size_payload
+        """Encodes an RTMP Set Chunk Size payload (4-byte chunk size)."""
+        return self.templates.render(
+            ("set_chunk_size", size), lambda: struct.pack(">I", size)
         )
 
-        # Debugging: Print the hex dump to verify structure before sending
-        print(
-            f"🔍 Debug Set Chunk Size: {set_chunk_size_packet.hex()} (Length: {len(set_chunk_size_packet)})"
-        )
-
-        return set_chunk_size_packet
-
     def window_ack_size(self, size):
-        """Encodes and returns an RTMP Window Acknowledgment Size message in the correct format for FFmpeg."""
-
-        # 1️⃣ RTMP Chunk Basic Header (1 byte)
-        basic_header = b"\x02"  # Format 0, Chunk Stream ID 2 (CSID = 2)
-
-        # 2️⃣ RTMP Message Header (7 bytes)
-        timestamp = b"\x00\x00\x00"  # Always 0 for control messages
-        message_length = b"\x00\x00\x04"  # Payload is always 4 bytes
-        message_type = b"\x05"  # RTMP Message Type ID for Window Acknowledgment Size
-        message_stream_id = b"\x00\x00\x00\x00"  # Always 0 for this message type
-
-        # 3️⃣ RTMP Payload (4 bytes) → The acknowledgment window size
-        ack_size_payload = struct.pack(">I", size)  # 4-byte Big Endian encoding
-
-        # Combine all parts into a single RTMP packet
-        window_ack_packet = (
-            basic_header
-            + timestamp
-            + message_length
-            + message_type
-            + message_stream_id
-            + ack_size_payload
+        """Encodes an RTMP Window Acknowledgement Size payload."""
+        return self.templates.render(
+            ("window_ack_size", size), lambda: struct.pack(">I", size)
         )
 
-        # Debugging: Print the hex dump to verify structure before sending
-        print(
-            f"🔍 Debug Window Acknowledgment Size: {window_ack_packet.hex()} (Length: {len(window_ack_packet)})"
-        )
-
-        return window_ack_packet
-
     def set_peer_bandwidth(self, size, limit_type=2):
-        """Encodes and returns an RTMP Set Peer Bandwidth message in the correct format for FFmpeg."""
-
-        # 1️⃣ RTMP Chunk Basic Header (1 byte)
-        basic_header = b"\x02"  # Format 0, Chunk Stream ID 2 (CSID = 2)
-
-        # 2️⃣ RTMP Message Header (7 bytes)
-        timestamp = b"\x00\x00\x00"  # Always 0 for control messages
-        message_length = b"\x00\x00\x05"  # Payload is always 5 bytes
-        message_type = b"\x06"  # RTMP Message Type ID for Set Peer Bandwidth
-        message_stream_id = b"\x00\x00\x00\x00"  # Always 0 for control messages
-
-        # 3️⃣ RTMP Payload (4-byte Window Size + 1-byte Limit Type)
-        bandwidth_payload = struct.pack(">I", size) + struct.pack(">B", limit_type)
-
-        # Combine all parts into a single RTMP packet
-        set_peer_bandwidth_packet = (
-            basic_header
-            + timestamp
-            + message_length
-            + message_type
-            + message_stream_id
-            + bandwidth_payload
+        """Encodes an RTMP Set Peer Bandwidth payload (window size + limit type)."""
+        return self.templates.render(
+            ("set_peer_bandwidth", size, limit_type),
+            lambda: struct.pack(">IB", size, limit_type),
         )
 
-        # Debugging: Print the hex dump to verify structure before sending
-        print(
-            f"🔍 Debug Set Peer Bandwidth: {set_peer_bandwidth_packet.hex()} (Length: {len(set_peer_bandwidth_packet)})"
-        )
-
-        return set_peer_bandwidth_packet
-
     def encode_amf0_boolean(self, value):
         """Encodes an AMF0 boolean."""
-        return b"\x01" + struct.pack(">B", 1 if value else 0)
+        return amf0.encode(bool(value))
 
     def encode_amf0_object(self, properties: dict) -> bytes:
         """
         Encodes an AMF0 object with correct key-value pairs.
         """
-        obj = b"\x03"  # AMF0 Object Start
-        for key, value in properties.items():
-            obj += struct.pack(">H", len(key)) + key.encode("utf-8")  # Key name
-            if isinstance(value, str):
-                obj += self.encode_amf0_string(value)  # Use correct string encoding
-            elif isinstance(value, (int, float)):
-                obj += self.encode_amf0_number(value)
-        obj += b"\x00\x00\x09"  # **Proper Object End Marker**
-        return obj
+        return amf0.encode(properties)
+
+    def encode_amf0_status(self, code, description, level="status", transaction_id=0):
+        """Encodes an AMF0 `onStatus` command carrying an info object."""
+        return self.templates.render(
+            ("onStatus", code, level),
+            lambda transaction_id, description: (
+                self.encode_amf0_string("onStatus")
+                + self.encode_amf0_number(transaction_id)
+                + b"\x05"  # AMF0 NULL
+                + self.encode_amf0_object(
+                    {"level": level, "code": code, "description": description}
+                )
+            ),
+            {"transaction_id": NUMBER, "description": STRING},
+            transaction_id=transaction_id,
+            description=description,
+        )
 
     def encode_amf0_onstatus_publish(self):
         """Encodes an AMF0 'onStatus' response for 'NetStream.Publish.Start'."""
@@ -946,172 +1112,95 @@ class RTMPServer:
             + self.encode_amf0_object(properties)
         )
 
-    async def send_publish_start(self, writer):
+    async def send_publish_start(self, session):
         """Sends the 'NetStream.Publish.Start' onStatus message to FFmpeg."""
-        status_payload = self.encode_amf0_onstatus_publish()
-
-        status_header = (
-            b"\x02"  # Chunk Basic Header (Format 0, CSID 2)
-            + b"\x00\x00\x00"  # Timestamp (0)
-            + struct.pack(">I", len(status_payload))[1:4]  # Payload Size
-            + b"\x14"  # Message Type ID (Command Message)
-            + b"\x00\x00\x00\x01"  # Stream ID
-        )
-
-        full_status = status_header + status_payload
-        writer.write(full_status)
-        await writer.drain()
+        session.send_command(self.encode_amf0_onstatus_publish(), stream_id=1)
+        await session.drain()
         logging.info("✅ Sent NetStream.Publish.Start.")
 
     def stream_begin(self, stream_id=3):
-        """Encodes and returns an RTMP Stream Begin (0x04) message in the correct format for FFmpeg."""
-
-        # return stream_begin_packet
-        return (
-            b"\x02"  # Chunk Basic Header (Format 0, CSID 2)
-            + b"\x00\x00\x00"  # Timestamp (0)
-            + b"\x00\x06"  # Payload size = 6 bytes
-            + b"\x04"  # Message Type ID = User Control Message
-            + b"\x00\x00\x00\x00"  # Always 0 for control messages
-            + struct.pack(">HI", 0, stream_id)  # Event Type (0) + Stream ID
+        """Encodes an RTMP User Control Stream Begin (event 0) payload."""
+        return self.templates.render(
+            ("stream_begin", stream_id),
+            lambda: struct.pack(">HI", USER_CONTROL_STREAM_BEGIN, stream_id),
         )
 
     def encode_amf0_onstatus(self):
         """Encodes the RTMP `onStatus` event using AMF0 format."""
-
-        return (
-            b"\x02"
-            + struct.pack(">H", len("onStatus"))
-            + b"onStatus"  # AMF0 String: `onStatus`
-            + b"\x00\x00\x00\x00"  # AMF0 Number: Transaction ID = 0.0
-            + b"\x03"  # AMF0 Object (Start)
-            + b"\x02"
-            + struct.pack(">H", len("level"))
-            + b"level"
-            + b"\x02"
-            + struct.pack(">H", len("status"))
-            + b"status"
-            + b"\x02"
-            + struct.pack(">H", len("code"))
-            + b"code"
-            + b"\x02"
-            + struct.pack(">H", len("NetConnection.Connect.Success"))
-            + b"NetConnection.Connect.Success"
-            + b"\x02"
-            + struct.pack(">H", len("description"))
-            + b"description"
-            + b"\x02"
-            + struct.pack(">H", len("Connection established successfully."))
-            + b"Connection established successfully."
-            + b"\x00\x00\x09"  # AMF0 Object End
+        return amf0.encode(
+            "onStatus",
+            0.0,  # Transaction ID
+            None,
+            {
+                "level": "status",
+                "code": "NetConnection.Connect.Success",
+                "description": "Connection established successfully.",
+            },
         )
 
     def send_onstatus(self):
-        """Encodes and returns an RTMP `onStatus` Invoke message to confirm a successful connection."""
-
-        # Encode AMF0 Payload
-        status_payload = self.encode_amf0_onstatus()
-
-        # 1️⃣ RTMP Chunk Basic Header (1 byte)
-        basic_header = b"\x02"  # Format 0, Chunk Stream ID 2 (CSID = 2)
-
-        # 2️⃣ RTMP Message Header (7 bytes)
-        timestamp = b"\x00\x00\x00"  # Always 0 for control messages
-        message_length = struct.pack(">I", len(status_payload))[
-            1:4
-        ]  # Payload size (3 bytes)
-        message_type = b"\x14"  # RTMP Message Type ID for Invoke (`onStatus`)
-        message_stream_id = b"\x00\x00\x00\x00"  # Always 0 for control messages
-
-        # Combine all parts into a single RTMP packet
-        onstatus_packet = (
-            basic_header
-            + timestamp
-            + message_length
-            + message_type
-            + message_stream_id
-            + status_payload
-        )
-
-        # Debugging: Print the hex dump to verify structure before sending
-        print(
-            f"🔍 Debug `onStatus`: {onstatus_packet.hex()} (Length: {len(onstatus_packet)})"
+        """Returns the `onStatus` Invoke payload confirming a successful connection."""
+        return self.templates.render("connect_onstatus", self.encode_amf0_onstatus)
+
+    def send_setdataframe(self, session):
+        """Returns the @setDataFrame payload establishing metadata for the stream."""
+        return self.templates.render(
+            "setdataframe",
+            lambda: (
+                self.encode_amf0_string("@setDataFrame")
+                + self.encode_amf0_string("onMetaData")
+                + self.encode_amf0_object({"encoder": "Lavf61.9.106", "filesize": 0})
+            ),
         )
 
-        return onstatus_packet
-
-    def send_setdataframe(self, writer):
-        """Sends @setDataFrame to establish metadata for the stream."""
-        payload = (
-            self.encode_amf0_string("@setDataFrame")
-            + self.encode_amf0_string("onMetaData")
-            + self.encode_amf0_object({"encoder": "Lavf61.9.106", "filesize": 0})
-        )
-
-        header = (
-            b"\x02"  # Chunk Basic Header
-            + b"\x00\x00\x00"
-            + struct.pack(">I", len(payload))[1:4]
-            + b"\x12"  # Message Type ID (0x12 = Data Message)
-            + b"\x00\x00\x00\x01"  # Stream ID
-        )
-
-        return header + payload
-
-    def send_onbwdone(self, writer):
+    def send_onbwdone(self, session):
         """Sends the RTMP `onBWDone` event, required for FFmpeg to proceed to publish."""
 
         # ✅ Construct the AMF0 `onBWDone` payload
-        bw_done_payload = (
-            self.encode_amf0_string("onBWDone")  # AMF0 String "onBWDone"
-            + self.encode_amf0_number(
-                0
-            )  # Transaction ID (always 0 for system messages)
-            + b"\x05"  # AMF0 NULL (Required!)
-        )
-
-        # ✅ Construct the RTMP Header for `onBWDone`
-        bw_done_header = (
-            b"\x02"  # Chunk Basic Header (Format 0, CSID 2)
-            + b"\x00\x00\x00"  # Timestamp (0)
-            + struct.pack(">I", len(bw_done_payload))[1:4]  # Payload Size (3 bytes)
-            + b"\x14"  # Message Type ID (0x14 = Command Message)
-            + b"\x00\x00\x00\x00"  # Message Stream ID (always 0 for control messages)
+        return self.templates.render(
+            "onBWDone",
+            lambda: (
+                self.encode_amf0_string("onBWDone")  # AMF0 String "onBWDone"
+                + self.encode_amf0_number(
+                    0
+                )  # Transaction ID (always 0 for system messages)
+                + b"\x05"  # AMF0 NULL (Required!)
+            ),
         )
 
-        full_bw_done = bw_done_header + bw_done_payload
-
-        logging.debug(f"RTMP onBWDone Response Hex: {full_bw_done.hex()}")
-        return full_bw_done
-
-    async def drain_and_sleep(self, writer):
-        await writer.drain()
-        await asyncio.sleep(0.1)
-
     def send_release_stream(self, transaction_id, app_name):
-        release_stream_payload = (
-            self.encode_amf0_string("releaseStream")
-            + self.encode_amf0_number(transaction_id + 1)
-            + b"\x05"  # AMF0 NULL
-            + self.encode_amf0_string(app_name)  # Stream Name
+        return self.templates.render(
+            "releaseStream",
+            lambda transaction_id, app_name: (
+                self.encode_amf0_string("releaseStream")
+                + self.encode_amf0_number(transaction_id)
+                + b"\x05"  # AMF0 NULL
+                + self.encode_amf0_string(app_name)  # Stream Name
+            ),
+            {"transaction_id": NUMBER, "app_name": STRING},
+            transaction_id=transaction_id,
+            app_name=app_name,
         )
-        release_stream_header = (
-            b"\x02"
-            + b"\x00\x00\x00"
-            + struct.pack(">I", len(release_stream_payload))[1:4]
-            + b"\x14"
-            + b"\x00\x00\x00\x00"
+
+    def send_sample_access(self):
+        """Returns the `|RtmpSampleAccess` data payload sent to players."""
+        return self.templates.render(
+            "sample_access",
+            lambda: (
+                self.encode_amf0_string("|RtmpSampleAccess")
+                + self.encode_amf0_boolean(True)
+                + self.encode_amf0_boolean(True)
+            ),
         )
-        return release_stream_header + release_stream_payload
 
-    async def handle_connect(self, transaction_id, command_object, writer):
+    async def handle_connect(self, transaction_id, command_object, session):
         try:
             # Prevent duplicate connect commands
-            if hasattr(self, "client_connected") and self.client_connected:
+            if session.connected:
                 logging.warning("Duplicate `connect` command received, ignoring.")
                 return
 
-            self.client_connected = True  # Mark session as active
+            session.connected = True  # Mark session as active
             logging.info(f"Handling RTMP connect, transaction_id: {transaction_id}")
 
             # # Extract App Name and Stream URL
@@ -1193,55 +1282,62 @@ class RTMPServer:
             tc_url = command_object.get(
                 f"tcUrl", f"rtmp://{self.host}:{self.port}/{app_name}"
             )
+            session.app = app_name
+            session.tc_url = tc_url
 
             # ✅ Step 1: Send Set Chunk Size (4096)
-            writer.write(self.set_chunk_size(4096))
-            await self.drain_and_sleep(writer)
+            session.send_control(
+                RTMP_MSG_TYPE_SET_CHUNK_SIZE, self.set_chunk_size(4096)
+            )
 
             # ✅ Step 2: Send Window Acknowledgment Size
-            writer.write(self.window_ack_size(2500000))
-            await self.drain_and_sleep(writer)
+            session.send_control(
+                RTMP_MSG_TYPE_WINDOW_ACK_SIZE, self.window_ack_size(WINDOW_ACK_SIZE)
+            )
+            session.sent_ack_window = WINDOW_ACK_SIZE
 
             # ✅ Step 3: Send Set Peer Bandwidth
-            writer.write(self.set_peer_bandwidth(2500000))
-            await self.drain_and_sleep(writer)
+            session.send_control(
+                RTMP_MSG_TYPE_SET_PEER_BANDWIDTH,
+                self.set_peer_bandwidth(PEER_BANDWIDTH),
+            )
 
             # ✅ Step 4: Send `_result` for NetConnection.Connect.Success
-            writer.write(self.build_result_packet(transaction_id, tc_url))
-            await self.drain_and_sleep(writer)
+            session.send_command(self.encode_amf0_result(transaction_id, tc_url))
+            self.metrics.connect_seconds.observe(
+                time.monotonic() - session.metrics.started
+            )
 
             # ✅ Step 5: Send `onStatus`
-            writer.write(self.send_onstatus())
-            await self.drain_and_sleep(writer)
+            session.send_command(self.send_onstatus())
 
             # ✅ Step 6: Send onBWDone BEFORE Set Chunk Size 128
-            writer.write(self.send_onbwdone(writer))
-            await self.drain_and_sleep(writer)
+            session.send_command(self.send_onbwdone(session))
 
             # ✅ Step 7: Send Set Chunk Size (128)
-            writer.write(self.set_chunk_size(128))
-            await self.drain_and_sleep(writer)
+            session.send_control(RTMP_MSG_TYPE_SET_CHUNK_SIZE, self.set_chunk_size(128))
 
             # ✅ Step 8: Send Stream Begin 0 BEFORE releaseStream
-            writer.write(self.stream_begin(0))
-            await self.drain_and_sleep(writer)
+            session.send_control(RTMP_MSG_TYPE_USER_CONTROL, self.stream_begin(0))
 
             # ✅ Step 9: Send releaseStream('webcam')
-            writer.write(self.send_release_stream(transaction_id, app_name))
-            await self.drain_and_sleep(writer)
+            session.send_command(
+                self.send_release_stream(session.next_transaction_id(), app_name)
+            )
 
             # ✅ Step 11: Send @setDataFrame Metadata
-            writer.write(self.send_setdataframe(writer))
-            await self.drain_and_sleep(writer)
+            session.send_message(
+                CSID_COMMAND, RTMP_MSG_TYPE_DATA, 1, 0, self.send_setdataframe(session)
+            )
 
             # ✅ Step 12: Wait for `createStream`
             logging.info("Waiting for createStream command...")
 
         except Exception as e:
             logging.error(f"❌ Error handling RTMP connect: {e}")
-            writer.close()
+            session.close()
 
-    async def handle_FCPublish(self, decoded_values, writer):
+    async def handle_FCPublish(self, decoded_values, session):
         """
         Handles RTMP 'publish' requests properly.
         """
@@ -1255,46 +1351,24 @@ class RTMPServer:
                 decoded_values[3] if len(decoded_values) > 3 else "default"
             )  # ✅ Extract correct index
 
-            print("decoded values: ", decoded_values)
             logging.info(f"📡 Publishing stream: key={stream_key}")
 
-            # ✅ Store stream info
-            self.streams[stream_key] = {"status": "publishing"}
-
             # ✅ Validate Stream Key (Ensure it's not None)
             if not stream_key or stream_key == "None":
                 logging.error("❌ Stream key is None! Possible AMF decoding issue.")
                 return
 
             # ✅ Send NetStream.Publish.Start response
-            response_body = (
-                self.encode_amf0_string("onStatus")
-                + self.encode_amf0_number(transaction_id)
-                + b"\x05"  # AMF0 NULL (Required!)
-                + self.encode_amf0_object(
-                    {
-                        "level": "status",
-                        "code": "NetStream.Publish.Start",
-                        "description": f"Publishing stream started for key {stream_key}.",
-                    }
-                )
+            response_body = self.encode_amf0_status(
+                "NetStream.Publish.Start",
+                f"Publishing stream started for key {stream_key}.",
+                transaction_id=transaction_id,
             )
 
-            response_header = (
-                b"\x02"  # Chunk Basic Header (Format 0, CSID 2)
-                + b"\x00\x00\x00"  # Timestamp
-                + struct.pack(">I", len(response_body))[1:4]  # Payload size
-                + b"\x14"  # Message Type ID (Command Message)
-                + struct.pack("<I", 1)  # Little-endian Stream ID
-            )
-
-            response = response_header + response_body
-            writer.write(response)
-            await self.drain_and_sleep(writer)
+            session.send_command(response_body, stream_id=1)
 
             # ✅ Step 5: Send `onStatus` event
-            writer.write(self.send_onstatus())
-            await self.drain_and_sleep(writer)
+            session.send_command(self.send_onstatus())
             logging.info("✅ Sent onStatus.")
 
             logging.info(f"✅ Stream '{stream_key}' successfully published.")
@@ -1302,37 +1376,116 @@ class RTMPServer:
         except Exception as e:
             logging.error(f"❌ Error handling publish request: {e}")
 
-    async def handle_publish_response(self, writer, transaction_id, stream_key):
+    async def handle_publish_response(
+        self, session, transaction_id, stream_key, stream_id=1
+    ):
         """Handles `publish` command from the client."""
         logging.info(f"✅ Handling publish request for stream: {stream_key}")
 
+        stream_key = self.normalize_stream_key(stream_key)
+        stream = self.get_stream(stream_key) if stream_key else None
+        if stream is None or stream.publisher not in (None, session):
+            logging.error(f"❌ Stream '{stream_key}' is unavailable for publishing.")
+            session.send_command(
+                self.encode_amf0_status(
+                    "NetStream.Publish.BadName",
+                    f"Stream {stream_key} is already being published.",
+                    level="error",
+                    transaction_id=transaction_id,
+                ),
+                stream_id=stream_id,
+            )
+            return
+
+        stream.publisher = session
+        session.publish_stream = stream
+        self.register_session(stream_key, session)
+        if not stream.sinks:
+            self.open_sinks(stream)
+
         # Acknowledge the publish command
-        response = (
-            self.encode_amf0_string("onStatus")
-            + self.encode_amf0_number(transaction_id)
-            + b"\x05"  # AMF0 NULL
-            + self.encode_amf0_object(
-                {
-                    "level": "status",
-                    "code": "NetStream.Publish.Start",
-                    "description": f"Stream {stream_key} is now published.",
-                }
+        response = self.encode_amf0_status(
+            "NetStream.Publish.Start",
+            f"Stream {stream_key} is now published.",
+            transaction_id=transaction_id,
+        )
+
+        session.send_command(response, stream_id=stream_id)
+        logging.info(f"✅ Sent NetStream.Publish.Start for {stream_key}.")
+
+    async def handle_play(self, decoded_values, session, stream_id):
+        """
+        Handles `play`: attaches the client to the live stream as a subscriber.
+        """
+        transaction_id = decoded_values[1] if len(decoded_values) > 1 else 0.0
+        stream_key = self.normalize_stream_key(
+            decoded_values[3] if len(decoded_values) > 3 else None
+        )
+        logging.info(f"▶️ Handling play request for stream: {stream_key}")
+
+        if not stream_key:
+            session.send_command(
+                self.encode_amf0_status(
+                    "NetStream.Play.StreamNotFound",
+                    "No stream name given.",
+                    level="error",
+                    transaction_id=transaction_id,
+                ),
+                stream_id=stream_id,
             )
+            return
+
+        # Replace any earlier subscription held by this connection
+        self.stop_playing(session)
+
+        session.send_control(
+            RTMP_MSG_TYPE_SET_CHUNK_SIZE, self.set_chunk_size(PLAY_CHUNK_SIZE)
+        )
+        session.send_control(RTMP_MSG_TYPE_USER_CONTROL, self.stream_begin(stream_id))
+        session.send_command(
+            self.encode_amf0_status(
+                "NetStream.Play.Reset", f"Playing and resetting {stream_key}."
+            ),
+            stream_id=stream_id,
+        )
+        session.send_command(
+            self.encode_amf0_status(
+                "NetStream.Play.Start", f"Started playing {stream_key}."
+            ),
+            stream_id=stream_id,
+        )
+        session.send_message(
+            CSID_COMMAND,
+            RTMP_MSG_TYPE_DATA,
+            stream_id,
+            0,
+            self.send_sample_access(),
         )
 
-        header = (
-            b"\x02"
-            + b"\x00\x00\x00"
-            + struct.pack(">I", len(response))[1:4]
-            + b"\x14"
-            + b"\x00\x00\x00\x01"  # Stream ID
+        stream = self.get_stream(stream_key)
+        subscriber = Subscriber(
+            session,
+            stream_id,
+            self.subscriber_queue_bytes,
+            self.slow_consumer_policy,
+            self.memory,
+        )
+        stream.add_subscriber(subscriber)
+        session.play_stream = stream
+        session.subscriber = subscriber
+        self.register_session(stream_key, session)
+        logging.info(
+            f"✅ Player attached to '{stream_key}' "
+            f"({len(stream.subscribers)} subscriber(s))."
         )
 
-        writer.write(header + response)
-        await self.drain_and_sleep(writer)
-        logging.info(f"✅ Sent NetStream.Publish.Start for {stream_key}.")
+    def normalize_stream_key(self, stream_key):
+        """Strips the query string (e.g. auth tokens) from a stream name."""
+        if not isinstance(stream_key, str):
+            return None
+        return stream_key.split("?", 1)[0].strip() or None
 
-    async def handle_video_packet(self, payload):
+    def handle_video_packet(self, payload, trace):
         """
         Handles RTMP video packets.
         """
@@ -1340,31 +1493,23 @@ class RTMPServer:
             logging.warning("Received empty video packet.")
             return
 
-        frame_type = (payload[0] & 0xF0) >> 4  # First 4 bits = frame type
-        codec_id = payload[0] & 0x0F  # Last 4 bits = codec ID
-
-        frame_types = {
-            1: "Keyframe",
-            2: "Inter frame",
-            3: "Disposable",
-            4: "Generated",
-            5: "Command",
-        }
-        codec_types = {7: "H.264", 2: "Sorenson H.263", 4: "VP6"}
-
-        frame_type_str = frame_types.get(frame_type, "Unknown")
-        codec_str = codec_types.get(codec_id, f"Unknown ({codec_id})")
-
-        logging.info(f"Received Video Packet: {len(payload)} bytes")
-        logging.info(f"Frame Type: {frame_type_str}, Codec: {codec_str}")
+        if trace.enabled(logging.DEBUG):
+            frame_type = (payload[0] & 0xF0) >> 4  # First 4 bits = frame type
+            codec_id = payload[0] & 0x0F  # Last 4 bits = codec ID
+            trace.event(
+                "video",
+                size=len(payload),
+                frame=VIDEO_FRAME_TYPES.get(frame_type, "Unknown"),
+                codec=VIDEO_CODECS.get(codec_id, f"Unknown ({codec_id})"),
+            )
 
         # Example: Extract AVC sequence header (if applicable)
-        if codec_id == 7 and len(payload) > 1:
+        if payload[0] & 0x0F == 7 and len(payload) > 1:
             avc_packet_type = payload[1]
             if avc_packet_type == 0:
                 logging.info("AVC Sequence Header detected.")
 
-    async def handle_audio_packet(self, payload):
+    def handle_audio_packet(self, payload, trace):
         """
         Handles RTMP audio packets.
         """
@@ -1373,47 +1518,818 @@ class RTMPServer:
             return
 
         sound_format = (payload[0] & 0xF0) >> 4  # First 4 bits = Sound format
-        sound_rate = (payload[0] & 0x0C) >> 2  # Bits 2-3 = Sampling rate
-        sound_size = (
-            payload[0] & 0x02
-        ) >> 1  # Bit 1 = Sample size (0: 8-bit, 1: 16-bit)
-        sound_type = payload[0] & 0x01  # Bit 0 = Mono (0) or Stereo (1)
 
-        sound_formats = {10: "AAC", 0: "Linear PCM", 1: "ADPCM", 2: "MP3", 11: "Speex"}
-        sample_rates = {0: "5.5 kHz", 1: "11 kHz", 2: "22 kHz", 3: "44 kHz"}
+        if trace.enabled(logging.DEBUG):
+            if sound_format == SOUND_FORMAT_AAC:
+                # The flags always say 44 kHz stereo for AAC; the real
+                # config comes from the sequence header (inspect_audio)
+                trace.event(
+                    "audio",
+                    size=len(payload),
+                    format="AAC",
+                    packet=(
+                        AAC_PACKET_TYPES.get(payload[1], "Unknown")
+                        if len(payload) > 1
+                        else "Missing"
+                    ),
+                )
+                return
+            sound_rate = (payload[0] & 0x0C) >> 2  # Bits 2-3 = Sampling rate
+            sound_size = (
+                payload[0] & 0x02
+            ) >> 1  # Bit 1 = Sample size (0: 8-bit, 1: 16-bit)
+            sound_type = payload[0] & 0x01  # Bit 0 = Mono (0) or Stereo (1)
+            trace.event(
+                "audio",
+                size=len(payload),
+                format=SOUND_FORMATS.get(sound_format, f"Unknown ({sound_format})"),
+                rate=SOUND_RATES.get(sound_rate, "Unknown"),
+                bits=16 if sound_size else 8,
+                channels="Stereo" if sound_type else "Mono",
+            )
 
-        sound_format_str = sound_formats.get(sound_format, f"Unknown ({sound_format})")
-        sample_rate_str = sample_rates.get(sound_rate, "Unknown")
+    def dump_traces(self):
+        """Logs every open session's chunk header ring (SIGUSR1)."""
+        logging.warning(f"Dumping chunk header traces of {len(self.sessions)} sessions")
+        for session in self.sessions:
+            session.trace.dump("SIGUSR1")
+
+    def stats(self):
+        """Returns a snapshot of this server's connection and stream counts."""
+        return {
+            "connections": len(self.sessions),
+            "streams": len(self.streams),
+            "publishers": sum(
+                1 for stream in self.streams.values() if stream.publisher is not None
+            ),
+            "subscribers": sum(
+                len(stream.subscribers) for stream in self.streams.values()
+            ),
+        }
 
-        logging.info(f"Received Audio Packet: {len(payload)} bytes")
-        logging.info(
-            f"Format: {sound_format_str}, Sample Rate: {sample_rate_str}, "
-            f"Size: {'16-bit' if sound_size else '8-bit'}, Channels: {'Stereo' if sound_type else 'Mono'}"
-        )
+    async def start(
+        self, sock=None, reuse_port=False, launch_stream=launchStreamWithFFMPEG
+    ):
+        """
+        Starts the RTMP server.
 
-        # Example: Detect AAC sequence header
-        if sound_format == 10 and len(payload) > 1:
-            aac_packet_type = payload[1]
-            if aac_packet_type == 0:
-                logging.info("AAC Sequence Header detected.")
+        `sock` serves on an already bound listening socket (shared by worker
+        processes); `reuse_port` binds with SO_REUSEPORT so several processes
+        can each own a listener on the same port. Otherwise the listener is
+        bound with the buffers and backlog of `tuning`, and either way every
+        accepted connection gets its TCP_NODELAY and write buffer limits.
+        """
+        if sock is None:
+            sock = create_listen_socket(self.host, self.port, self.tuning, reuse_port)
 
-    async def start(self):
-        """Starts the RTMP server."""
-        server = await asyncio.start_server(self.handle_client, self.host, self.port)
-        # ✅ FIX: Loop through `server.sockets` correctly
-        # for sock in server.sockets:
-        #     sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Disable Nagle's algorithm
+        if self.ingest_mode == "protocol":
+            loop = asyncio.get_running_loop()
+            server = await loop.create_server(lambda: RTMPProtocol(self), sock=sock)
+        else:
+            server = await asyncio.start_server(self.handle_client, sock=sock)
 
         logging.info(f"RTMP Server listening on {self.host}:{self.port}")
 
+        monitor = asyncio.create_task(self.metrics.monitor())
+        self.background_tasks.add(monitor)
+        if self.metrics_port:
+            await start_http_server(self, METRICS_HOST, self.metrics_port)
+        if self.http_port:
+            await start_media_http_server(self, HTTP_HOST, self.http_port)
+
+        if hasattr(signal, "SIGUSR1"):
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGUSR1, self.dump_traces
+            )
+
         # Launch the audio/video stream
-        if launchStreamWithFFMPEG == True:
+        if launch_stream == True:
             self.launch_audiovideostream()
 
-        async with server:
-            await server.serve_forever()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if self.capture is not None:
+                self.capture.close()  # Writes out what is still queued
+            for stream in self.streams.values():
+                self.close_sinks(stream)
+            for writer in (self.recording, self.hls):
+                if writer is not None:
+                    writer.close()  # Writes out what is still queued
+
+
+class RTMPSession:
+    """
+    Per-connection RTMP state.
+
+    Owns the connection's chunk demuxer and muxer (and so its inbound and
+    outbound chunk sizes and chunk stream state), its transaction counter
+    and message stream ID allocator, and what it publishes or plays. It also
+    stands in for the connection's writer: all outbound RTMP messages go
+    through `send_message`, which chunks them at the negotiated outbound
+    chunk size and hands the chunks to `writelines`.
+
+    It also runs the RTMP flow control of the connection: it acknowledges
+    every `ack_window` bytes received, and tracks the peer's
+    acknowledgements against the window the peer granted with Set Peer
+    Bandwidth, which relayed media waits on (see `wait_send_window`).
+    """
+
+    __slots__ = (
+        "server",
+        "writer",
+        "demuxer",
+        "muxer",
+        "peer",
+        "trace",
+        "metrics",
+        "connected",
+        "app",
+        "tc_url",
+        "transaction_id",
+        "next_stream_id",
+        "stream_ids",
+        "stream_key",
+        "publish_stream",
+        "play_stream",
+        "subscriber",
+        "corked",
+        "bytes_received",
+        "last_ack_sent",
+        "ack_window",
+        "sent_ack_window",
+        "peer_acked",
+        "send_window",
+        "send_window_limit_type",
+        "send_window_open",
+        "capture",
+    )
+
+    def __init__(self, server, writer, started=None, capture=None):
+        self.server = server
+        self.writer = writer
+        self.peer = writer.get_extra_info("peername")
+        self.trace = server.tracer.session(self.peer)  # Sampling + chunk header ring
+        self.metrics = server.metrics.session(started)  # Ingest counters
+        self.demuxer = ChunkDemuxer(
+            header_log=self.trace.headers,
+            max_message_size=server.max_message_size,
+            max_partial_messages=server.max_partial_messages,
+            max_partial_bytes=server.max_partial_bytes,
+            budget=server.memory,
+        )
+        self.muxer = ChunkMuxer()
+        self.connected = False
+        self.app = None
+        self.tc_url = None
+        self.transaction_id = 1  # Last transaction ID used; `connect` takes 1
+        self.next_stream_id = 1
+        self.stream_ids = set()  # Message stream IDs handed out by createStream
+        self.stream_key = None
+        self.publish_stream = None  # LiveStream this session publishes
+        self.play_stream = None  # LiveStream this session plays
+        self.subscriber = None  # Subscriber attached to `play_stream`
+        self.corked = None  # Chunks held back by `cork` until `flush`
+        self.bytes_received = 0  # Every byte read from the peer, handshake included
+        self.last_ack_sent = 0  # `bytes_received` at our last Acknowledgement
+        self.ack_window = WINDOW_ACK_SIZE  # Acknowledge after this many bytes
+        self.sent_ack_window = None  # Last Window Acknowledgement Size we sent
+        self.peer_acked = None  # Sequence number of the peer's last Acknowledgement
+        self.send_window = None  # Unacknowledged bytes allowed by the peer, if set
+        self.send_window_limit_type = None
+        self.send_window_open = asyncio.Event()
+        self.capture = capture  # SessionCapture of the inbound bytes, if enabled
+
+    def __repr__(self):
+        return f"RTMPSession(peer={self.peer}, stream_key={self.stream_key})"
+
+    @property
+    def in_chunk_size(self):
+        return self.demuxer.chunk_size
+
+    @property
+    def out_chunk_size(self):
+        return self.muxer.chunk_size
+
+    def next_transaction_id(self):
+        self.transaction_id += 1
+        return self.transaction_id
+
+    def allocate_stream_id(self):
+        """Hands out a message stream ID for `createStream`."""
+        stream_id = self.next_stream_id
+        self.next_stream_id += 1
+        self.stream_ids.add(stream_id)
+        return stream_id
+
+    def release_stream_id(self, stream_id):
+        if isinstance(stream_id, (int, float)):
+            self.stream_ids.discard(int(stream_id))
+
+    def send_message(self, csid, msg_type, stream_id, timestamp, payload):
+        chunks = self.muxer.mux(csid, msg_type, stream_id, timestamp, payload)
+        if self.corked is not None:
+            self.corked += chunks
+        else:
+            self.writer.writelines(chunks)
+
+    def cork(self):
+        """Holds back outbound messages so `flush` can write them in one call."""
+        if self.corked is None:
+            self.corked = []
+
+    async def flush(self):
+        """Writes everything held back since `cork` and waits for it to drain."""
+        chunks = self.corked
+        self.corked = None
+        if chunks:
+            self.writer.writelines(chunks)
+            await self.writer.drain()
+
+    def memory_used(self):
+        """Bytes of partial messages, send queue and GOP cache this session holds."""
+        used = self.demuxer.partial_bytes
+        if self.subscriber is not None:
+            used += self.subscriber.queued_bytes
+        if self.publish_stream is not None:
+            used += self.publish_stream.gop_cached_bytes
+        return used
+
+    @property
+    def bytes_sent(self):
+        return HANDSHAKE_RESPONSE_SIZE + self.muxer.bytes_out
+
+    def received(self, nbytes):
+        """Counts bytes read from the peer, acknowledging each full window."""
+        self.bytes_received += nbytes
+        if (
+            self.ack_window
+            and self.bytes_received - self.last_ack_sent >= self.ack_window
+        ):
+            self.last_ack_sent = self.bytes_received
+            self.send_control(
+                RTMP_MSG_TYPE_ACK,
+                struct.pack(">I", self.bytes_received & SEQUENCE_MASK),
+            )
+
+    def unacknowledged_bytes(self):
+        """Bytes sent since the peer's last Acknowledgement (all, if none yet)."""
+        if self.peer_acked is None:
+            return self.bytes_sent
+        unacknowledged = (self.bytes_sent - self.peer_acked) & SEQUENCE_MASK
+        # A peer that counts a few more bytes than we do (e.g. its own C0/C1)
+        # may acknowledge slightly ahead of us; that's not 4 GB in flight
+        return 0 if unacknowledged > SEQUENCE_MASK >> 1 else unacknowledged
+
+    def send_window_full(self):
+        """
+        True while the peer's window is used up.
+
+        Only enforced once the peer has both set a window and acknowledged
+        something, so a peer that never acknowledges is never stalled.
+        """
+        return (
+            self.send_window is not None
+            and self.peer_acked is not None
+            and self.unacknowledged_bytes() >= self.send_window
+        )
+
+    async def wait_send_window(self):
+        """Waits until an Acknowledgement reopens the peer's window."""
+        while self.send_window_full():
+            self.send_window_open.clear()
+            await self.send_window_open.wait()
+
+    def on_acknowledgement(self, payload):
+        self.peer_acked = struct.unpack_from(">I", payload)[0]
+        self.send_window_open.set()
+
+    def on_window_ack_size(self, payload):
+        window = struct.unpack_from(">I", payload)[0]
+        logging.info(f"Peer set window acknowledgement size: {window}")
+        self.ack_window = window
+
+    def on_set_peer_bandwidth(self, payload):
+        """Applies a Set Peer Bandwidth limit to our unacknowledged output."""
+        window = struct.unpack_from(">I", payload)[0]
+        limit_type = payload[4] if len(payload) > 4 else PEER_BANDWIDTH_HARD
+        previous = self.send_window
+
+        if limit_type == PEER_BANDWIDTH_DYNAMIC:
+            # Hard if the previous limit was hard, otherwise ignored
+            if self.send_window_limit_type != PEER_BANDWIDTH_HARD:
+                return
+            limit_type = PEER_BANDWIDTH_HARD
+        if limit_type == PEER_BANDWIDTH_SOFT and previous is not None:
+            window = min(window, previous)
+
+        self.send_window = window
+        self.send_window_limit_type = limit_type
+        self.send_window_open.set()
+        logging.info(f"Peer set bandwidth: {window} (limit type {limit_type})")
+        if window != self.sent_ack_window:
+            # Tell the peer the window we'll expect its acknowledgements by
+            self.send_control(RTMP_MSG_TYPE_WINDOW_ACK_SIZE, struct.pack(">I", window))
+            self.sent_ack_window = window
+
+    def on_user_control(self, payload):
+        event_type = struct.unpack_from(">H", payload)[0]
+        if event_type == USER_CONTROL_PING_REQUEST and len(payload) >= 6:
+            self.send_control(
+                RTMP_MSG_TYPE_USER_CONTROL,
+                struct.pack(">H", USER_CONTROL_PING_RESPONSE) + payload[2:6],
+            )
+        elif event_type == USER_CONTROL_SET_BUFFER_LENGTH and len(payload) >= 10:
+            stream_id, buffer_length = struct.unpack_from(">II", payload, 2)
+            logging.debug(
+                f"Peer buffer length for stream {stream_id}: {buffer_length} ms"
+            )
+
+    def send_control(self, msg_type, payload):
+        """Sends a protocol control message on chunk stream 2, message stream 0."""
+        self.send_message(CSID_PROTOCOL_CONTROL, msg_type, 0, 0, payload)
+
+    def send_command(self, payload, stream_id=0):
+        """Sends an AMF0 command message."""
+        self.send_message(CSID_COMMAND, RTMP_MSG_TYPE_COMMAND, stream_id, 0, payload)
+
+    def write(self, data):
+        self.writer.write(data)
+
+    def writelines(self, data):
+        self.writer.writelines(data)
+
+    def get_extra_info(self, name, default=None):
+        return self.writer.get_extra_info(name, default)
+
+    def is_closing(self):
+        return self.writer.is_closing()
+
+    def close(self):
+        self.writer.close()
+
+    async def wait_closed(self):
+        await self.writer.wait_closed()
+
+    async def drain(self):
+        await self.writer.drain()
+
+
+# Protocol control messages that the session handles itself
+CONTROL_MESSAGE_HANDLERS = {
+    RTMP_MSG_TYPE_ACK: RTMPSession.on_acknowledgement,
+    RTMP_MSG_TYPE_USER_CONTROL: RTMPSession.on_user_control,
+    RTMP_MSG_TYPE_WINDOW_ACK_SIZE: RTMPSession.on_window_ack_size,
+    RTMP_MSG_TYPE_SET_PEER_BANDWIDTH: RTMPSession.on_set_peer_bandwidth,
+}
+
+
+class TransportWriter:
+    """
+    Minimal StreamWriter stand-in over a protocol transport.
+
+    Lets the command handlers written against StreamWriter (`write`, `drain`,
+    `close`, `wait_closed`) run unchanged in the BufferedProtocol ingest mode.
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+        self._paused = False
+        # Every drain() blocked while paused: a player session is drained by
+        # both its Subscriber's sender and the reader's flush
+        self._drain_waiters = collections.deque()
+        self._closed = asyncio.get_running_loop().create_future()
+
+    def write(self, data):
+        self.transport.write(data)
+
+    def writelines(self, data):
+        self.transport.writelines(data)
+
+    def get_extra_info(self, name, default=None):
+        return self.transport.get_extra_info(name, default)
+
+    def is_closing(self):
+        return self.transport.is_closing()
+
+    def close(self):
+        self.transport.close()
+
+    async def wait_closed(self):
+        await self._closed
+
+    async def drain(self):
+        if self.transport.is_closing():
+            # Let the event loop deliver connection_lost before reporting it
+            await asyncio.sleep(0)
+            if self._closed.done():
+                raise ConnectionResetError("Connection lost")
+        if self._paused:
+            waiter = asyncio.get_running_loop().create_future()
+            self._drain_waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                self._drain_waiters.remove(waiter)
+
+    def set_reading(self, reading):
+        if self.transport.is_closing():
+            return
+        if reading:
+            self.transport.resume_reading()
+        else:
+            self.transport.pause_reading()
+
+    def pause_writing(self):
+        self._paused = True
+
+    def resume_writing(self):
+        self._paused = False
+        self._wake_drain_waiters()
+
+    def connection_lost(self, exc):
+        if not self._closed.done():
+            self._closed.set_result(None)
+        self._wake_drain_waiters(exc or ConnectionResetError("Connection lost"))
+
+    def _wake_drain_waiters(self, exc=None):
+        for waiter in self._drain_waiters:
+            if not waiter.done():
+                if exc is None:
+                    waiter.set_result(None)
+                else:
+                    waiter.set_exception(exc)
+
+
+class RTMPProtocol(asyncio.BufferedProtocol):
+    """
+    BufferedProtocol ingest path: one Python callback per socket read.
+
+    The event loop reads straight into a per-connection receive buffer
+    (`get_buffer`/`buffer_updated`), and every complete chunk in it is parsed
+    synchronously. Unparsed bytes stay in place; the buffer is compacted when
+    its free tail runs low, so no copy happens on the common path. Media and
+    control messages are handled inline; AMF commands, which await writes,
+    are queued to a per-connection task that preserves message order.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.transport_writer = None
+        self.session = None
+        self.buffer = bytearray(RECEIVE_BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
+        self.read_pos = 0
+        self.write_pos = 0
+        self.handshake_state = HANDSHAKE_WAIT_C0C1
+        self.pending = collections.deque()
+        self.command_task = None
+        self.handshake_timer = None  # Drops the connection if a phase stalls
+        self.s1_sent = None
+
+    def connection_made(self, transport):
+        server = self.server
+        if server.pending_handshakes >= server.max_pending_handshakes:
+            server.reject_handshake(transport)
+            return
+        logging.info("New client connected.")
+        tune_connection(transport, server.tuning)
+        self.transport = transport
+        self.transport_writer = TransportWriter(transport)
+        self.session = server.open_session(
+            self.transport_writer,
+            capture=server.open_capture(transport.get_extra_info("peername")),
+        )
+        if server.memory.paused:
+            self.transport_writer.set_reading(False)
+        server.pending_handshakes += 1
+        self.handshake_timer = asyncio.get_running_loop().call_later(
+            server.handshake_c0c1_timeout, self.handshake_timed_out, "C0+C1"
+        )
+
+    def get_buffer(self, sizehint):
+        if len(self.buffer) - self.write_pos < RECEIVE_BUFFER_MIN_FREE:
+            unread = self.write_pos - self.read_pos
+            self.view[:unread] = self.view[self.read_pos : self.write_pos]
+            self.read_pos = 0
+            self.write_pos = unread
+        return self.view[self.write_pos :]
+
+    def buffer_updated(self, nbytes):
+        capture = self.session.capture
+        if capture is not None:
+            capture.write(self.view[self.write_pos : self.write_pos + nbytes])
+        self.write_pos += nbytes
+        session_metrics = self.session.metrics
+        self.session.received(nbytes)
+        busy_from = time.perf_counter()
+
+        try:
+            if self.handshake_state != HANDSHAKE_DONE and not self.handshake():
+                return
+
+            consumed, messages = self.session.demuxer.parse(
+                self.view[self.read_pos : self.write_pos]
+            )
+            self.read_pos += consumed
+            if self.read_pos == self.write_pos:
+                self.read_pos = self.write_pos = 0
+            elif self.write_pos == len(self.buffer) and self.read_pos == 0:
+                logging.error("Receive buffer full without a complete chunk.")
+                self.transport.close()
+                return
+
+            message_counts = session_metrics.messages
+            for message in messages:
+                message_counts[message.msg_type] += 1
+                self.message_received(message)
+
+        except ChunkProtocolError as e:
+            logging.warning(f"Closing {self.session.peer}: {e}")
+            self.session.trace.dump(f"protocol error: {e}")
+            self.transport.close()
+        except Exception as e:
+            logging.exception(f"Error handling client: {e}")
+            self.session.trace.dump(f"error: {e!r}")
+            self.transport.close()
+        finally:
+            session_metrics.busy_seconds += time.perf_counter() - busy_from
+
+    def handshake(self):
+        """Advances the RTMP handshake; returns True once it has completed."""
+        available = self.write_pos - self.read_pos
+
+        if self.handshake_state == HANDSHAKE_WAIT_C0C1:
+            if available < 1 + RTMP_HANDSHAKE_SIZE:
+                return False
+            version = self.buffer[self.read_pos]
+            if version != RTMP_VERSION:
+                logging.error("Invalid RTMP version: %s", version)
+                self.transport.close()
+                return False
+
+            c1_start = self.read_pos + 1
+            # S2 is an exact copy of C1 (unless answering a digest C1); copied
+            # out because the transport may hold on to it after the receive
+            # buffer has been reused
+            c1 = bytes(self.view[c1_start : c1_start + RTMP_HANDSHAKE_SIZE])
+            self.transport.writelines(self.server.handshake_response(c1))
+            logging.info("✅ Sent S0+S1+S2")
+            self.read_pos = c1_start + RTMP_HANDSHAKE_SIZE
+            available -= 1 + RTMP_HANDSHAKE_SIZE
+            self.handshake_state = HANDSHAKE_WAIT_C2
+
+            self.s1_sent = time.monotonic()
+            self.server.metrics.handshake_c0c1_seconds.observe(
+                self.s1_sent - self.session.metrics.started
+            )
+            self.handshake_timer.cancel()
+            self.handshake_timer = asyncio.get_running_loop().call_later(
+                self.server.handshake_c2_timeout, self.handshake_timed_out, "C2"
+            )
+
+        if available < RTMP_HANDSHAKE_SIZE:
+            return False
+        self.read_pos += RTMP_HANDSHAKE_SIZE
+        self.handshake_state = HANDSHAKE_DONE
+        self.end_handshake()
+        now = time.monotonic()
+        metrics = self.server.metrics
+        metrics.handshake_c2_seconds.observe(now - self.s1_sent)
+        metrics.handshake_seconds.observe(now - self.session.metrics.started)
+        logging.info("🚀 RTMP Handshake complete -- SUCCESS.")
+        return True
+
+    def handshake_timed_out(self, phase):
+        self.server.metrics.handshake_timeouts += 1
+        logging.warning(
+            f"RTMP Handshake with {self.session.peer} timed out waiting for {phase}."
+        )
+        self.transport.close()
+
+    def end_handshake(self):
+        """Stops the handshake timer and leaves the in-flight handshake count."""
+        self.handshake_timer.cancel()
+        self.server.pending_handshakes -= 1
+
+    def message_received(self, message):
+        # Once a command is queued, later messages queue behind it so that,
+        # e.g., media never overtakes the `publish` that precedes it.
+        if self.pending or message.msg_type == RTMP_MSG_TYPE_COMMAND:
+            self.pending.append(message)
+            if self.command_task is None:
+                self.command_task = asyncio.create_task(self.process_pending())
+        else:
+            self.server.process_message(message, self.session)
+
+    async def process_pending(self):
+        session = self.session
+        try:
+            while True:
+                session.cork()
+                while self.pending:
+                    message = self.pending[0]
+                    await self.server.handle_message(message, session)
+                    self.pending.popleft()
+                await session.flush()
+                # Commands received while the flush waited are handled too
+                if not self.pending:
+                    break
+        except Exception as e:
+            logging.exception(f"Error handling client: {e}")
+            session.trace.dump(f"error: {e!r}")
+            self.transport.close()
+        finally:
+            self.command_task = None
+
+    def pause_writing(self):
+        self.transport_writer.pause_writing()
+
+    def resume_writing(self):
+        self.transport_writer.resume_writing()
+
+    def eof_received(self):
+        return False
+
+    def connection_lost(self, exc):
+        if self.session is None:
+            return  # Rejected by admission control before the handshake
+        if self.handshake_state != HANDSHAKE_DONE:
+            self.end_handshake()
+            self.server.metrics.handshake_failures += 1
+        if exc is None:
+            logging.info("Client disconnected.")
+        else:
+            logging.warning(f"Client connection lost: {exc}")
+        self.transport_writer.connection_lost(exc)
+        if self.command_task is not None:
+            self.command_task.cancel()
+        self.pending.clear()
+        self.server.close_session(self.session)
 
 
 if __name__ == "__main__":
-    rtmp_server = RTMPServer()
-    asyncio.run(rtmp_server.start())
+    parser = argparse.ArgumentParser(description="Minimal RTMP server")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of worker processes sharing the listening port",
+    )
+    parser.add_argument(
+        "--log-level",
+        default=LOG_LEVEL,
+        help="DEBUG and TRACE (per-message) events are sampled per connection",
+    )
+    parser.add_argument(
+        "--trace-sample-rate",
+        type=float,
+        default=TRACE_SAMPLE_RATE,
+        help="fraction of connections that emit DEBUG/TRACE events",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=METRICS_PORT,
+        help="port of the Prometheus /metrics endpoint (0 disables it)",
+    )
+    parser.add_argument(
+        "--capture-dir",
+        default=CAPTURE_DIR,
+        help="record every connection's inbound bytes to files in this directory",
+    )
+    parser.add_argument(
+        "--record-dir",
+        default=RECORD_DIR,
+        help="record every published stream to FLV files in this directory",
+    )
+    parser.add_argument(
+        "--record-segment-bytes",
+        type=int,
+        default=RECORD_SEGMENT_BYTES,
+        help="start a new recording file after this many bytes (0: no limit)",
+    )
+    parser.add_argument(
+        "--record-segment-seconds",
+        type=float,
+        default=RECORD_SEGMENT_SECONDS,
+        help="start a new recording file after this many seconds (0: no limit)",
+    )
+    parser.add_argument(
+        "--hls-dir",
+        default=HLS_DIR,
+        help="package every published stream as HLS in this directory",
+    )
+    parser.add_argument("--hls-format", choices=hls.FORMATS, default=HLS_FORMAT)
+    parser.add_argument(
+        "--hls-segment-seconds",
+        type=float,
+        default=HLS_SEGMENT_SECONDS,
+        help="minimum HLS segment length; segments start on keyframes",
+    )
+    parser.add_argument(
+        "--hls-playlist-length",
+        type=int,
+        default=HLS_PLAYLIST_LENGTH,
+        help="segments listed in each HLS playlist",
+    )
+    parser.add_argument(
+        "--http-port",
+        type=int,
+        default=HTTP_PORT,
+        help="port serving HTTP-FLV, WebSocket-FLV and HLS, 0 to disable "
+        "(worker N: port + N)",
+    )
+    parser.add_argument(
+        "--h264-profiles",
+        type=h264.parse_profiles,
+        default=H264_PROFILES,
+        help="comma-separated H.264 profiles publishers may use, e.g. "
+        "baseline,main,high (default: any)",
+    )
+    parser.add_argument(
+        "--uvloop",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="use uvloop's event loop (default: when installed)",
+    )
+    parser.add_argument(
+        "--tcp-nodelay",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="disable Nagle's algorithm on accepted connections",
+    )
+    parser.add_argument("--recv-buffer", type=int, help="SO_RCVBUF bytes")
+    parser.add_argument("--send-buffer", type=int, help="SO_SNDBUF bytes")
+    parser.add_argument("--backlog", type=int, default=1024, help="listen() backlog")
+    parser.add_argument(
+        "--write-high-water",
+        type=int,
+        help="transport write buffer size at which a connection's writes pause",
+    )
+    parser.add_argument(
+        "--write-low-water",
+        type=int,
+        help="write buffer size at which they resume",
+    )
+    parser.add_argument(
+        "--digest-handshake",
+        action=argparse.BooleanOptionalAction,
+        default=DIGEST_HANDSHAKE,
+        help="answer digest (FP9) C1s with the digest handshake",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper())
+    tuning = TuningSettings(
+        uvloop=args.uvloop,
+        tcp_nodelay=args.tcp_nodelay,
+        recv_buffer=args.recv_buffer,
+        send_buffer=args.send_buffer,
+        backlog=args.backlog,
+        write_high_water=args.write_high_water,
+        write_low_water=args.write_low_water,
+    )
+
+    if args.workers > 1:
+        from rtmp_workers import WorkerSupervisor
+
+        WorkerSupervisor(
+            args.workers,
+            log_level=args.log_level.upper(),
+            trace_sample_rate=args.trace_sample_rate,
+            metrics_port=args.metrics_port,
+            capture_dir=args.capture_dir,
+            record_dir=args.record_dir,
+            record_segment_bytes=args.record_segment_bytes,
+            record_segment_seconds=args.record_segment_seconds,
+            hls_dir=args.hls_dir,
+            hls_format=args.hls_format,
+            hls_segment_seconds=args.hls_segment_seconds,
+            hls_playlist_length=args.hls_playlist_length,
+            http_port=args.http_port,
+            h264_profiles=args.h264_profiles,
+            digest_handshake=args.digest_handshake,
+            tuning=tuning,
+        ).run()
+    else:
+        rtmp_server = RTMPServer(
+            trace_sample_rate=args.trace_sample_rate,
+            metrics_port=args.metrics_port,
+            capture_dir=args.capture_dir,
+            record_dir=args.record_dir,
+            record_segment_bytes=args.record_segment_bytes,
+            record_segment_seconds=args.record_segment_seconds,
+            hls_dir=args.hls_dir,
+            hls_format=args.hls_format,
+            hls_segment_seconds=args.hls_segment_seconds,
+            hls_playlist_length=args.hls_playlist_length,
+            http_port=args.http_port,
+            h264_profiles=args.h264_profiles,
+            digest_handshake=args.digest_handshake,
+            tuning=tuning,
+        )
+        logging.info(f"Event loop: {select_event_loop(tuning)}")
+        asyncio.run(rtmp_server.start())
@@ -0,0 +1,272 @@
+from h264 import BitReader, H264Error
+from rtmp_live import SOUND_FORMAT_AAC
+
+# FLV AAC packet types (second byte of an AAC audio tag)
+AAC_SEQUENCE_HEADER = 0
+AAC_RAW = 1
+# FLV AAC audio tag header: sound format/flags, packet type
+AAC_TAG_HEADER_SIZE = 2
+
+SAMPLE_RATES = (
+    96000,
+    88200,
+    64000,
+    48000,
+    44100,
+    32000,
+    24000,
+    22050,
+    16000,
+    12000,
+    11025,
+    8000,
+    7350,
+)
+_EXPLICIT_FREQUENCY = 15  # A 24-bit sampling frequency follows
+_ESCAPE_OBJECT_TYPE = 31  # A 6-bit extension (plus 32) follows
+
+OBJECT_TYPE_SBR = 5
+OBJECT_TYPE_PS = 29
+OBJECT_TYPE_NAMES = {
+    1: "main",
+    2: "lc",
+    3: "ssr",
+    4: "ltp",
+    OBJECT_TYPE_SBR: "he-aac",
+    6: "scalable",
+    23: "ld",
+    OBJECT_TYPE_PS: "he-aacv2",
+    39: "eld",
+    42: "usac",
+}
+# Object types whose GASpecificConfig flags 960-sample frames
+_GA_OBJECT_TYPES = frozenset((1, 2, 3, 4, 6, 7, 17, 19, 20, 21, 22))
+# Low delay object types: 512-sample frames, or 480
+_LOW_DELAY_OBJECT_TYPES = frozenset((23, 39))
+# Channels of each channel_configuration; 0 leaves it to a program config
+_CHANNELS = (0, 1, 2, 3, 4, 5, 6, 8, 0, 0, 0, 7, 8, 24, 8, 0)
+
+ADTS_HEADER_SIZE = 7
+
+# A timestamp step longer than this many frames is a gap in the audio
+GAP_FRAMES = 1.5
+# Gain of the jitter and A/V offset averages, as in RFC 3550's jitter
+SMOOTHING = 16
+# Drift (ms) past which a stream's audio is logged as drifting
+DRIFT_WARNING_MS = 100
+
+
+class AACError(ValueError):
+    """Raised for an AudioSpecificConfig that isn't well-formed."""
+
+
+def _signed(delta):
+    """A difference of two 32-bit RTMP timestamps, across wraparound."""
+    return ((delta + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+
+class AudioSpecificConfig:
+    """
+    What an AudioSpecificConfig (the body of an AAC sequence header tag)
+    says about the stream: object type, the core sampling rate its frames
+    are timed at (the SBR output rate may be twice that), channels and
+    samples per frame.
+    """
+
+    __slots__ = (
+        "config",
+        "object_type",
+        "core_object_type",
+        "frequency_index",
+        "sample_rate",
+        "output_sample_rate",
+        "channel_configuration",
+        "channels",
+        "frame_samples",
+    )
+
+    def __init__(self, config):
+        self.config = bytes(config)
+        reader = BitReader(self.config)
+        try:
+            self.object_type = self.read_object_type(reader)
+            self.frequency_index, self.sample_rate = self.read_frequency(reader)
+            self.channel_configuration = reader.bits(4)
+            self.core_object_type = self.object_type
+            self.output_sample_rate = self.sample_rate
+            if self.object_type in (OBJECT_TYPE_SBR, OBJECT_TYPE_PS):
+                # Explicit HE-AAC: the SBR output rate, then the core's type
+                self.output_sample_rate = self.read_frequency(reader)[1]
+                self.core_object_type = self.read_object_type(reader)
+            short_frames = (
+                self.core_object_type in _GA_OBJECT_TYPES
+                or self.core_object_type in _LOW_DELAY_OBJECT_TYPES
+            ) and reader.flag()
+        except H264Error:
+            raise AACError("Truncated AudioSpecificConfig") from None
+        if not self.sample_rate:
+            raise AACError("AudioSpecificConfig with a zero sampling frequency")
+        self.channels = _CHANNELS[self.channel_configuration]
+        if self.core_object_type in _LOW_DELAY_OBJECT_TYPES:
+            self.frame_samples = 480 if short_frames else 512
+        else:
+            self.frame_samples = 960 if short_frames else 1024
+
+    @staticmethod
+    def read_object_type(reader):
+        object_type = reader.bits(5)
+        if object_type == _ESCAPE_OBJECT_TYPE:
+            object_type = 32 + reader.bits(6)
+        return object_type
+
+    @staticmethod
+    def read_frequency(reader):
+        """(sampling_frequency_index, sampling frequency in Hz)"""
+        index = reader.bits(4)
+        if index == _EXPLICIT_FREQUENCY:
+            return index, reader.bits(24)
+        if index >= len(SAMPLE_RATES):
+            raise AACError(f"Reserved sampling frequency index {index}")
+        return index, SAMPLE_RATES[index]
+
+    @property
+    def profile(self):
+        return OBJECT_TYPE_NAMES.get(self.object_type, str(self.object_type))
+
+    @property
+    def frame_duration(self):
+        """Milliseconds of audio in one frame."""
+        return 1000 * self.frame_samples / self.sample_rate
+
+    @property
+    def adts(self):
+        """
+        Whether frames can be carried in ADTS: one of the four MPEG-2
+        profiles at a tabled rate (HE-AAC as its core, with implicit SBR).
+        """
+        return (
+            1 <= self.core_object_type <= 4
+            and self.frequency_index != _EXPLICIT_FREQUENCY
+            and self.frame_samples == 1024
+        )
+
+    def adts_header(self, payload_size):
+        """The 7-byte ADTS header (no CRC) of one raw AAC frame."""
+        size = ADTS_HEADER_SIZE + payload_size
+        return bytes(
+            (
+                0xFF,
+                0xF1,  # MPEG-4, layer 0, no CRC
+                ((self.core_object_type - 1) << 6)
+                | (self.frequency_index << 2)
+                | (self.channel_configuration >> 2),
+                ((self.channel_configuration & 0x03) << 6) | (size >> 11),
+                (size >> 3) & 0xFF,
+                ((size & 0x07) << 5) | 0x1F,  # Buffer fullness 0x7FF (VBR)
+                0xFC,
+            )
+        )
+
+
+class AACInspector:
+    """
+    Follows one published AAC stream's timeline: the AudioSpecificConfig
+    from its sequence header, then each frame's timestamp against the
+    duration of the frames before it (drift, jitter, gaps) and against the
+    latest video timestamp (A/V offset). Per-frame work is a few additions
+    and comparisons.
+
+    Drift is measured from the frame after the sequence header or after
+    the last gap or backwards step, which restart the timeline.
+    """
+
+    __slots__ = (
+        "config",
+        "frame_duration",
+        "frames",
+        "last_timestamp",
+        "elapsed",
+        "span_frames",
+        "drift",
+        "max_drift",
+        "drift_warned",
+        "jitter",
+        "gaps",
+        "gap_time",
+        "discontinuities",
+        "video_timestamp",
+        "av_offset",
+    )
+
+    def __init__(self):
+        self.config = None  # AudioSpecificConfig
+        self.frame_duration = 0.0  # ms
+        self.frames = 0
+        self.last_timestamp = None
+        self.elapsed = 0  # Timestamp progression since the timeline started (ms)
+        self.span_frames = 0  # Frames in that time
+        self.drift = 0.0  # `elapsed` minus the frames' duration (ms)
+        self.max_drift = 0.0  # Largest absolute drift seen (ms)
+        self.drift_warned = False  # Set by the server once it logs the drift
+        self.jitter = 0.0  # Smoothed deviation of steps from a frame (ms)
+        self.gaps = 0
+        self.gap_time = 0.0  # Audio missing in the gaps (ms)
+        self.discontinuities = 0  # Timestamps stepping backwards
+        self.video_timestamp = None  # Latest video DTS, set by StreamMetrics
+        self.av_offset = None  # Smoothed audio minus video timestamp (ms)
+
+    def restart(self):
+        self.elapsed = 0
+        self.span_frames = 0
+        self.drift = 0.0
+        self.drift_warned = False
+
+    def inspect(self, timestamp, payload):
+        """
+        Inspects one FLV audio tag body. Returns the new
+        AudioSpecificConfig at a sequence header, else None; raises
+        AACError for a sequence header that doesn't parse.
+        """
+        if len(payload) < AAC_TAG_HEADER_SIZE or payload[0] >> 4 != SOUND_FORMAT_AAC:
+            return None
+        if payload[1] == AAC_SEQUENCE_HEADER:
+            self.config = AudioSpecificConfig(memoryview(payload)[AAC_TAG_HEADER_SIZE:])
+            self.frame_duration = self.config.frame_duration
+            self.last_timestamp = None
+            self.restart()
+            return self.config
+        if payload[1] != AAC_RAW or self.config is None:
+            return None
+
+        self.frames += 1
+        if self.video_timestamp is not None:
+            offset = _signed(timestamp - self.video_timestamp)
+            if self.av_offset is None:
+                self.av_offset = float(offset)
+            else:
+                self.av_offset += (offset - self.av_offset) / SMOOTHING
+
+        last_timestamp = self.last_timestamp
+        self.last_timestamp = timestamp
+        if last_timestamp is None:
+            return None
+        step = _signed(timestamp - last_timestamp)
+        frame_duration = self.frame_duration
+        if step < 0:
+            self.discontinuities += 1
+            self.restart()
+            return None
+        if step > frame_duration * GAP_FRAMES:
+            self.gaps += 1
+            self.gap_time += step - frame_duration
+            self.restart()
+            return None
+
+        self.jitter += (abs(step - frame_duration) - self.jitter) / SMOOTHING
+        self.elapsed += step
+        self.span_frames += 1
+        drift = self.elapsed - self.span_frames * frame_duration
+        self.drift = drift
+        if abs(drift) > self.max_drift:
+            self.max_drift = abs(drift)
+        return None
@@ -0,0 +1,383 @@
+import datetime
+import struct
+
+# AMF0 type markers
+AMF0_NUMBER = 0x00
+AMF0_BOOLEAN = 0x01
+AMF0_STRING = 0x02
+AMF0_OBJECT = 0x03
+AMF0_MOVIECLIP = 0x04  # Reserved, not supported
+AMF0_NULL = 0x05
+AMF0_UNDEFINED = 0x06
+AMF0_REFERENCE = 0x07
+AMF0_ECMA_ARRAY = 0x08
+AMF0_OBJECT_END = 0x09
+AMF0_STRICT_ARRAY = 0x0A
+AMF0_DATE = 0x0B
+AMF0_LONG_STRING = 0x0C
+AMF0_UNSUPPORTED = 0x0D
+AMF0_RECORDSET = 0x0E  # Reserved, not supported
+AMF0_XML_DOCUMENT = 0x0F
+AMF0_TYPED_OBJECT = 0x10
+AMF0_AVMPLUS = 0x11  # Switch to AMF3
+
+OBJECT_END = b"\x00\x00\x09"  # Empty property name + object end marker
+
+_DOUBLE = struct.Struct(">d")
+_UINT16 = struct.Struct(">H")
+_UINT32 = struct.Struct(">I")
+_DATE = struct.Struct(">dh")  # Milliseconds since the epoch, time zone (unused)
+_MARKED_DOUBLE = struct.Struct(">Bd")
+_MARKED_UINT16 = struct.Struct(">BH")
+_MARKED_UINT32 = struct.Struct(">BI")
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class AMF0DecodeError(ValueError):
+    """Raised for truncated or malformed AMF0 data."""
+
+
+class _Marker:
+    """Singleton for AMF0 values with no Python equivalent."""
+
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+    def __bool__(self):
+        return False
+
+
+UNDEFINED = _Marker("UNDEFINED")
+UNSUPPORTED = _Marker("UNSUPPORTED")
+
+
+class ECMAArray(dict):
+    """An AMF0 ECMA array (associative array); encoded back as one."""
+
+
+class TypedObject(dict):
+    """An AMF0 typed object: an object with a registered class name."""
+
+    def __init__(self, class_name, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.class_name = class_name
+
+    def __repr__(self):
+        return f"TypedObject({self.class_name!r}, {dict.__repr__(self)})"
+
+
+class XMLDocument(str):
+    """An AMF0 XML document; encoded back as one."""
+
+
+def _decode_utf8(data):
+    try:
+        return str(data, "utf-8")
+    except UnicodeDecodeError:
+        # Some encoders send Latin-1 metadata (e.g. file names)
+        return str(data, "latin-1")
+
+
+class Decoder:
+    """
+    Decodes AMF0 values from a bytes-like object without copying it.
+
+    Reads through a memoryview with precompiled structs and dispatches on the
+    type marker through `_readers`. Objects, ECMA arrays, strict arrays and
+    typed objects are recorded in decode order so reference markers resolve
+    to the same Python object.
+    """
+
+    __slots__ = ("view", "end", "pos", "references")
+
+    def __init__(self, data, pos=0):
+        self.view = data if isinstance(data, memoryview) else memoryview(data)
+        self.end = len(self.view)
+        self.pos = pos
+        self.references = []
+
+    def need(self, size):
+        if self.pos + size > self.end:
+            raise AMF0DecodeError(
+                f"AMF0 data truncated at offset {self.pos} "
+                f"(need {size} bytes, have {self.end - self.pos})"
+            )
+
+    def read_value(self):
+        self.need(1)
+        marker = self.view[self.pos]
+        self.pos += 1
+        reader = _readers.get(marker)
+        if reader is None:
+            raise AMF0DecodeError(
+                f"Unknown AMF0 type marker {hex(marker)} at offset {self.pos - 1}"
+            )
+        return reader(self)
+
+    def read_number(self):
+        self.need(8)
+        value = _DOUBLE.unpack_from(self.view, self.pos)[0]
+        self.pos += 8
+        return value
+
+    def read_boolean(self):
+        self.need(1)
+        value = self.view[self.pos] != 0
+        self.pos += 1
+        return value
+
+    def read_utf8(self):
+        """Reads a UTF-8 string with a 16-bit length (no type marker)."""
+        self.need(2)
+        length = _UINT16.unpack_from(self.view, self.pos)[0]
+        start = self.pos + 2
+        self.pos = start + length
+        if self.pos > self.end:
+            self.pos = start
+            self.need(length)
+        return _decode_utf8(self.view[start : self.pos])
+
+    def read_utf8_long(self):
+        """Reads a UTF-8 string with a 32-bit length (no type marker)."""
+        self.need(4)
+        length = _UINT32.unpack_from(self.view, self.pos)[0]
+        start = self.pos + 4
+        self.pos = start + length
+        if self.pos > self.end:
+            self.pos = start
+            self.need(length)
+        return _decode_utf8(self.view[start : self.pos])
+
+    def read_properties(self, target):
+        """Reads name/value pairs into `target` up to the object end marker."""
+        view = self.view
+        while True:
+            self.need(2)
+            length = _UINT16.unpack_from(view, self.pos)[0]
+            if length == 0:
+                self.need(3)
+                if view[self.pos + 2] == AMF0_OBJECT_END:
+                    self.pos += 3
+                    return target
+            name = self.read_utf8()
+            target[name] = self.read_value()
+
+    def read_object(self):
+        obj = {}
+        self.references.append(obj)
+        return self.read_properties(obj)
+
+    def read_null(self):
+        return None
+
+    def read_undefined(self):
+        return UNDEFINED
+
+    def read_unsupported(self):
+        return UNSUPPORTED
+
+    def read_reference(self):
+        self.need(2)
+        index = _UINT16.unpack_from(self.view, self.pos)[0]
+        self.pos += 2
+        if index >= len(self.references):
+            raise AMF0DecodeError(f"AMF0 reference {index} out of range")
+        return self.references[index]
+
+    def read_ecma_array(self):
+        self.need(4)
+        self.pos += 4  # Associative count, a hint only; the end marker is authoritative
+        array = ECMAArray()
+        self.references.append(array)
+        return self.read_properties(array)
+
+    def read_strict_array(self):
+        self.need(4)
+        count = _UINT32.unpack_from(self.view, self.pos)[0]
+        self.pos += 4
+        # Every element takes at least one byte, so the count can't exceed what's left
+        self.need(count)
+        array = []
+        self.references.append(array)
+        for _ in range(count):
+            array.append(self.read_value())
+        return array
+
+    def read_date(self):
+        self.need(10)
+        milliseconds = _DATE.unpack_from(self.view, self.pos)[0]
+        self.pos += 10
+        try:
+            return _EPOCH + datetime.timedelta(milliseconds=milliseconds)
+        except (OverflowError, ValueError):
+            raise AMF0DecodeError(f"AMF0 date out of range: {milliseconds}") from None
+
+    def read_long_string(self):
+        return self.read_utf8_long()
+
+    def read_xml_document(self):
+        return XMLDocument(self.read_utf8_long())
+
+    def read_typed_object(self):
+        obj = TypedObject(self.read_utf8())
+        self.references.append(obj)
+        return self.read_properties(obj)
+
+    def read_object_end(self):
+        raise AMF0DecodeError(f"Unexpected AMF0 object end at offset {self.pos - 1}")
+
+    def read_reserved(self):
+        marker = self.view[self.pos - 1]
+        raise AMF0DecodeError(f"Unsupported AMF0 type marker {hex(marker)}")
+
+
+_readers = {
+    AMF0_NUMBER: Decoder.read_number,
+    AMF0_BOOLEAN: Decoder.read_boolean,
+    AMF0_STRING: Decoder.read_utf8,
+    AMF0_OBJECT: Decoder.read_object,
+    AMF0_MOVIECLIP: Decoder.read_reserved,
+    AMF0_NULL: Decoder.read_null,
+    AMF0_UNDEFINED: Decoder.read_undefined,
+    AMF0_REFERENCE: Decoder.read_reference,
+    AMF0_ECMA_ARRAY: Decoder.read_ecma_array,
+    AMF0_OBJECT_END: Decoder.read_object_end,
+    AMF0_STRICT_ARRAY: Decoder.read_strict_array,
+    AMF0_DATE: Decoder.read_date,
+    AMF0_LONG_STRING: Decoder.read_long_string,
+    AMF0_UNSUPPORTED: Decoder.read_unsupported,
+    AMF0_RECORDSET: Decoder.read_reserved,
+    AMF0_XML_DOCUMENT: Decoder.read_xml_document,
+    AMF0_TYPED_OBJECT: Decoder.read_typed_object,
+    AMF0_AVMPLUS: Decoder.read_reserved,
+}
+
+
+def iter_values(data):
+    """Yields each top-level value in `data`; raises AMF0DecodeError on bad data."""
+    decoder = Decoder(data)
+    while decoder.pos < decoder.end:
+        yield decoder.read_value()
+
+
+def decode_all(data):
+    """Decodes every top-level value in `data`."""
+    return list(iter_values(data))
+
+
+def write_number(out, value):
+    out += _MARKED_DOUBLE.pack(AMF0_NUMBER, value)
+
+
+def write_boolean(out, value):
+    out += b"\x01\x01" if value else b"\x01\x00"
+
+
+def write_utf8(out, value):
+    """Writes a property name: a UTF-8 string with a 16-bit length."""
+    encoded = value.encode("utf-8")
+    out += _UINT16.pack(len(encoded))
+    out += encoded
+
+
+def write_string(out, value):
+    encoded = value.encode("utf-8")
+    if len(encoded) > 0xFFFF:
+        out += _MARKED_UINT32.pack(AMF0_LONG_STRING, len(encoded))
+    else:
+        out += _MARKED_UINT16.pack(AMF0_STRING, len(encoded))
+    out += encoded
+
+
+def write_xml_document(out, value):
+    encoded = value.encode("utf-8")
+    out += _MARKED_UINT32.pack(AMF0_XML_DOCUMENT, len(encoded))
+    out += encoded
+
+
+def write_null(out, value):
+    out.append(AMF0_NULL)
+
+
+def write_marker(out, value):
+    out.append(AMF0_UNDEFINED if value is UNDEFINED else AMF0_UNSUPPORTED)
+
+
+def write_properties(out, value):
+    for name, item in value.items():
+        write_utf8(out, str(name))
+        write_value(out, item)
+    out += OBJECT_END
+
+
+def write_object(out, value):
+    out.append(AMF0_OBJECT)
+    write_properties(out, value)
+
+
+def write_ecma_array(out, value):
+    out += _MARKED_UINT32.pack(AMF0_ECMA_ARRAY, len(value))
+    write_properties(out, value)
+
+
+def write_typed_object(out, value):
+    out.append(AMF0_TYPED_OBJECT)
+    write_utf8(out, value.class_name)
+    write_properties(out, value)
+
+
+def write_strict_array(out, value):
+    out += _MARKED_UINT32.pack(AMF0_STRICT_ARRAY, len(value))
+    for item in value:
+        write_value(out, item)
+
+
+def write_date(out, value):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    milliseconds = (value - _EPOCH) / datetime.timedelta(milliseconds=1)
+    out.append(AMF0_DATE)
+    out += _DATE.pack(milliseconds, 0)
+
+
+_writers = {
+    float: write_number,
+    int: write_number,
+    bool: write_boolean,
+    str: write_string,
+    XMLDocument: write_xml_document,
+    type(None): write_null,
+    _Marker: write_marker,
+    dict: write_object,
+    ECMAArray: write_ecma_array,
+    TypedObject: write_typed_object,
+    list: write_strict_array,
+    tuple: write_strict_array,
+    datetime.datetime: write_date,
+}
+
+
+def write_value(out, value):
+    """Appends the AMF0 encoding of `value` to the bytearray `out`."""
+    writer = _writers.get(type(value))
+    if writer is None:
+        for value_type, writer in _writers.items():
+            if isinstance(value, value_type):
+                break
+        else:
+            raise TypeError(f"Cannot encode {type(value).__name__} as AMF0")
+    writer(out, value)
+
+
+def encode(*values):
+    """Encodes `values` back to back into one bytearray."""
+    out = bytearray()
+    for value in values:
+        write_value(out, value)
+    return out
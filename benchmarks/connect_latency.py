@@ -0,0 +1,158 @@
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import amf0
+import RTMPServer as rtmp
+from rtmp_client import (
+    CSID_COMMAND,
+    CSID_VIDEO,
+    RTMP_MSG_TYPE_AUDIO,
+    RTMP_MSG_TYPE_DATA,
+    RTMP_MSG_TYPE_VIDEO,
+    RTMPClient,
+)
+from rtmp_tuning import TuningSettings, create_listen_socket
+
+# AVC sequence header and keyframe FLV video tag bodies (contents are opaque
+# to the server; only the first two bytes are inspected)
+AVC_SEQUENCE_HEADER = b"\x17\x00\x00\x00\x00\x01\x64\x00\x1f\xff\xe1"
+AVC_KEYFRAME = b"\x17\x01\x00\x00\x00" + bytes(4096)
+
+
+async def publish_ffmpeg(client, host, port, stream_key):
+    """FFmpeg: connect, then releaseStream/FCPublish/createStream, then publish."""
+    await client.open(host, port)
+    await client.connect("live", f"rtmp://{host}:{port}/live")
+    stream_id = await client.publish(stream_key)
+    client.set_chunk_size(4096)
+    return stream_id
+
+
+async def publish_obs(client, host, port, stream_key):
+    """OBS: Set Chunk Size before connect, richer connect object, @setDataFrame."""
+    await client.open(host, port)
+    client.set_chunk_size(4096)
+    transaction_id = client.send_command(
+        "connect",
+        {
+            "app": "live",
+            "type": "nonprivate",
+            "flashVer": "FMLE/3.0 (compatible; FMSc/1.0)",
+            "swfUrl": f"rtmp://{host}:{port}/live",
+            "tcUrl": f"rtmp://{host}:{port}/live",
+        },
+    )
+    await client.writer.drain()
+    await client.wait_result(transaction_id)
+    stream_id = await client.publish(stream_key)
+    client.send_message(
+        CSID_COMMAND,
+        RTMP_MSG_TYPE_DATA,
+        stream_id,
+        0,
+        amf0.encode(
+            "@setDataFrame",
+            "onMetaData",
+            amf0.ECMAArray(width=1280.0, height=720.0, framerate=30.0),
+        ),
+    )
+    return stream_id
+
+
+SEQUENCES = {"ffmpeg": publish_ffmpeg, "obs": publish_obs}
+
+
+async def wait_first_media(player):
+    while True:
+        message = await player.read_message()
+        if message.msg_type in (RTMP_MSG_TYPE_AUDIO, RTMP_MSG_TYPE_VIDEO):
+            return
+
+
+async def measure_once(host, port, sequence, stream_key):
+    """
+    Time from the publisher's TCP connect to the first media message a
+    player, already waiting on the stream, receives.
+    """
+    player = RTMPClient()
+    await player.open(host, port)
+    await player.connect("live", f"rtmp://{host}:{port}/live")
+    await player.play(stream_key)
+
+    publisher = RTMPClient()
+    started = time.perf_counter()
+    stream_id = await SEQUENCES[sequence](publisher, host, port, stream_key)
+    publisher.send_message(
+        CSID_VIDEO, RTMP_MSG_TYPE_VIDEO, stream_id, 0, AVC_SEQUENCE_HEADER
+    )
+    publisher.send_message(CSID_VIDEO, RTMP_MSG_TYPE_VIDEO, stream_id, 0, AVC_KEYFRAME)
+    await publisher.writer.drain()
+    await wait_first_media(player)
+    elapsed = time.perf_counter() - started
+
+    await publisher.close()
+    await player.close()
+    return elapsed
+
+
+async def run(args):
+    server = rtmp.RTMPServer("127.0.0.1", 0, ingest_mode=args.ingest_mode)
+    sock = create_listen_socket("127.0.0.1", 0, TuningSettings())
+    host, port = sock.getsockname()
+    serve_task = asyncio.create_task(server.start(sock=sock, launch_stream=False))
+    await asyncio.sleep(0.1)
+
+    try:
+        for sequence in args.sequences:
+            samples = []
+            for round_number in range(args.rounds):
+                samples += await asyncio.gather(
+                    *(
+                        measure_once(host, port, sequence, f"bench-{round_number}-{i}")
+                        for i in range(args.concurrency)
+                    )
+                )
+            samples.sort()
+            print(
+                f"{sequence:>6} ({args.ingest_mode}, x{args.concurrency}): "
+                f"median {statistics.median(samples) * 1000:.2f} ms, "
+                f"p95 {samples[int(len(samples) * 0.95) - 1] * 1000:.2f} ms, "
+                f"max {samples[-1] * 1000:.2f} ms over {len(samples)} publishes"
+            )
+    finally:
+        serve_task.cancel()
+        sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure publisher connect-to-first-media latency"
+    )
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="publishers connecting at once (simulates a reconnect storm)",
+    )
+    parser.add_argument(
+        "--ingest-mode", choices=("protocol", "stream"), default=rtmp.INGEST_MODE
+    )
+    parser.add_argument(
+        "--sequences", nargs="+", choices=sorted(SEQUENCES), default=sorted(SEQUENCES)
+    )
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import RTMPServer as rtmp
+from rtmp_chunk import ChunkMuxer
+from rtmp_client import RTMPClient
+from rtmp_tuning import TuningSettings, create_listen_socket, select_event_loop
+from suite import PUBLISH_CHUNK_SIZE, synthetic_messages
+
+LOOPS = ("asyncio", "uvloop")
+
+
+def report_cpu(conn):
+    """Answers each request on `conn` with this process's CPU time."""
+    while True:
+        try:
+            conn.recv()
+        except EOFError:
+            return
+        conn.send(time.process_time())
+
+
+def serve(sock, loop_name, ingest_mode, cpu_conn):
+    """Server process: serves `sock` on the chosen event loop."""
+    logging.basicConfig(level="ERROR")  # Every connect logs a warning
+    tuning = TuningSettings(uvloop=loop_name == "uvloop")
+    select_event_loop(tuning)
+    server = rtmp.RTMPServer(
+        "127.0.0.1",
+        0,
+        ingest_mode=ingest_mode,
+        metrics_port=0,
+        http_port=0,
+        tuning=tuning,
+    )
+    threading.Thread(target=report_cpu, args=(cpu_conn,), daemon=True).start()
+    try:
+        asyncio.run(server.start(sock=sock, launch_stream=False))
+    except KeyboardInterrupt:
+        pass
+
+
+def mux_media(media, stream_id):
+    """
+    A publisher's media chunked at the publish chunk size, done before the
+    clock starts so the client's own CPU stays out of the measurement.
+    """
+    muxer = ChunkMuxer(PUBLISH_CHUNK_SIZE)
+    return b"".join(
+        b"".join(muxer.mux(m.csid, m.msg_type, stream_id, m.timestamp, m.payload))
+        for m in media
+    )
+
+
+async def publish_once(host, port, stream_key, media):
+    """
+    Publishes `media` as fast as the server takes it; returns the seconds from
+    the first media byte until the server answers a command sent after the
+    last one, i.e. has ingested all of it.
+    """
+    client = RTMPClient()
+    await client.open(host, port)
+    try:
+        await client.connect("live", f"rtmp://{host}:{port}/live")
+        stream_id = await client.publish(stream_key)
+        data = mux_media(media, stream_id)
+        client.set_chunk_size(PUBLISH_CHUNK_SIZE)
+        started = time.perf_counter()
+        client.writer.write(data)
+        transaction_id = client.send_command("createStream", None)
+        await client.writer.drain()
+        await client.wait_result(transaction_id)
+        return time.perf_counter() - started
+    finally:
+        await client.close()
+
+
+def server_cpu(conn):
+    conn.send(None)
+    return conn.recv()
+
+
+async def bench_loop(host, port, cpu_conn, media, args):
+    """
+    Rounds of `args.publishers` concurrent publishers; returns the ingest
+    rate (MB/s) and server CPU per MB of each round.
+    """
+    payload_bytes = sum(len(m.payload) for m in media) * args.publishers
+    rates = []
+    cpu_per_mb = []
+    for round_number in range(args.rounds):
+        cpu_before = server_cpu(cpu_conn)
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(
+                publish_once(host, port, f"bench-{round_number}-{i}", media)
+                for i in range(args.publishers)
+            )
+        )
+        elapsed = time.perf_counter() - started
+        cpu = server_cpu(cpu_conn) - cpu_before
+        rates.append(payload_bytes / elapsed / 1e6)
+        cpu_per_mb.append(cpu / (payload_bytes / 1e6))
+    return rates, cpu_per_mb
+
+
+def run_loop(loop_name, media, args):
+    context = multiprocessing.get_context("spawn")
+    sock = create_listen_socket("127.0.0.1", 0, TuningSettings())
+    host, port = sock.getsockname()[:2]
+    parent_conn, child_conn = context.Pipe()
+    process = context.Process(
+        target=serve,
+        args=(sock, loop_name, args.ingest_mode, child_conn),
+        daemon=True,
+    )
+    process.start()
+    sock.close()  # The server process has its own copy
+    try:
+        return asyncio.run(bench_loop(host, port, parent_conn, media, args))
+    finally:
+        process.terminate()
+        process.join()
+
+
+def uvloop_installed():
+    try:
+        import uvloop  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare asyncio's event loop with uvloop on the ingest path"
+    )
+    parser.add_argument("--loops", default=",".join(LOOPS))
+    parser.add_argument(
+        "--ingest-mode", choices=("stream", "protocol"), default=rtmp.INGEST_MODE
+    )
+    parser.add_argument("--publishers", type=int, default=8)
+    parser.add_argument(
+        "--messages", type=int, default=3000, help="media messages per publisher"
+    )
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    _, media = synthetic_messages(args.messages)
+    megabytes = sum(len(m.payload) for m in media) * args.publishers / 1e6
+    print(
+        f"{args.publishers} publishers x {args.messages} messages "
+        f"({megabytes:.1f} MB per round), {args.ingest_mode} ingest, "
+        f"{args.rounds} rounds"
+    )
+    for loop_name in args.loops.split(","):
+        if loop_name == "uvloop" and not uvloop_installed():
+            print(f"  {loop_name:8} skipped: not installed (pip install uvloop)")
+            continue
+        rates, cpu_per_mb = run_loop(loop_name, media, args)
+        print(
+            f"  {loop_name:8} median {statistics.median(rates):7.1f} MB/s "
+            f"(best {max(rates):.1f}), server CPU "
+            f"{statistics.median(cpu_per_mb) * 1000:.2f} ms/MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
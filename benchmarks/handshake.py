@@ -0,0 +1,108 @@
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import RTMPServer as rtmp
+from rtmp_client import RTMPClient
+from rtmp_handshake import generate_c1, generate_s1_blobs
+from rtmp_tuning import TuningSettings, create_listen_socket
+
+CASES = {
+    "simple C1, digest off": (False, False, 0),
+    "simple C1, digest on": (True, False, 0),
+    "digest C1 scheme 0": (True, True, 0),
+    "digest C1 scheme 1": (True, True, 1),
+}
+
+
+class FixedS1Pool:
+    """Hands out one S1 forever, so os.urandom isn't what gets measured."""
+
+    def __init__(self):
+        self.blob = generate_s1_blobs(1)[0]
+        self.misses = 0
+
+    def take(self):
+        return self.blob
+
+
+def bench_response(digest_handshake, digest_c1, scheme, number, repeat):
+    """Server CPU to answer one C1 with S0 + S1 + S2."""
+    server = rtmp.RTMPServer(metrics_port=0, digest_handshake=digest_handshake)
+    server.s1_pool = FixedS1Pool()
+    c1s = [generate_c1(digest_c1, scheme) for _ in range(64)]
+    respond = server.handshake_response
+    index = iter(range(number * repeat + 1))
+    timings = timeit.repeat(
+        lambda: respond(c1s[next(index) % len(c1s)]), number=number, repeat=repeat
+    )
+    return min(timings) / number
+
+
+async def bench_connections(digest, connections, concurrency):
+    """Accept-to-C2 handshakes through a real listener, client CPU included."""
+    server = rtmp.RTMPServer(
+        "127.0.0.1", 0, metrics_port=0, http_port=0, digest_handshake=digest
+    )
+    sock = create_listen_socket("127.0.0.1", 0, TuningSettings())
+    host, port = sock.getsockname()
+    serve_task = asyncio.create_task(server.start(sock=sock, launch_stream=False))
+    await asyncio.sleep(0.1)
+
+    async def once():
+        client = RTMPClient()
+        started = time.perf_counter()
+        await client.open(host, port, digest=digest)
+        elapsed = time.perf_counter() - started
+        await client.close()
+        return elapsed
+
+    samples = []
+    started = time.perf_counter()
+    try:
+        for _ in range(connections // concurrency):
+            samples += await asyncio.gather(*(once() for _ in range(concurrency)))
+    finally:
+        serve_task.cancel()
+        sock.close()
+    return samples, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the per-connection cost of the simple and digest handshakes"
+    )
+    parser.add_argument("--number", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--connections", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    print("server CPU per handshake response:")
+    for name, case in CASES.items():
+        seconds = bench_response(*case, args.number, args.repeat)
+        print(f"  {name:<22} {seconds * 1e6:8.2f} us")
+
+    print(f"end to end, {args.connections} connections x{args.concurrency}:")
+    for name, digest in (("simple", False), ("digest", True)):
+        samples, elapsed = asyncio.run(
+            bench_connections(digest, args.connections, args.concurrency)
+        )
+        samples.sort()
+        print(
+            f"  {name:<6} median {statistics.median(samples) * 1000:.2f} ms, "
+            f"p95 {samples[int(len(samples) * 0.95) - 1] * 1000:.2f} ms, "
+            f"{len(samples) / elapsed:.0f} handshakes/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,481 @@
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import os
+import struct
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import amf0
+import flv
+import RTMPServer as rtmp
+from rtmp_client import (
+    CSID_AUDIO,
+    CSID_COMMAND,
+    CSID_VIDEO,
+    READ_BUFFER_SIZE,
+    RTMP_MSG_TYPE_AUDIO,
+    RTMP_MSG_TYPE_DATA,
+    RTMP_MSG_TYPE_VIDEO,
+    RTMPClient,
+)
+
+CSIDS = {
+    RTMP_MSG_TYPE_AUDIO: CSID_AUDIO,
+    RTMP_MSG_TYPE_VIDEO: CSID_VIDEO,
+    RTMP_MSG_TYPE_DATA: CSID_COMMAND,
+}
+
+# Synthetic media: H.264 in FLV video tags, AAC-LC 44.1 kHz in FLV audio tags.
+# The sequence headers are real (Constrained Baseline 3.1, 1280x720, one SPS
+# and PPS); each video tag holds one IDR or non-IDR slice NAL unit and each
+# audio tag one frame, with random bodies
+AVC_SPS = bytes.fromhex("6742c01feca02802dc80")
+AVC_PPS = bytes.fromhex("68ce3c80")
+AVC_SEQUENCE_HEADER = (
+    b"\x17\x00\x00\x00\x00"
+    + bytes((1, AVC_SPS[1], AVC_SPS[2], AVC_SPS[3], 0xFF, 0xE1))  # 4-byte lengths
+    + struct.pack(">H", len(AVC_SPS))
+    + AVC_SPS
+    + b"\x01"
+    + struct.pack(">H", len(AVC_PPS))
+    + AVC_PPS
+)
+AAC_SEQUENCE_HEADER = b"\xaf\x00\x12\x10"
+AVC_KEYFRAME_HEADER = b"\x17\x01\x00\x00\x00"
+AVC_INTERFRAME_HEADER = b"\x27\x01\x00\x00\x00"
+NAL_IDR_SLICE = b"\x65"
+NAL_SLICE = b"\x41"
+AAC_RAW_HEADER = b"\xaf\x01"
+AAC_SAMPLE_RATE = 44100
+AAC_FRAME_SAMPLES = 1024
+KEYFRAME_WEIGHT = 4  # A keyframe is this many times the size of an inter frame
+
+# Tags due within this many seconds are sent together rather than slept for
+PACING_GRANULARITY = 0.005
+
+METRICS_SAMPLE_INTERVAL = 1.0
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+class SyntheticMedia:
+    """Constant-bitrate audio/video tags with a fixed GOP, shared by publishers."""
+
+    def __init__(self, video_kbps, audio_kbps, fps, gop):
+        self.fps = fps
+        self.gop = gop
+        self.bitrate = (video_kbps + audio_kbps) * 1000
+        gop_bytes = video_kbps * 125 * gop / fps
+        inter_size = int(gop_bytes / (gop - 1 + KEYFRAME_WEIGHT))
+        self.keyframe = self.video_tag(
+            AVC_KEYFRAME_HEADER, NAL_IDR_SLICE, inter_size * KEYFRAME_WEIGHT
+        )
+        self.interframe = self.video_tag(AVC_INTERFRAME_HEADER, NAL_SLICE, inter_size)
+        self.has_video = video_kbps > 0
+        audio_size = int(audio_kbps * 125 * AAC_FRAME_SAMPLES / AAC_SAMPLE_RATE)
+        self.audio = AAC_RAW_HEADER + os.urandom(audio_size)
+        self.has_audio = audio_kbps > 0
+        self.metadata = amf0.encode(
+            "@setDataFrame",
+            "onMetaData",
+            amf0.ECMAArray(
+                videodatarate=float(video_kbps),
+                audiodatarate=float(audio_kbps),
+                framerate=float(fps),
+                videocodecid=7.0,
+                audiocodecid=10.0,
+                audiosamplerate=float(AAC_SAMPLE_RATE),
+            ),
+        )
+
+    @staticmethod
+    def video_tag(header, nal_header, size):
+        """A video tag holding one NAL unit with a `size`-byte random body."""
+        nal = nal_header + os.urandom(size)
+        return header + struct.pack(">I", len(nal)) + nal
+
+    def timeline(self):
+        """Yields `(msg_type, timestamp in ms, payload)` forever, in send order."""
+        yield RTMP_MSG_TYPE_DATA, 0, self.metadata
+        if self.has_video:
+            yield RTMP_MSG_TYPE_VIDEO, 0, AVC_SEQUENCE_HEADER
+        if self.has_audio:
+            yield RTMP_MSG_TYPE_AUDIO, 0, AAC_SEQUENCE_HEADER
+        frame = sample = 0
+        while True:
+            video_ts = frame * 1000 / self.fps if self.has_video else float("inf")
+            audio_ts = (
+                sample * 1000 / AAC_SAMPLE_RATE if self.has_audio else float("inf")
+            )
+            if video_ts <= audio_ts:
+                payload = self.interframe if frame % self.gop else self.keyframe
+                yield RTMP_MSG_TYPE_VIDEO, round(video_ts), payload
+                frame += 1
+            else:
+                yield RTMP_MSG_TYPE_AUDIO, round(audio_ts), self.audio
+                sample += AAC_FRAME_SAMPLES
+
+
+class FLVMedia:
+    """The tags of a recorded FLV file, looped with continuous timestamps."""
+
+    def __init__(self, path):
+        self.tags = [
+            tag
+            for tag in flv.read_tags(path)
+            if tag.tag_type in (flv.TAG_AUDIO, flv.TAG_VIDEO, flv.TAG_SCRIPT_DATA)
+        ]
+        if not self.tags:
+            raise flv.FLVError(f"No audio or video tags in {path}")
+        self.base = self.tags[0].timestamp
+        # One frame past the last tag, so the loop doesn't repeat a timestamp
+        self.duration = max(1, self.tags[-1].timestamp - self.base + 33)
+        media_bytes = sum(len(tag.data) for tag in self.tags)
+        self.bitrate = media_bytes * 8000 / self.duration
+
+    def timeline(self):
+        set_data_frame = amf0.encode("@setDataFrame")
+        offset = 0
+        while True:
+            for tag in self.tags:
+                timestamp = offset + tag.timestamp - self.base
+                if tag.tag_type == flv.TAG_SCRIPT_DATA:
+                    if not offset:  # Metadata once, as an encoder would
+                        yield RTMP_MSG_TYPE_DATA, timestamp, set_data_frame + tag.data
+                else:
+                    yield tag.tag_type, timestamp, tag.data
+            offset += self.duration
+
+
+class StepStats:
+    """What one concurrency step measured."""
+
+    def __init__(self, publishers):
+        self.publishers = publishers
+        self.connect_seconds = []  # TCP connect to NetStream.Publish.Start
+        self.play_seconds = []  # TCP connect to NetStream.Play.Start
+        self.lag_seconds = []  # Video tag due time to arrival at a player
+        self.max_slip = 0.0  # How far publishers fell behind their schedule
+        self.server_lag = []  # Scraped rtmp_event_loop_lag_last_seconds
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.errors = collections.Counter()
+
+    def error(self, kind, exc):
+        self.errors[kind] += 1
+        logging.debug(f"{kind}: {exc!r}")
+
+
+class LoadGenerator:
+    """Ramps publishers (and players on their streams) against one server."""
+
+    def __init__(self, args, media):
+        self.args = args
+        self.media = media
+        self.step = StepStats(0)
+        self.publishers = []
+        self.tasks = set()
+        self.clients = []
+
+    def spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def open_client(self):
+        """Handshake, then `connect` to the app."""
+        args = self.args
+        client = RTMPClient()
+        self.clients.append(client)
+        await client.open(args.host, args.port)
+        await client.connect(args.app, f"rtmp://{args.host}:{args.port}/{args.app}")
+        return client
+
+    async def start_publisher(self, index):
+        args = self.args
+        stream_key = f"{args.stream_prefix}-{index}"
+        started = time.perf_counter()
+        try:
+            client = await asyncio.wait_for(self.open_client(), args.timeout)
+            stream_id = await asyncio.wait_for(client.publish(stream_key), args.timeout)
+        except asyncio.TimeoutError as e:
+            self.step.error("publish_timeout", e)
+            return
+        except (OSError, asyncio.IncompleteReadError) as e:
+            self.step.error("publish_connect", e)
+            return
+        self.step.connect_seconds.append(time.perf_counter() - started)
+        client.set_chunk_size(args.chunk_size)
+
+        # Players join before the first tag, so every video tag is a lag sample
+        origin = []
+        await asyncio.gather(
+            *(
+                self.start_player(stream_key, origin)
+                for _ in range(args.players_per_stream)
+            )
+        )
+        self.publishers.append(client)
+        self.spawn(self.discard_input(client))
+        self.spawn(self.publish(client, stream_id, origin))
+
+    async def publish(self, client, stream_id, origin):
+        origin.append(time.perf_counter())
+        start = origin[0]
+        writer = client.writer
+        sent = client.muxer.bytes_out
+        try:
+            for msg_type, timestamp, payload in self.media.timeline():
+                delay = start + timestamp / 1000 - time.perf_counter()
+                if delay > PACING_GRANULARITY:
+                    await asyncio.sleep(delay)
+                elif delay < 0 and -delay > self.step.max_slip:
+                    self.step.max_slip = -delay
+                client.send_message(
+                    CSIDS[msg_type], msg_type, stream_id, timestamp, payload
+                )
+                await writer.drain()
+                bytes_out = client.muxer.bytes_out
+                self.step.bytes_sent += bytes_out - sent
+                sent = bytes_out
+        except (OSError, RuntimeError) as e:
+            self.step.error("publish_disconnect", e)
+        finally:
+            client.writer.close()
+
+    async def discard_input(self, client):
+        """Reads and drops what the server sends a publisher (acks, statuses)."""
+        try:
+            while await client.reader.read(READ_BUFFER_SIZE):
+                pass
+        except OSError:
+            pass
+
+    async def start_player(self, stream_key, origin):
+        args = self.args
+        started = time.perf_counter()
+        try:
+            client = await asyncio.wait_for(self.open_client(), args.timeout)
+            await asyncio.wait_for(client.play(stream_key), args.timeout)
+        except asyncio.TimeoutError as e:
+            self.step.error("play_timeout", e)
+            return
+        except (OSError, asyncio.IncompleteReadError) as e:
+            self.step.error("play_connect", e)
+            return
+        self.step.play_seconds.append(time.perf_counter() - started)
+        self.spawn(self.play(client, origin))
+
+    async def play(self, client, origin):
+        try:
+            while True:
+                message = await client.read_message()
+                if message.msg_type == RTMP_MSG_TYPE_VIDEO:
+                    self.step.lag_seconds.append(
+                        time.perf_counter() - origin[0] - message.timestamp / 1000
+                    )
+                elif message.msg_type != RTMP_MSG_TYPE_AUDIO:
+                    continue
+                self.step.bytes_received += len(message.payload)
+        except (OSError, ValueError) as e:
+            self.step.error("play_disconnect", e)
+
+    async def sample_server_lag(self):
+        """Polls the server's /metrics for its latest event loop lag."""
+        while True:
+            await asyncio.sleep(METRICS_SAMPLE_INTERVAL)
+            try:
+                text = await asyncio.to_thread(self.scrape)
+            except OSError as e:
+                self.step.error("metrics", e)
+                continue
+            for line in text.splitlines():
+                if line.startswith("rtmp_event_loop_lag_last_seconds "):
+                    self.step.server_lag.append(float(line.split()[1]))
+
+    def scrape(self):
+        with urllib.request.urlopen(self.args.metrics_url, timeout=2) as response:
+            return response.read().decode()
+
+    async def run_step(self, target):
+        """Connects publishers up to `target`, then measures for a step."""
+        args = self.args
+        step = self.step = StepStats(target)
+        starting = []
+        for index in range(len(self.publishers), target):
+            starting.append(asyncio.create_task(self.start_publisher(index)))
+            await asyncio.sleep(1 / args.connect_rate)
+        await asyncio.gather(*starting)
+
+        # Connect latencies belong to the ramp; throughput and lag to the hold
+        step.lag_seconds.clear()
+        step.server_lag.clear()
+        step.bytes_sent = step.bytes_received = 0
+        step.max_slip = 0.0
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        await asyncio.sleep(args.step_seconds)
+        elapsed = time.perf_counter() - started
+        return self.report(step, elapsed, (time.process_time() - cpu_started) / elapsed)
+
+    def report(self, step, elapsed, cpu):
+        streaming = sum(not client.writer.is_closing() for client in self.publishers)
+        target_bps = streaming * self.media.bitrate
+        sent_bps = step.bytes_sent * 8 / elapsed
+        result = {
+            "target_publishers": step.publishers,
+            "publishers": streaming,
+            "players": streaming * self.args.players_per_stream,
+            "sent_mbps": sent_bps / 1e6,
+            "target_mbps": target_bps / 1e6,
+            "received_mbps": step.bytes_received * 8 / elapsed / 1e6,
+            "max_send_slip_ms": step.max_slip * 1000,
+            "loadgen_cpu": cpu,
+            "errors": dict(step.errors),
+        }
+        for name, samples in (
+            ("connect", step.connect_seconds),
+            ("play", step.play_seconds),
+            ("lag", step.lag_seconds),
+            ("server_loop_lag", step.server_lag),
+        ):
+            if samples:
+                samples.sort()
+                result[f"{name}_p50_ms"] = percentile(samples, 0.5) * 1000
+                result[f"{name}_p99_ms"] = percentile(samples, 0.99) * 1000
+                result[f"{name}_max_ms"] = samples[-1] * 1000
+
+        def latency(name):
+            if f"{name}_p50_ms" not in result:
+                return f"{name} -"
+            return (
+                f"{name} p50 {result[f'{name}_p50_ms']:.1f} "
+                f"p99 {result[f'{name}_p99_ms']:.1f} "
+                f"max {result[f'{name}_max_ms']:.1f} ms"
+            )
+
+        print(
+            f"{streaming:>5}/{step.publishers} publishers, "
+            f"{result['players']} players: {latency('connect')}; {latency('play')}\n"
+            f"      sent {result['sent_mbps']:.1f}/{result['target_mbps']:.1f} Mbit/s, "
+            f"received {result['received_mbps']:.1f} Mbit/s, "
+            f"max send slip {result['max_send_slip_ms']:.1f} ms; "
+            f"{latency('lag')}; {latency('server_loop_lag')}\n"
+            f"      loadgen CPU {cpu:.0%}, errors "
+            f"{', '.join(f'{k} {v}' for k, v in sorted(step.errors.items())) or '0'}"
+        )
+        if cpu > 0.9:
+            print(
+                "      ⚠️ The load generator is CPU-bound; run several instances "
+                "(with different --stream-prefix) to load the server further."
+            )
+        return result
+
+    async def run(self):
+        args = self.args
+        results = []
+        if args.metrics_url:
+            self.spawn(self.sample_server_lag())
+        try:
+            for target in args.ramp:
+                result = await self.run_step(target)
+                results.append(result)
+                if (
+                    result["target_mbps"]
+                    and result["sent_mbps"] < args.stop_below * result["target_mbps"]
+                ) or result["publishers"] < target:
+                    print(
+                        f"Stopping: {result['publishers']} publishers could not "
+                        f"all be sustained at {target}."
+                    )
+                    break
+        finally:
+            for task in list(self.tasks):
+                task.cancel()
+            for client in self.clients:
+                if client.writer is not None:
+                    client.writer.close()
+        return results
+
+
+def parse_ramp(value):
+    return [int(step) for step in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Ramp synthetic RTMP publishers and players against a server"
+    )
+    parser.add_argument("--host", default=rtmp.localhost)
+    parser.add_argument("--port", type=int, default=rtmp.localport)
+    parser.add_argument("--app", default=rtmp.APPLICATION)
+    parser.add_argument("--stream-prefix", default="loadgen")
+    parser.add_argument(
+        "--ramp",
+        type=parse_ramp,
+        default=[10, 50, 100, 200],
+        help="comma-separated publisher counts, one step each (default 10,50,100,200)",
+    )
+    parser.add_argument("--step-seconds", type=float, default=10.0)
+    parser.add_argument(
+        "--connect-rate", type=float, default=100.0, help="new publishers per second"
+    )
+    parser.add_argument(
+        "--players-per-stream",
+        type=int,
+        default=0,
+        help="players on each publisher's stream, measuring delivery lag",
+    )
+    parser.add_argument("--video-kbps", type=int, default=2500)
+    parser.add_argument("--audio-kbps", type=int, default=128)
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--gop", type=int, default=60, help="frames per keyframe")
+    parser.add_argument("--chunk-size", type=int, default=4096)
+    parser.add_argument(
+        "--flv", help="replay this FLV file instead of synthetic tags (looped)"
+    )
+    parser.add_argument(
+        "--metrics-url",
+        help=f"server /metrics to sample event loop lag from, e.g. "
+        f"http://127.0.0.1:{rtmp.METRICS_PORT}/metrics",
+    )
+    parser.add_argument(
+        "--stop-below",
+        type=float,
+        default=0.95,
+        help="stop ramping once publishers achieve less than this fraction of "
+        "their bitrate",
+    )
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--output", help="write the per-step results as JSON")
+    args = parser.parse_args()
+
+    if args.flv:
+        media = FLVMedia(args.flv)
+    else:
+        media = SyntheticMedia(args.video_kbps, args.audio_kbps, args.fps, args.gop)
+    print(
+        f"Each publisher sends {media.bitrate / 1e6:.2f} Mbit/s "
+        f"({'FLV ' + args.flv if args.flv else 'synthetic'}) "
+        f"to rtmp://{args.host}:{args.port}/{args.app}"
+    )
+
+    logging.basicConfig(level=logging.WARNING)
+    results = asyncio.run(LoadGenerator(args, media).run())
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import argparse
+import asyncio
+import cProfile
+import logging
+import os
+import pstats
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import amf0
+import RTMPServer as rtmp
+from rtmp_capture import read_capture
+from rtmp_chunk import ChunkDemuxer, ChunkProtocolError
+from suite import FakeStreamWriter, FakeTransport, new_server
+
+PROFILE_LINES = 30
+
+
+class CaptureReader:
+    """
+    StreamReader stand-in that serves a capture's reads in order, at their
+    recorded times if `paced`, then EOF.
+    """
+
+    def __init__(self, records, paced):
+        self.records = records
+        self.paced = paced
+        self.index = 0
+        self.pending = b""
+        self.started = time.perf_counter()
+
+    async def next_record(self):
+        if self.index == len(self.records):
+            return b""
+        offset, data = self.records[self.index]
+        self.index += 1
+        if self.paced:
+            delay = self.started + offset - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        return data
+
+    async def readexactly(self, n):
+        while len(self.pending) < n:
+            data = await self.next_record()
+            if not data:
+                raise asyncio.IncompleteReadError(self.pending, n)
+            self.pending += data
+        data, self.pending = self.pending[:n], self.pending[n:]
+        return data
+
+    async def read(self, n=-1):
+        if self.pending:
+            data, self.pending = self.pending, b""
+            return data
+        return await self.next_record()
+
+
+async def replay_stream(records, paced):
+    """Through handle_client; returns the reads consumed and bytes written."""
+    reader = CaptureReader(records, paced)
+    writer = FakeStreamWriter()
+    await new_server().handle_client(reader, writer)
+    return reader.index, writer.bytes_written
+
+
+async def replay_protocol(records, paced):
+    """Through RTMPProtocol; returns the reads consumed and bytes written."""
+    protocol = rtmp.RTMPProtocol(new_server())
+    transport = FakeTransport()
+    protocol.connection_made(transport)
+    started = time.perf_counter()
+    consumed = 0
+    for offset, data in records:
+        if transport.closing:
+            break  # Closed by the server, e.g. on a protocol error
+        if paced:
+            delay = started + offset - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        view = memoryview(data)
+        while view:
+            buffer = protocol.get_buffer(len(view))
+            n = min(len(buffer), len(view))
+            buffer[:n] = view[:n]
+            protocol.buffer_updated(n)
+            view = view[n:]
+        consumed += 1
+        await asyncio.sleep(0)  # Let queued commands run, as between socket reads
+    while protocol.command_task is not None:
+        await asyncio.sleep(0)
+    protocol.connection_lost(None)
+    return consumed, transport.bytes_written
+
+
+REPLAYERS = {"stream": replay_stream, "protocol": replay_protocol}
+
+
+def summarize(records):
+    """Message counts by type and the commands sent, from the bytes alone."""
+    data = b"".join(data for _, data in records)
+    counts = {}
+    commands = []
+    try:
+        _, messages = ChunkDemuxer().parse(
+            memoryview(data)[1 + 2 * rtmp.RTMP_HANDSHAKE_SIZE :]
+        )
+    except ChunkProtocolError as e:
+        return counts, commands, str(e)
+    for message in messages:
+        counts[message.msg_type] = counts.get(message.msg_type, 0) + 1
+        if message.msg_type == rtmp.RTMP_MSG_TYPE_COMMAND:
+            try:
+                values = amf0.decode_all(message.payload)
+            except amf0.AMF0DecodeError:
+                commands.append("<undecodable>")
+                continue
+            name = values[0] if values else "<empty>"
+            if name in ("publish", "play") and len(values) > 3:
+                name = f"{name}({values[3]!r})"
+            commands.append(str(name))
+    return counts, commands, None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Feed a captured RTMP session back through the server"
+    )
+    parser.add_argument("capture", help="a .rtmpcap file written with --capture-dir")
+    parser.add_argument(
+        "--ingest-mode", choices=sorted(REPLAYERS), default=rtmp.INGEST_MODE
+    )
+    parser.add_argument(
+        "--wire-speed",
+        action="store_true",
+        help="replay each read at its recorded time instead of as fast as possible",
+    )
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument(
+        "--profile", action="store_true", help="print a cProfile of the replays"
+    )
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper())
+    records = read_capture(args.capture)
+    total_bytes = sum(len(data) for _, data in records)
+    duration = records[-1][0] if records else 0.0
+    print(
+        f"{args.capture}: {len(records)} reads, {total_bytes} bytes "
+        f"over {duration:.2f} s"
+    )
+
+    counts, commands, error = summarize(records)
+    print(
+        "  messages: " + ", ".join(f"{hex(t)} x{n}" for t, n in sorted(counts.items()))
+    )
+    print(f"  commands: {', '.join(commands) or '-'}")
+    if error:
+        print(f"  ⚠️ chunk stream error: {error}")
+
+    replay = REPLAYERS[args.ingest_mode]
+    profiler = cProfile.Profile() if args.profile else None
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        consumed, written = asyncio.run(replay(records, args.wire_speed))
+        if profiler is not None:
+            profiler.disable()
+        timings.append(time.perf_counter() - started)
+
+    elapsed = statistics.median(timings)
+    message_count = sum(counts.values())
+    print(
+        f"  replayed ({args.ingest_mode}, "
+        f"{'wire speed' if args.wire_speed else 'max speed'}, x{args.repeat}): "
+        f"median {elapsed * 1000:.2f} ms, {total_bytes / elapsed / 1e6:.1f} MB/s, "
+        f"{message_count / elapsed:.0f} msg/s; server wrote {written} bytes"
+    )
+    if consumed < len(records):
+        print(f"  ⚠️ server stopped reading after {consumed}/{len(records)} reads")
+
+    if profiler is not None:
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(PROFILE_LINES)
+
+
+if __name__ == "__main__":
+    main()
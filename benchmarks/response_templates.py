@@ -0,0 +1,84 @@
+import argparse
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import RTMPServer as rtmp
+from rtmp_templates import TemplateCache
+
+
+class UncachedTemplates(TemplateCache):
+    """Builds every payload from scratch, as before templates existed."""
+
+    def render(self, key, encode, fields=None, **values):
+        return encode(**values)
+
+
+def connect_responses(server, connection):
+    """Builds every payload the server sends to one FFmpeg-style publisher."""
+    transaction_id = 1.0
+    tc_url = "rtmp://127.0.0.1:1935/live"
+    stream_key = f"stream-{connection}"
+
+    # connect
+    server.set_chunk_size(4096)
+    server.window_ack_size(2500000)
+    server.set_peer_bandwidth(2500000)
+    server.encode_amf0_result(transaction_id, tc_url)
+    server.send_onstatus()
+    server.send_onbwdone(None)
+    server.set_chunk_size(128)
+    server.stream_begin(0)
+    server.send_release_stream(2.0, "live")
+    server.send_setdataframe(None)
+    # releaseStream, FCPublish, createStream
+    server.encode_amf0_call_result(2.0)
+    server.encode_amf0_status(
+        "NetStream.Publish.Start",
+        f"Publishing stream started for key {stream_key}.",
+        transaction_id=3.0,
+    )
+    server.send_onstatus()
+    server.encode_amf0_call_result(4.0, 1)
+    # publish
+    server.encode_amf0_status(
+        "NetStream.Publish.Start",
+        f"Stream {stream_key} is now published.",
+        transaction_id=5.0,
+    )
+
+
+def bench(templates, number, repeat):
+    server = rtmp.RTMPServer()
+    server.templates = templates
+    connection = iter(range(number * repeat + 1))
+    connect_responses(server, next(connection))  # Warm the cache
+    timings = timeit.repeat(
+        lambda: connect_responses(server, next(connection)),
+        number=number,
+        repeat=repeat,
+    )
+    return min(timings) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the cost of building one connection's response payloads"
+    )
+    parser.add_argument("--number", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    uncached = bench(UncachedTemplates(), args.number, args.repeat)
+    cached = bench(TemplateCache(), args.number, args.repeat)
+    print(f"built per connect:    {uncached * 1e6:.2f} us")
+    print(f"templated per connect: {cached * 1e6:.2f} us")
+    print(f"speedup:              {uncached / cached:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,583 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import amf0
+import RTMPServer as rtmp
+from rtmp_capture import is_capture, read_capture
+from rtmp_chunk import ChunkDemuxer, ChunkMuxer, RTMPMessage
+
+# Synthetic publisher: 30 fps video with a keyframe every 2 s, AAC audio at
+# ~43 frames/s, sent at FFmpeg's 4096-byte chunk size
+VIDEO_FPS = 30
+KEYFRAME_INTERVAL = 60
+KEYFRAME_SIZE = 40000
+INTER_FRAME_SIZE = 6000
+AUDIO_FRAME_SIZE = 370
+AUDIO_FRAME_MS = 1024 * 1000 / 44100
+PUBLISH_CHUNK_SIZE = 4096
+STREAM_ID = 1
+
+# Messages measured by the tracemalloc pass, which is ~10x slower than the rest
+TRACEMALLOC_MESSAGES = 2000
+
+# compare: a result regresses when it gets worse than this fraction
+DEFAULT_THRESHOLD = 0.10
+
+
+def command(name, transaction_id, *args, stream_id=0):
+    return RTMPMessage(
+        rtmp.CSID_COMMAND,
+        rtmp.RTMP_MSG_TYPE_COMMAND,
+        stream_id,
+        0,
+        amf0.encode(name, float(transaction_id), *args),
+    )
+
+
+def synthetic_messages(count, seed=0):
+    """An FFmpeg-style publish session followed by `count` media messages."""
+    rng = random.Random(seed)
+    tc_url = "rtmp://127.0.0.1:1935/live"
+    setup = [
+        RTMPMessage(
+            rtmp.CSID_PROTOCOL_CONTROL,
+            rtmp.RTMP_MSG_TYPE_SET_CHUNK_SIZE,
+            0,
+            0,
+            PUBLISH_CHUNK_SIZE.to_bytes(4, "big"),
+        ),
+        command(
+            "connect",
+            1,
+            {
+                "app": "live",
+                "type": "nonprivate",
+                "flashVer": "FMLE/3.0",
+                "tcUrl": tc_url,
+            },
+        ),
+        command("releaseStream", 2, None, "bench"),
+        command("FCPublish", 3, None, "bench"),
+        command("createStream", 4, None),
+        command("publish", 5, None, "bench", "live", stream_id=STREAM_ID),
+        RTMPMessage(
+            rtmp.CSID_COMMAND,
+            rtmp.RTMP_MSG_TYPE_DATA,
+            STREAM_ID,
+            0,
+            amf0.encode(
+                "@setDataFrame",
+                "onMetaData",
+                amf0.ECMAArray(
+                    width=1280.0,
+                    height=720.0,
+                    framerate=30.0,
+                    videocodecid=7.0,
+                    audiocodecid=10.0,
+                    audiosamplerate=44100.0,
+                ),
+            ),
+        ),
+        RTMPMessage(6, rtmp.RTMP_MSG_TYPE_VIDEO, STREAM_ID, 0, b"\x17\x00" + bytes(40)),
+        RTMPMessage(4, rtmp.RTMP_MSG_TYPE_AUDIO, STREAM_ID, 0, b"\xaf\x00\x12\x10"),
+    ]
+
+    media = []
+    video_frames = audio_frames = 0
+    while len(media) < count:
+        video_ms = video_frames * 1000 // VIDEO_FPS
+        audio_ms = int(audio_frames * AUDIO_FRAME_MS)
+        if video_ms <= audio_ms:
+            keyframe = video_frames % KEYFRAME_INTERVAL == 0
+            size = KEYFRAME_SIZE if keyframe else INTER_FRAME_SIZE
+            header = b"\x17\x01\x00\x00\x00" if keyframe else b"\x27\x01\x00\x00\x00"
+            media.append(
+                RTMPMessage(
+                    6,
+                    rtmp.RTMP_MSG_TYPE_VIDEO,
+                    STREAM_ID,
+                    video_ms,
+                    header + rng.randbytes(size),
+                )
+            )
+            video_frames += 1
+        else:
+            media.append(
+                RTMPMessage(
+                    4,
+                    rtmp.RTMP_MSG_TYPE_AUDIO,
+                    STREAM_ID,
+                    audio_ms,
+                    b"\xaf\x01" + rng.randbytes(AUDIO_FRAME_SIZE),
+                )
+            )
+            audio_frames += 1
+    return setup, media
+
+
+def recorded_messages(path, count):
+    """
+    Splits a recorded client-to-server byte stream (C0 + C1 + C2 first), raw
+    or as a capture file, into set-up messages (up to and including
+    `publish`) and media messages, repeated up to `count`.
+    """
+    if is_capture(path):
+        data = b"".join(data for _, data in read_capture(path))
+    else:
+        with open(path, "rb") as f:
+            data = f.read()
+    _, messages = ChunkDemuxer().parse(
+        memoryview(data)[1 + 2 * rtmp.RTMP_HANDSHAKE_SIZE :]
+    )
+
+    setup = []
+    for index, message in enumerate(messages):
+        setup.append(message)
+        if message.msg_type == rtmp.RTMP_MSG_TYPE_COMMAND:
+            values = amf0.decode_all(message.payload)
+            if values and values[0] == "publish":
+                break
+    media = messages[index + 1 :]
+    if not media:
+        raise SystemExit(f"{path}: no media after publish")
+    while len(media) < count:
+        media = media + media
+    return setup, media[:count]
+
+
+def mux_reads(messages):
+    """Chunks each message as a client would; returns one read per message."""
+    muxer = ChunkMuxer()
+    return [
+        b"".join(muxer.mux(m.csid, m.msg_type, m.stream_id, m.timestamp, m.payload))
+        for m in messages
+    ]
+
+
+def handshake_bytes():
+    return bytes((rtmp.RTMP_VERSION,)) + bytes(2 * rtmp.RTMP_HANDSHAKE_SIZE)
+
+
+class FakeStreamWriter:
+    """StreamWriter stand-in that counts what the server writes."""
+
+    def __init__(self):
+        self.transport = FakeTransport()  # What tune_connection configures
+        self.bytes_written = 0
+        self.closed = False
+
+    def write(self, data):
+        self.bytes_written += len(data)
+
+    def writelines(self, data):
+        for chunk in data:
+            self.bytes_written += len(chunk)
+
+    async def drain(self):
+        pass
+
+    def get_extra_info(self, name, default=None):
+        return ("127.0.0.1", 50000) if name == "peername" else default
+
+    def is_closing(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        pass
+
+
+class FakeStreamReader:
+    """
+    StreamReader stand-in that serves the handshake to `readexactly`, then
+    one prepared read per `read` call, then EOF.
+
+    `probe` is called before each read of the measured reads and once at
+    EOF, so the time between two probes is the handling of one read.
+    """
+
+    def __init__(self, handshake, setup_reads, reads, probe):
+        self.handshake = memoryview(handshake)
+        self.reads = setup_reads + reads
+        self.measured_from = len(setup_reads)
+        self.index = 0
+        self.probe = probe
+
+    async def readexactly(self, n):
+        data = bytes(self.handshake[:n])
+        self.handshake = self.handshake[n:]
+        if len(data) < n:
+            raise asyncio.IncompleteReadError(data, n)
+        return data
+
+    async def read(self, n=-1):
+        if self.index >= self.measured_from:
+            self.probe()
+        if self.index == len(self.reads):
+            return b""
+        data = self.reads[self.index]
+        self.index += 1
+        return data
+
+
+class FakeTransport:
+    """Transport stand-in for RTMPProtocol that counts what the server writes."""
+
+    def __init__(self):
+        self.bytes_written = 0
+        self.closing = False
+
+    def write(self, data):
+        self.bytes_written += len(data)
+
+    def writelines(self, data):
+        for chunk in data:
+            self.bytes_written += len(chunk)
+
+    def get_extra_info(self, name, default=None):
+        return ("127.0.0.1", 50000) if name == "peername" else default
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        pass
+
+    def is_closing(self):
+        return self.closing
+
+    def close(self):
+        self.closing = True
+
+    def pause_reading(self):
+        pass
+
+    def resume_reading(self):
+        pass
+
+
+def new_server():
+    return rtmp.RTMPServer(metrics_port=0, trace_sample_rate=0.0)
+
+
+def bench_demux(workload):
+    setup_reads, reads = workload["setup_reads"], workload["reads"]
+
+    def run(probe):
+        demuxer = ChunkDemuxer()
+        for data in setup_reads:
+            demuxer.parse(data)
+        parse = demuxer.parse
+        for data in reads:
+            probe()
+            parse(data)
+        probe()
+
+    return run, sum(map(len, reads))
+
+
+def bench_ingest_stream(workload):
+    """handle_client (StreamReader ingest mode) over a fake reader and writer."""
+    setup_reads, reads = workload["setup_reads"], workload["reads"]
+
+    def run(probe):
+        server = new_server()
+        reader = FakeStreamReader(handshake_bytes(), setup_reads, reads, probe)
+        asyncio.run(server.handle_client(reader, FakeStreamWriter()))
+
+    return run, sum(map(len, reads))
+
+
+def bench_ingest_protocol(workload):
+    """RTMPProtocol (BufferedProtocol ingest mode) over a fake transport."""
+    setup_reads, reads = workload["setup_reads"], workload["reads"]
+
+    def feed(protocol, data):
+        protocol.get_buffer(len(data))[: len(data)] = data
+        protocol.buffer_updated(len(data))
+
+    async def session(probe):
+        server = new_server()
+        protocol = rtmp.RTMPProtocol(server)
+        protocol.connection_made(FakeTransport())
+        feed(protocol, handshake_bytes())
+        for data in setup_reads:
+            feed(protocol, data)
+        while protocol.command_task is not None:
+            await asyncio.sleep(0)
+
+        for data in reads:
+            probe()
+            feed(protocol, data)
+        probe()
+        protocol.connection_lost(None)
+
+    def run(probe):
+        asyncio.run(session(probe))
+
+    return run, sum(map(len, reads))
+
+
+def bench_amf_decode(workload):
+    """decode_amf_payload over the workload's command and data payloads."""
+    payloads = workload["amf_payloads"]
+    items = [payloads[i % len(payloads)] for i in range(workload["count"])]
+
+    def run(probe):
+        decode = new_server().decode_amf_payload
+        for payload in items:
+            probe()
+            decode(payload)
+        probe()
+
+    return run, sum(map(len, items))
+
+
+def bench_amf_encode(workload):
+    """The encode_amf0_* response builders, one call per message."""
+    server = new_server()
+    builders = [
+        lambda: server.encode_amf0_result(1.0, "rtmp://127.0.0.1:1935/live"),
+        lambda: server.encode_amf0_call_result(4.0, 1),
+        lambda: server.encode_amf0_status(
+            "NetStream.Publish.Start",
+            "Stream bench is now published.",
+            transaction_id=5.0,
+        ),
+        lambda: server.encode_amf0_onstatus(),
+        lambda: server.send_onbwdone(None),
+        lambda: server.send_release_stream(2.0, "live"),
+        lambda: server.set_chunk_size(4096),
+        lambda: server.stream_begin(1),
+    ]
+    items = [builders[i % len(builders)] for i in range(workload["count"])]
+    nbytes = sum(len(build()) for build in items)
+
+    def run(probe):
+        for build in items:
+            probe()
+            build()
+        probe()
+
+    return run, nbytes
+
+
+def bench_media_handlers(workload):
+    """handle_video_packet / handle_audio_packet over the media payloads."""
+    media = workload["media"]
+
+    def run(probe):
+        server = new_server()
+        trace = server.tracer.session(None)
+        video, audio = server.handle_video_packet, server.handle_audio_packet
+        for message in media:
+            probe()
+            if message.msg_type == rtmp.RTMP_MSG_TYPE_VIDEO:
+                video(message.payload, trace)
+            else:
+                audio(message.payload, trace)
+        probe()
+
+    return run, sum(len(message.payload) for message in media)
+
+
+BENCHMARKS = {
+    "demux": bench_demux,
+    "ingest_stream": bench_ingest_stream,
+    "ingest_protocol": bench_ingest_protocol,
+    "amf_decode": bench_amf_decode,
+    "amf_encode": bench_amf_encode,
+    "media_handlers": bench_media_handlers,
+}
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def measure(factory, workload):
+    """
+    Runs one benchmark three times: timed, counting retained memory blocks,
+    and under tracemalloc for the transient peak each message allocates.
+
+    CPython has no cumulative allocation counter, so "allocations per
+    message" is reported as those two figures.
+    """
+    timestamps = []
+    run, nbytes = factory(workload)
+    run(lambda: timestamps.append(time.perf_counter_ns()))
+    latencies = sorted(b - a for a, b in zip(timestamps, timestamps[1:]))
+    messages = len(latencies)
+    seconds = (timestamps[-1] - timestamps[0]) / 1e9
+
+    run, _ = factory(workload)
+    blocks_before = sys.getallocatedblocks()
+    run(lambda: None)
+    retained_blocks = sys.getallocatedblocks() - blocks_before
+
+    limited = dict(workload)
+    for key in ("reads", "media"):
+        limited[key] = workload[key][:TRACEMALLOC_MESSAGES]
+    limited["count"] = min(workload["count"], TRACEMALLOC_MESSAGES)
+    run, _ = factory(limited)
+    peaks = []
+    last = [0]
+
+    def traced_probe():
+        current, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - last[0])
+        tracemalloc.reset_peak()
+        last[0] = tracemalloc.get_traced_memory()[0]
+
+    tracemalloc.start()
+    try:
+        run(traced_probe)
+    finally:
+        tracemalloc.stop()
+    peaks = peaks[1:]  # The first probe measures the set-up
+
+    return {
+        "messages": messages,
+        "seconds": seconds,
+        "messages_per_sec": messages / seconds,
+        "mb_per_sec": nbytes / seconds / 1e6,
+        "p50_us": percentile(latencies, 0.50) / 1e3,
+        "p99_us": percentile(latencies, 0.99) / 1e3,
+        "retained_blocks_per_message": retained_blocks / messages,
+        "transient_bytes_per_message": sum(peaks) / max(1, len(peaks)),
+    }
+
+
+def build_workload(args):
+    if args.input:
+        setup, media = recorded_messages(args.input, args.messages)
+    else:
+        setup, media = synthetic_messages(args.messages)
+    reads = mux_reads(setup + media)
+    return {
+        "count": len(media),
+        "media": media,
+        "setup_reads": reads[: len(setup)],
+        "reads": reads[len(setup) :],
+        "amf_payloads": [
+            bytes(message.payload)
+            for message in setup
+            if message.msg_type in (rtmp.RTMP_MSG_TYPE_COMMAND, rtmp.RTMP_MSG_TYPE_DATA)
+        ],
+    }
+
+
+def run_suite(args):
+    workload = build_workload(args)
+    results = {}
+    for name in args.only or BENCHMARKS:
+        result = results[name] = measure(BENCHMARKS[name], workload)
+        print(
+            f"{name:16} {result['messages_per_sec']:12,.0f} msg/s "
+            f"{result['mb_per_sec']:9.1f} MB/s  p99 {result['p99_us']:8.2f} us  "
+            f"{result['retained_blocks_per_message']:6.2f} blocks/msg  "
+            f"{result['transient_bytes_per_message']:9.0f} B/msg"
+        )
+
+    report = {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "workload": args.input or f"synthetic:{args.messages}",
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+
+
+# Metric -> True if higher is better
+COMPARED_METRICS = {
+    "messages_per_sec": True,
+    "mb_per_sec": True,
+    "p99_us": False,
+    "retained_blocks_per_message": False,
+    "transient_bytes_per_message": False,
+}
+
+
+def compare(args):
+    """Prints every metric's change; exits 1 if any regressed past the threshold."""
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    with open(args.current) as f:
+        current = json.load(f)["results"]
+
+    regressions = 0
+    for name in sorted(baseline.keys() & current.keys()):
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            old, new = baseline[name][metric], current[name][metric]
+            if old == 0:
+                change = 0.0 if new == 0 else float("inf")
+            else:
+                change = (new - old) / abs(old)
+            worse = -change if higher_is_better else change
+            # Tiny allocation counts jitter by whole blocks; ignore sub-block moves
+            regressed = worse > args.threshold and abs(new - old) >= 0.5
+            regressions += regressed
+            flag = "REGRESSION" if regressed else ""
+            print(
+                f"{name:16} {metric:28} {old:14.2f} -> {new:14.2f} "
+                f"{change:+8.1%} {flag}"
+            )
+    for name in sorted(baseline.keys() - current.keys()):
+        print(f"{name:16} missing from {args.current}")
+
+    if regressions:
+        print(f"{regressions} regression(s) over {args.threshold:.0%}")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Offline micro-benchmarks of the ingest path and AMF codec"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--messages", type=int, default=20000)
+    run_parser.add_argument(
+        "--input",
+        help="recorded client-to-server RTMP byte stream or .rtmpcap capture, "
+        "instead of synthetic media",
+    )
+    run_parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS))
+    run_parser.add_argument("--output", help="write the results as JSON")
+
+    compare_parser = commands.add_parser(
+        "compare", help="flag regressions against a stored baseline"
+    )
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    if args.command == "run":
+        run_suite(args)
+    else:
+        compare(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import struct
+
+# FLV file header: "FLV", version 1, flags, header size
+FLV_SIGNATURE = b"FLV"
+FLV_HEADER_SIZE = 9
+FLV_FLAG_AUDIO = 0x04
+FLV_FLAG_VIDEO = 0x01
+
+# Tag header: type, 24-bit data size, 24-bit timestamp + 8-bit extension,
+# 24-bit stream ID (always 0); each tag is followed by its 32-bit total size
+TAG_HEADER_SIZE = 11
+PREVIOUS_TAG_SIZE = 4
+
+# Tag types; the same IDs as the RTMP message types that carry them
+TAG_AUDIO = 0x08
+TAG_VIDEO = 0x09
+TAG_SCRIPT_DATA = 0x12
+
+FLV_VERSION = 1
+# Byte of the file header holding the audio/video flags
+FLV_FLAGS_OFFSET = 4
+
+_HEADER = struct.Struct(">3sBBI")
+_UINT32 = struct.Struct(">I")
+_TAG_HEADER = struct.Struct(">IIHB")  # type + size, timestamp + ext, stream ID
+
+
+class FLVError(ValueError):
+    """Raised for data that isn't a well-formed FLV file."""
+
+
+class FLVTag:
+    """One FLV tag; `data` is the tag body (an RTMP message payload)."""
+
+    __slots__ = ("tag_type", "timestamp", "data")
+
+    def __init__(self, tag_type, timestamp, data):
+        self.tag_type = tag_type
+        self.timestamp = timestamp
+        self.data = data
+
+    def __repr__(self):
+        return (
+            f"FLVTag(type={self.tag_type}, timestamp={self.timestamp}, "
+            f"size={len(self.data)})"
+        )
+
+
+def parse_header(data):
+    """Returns `(has_audio, has_video, offset of the first tag)`."""
+    if len(data) < FLV_HEADER_SIZE + PREVIOUS_TAG_SIZE:
+        raise FLVError("FLV data shorter than its header")
+    signature, version, flags, header_size = _HEADER.unpack_from(data)
+    if signature != FLV_SIGNATURE:
+        raise FLVError("Not an FLV file")
+    if header_size < FLV_HEADER_SIZE:
+        raise FLVError(f"Invalid FLV header size {header_size}")
+    return (
+        bool(flags & FLV_FLAG_AUDIO),
+        bool(flags & FLV_FLAG_VIDEO),
+        header_size + PREVIOUS_TAG_SIZE,
+    )
+
+
+def iter_tags(data):
+    """
+    Yields the tags of a complete FLV file held in `data`.
+
+    Tag bodies are memoryview slices of `data`, not copies. A truncated last
+    tag (a recording cut off mid-write) ends the iteration quietly.
+    """
+    view = memoryview(data)
+    _, _, pos = parse_header(view)
+    end = len(view)
+    while pos + TAG_HEADER_SIZE <= end:
+        tag_type = view[pos] & 0x1F  # Upper bits: reserved and filter flag
+        size = _UINT32.unpack_from(view, pos)[0] & 0xFFFFFF
+        timestamp = (_UINT32.unpack_from(view, pos + 4)[0] >> 8) | (view[pos + 7] << 24)
+        body = pos + TAG_HEADER_SIZE
+        if body + size > end:
+            return
+        yield FLVTag(tag_type, timestamp, view[body : body + size])
+        pos = body + size + PREVIOUS_TAG_SIZE
+
+
+def header_flags(has_audio, has_video):
+    """The file header's flags byte."""
+    return (FLV_FLAG_AUDIO if has_audio else 0) | (FLV_FLAG_VIDEO if has_video else 0)
+
+
+def encode_header(has_audio, has_video):
+    """The file header, followed by the zero PreviousTagSize before tag 1."""
+    header = _HEADER.pack(
+        FLV_SIGNATURE, FLV_VERSION, header_flags(has_audio, has_video), FLV_HEADER_SIZE
+    )
+    return header + bytes(PREVIOUS_TAG_SIZE)
+
+
+def encode_tag_header(tag_type, timestamp, size):
+    """The 11-byte header of a tag with a `size`-byte body."""
+    timestamp &= 0xFFFFFFFF
+    return _TAG_HEADER.pack(
+        (tag_type << 24) | size,
+        ((timestamp & 0xFFFFFF) << 8) | (timestamp >> 24),
+        0,
+        0,
+    )
+
+
+def encode_previous_tag_size(size):
+    """The PreviousTagSize following a tag with a `size`-byte body."""
+    return _UINT32.pack(TAG_HEADER_SIZE + size)
+
+
+def write_tag(out, tag_type, timestamp, data):
+    """Appends one tag and its PreviousTagSize to the bytearray `out`."""
+    size = len(data)
+    out += encode_tag_header(tag_type, timestamp, size)
+    out += data
+    out += encode_previous_tag_size(size)
+
+
+def read_tags(path):
+    """Reads every tag of the FLV file at `path`."""
+    with open(path, "rb") as f:
+        return list(iter_tags(f.read()))
@@ -0,0 +1,252 @@
+import struct
+
+# Fragmented MP4 (ISO/IEC 14496-12) for HLS: an init segment (ftyp + moov)
+# describing the tracks, then one moof + mdat per media segment
+VIDEO_TRACK_ID = 1
+AUDIO_TRACK_ID = 2
+VIDEO_TIMESCALE = 90000
+MOVIE_TIMESCALE = 1000
+
+# Sample flags: sync samples depend on nothing; other video samples depend
+# on earlier ones and are not sync samples
+SAMPLE_FLAGS_SYNC = 0x02000000
+SAMPLE_FLAGS_NON_SYNC = 0x01010000
+
+# tfhd: sample data offsets are relative to the moof
+TFHD_DEFAULT_BASE_IS_MOOF = 0x020000
+# trun: data offset and per-sample duration, size, flags and composition offset
+TRUN_FLAGS = 0x000001 | 0x000100 | 0x000200 | 0x000400 | 0x000800
+
+_MATRIX = struct.pack(">9I", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+_TRUN_SAMPLE = struct.Struct(">IIIi")
+
+
+def box(box_type, *payloads):
+    """An ISO BMFF box: 32-bit size, four-character type, payloads."""
+    size = 8 + sum(len(p) for p in payloads)
+    return b"".join((struct.pack(">I4s", size, box_type), *payloads))
+
+
+def full_box(box_type, version, flags, *payloads):
+    return box(box_type, struct.pack(">I", (version << 24) | flags), *payloads)
+
+
+def descriptor(tag, payload):
+    """An MPEG-4 descriptor with a 4-byte expandable size, as in esds."""
+    size = len(payload)
+    return (
+        bytes(
+            (
+                tag,
+                0x80 | (size >> 21) & 0x7F,
+                0x80 | (size >> 14) & 0x7F,
+                0x80 | (size >> 7) & 0x7F,
+                size & 0x7F,
+            )
+        )
+        + payload
+    )
+
+
+class Track:
+    """
+    One track of the init segment: `codec_config` is the
+    AVCDecoderConfigurationRecord (video) or AudioSpecificConfig (audio).
+    """
+
+    def __init__(
+        self,
+        track_id,
+        timescale,
+        codec_config,
+        width=0,
+        height=0,
+        sample_rate=0,
+        channels=0,
+    ):
+        self.track_id = track_id
+        self.timescale = timescale
+        self.codec_config = bytes(codec_config)
+        self.width = width
+        self.height = height
+        self.sample_rate = sample_rate
+        self.channels = channels
+
+    @property
+    def is_video(self):
+        return self.track_id == VIDEO_TRACK_ID
+
+
+def sample_entry(track):
+    if track.is_video:
+        return box(
+            b"avc1",
+            bytes(6),
+            struct.pack(">H", 1),  # Data reference index
+            bytes(16),  # Pre-defined and reserved
+            struct.pack(">HH", track.width, track.height),
+            struct.pack(">II", 0x00480000, 0x00480000),  # 72 dpi
+            bytes(4),
+            struct.pack(">H", 1),  # Frame count
+            bytes(32),  # Compressor name
+            struct.pack(">Hh", 0x18, -1),  # Depth, pre-defined
+            box(b"avcC", track.codec_config),
+        )
+    decoder_config = descriptor(
+        0x04,
+        bytes((0x40, 0x15))  # MPEG-4 audio, audio stream
+        + bytes(3)  # Buffer size
+        + struct.pack(">II", 0, 0)  # Max and average bitrate
+        + descriptor(0x05, track.codec_config),
+    )
+    es = descriptor(
+        0x03,
+        struct.pack(">HB", track.track_id, 0)
+        + decoder_config
+        + descriptor(0x06, b"\x02"),
+    )
+    return box(
+        b"mp4a",
+        bytes(6),
+        struct.pack(">H", 1),
+        bytes(8),
+        struct.pack(">HH", track.channels, 16),
+        bytes(4),
+        struct.pack(">I", min(track.sample_rate, 0xFFFF) << 16),
+        full_box(b"esds", 0, 0, es),
+    )
+
+
+def trak(track):
+    if track.is_video:
+        handler, media_header = b"vide", full_box(b"vmhd", 0, 1, bytes(8))
+        volume, width, height = 0, track.width, track.height
+    else:
+        handler, media_header = b"soun", full_box(b"smhd", 0, 0, bytes(4))
+        volume, width, height = 0x0100, 0, 0
+    empty_table = struct.pack(">I", 0)
+    stbl = box(
+        b"stbl",
+        full_box(b"stsd", 0, 0, struct.pack(">I", 1), sample_entry(track)),
+        full_box(b"stts", 0, 0, empty_table),
+        full_box(b"stsc", 0, 0, empty_table),
+        full_box(b"stsz", 0, 0, struct.pack(">II", 0, 0)),
+        full_box(b"stco", 0, 0, empty_table),
+    )
+    dinf = box(
+        b"dinf",
+        full_box(b"dref", 0, 0, struct.pack(">I", 1), full_box(b"url ", 0, 1)),
+    )
+    return box(
+        b"trak",
+        full_box(
+            b"tkhd",
+            0,
+            0x3,  # Enabled, in movie
+            struct.pack(">IIIII", 0, 0, track.track_id, 0, 0),
+            bytes(8),
+            struct.pack(">hhH", 0, 0, volume),
+            bytes(2),
+            _MATRIX,
+            struct.pack(">II", width << 16, height << 16),
+        ),
+        box(
+            b"mdia",
+            full_box(
+                b"mdhd",
+                0,
+                0,
+                struct.pack(">IIII", 0, 0, track.timescale, 0),
+                struct.pack(">HH", 0x55C4, 0),  # Language "und"
+            ),
+            full_box(b"hdlr", 0, 0, bytes(4), handler, bytes(12), b"RTMPServer\x00"),
+            box(b"minf", media_header, dinf, stbl),
+        ),
+    )
+
+
+def init_segment(tracks):
+    """ftyp + moov for `tracks`, with an mvex so every sample is in fragments."""
+    ftyp = box(b"ftyp", b"iso5", struct.pack(">I", 512), b"iso5iso6mp41")
+    mvhd = full_box(
+        b"mvhd",
+        0,
+        0,
+        struct.pack(">IIII", 0, 0, MOVIE_TIMESCALE, 0),
+        struct.pack(">IH", 0x00010000, 0x0100),  # Rate 1.0, volume 1.0
+        bytes(10),
+        _MATRIX,
+        bytes(24),
+        struct.pack(">I", max(track.track_id for track in tracks) + 1),
+    )
+    mvex = box(
+        b"mvex",
+        *(
+            full_box(b"trex", 0, 0, struct.pack(">IIIII", track.track_id, 1, 0, 0, 0))
+            for track in tracks
+        ),
+    )
+    return ftyp + box(b"moov", mvhd, *(trak(track) for track in tracks), mvex)
+
+
+class Fragment:
+    """The samples of one track in a media segment."""
+
+    def __init__(self, track_id, base_decode_time):
+        self.track_id = track_id
+        self.base_decode_time = base_decode_time
+        self.samples = []  # (duration, size, flags, composition offset)
+        self.data = []
+
+    def add(self, data, duration, flags, composition_offset=0):
+        self.samples.append((duration, len(data), flags, composition_offset))
+        self.data.append(data)
+
+
+def media_segment(sequence_number, fragments):
+    """
+    moof + mdat holding `fragments` (one per track), their data back to
+    back in the mdat.
+    """
+    fragments = [fragment for fragment in fragments if fragment.samples]
+
+    def build_moof(data_offsets):
+        trafs = []
+        for fragment, data_offset in zip(fragments, data_offsets):
+            trun = full_box(
+                b"trun",
+                1,  # Signed composition offsets
+                TRUN_FLAGS,
+                struct.pack(">Ii", len(fragment.samples), data_offset),
+                b"".join(_TRUN_SAMPLE.pack(*sample) for sample in fragment.samples),
+            )
+            trafs.append(
+                box(
+                    b"traf",
+                    full_box(
+                        b"tfhd",
+                        0,
+                        TFHD_DEFAULT_BASE_IS_MOOF,
+                        struct.pack(">I", fragment.track_id),
+                    ),
+                    full_box(
+                        b"tfdt", 1, 0, struct.pack(">Q", fragment.base_decode_time)
+                    ),
+                    trun,
+                )
+            )
+        return box(
+            b"moof", full_box(b"mfhd", 0, 0, struct.pack(">I", sequence_number)), *trafs
+        )
+
+    # The moof's size doesn't depend on the offsets' values: size it first
+    moof_size = len(build_moof([0] * len(fragments)))
+    data_offsets = []
+    offset = moof_size + 8  # Past the mdat header
+    for fragment in fragments:
+        data_offsets.append(offset)
+        offset += sum(size for _, size, _, _ in fragment.samples)
+    mdat = [struct.pack(">I4s", offset - moof_size, b"mdat")]
+    for fragment in fragments:
+        mdat.extend(fragment.data)
+    return build_moof(data_offsets) + b"".join(mdat)
@@ -0,0 +1,466 @@
+import array
+import struct
+
+from rtmp_live import VIDEO_CODEC_AVC, VIDEO_KEYFRAME
+
+# FLV AVC packet types (second byte of an H.264 video tag)
+AVC_SEQUENCE_HEADER = 0
+AVC_NALU = 1
+AVC_END_OF_SEQUENCE = 2
+# FLV AVC video tag header: frame type/codec, packet type, composition time
+AVC_TAG_HEADER_SIZE = 5
+
+NAL_TYPE_SLICE = 1
+NAL_TYPE_IDR = 5
+NAL_TYPE_SEI = 6
+NAL_TYPE_SPS = 7
+NAL_TYPE_PPS = 8
+NAL_TYPE_AUD = 9
+NAL_TYPES = 32
+
+# profile_idc values, by the names --h264-profiles takes
+PROFILES = {
+    "baseline": 66,
+    "main": 77,
+    "extended": 88,
+    "high": 100,
+    "high10": 110,
+    "high422": 122,
+    "high444": 244,
+    "cavlc444": 44,
+}
+PROFILE_NAMES = {idc: name for name, idc in PROFILES.items()}
+# Profiles whose SPS carries chroma format, bit depths and scaling matrices
+_HIGH_PROFILES = frozenset(
+    (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135)
+)
+# Profiles that may flag intra-only coding with constraint_set3
+_INTRA_PROFILES = frozenset((44, 86, 100, 110, 122, 244))
+CONSTRAINT_SET1 = 0x40  # Baseline: Constrained Baseline
+CONSTRAINT_SET3 = 0x10  # High profiles: intra only
+
+# NAL units a frame is expected to hold; the index grows past this if needed
+NAL_INDEX_CAPACITY = 16
+
+# Sample aspect ratios of VUI aspect_ratio_idc 1-16; 255 gives its own
+_SAR_TABLE = (
+    (1, 1),
+    (12, 11),
+    (10, 11),
+    (16, 11),
+    (40, 33),
+    (24, 11),
+    (20, 11),
+    (32, 11),
+    (80, 33),
+    (18, 11),
+    (15, 11),
+    (64, 33),
+    (160, 99),
+    (4, 3),
+    (3, 2),
+    (2, 1),
+)
+_EXTENDED_SAR = 255
+_EMULATION_PREVENTION = b"\x00\x00\x03"
+_UINT16 = struct.Struct(">H")
+_UINT32 = struct.Struct(">I")
+_NAL_LENGTH = {
+    1: struct.Struct(">B"),
+    2: struct.Struct(">H"),
+    4: _UINT32,
+}
+
+
+class H264Error(ValueError):
+    """Raised for H.264 data that isn't well-formed."""
+
+
+class BitReader:
+    """
+    Reads big-endian bit fields and Exp-Golomb codes from a parameter set's
+    RBSP, held as one integer.
+    """
+
+    __slots__ = ("value", "size", "pos")
+
+    def __init__(self, data):
+        self.value = int.from_bytes(data, "big")
+        self.size = len(data) * 8
+        self.pos = 0
+
+    def bits(self, count):
+        pos = self.pos + count
+        if pos > self.size:
+            raise H264Error("Truncated parameter set")
+        self.pos = pos
+        return (self.value >> (self.size - pos)) & ((1 << count) - 1)
+
+    def flag(self):
+        return self.bits(1) == 1
+
+    def ue(self):
+        """An unsigned Exp-Golomb code: leading zeros, a 1, as many bits."""
+        remaining = self.size - self.pos
+        rest = self.value & ((1 << remaining) - 1)
+        zeros = remaining - rest.bit_length()
+        if zeros > 31 or zeros == remaining:
+            raise H264Error("Invalid Exp-Golomb code")
+        self.pos += zeros + 1
+        return (1 << zeros) - 1 + self.bits(zeros)
+
+    def se(self):
+        """A signed Exp-Golomb code: 1, -1, 2, -2, ... for 1, 2, 3, 4, ..."""
+        code = self.ue()
+        return (code + 1) >> 1 if code & 1 else -(code >> 1)
+
+
+def unescape_rbsp(nal):
+    """A NAL unit's payload without its emulation prevention bytes (a copy)."""
+    return bytes(nal[1:]).replace(_EMULATION_PREVENTION, b"\x00\x00")
+
+
+def skip_scaling_list(reader, size):
+    last = next_scale = 8
+    for _ in range(size):
+        if next_scale:
+            next_scale = (last + reader.se()) & 0xFF
+        last = next_scale or last
+
+
+def skip_hrd_parameters(reader):
+    count = reader.ue() + 1
+    reader.bits(8)  # bit_rate_scale, cpb_size_scale
+    for _ in range(count):
+        reader.ue()  # bit_rate_value_minus1
+        reader.ue()  # cpb_size_value_minus1
+        reader.bits(1)  # cbr_flag
+    reader.bits(20)  # Delay and time offset field lengths
+
+
+class SPS:
+    """
+    What a sequence parameter set says about the stream: profile, level,
+    coded size after cropping, frame rate (VUI timing, if given) and how
+    many frames may be reordered (None: unknown, up to the DPB size).
+    """
+
+    __slots__ = (
+        "profile_idc",
+        "constraint_flags",
+        "level_idc",
+        "sps_id",
+        "chroma_format_idc",
+        "bit_depth",
+        "width",
+        "height",
+        "frame_mbs_only",
+        "sar",
+        "frame_rate",
+        "max_num_ref_frames",
+        "reorder_frames",
+    )
+
+    def __init__(self, nal):
+        if not nal or nal[0] & 0x1F != NAL_TYPE_SPS:
+            raise H264Error("Not a sequence parameter set")
+        reader = BitReader(unescape_rbsp(nal))
+        self.profile_idc = reader.bits(8)
+        self.constraint_flags = reader.bits(8)
+        self.level_idc = reader.bits(8)
+        self.sps_id = reader.ue()
+
+        self.chroma_format_idc = 1
+        self.bit_depth = 8
+        separate_colour_planes = False
+        if self.profile_idc in _HIGH_PROFILES:
+            self.chroma_format_idc = reader.ue()
+            if self.chroma_format_idc == 3:
+                separate_colour_planes = reader.flag()
+            self.bit_depth = reader.ue() + 8
+            reader.ue()  # bit_depth_chroma_minus8
+            reader.bits(1)  # qpprime_y_zero_transform_bypass_flag
+            if reader.flag():  # seq_scaling_matrix_present_flag
+                for i in range(8 if self.chroma_format_idc != 3 else 12):
+                    if reader.flag():
+                        skip_scaling_list(reader, 16 if i < 6 else 64)
+
+        reader.ue()  # log2_max_frame_num_minus4
+        pic_order_cnt_type = reader.ue()
+        if pic_order_cnt_type == 0:
+            reader.ue()  # log2_max_pic_order_cnt_lsb_minus4
+        elif pic_order_cnt_type == 1:
+            reader.bits(1)  # delta_pic_order_always_zero_flag
+            reader.se()  # offset_for_non_ref_pic
+            reader.se()  # offset_for_top_to_bottom_field
+            for _ in range(reader.ue()):
+                reader.se()  # offset_for_ref_frame
+        self.max_num_ref_frames = reader.ue()
+        reader.bits(1)  # gaps_in_frame_num_value_allowed_flag
+        width_mbs = reader.ue() + 1
+        height_map_units = reader.ue() + 1
+        self.frame_mbs_only = reader.flag()
+        if not self.frame_mbs_only:
+            reader.bits(1)  # mb_adaptive_frame_field_flag
+        reader.bits(1)  # direct_8x8_inference_flag
+
+        # Cropping is counted in chroma samples, and field pairs when interlaced
+        field_factor = 1 if self.frame_mbs_only else 2
+        if separate_colour_planes or self.chroma_format_idc == 0:
+            crop_x, crop_y = 1, field_factor
+        else:
+            crop_x = 1 if self.chroma_format_idc == 3 else 2
+            crop_y = (2 if self.chroma_format_idc == 1 else 1) * field_factor
+        self.width = width_mbs * 16
+        self.height = height_map_units * 16 * field_factor
+        if reader.flag():  # frame_cropping_flag
+            left, right, top, bottom = (reader.ue() for _ in range(4))
+            self.width -= crop_x * (left + right)
+            self.height -= crop_y * (top + bottom)
+
+        self.sar = (1, 1)
+        self.frame_rate = None
+        self.reorder_frames = None
+        if reader.flag():  # vui_parameters_present_flag
+            self.parse_vui(reader)
+        if self.reorder_frames is None:
+            intra_only = (
+                self.profile_idc in _INTRA_PROFILES
+                and self.constraint_flags & CONSTRAINT_SET3
+            )
+            if intra_only or self.profile_idc == PROFILES["baseline"]:
+                self.reorder_frames = 0  # No B slices
+
+    def parse_vui(self, reader):
+        if reader.flag():  # aspect_ratio_info_present_flag
+            aspect_ratio_idc = reader.bits(8)
+            if aspect_ratio_idc == _EXTENDED_SAR:
+                self.sar = (reader.bits(16), reader.bits(16))
+            elif 1 <= aspect_ratio_idc <= len(_SAR_TABLE):
+                self.sar = _SAR_TABLE[aspect_ratio_idc - 1]
+        if reader.flag():  # overscan_info_present_flag
+            reader.bits(1)
+        if reader.flag():  # video_signal_type_present_flag
+            reader.bits(4)  # video_format, video_full_range_flag
+            if reader.flag():  # colour_description_present_flag
+                reader.bits(24)
+        if reader.flag():  # chroma_loc_info_present_flag
+            reader.ue()
+            reader.ue()
+        if reader.flag():  # timing_info_present_flag
+            num_units_in_tick = reader.bits(32)
+            time_scale = reader.bits(32)
+            reader.bits(1)  # fixed_frame_rate_flag
+            if num_units_in_tick:
+                # Two ticks per frame: one per field
+                self.frame_rate = time_scale / (2 * num_units_in_tick)
+        nal_hrd = reader.flag()
+        if nal_hrd:
+            skip_hrd_parameters(reader)
+        vcl_hrd = reader.flag()
+        if vcl_hrd:
+            skip_hrd_parameters(reader)
+        if nal_hrd or vcl_hrd:
+            reader.bits(1)  # low_delay_hrd_flag
+        reader.bits(1)  # pic_struct_present_flag
+        if reader.flag():  # bitstream_restriction_flag
+            reader.bits(1)  # motion_vectors_over_pic_boundaries_flag
+            for _ in range(4):
+                reader.ue()  # Max bytes/bits and motion vector lengths
+            self.reorder_frames = reader.ue()  # max_num_reorder_frames
+            reader.ue()  # max_dec_frame_buffering
+
+    @property
+    def profile(self):
+        if (
+            self.profile_idc == PROFILES["baseline"]
+            and self.constraint_flags & CONSTRAINT_SET1
+        ):
+            return "constrained baseline"
+        return PROFILE_NAMES.get(self.profile_idc, str(self.profile_idc))
+
+    @property
+    def level(self):
+        return f"{self.level_idc // 10}.{self.level_idc % 10}"
+
+
+class AVCDecoderConfig:
+    """
+    An AVCDecoderConfigurationRecord (the body of an H.264 sequence header
+    tag): profile, level, NAL unit length size and parameter sets, with
+    the first SPS parsed.
+    """
+
+    def __init__(self, record):
+        if len(record) < 7 or record[0] != 1:
+            raise H264Error("Invalid AVCDecoderConfigurationRecord")
+        self.record = bytes(record)
+        self.profile_idc = record[1]
+        self.profile_compatibility = record[2]
+        self.level_idc = record[3]
+        self.nal_length_size = (record[4] & 0x03) + 1
+        if self.nal_length_size == 3:
+            raise H264Error("Unsupported NAL unit length size 3")
+        self.sps_units = []
+        self.pps_units = []
+        pos = 5
+        try:
+            for units, count_mask in ((self.sps_units, 0x1F), (self.pps_units, 0xFF)):
+                count = record[pos] & count_mask
+                pos += 1
+                for _ in range(count):
+                    size = _UINT16.unpack_from(record, pos)[0]
+                    if pos + 2 + size > len(record):
+                        raise IndexError
+                    units.append(self.record[pos + 2 : pos + 2 + size])
+                    pos += 2 + size
+        except (IndexError, struct.error):
+            raise H264Error("Truncated AVCDecoderConfigurationRecord")
+        if not self.sps_units:
+            raise H264Error("AVCDecoderConfigurationRecord without SPS")
+        self.sps = SPS(self.sps_units[0])
+        self.parameter_sets = self.sps_units + self.pps_units
+        # SPS and PPS in Annex-B, repeated before every keyframe in MPEG-TS
+        self.annexb_parameter_sets = b"".join(
+            b"\x00\x00\x00\x01" + nal for nal in self.parameter_sets
+        )
+
+
+class NALIndex:
+    """
+    The NAL units of one AVCC frame: types, offsets and sizes in arrays
+    reused from frame to frame, and the frame's composition time offset.
+    Indexing copies no data and allocates nothing per NAL unit.
+    """
+
+    __slots__ = ("types", "offsets", "sizes", "count", "composition_offset")
+
+    def __init__(self, capacity=NAL_INDEX_CAPACITY):
+        self.types = bytearray(capacity)
+        self.offsets = array.array("L", [0]) * capacity
+        self.sizes = array.array("L", [0]) * capacity
+        self.count = 0
+        self.composition_offset = 0
+
+    def index(self, payload, nal_length_size):
+        """
+        Indexes the NAL units of an FLV AVC NALU video tag body (a bytes-like,
+        tag header included, so offsets are into `payload`); returns their
+        count. Raises H264Error if a NAL unit overruns the frame.
+        """
+        end = len(payload)
+        if end < AVC_TAG_HEADER_SIZE:
+            raise H264Error("Truncated AVC video tag")
+        offset = _UINT32.unpack_from(payload, 1)[0] & 0xFFFFFF
+        self.composition_offset = offset - 0x1000000 if offset & 0x800000 else offset
+        read_length = _NAL_LENGTH[nal_length_size].unpack_from
+        types = self.types
+        count = 0
+        pos = AVC_TAG_HEADER_SIZE
+        while pos < end:
+            start = pos + nal_length_size
+            if start > end:
+                raise H264Error("Truncated NAL unit length")
+            size = read_length(payload, pos)[0]
+            pos = start + size
+            if pos > end:
+                raise H264Error("NAL unit overruns its frame")
+            if not size:
+                continue
+            if count == len(types):
+                self.grow()
+                types = self.types
+            types[count] = payload[start] & 0x1F
+            self.offsets[count] = start
+            self.sizes[count] = size
+            count += 1
+        self.count = count
+        return count
+
+    def grow(self):
+        self.types.extend(bytes(len(self.types)))
+        self.offsets.extend(self.offsets)
+        self.sizes.extend(self.sizes)
+
+    def has_type(self, nal_type):
+        return self.types.find(nal_type, 0, self.count) >= 0
+
+
+class H264Inspector:
+    """
+    Inspects one published H.264 stream: the decoder configuration from
+    its sequence header, then each frame's NAL units and composition time
+    offset. Per-frame work is a NALIndex pass and a few counters.
+    """
+
+    __slots__ = (
+        "config",
+        "nals",
+        "frames",
+        "malformed_frames",
+        "keyframe_mismatches",
+        "nal_counts",
+        "max_composition_offset",
+        "reordered_frames",
+    )
+
+    def __init__(self):
+        self.config = None  # AVCDecoderConfig
+        self.nals = NALIndex()
+        self.frames = 0
+        self.malformed_frames = 0
+        # Frames flagged as keyframes without an IDR slice, or the reverse
+        self.keyframe_mismatches = 0
+        self.nal_counts = [0] * NAL_TYPES
+        self.max_composition_offset = 0  # ms
+        self.reordered_frames = 0  # With a composition time offset
+
+    def inspect(self, payload):
+        """
+        Inspects one FLV video tag body. Returns the new AVCDecoderConfig
+        at a sequence header, else None; raises H264Error for a sequence
+        header that doesn't parse.
+        """
+        if len(payload) < AVC_TAG_HEADER_SIZE or payload[0] & 0x0F != VIDEO_CODEC_AVC:
+            return None
+        packet_type = payload[1]
+        if packet_type == AVC_SEQUENCE_HEADER:
+            self.config = AVCDecoderConfig(memoryview(payload)[AVC_TAG_HEADER_SIZE:])
+            return self.config
+        if packet_type != AVC_NALU or self.config is None:
+            return None
+
+        self.frames += 1
+        nals = self.nals
+        try:
+            count = nals.index(payload, self.config.nal_length_size)
+        except H264Error:
+            self.malformed_frames += 1
+            return None
+        nal_counts = self.nal_counts
+        types = nals.types
+        for i in range(count):
+            nal_counts[types[i]] += 1
+        keyframe = payload[0] >> 4 == VIDEO_KEYFRAME
+        if keyframe != nals.has_type(NAL_TYPE_IDR):
+            self.keyframe_mismatches += 1
+        composition_offset = nals.composition_offset
+        if composition_offset:
+            self.reordered_frames += 1
+            if composition_offset > self.max_composition_offset:
+                self.max_composition_offset = composition_offset
+        return None
+
+
+def parse_profiles(text):
+    """profile_idc values from comma-separated names or numbers (argparse type)."""
+    profiles = set()
+    for name in text.split(","):
+        name = name.strip().lower()
+        if name in PROFILES:
+            profiles.add(PROFILES[name])
+        elif name.isdigit():
+            profiles.add(int(name))
+        elif name:
+            raise ValueError(f"Unknown H.264 profile {name!r}")
+    return frozenset(profiles)
@@ -0,0 +1,524 @@
+import collections
+import logging
+import math
+import os
+import queue
+import re
+import threading
+
+import aac
+import fmp4
+import h264
+import mpegts
+from rtmp_live import (
+    RTMP_MSG_TYPE_AUDIO,
+    RTMP_MSG_TYPE_VIDEO,
+    SOUND_FORMAT_AAC,
+    VIDEO_CODEC_AVC,
+    is_aac_sequence_header,
+    is_avc_sequence_header,
+    is_video_keyframe,
+)
+
+# Segment formats: MPEG-TS (H.264 in Annex-B, AAC in ADTS) or fragmented MP4
+# (the publisher's AVCC and raw AAC frames as they are)
+FORMAT_MPEGTS = "mpegts"
+FORMAT_FMP4 = "fmp4"
+FORMATS = (FORMAT_MPEGTS, FORMAT_FMP4)
+
+PLAYLIST_NAME = "index.m3u8"
+SEGMENT_EXTENSIONS = {FORMAT_MPEGTS: ".ts", FORMAT_FMP4: ".m4s"}
+# Files a stream directory may hold, cleared when the stream is published again
+HLS_FILE = re.compile(r"^[A-Za-z0-9_.-]+\.(m3u8|ts|m4s|mp4)$")
+
+NAL_START_CODE = b"\x00\x00\x00\x01"
+# Access unit delimiter opening each Annex-B access unit (any slice types)
+ACCESS_UNIT_DELIMITER = NAL_START_CODE + b"\x09\xf0"
+
+# AAC frames per MPEG-TS audio PES packet: fewer, larger packets waste less
+# space on TS headers and stuffing
+AUDIO_FRAMES_PER_PES = 4
+# Video frame duration (ms) assumed for the last frame of a stream
+DEFAULT_FRAME_MS = 1000 / 30
+
+_UNSAFE_NAME = re.compile(r"[^A-Za-z0-9_.-]")
+
+_WRITE, _DELETE, _CLEAR, _STOP = range(4)
+
+
+def safe_name(stream_key):
+    """A stream key as a directory name: no separators, no leading dot."""
+    name = _UNSAFE_NAME.sub("_", stream_key)
+    return "_" + name[1:] if name.startswith(".") else name
+
+
+def avcc_to_annexb(out, payload, nals, config, keyframe):
+    """
+    Appends one AVCC access unit to `out` in Annex-B: an access unit
+    delimiter, the SPS and PPS before a keyframe that doesn't carry its
+    own, then each NAL unit behind a start code. `nals` is the NALIndex of
+    `payload`, the frame's FLV tag body.
+    """
+    out += ACCESS_UNIT_DELIMITER
+    if (
+        keyframe
+        and not nals.has_type(h264.NAL_TYPE_SPS)
+        and not nals.has_type(h264.NAL_TYPE_PPS)
+    ):
+        out += config.annexb_parameter_sets
+    view = memoryview(payload)
+    types, offsets, sizes = nals.types, nals.offsets, nals.sizes
+    for i in range(nals.count):
+        if types[i] != h264.NAL_TYPE_AUD:
+            out += NAL_START_CODE
+            out += view[offsets[i] : offsets[i] + sizes[i]]
+
+
+class TSSegmenter:
+    """Builds MPEG-TS segments: PAT/PMT, then one PES per frame."""
+
+    extension = SEGMENT_EXTENSIONS[FORMAT_MPEGTS]
+
+    def __init__(self, video, audio):
+        self.video = video
+        self.audio = audio
+        self.muxer = mpegts.TSMuxer(video is not None, audio is not None)
+        self.data = bytearray()
+        self.audio_frames = bytearray()
+        self.audio_pts = None
+        self.audio_count = 0
+
+    def init_segment(self):
+        return None
+
+    def begin(self, sequence):
+        self.data = bytearray()
+        self.muxer.write_tables(self.data)
+
+    def add_video(self, dts, payload, nals, keyframe):
+        frame = bytearray()
+        avcc_to_annexb(frame, payload, nals, self.video, keyframe)
+        pts = dts + nals.composition_offset
+        self.muxer.write_video(self.data, dts * 90, pts * 90, frame, keyframe)
+
+    def add_audio(self, timestamp, data):
+        if self.audio_pts is None:
+            self.audio_pts = timestamp * 90
+        self.audio_frames += self.audio.adts_header(len(data))
+        self.audio_frames += data
+        self.audio_count += 1
+        if self.audio_count == AUDIO_FRAMES_PER_PES:
+            self.flush_audio()
+
+    def flush_audio(self):
+        if self.audio_count:
+            self.muxer.write_audio(self.data, self.audio_pts, self.audio_frames)
+            self.audio_frames = bytearray()
+            self.audio_pts = None
+            self.audio_count = 0
+
+    def finish(self, next_timestamp):
+        self.flush_audio()
+        data, self.data = self.data, bytearray()
+        return data
+
+
+class FMP4Segmenter:
+    """Builds fMP4 segments: one moof + mdat with a fragment per track."""
+
+    extension = SEGMENT_EXTENSIONS[FORMAT_FMP4]
+
+    def __init__(self, video, audio):
+        self.video = video
+        self.audio = audio
+        self.tracks = []
+        if video is not None:
+            self.tracks.append(
+                fmp4.Track(
+                    fmp4.VIDEO_TRACK_ID,
+                    fmp4.VIDEO_TIMESCALE,
+                    video.record,
+                    width=video.sps.width,
+                    height=video.sps.height,
+                )
+            )
+        if audio is not None:
+            self.tracks.append(
+                fmp4.Track(
+                    fmp4.AUDIO_TRACK_ID,
+                    audio.sample_rate,
+                    audio.config,
+                    sample_rate=audio.sample_rate,
+                    channels=audio.channels,
+                )
+            )
+        self.sequence = 0
+        self.video_fragment = None
+        self.audio_fragment = None
+        # The latest video sample waits for the next one to know its duration
+        self.pending_video = None
+        self.video_duration = round(DEFAULT_FRAME_MS * 90)
+        # Audio decode time in samples, carried across segments: millisecond
+        # timestamps can't place AAC frames exactly
+        self.audio_time = None
+
+    def init_segment(self):
+        return fmp4.init_segment(self.tracks)
+
+    def begin(self, sequence):
+        self.sequence = sequence
+        self.video_fragment = self.audio_fragment = None
+
+    def add_video(self, dts, payload, nals, keyframe):
+        dts *= 90
+        self.flush_video(dts)
+        if self.video_fragment is None:
+            self.video_fragment = fmp4.Fragment(fmp4.VIDEO_TRACK_ID, dts)
+        self.pending_video = (
+            dts,
+            bytes(memoryview(payload)[h264.AVC_TAG_HEADER_SIZE :]),  # AVCC as is
+            fmp4.SAMPLE_FLAGS_SYNC if keyframe else fmp4.SAMPLE_FLAGS_NON_SYNC,
+            nals.composition_offset * 90,
+        )
+
+    def flush_video(self, next_dts):
+        if self.pending_video is None:
+            return
+        dts, data, flags, composition_offset = self.pending_video
+        if next_dts is not None and next_dts > dts:
+            self.video_duration = next_dts - dts
+        self.video_fragment.add(data, self.video_duration, flags, composition_offset)
+        self.pending_video = None
+
+    def add_audio(self, timestamp, data):
+        if self.audio_fragment is None:
+            time = timestamp * self.audio.sample_rate // 1000
+            # Only a gap of a frame or more resynchronizes with the timestamps
+            if (
+                self.audio_time is None
+                or abs(time - self.audio_time) >= self.audio.frame_samples
+            ):
+                self.audio_time = time
+            self.audio_fragment = fmp4.Fragment(fmp4.AUDIO_TRACK_ID, self.audio_time)
+        frame_samples = self.audio.frame_samples
+        self.audio_fragment.add(bytes(data), frame_samples, fmp4.SAMPLE_FLAGS_SYNC)
+        self.audio_time += frame_samples
+
+    def finish(self, next_timestamp):
+        self.flush_video(None if next_timestamp is None else next_timestamp * 90)
+        fragments = [
+            fragment
+            for fragment in (self.video_fragment, self.audio_fragment)
+            if fragment is not None
+        ]
+        return fmp4.media_segment(self.sequence, fragments)
+
+
+SEGMENTERS = {FORMAT_MPEGTS: TSSegmenter, FORMAT_FMP4: FMP4Segmenter}
+
+
+class Segment:
+    __slots__ = ("sequence", "name", "duration", "init_name", "discontinuity")
+
+    def __init__(self, sequence, name, duration, init_name, discontinuity):
+        self.sequence = sequence
+        self.name = name
+        self.duration = duration
+        self.init_name = init_name
+        self.discontinuity = discontinuity
+
+
+class HLSPackager:
+    """
+    Remuxes one published stream into HLS segments and a live playlist.
+
+    Nothing is decoded: H.264 and AAC frames are only rewrapped. A segment
+    starts on a video keyframe (on any audio frame for streams without
+    video) once the current one is at least `segment_seconds` long. The
+    playlist lists the last `playlist_length` segments; segments that left
+    it are deleted after as many more, so players holding an older playlist
+    can still fetch them. Codecs other than H.264/AAC are left out.
+    Segments and playlists are written by the HLSWriter's thread; a segment
+    finished while it is more than `max_queued_bytes` behind is dropped and
+    the playlist marks the gap as a discontinuity.
+    """
+
+    def __init__(self, writer, stream):
+        self.writer = writer
+        self.stream = stream  # LiveStream: its cached sequence headers
+        self.name = safe_name(stream.stream_key)
+        self.directory = os.path.join(writer.directory, self.name)
+        self.segmenter = None
+        self.video = None  # h264.AVCDecoderConfig
+        self.nals = h264.NALIndex()  # Of the frame being packaged
+        self.audio = None  # aac.AudioSpecificConfig
+        self.video_record = None  # Sequence header payloads the configs came from
+        self.audio_record = None
+        self.last_timestamp = 0
+        self.init_name = None
+        self.inits = 0
+        self.sequence = 0
+        self.segment_start = 0
+        self.segments = collections.deque()  # Segment, in the playlist
+        self.expired = collections.deque()  # Segment names awaiting deletion
+        self.discontinuity = False
+        self.discontinuity_sequence = 0
+        self.target_duration = math.ceil(writer.segment_seconds)
+        self.warned = set()
+        writer.queue.put((_CLEAR, self.directory, None))
+
+    def warn_once(self, key, text):
+        if key not in self.warned:
+            self.warned.add(key)
+            logging.warning(f"HLS '{self.stream.stream_key}': {text}")
+
+    def write(self, message):
+        """Packages one of the stream's messages (after LiveStream caching)."""
+        payload = message.payload
+        self.last_timestamp = message.timestamp
+        if message.msg_type == RTMP_MSG_TYPE_VIDEO:
+            if not payload or payload[0] & 0x0F != VIDEO_CODEC_AVC:
+                self.warn_once("video", "video codec isn't H.264, leaving it out.")
+                return
+            if is_avc_sequence_header(message) or len(payload) < 5:
+                return
+            if payload[1] != h264.AVC_NALU:
+                return  # End of sequence
+            keyframe = is_video_keyframe(message)
+            if keyframe:
+                self.boundary(message.timestamp)
+            if self.segmenter is None or self.segmenter.video is None:
+                return
+            try:
+                self.nals.index(payload, self.video.nal_length_size)
+            except h264.H264Error as e:
+                self.warn_once("video frame", f"{e}, skipping frames like it.")
+                return
+            self.segmenter.add_video(message.timestamp, payload, self.nals, keyframe)
+        elif message.msg_type == RTMP_MSG_TYPE_AUDIO:
+            if not payload or payload[0] >> 4 != SOUND_FORMAT_AAC:
+                self.warn_once("audio", "audio codec isn't AAC, leaving it out.")
+                return
+            if is_aac_sequence_header(message) or len(payload) < 3:
+                return
+            if self.stream.avc_sequence_header is None:
+                self.boundary(message.timestamp)  # Audio-only stream
+            if self.segmenter is None or self.segmenter.audio is None:
+                return
+            self.segmenter.add_audio(
+                message.timestamp, memoryview(payload)[aac.AAC_TAG_HEADER_SIZE :]
+            )
+
+    def boundary(self, timestamp):
+        """At a keyframe: starts a segment if the current one is long enough."""
+        if self.segmenter is not None:
+            elapsed = ((timestamp - self.segment_start) & 0xFFFFFFFF) / 1000
+            if elapsed < self.writer.segment_seconds and not self.configs_changed():
+                return
+            self.finish_segment(timestamp)
+        if self.configs_changed():
+            self.load_configs()
+        if self.video is None and self.audio is None:
+            return
+        if self.segmenter is None:
+            self.segmenter = SEGMENTERS[self.writer.format](self.video, self.audio)
+            init = self.segmenter.init_segment()
+            if init is not None:
+                self.inits += 1
+                self.init_name = f"init{self.inits}.mp4"
+                self.writer.write(
+                    os.path.join(self.directory, self.init_name), init, force=True
+                )
+        self.sequence += 1
+        self.segment_start = timestamp
+        self.segmenter.begin(self.sequence)
+
+    def sequence_headers(self):
+        """The payloads of the stream's current AVC and AAC sequence headers."""
+        stream = self.stream
+        return tuple(
+            None if message is None else bytes(message.payload)
+            for message in (stream.avc_sequence_header, stream.aac_sequence_header)
+        )
+
+    def configs_changed(self):
+        # Encoders may resend identical sequence headers: compare contents
+        return self.sequence_headers() != (self.video_record, self.audio_record)
+
+    def load_configs(self):
+        """Parses the stream's sequence headers; a new segmenter uses them."""
+        self.video_record, self.audio_record = self.sequence_headers()
+        self.video = self.audio = None
+        try:
+            if self.video_record is not None:
+                self.video = h264.AVCDecoderConfig(
+                    memoryview(self.video_record)[h264.AVC_TAG_HEADER_SIZE :]
+                )
+        except h264.H264Error as e:
+            self.warn_once("video config", f"{e}, leaving video out.")
+        try:
+            if self.audio_record is not None:
+                audio = aac.AudioSpecificConfig(
+                    memoryview(self.audio_record)[aac.AAC_TAG_HEADER_SIZE :]
+                )
+                if self.writer.format == FORMAT_MPEGTS and not audio.adts:
+                    raise aac.AACError(f"AAC {audio.profile} doesn't fit in ADTS")
+                self.audio = audio
+        except aac.AACError as e:
+            self.warn_once("audio config", f"{e}, leaving audio out.")
+        if self.segmenter is not None:
+            self.segmenter = None
+            self.discontinuity = True
+
+    def finish_segment(self, next_timestamp=None):
+        segmenter = self.segmenter
+        data = segmenter.finish(next_timestamp)
+        if next_timestamp is None:
+            # No keyframe followed: end after the last frame received
+            end = self.last_timestamp + round(DEFAULT_FRAME_MS)
+        else:
+            end = next_timestamp
+        duration = ((end - self.segment_start) & 0xFFFFFFFF) / 1000
+        name = f"segment{self.sequence}{segmenter.extension}"
+        if not self.writer.write(os.path.join(self.directory, name), data):
+            self.warn_once("behind", "writes falling behind, dropping segments.")
+            self.discontinuity = True
+            return
+        self.segments.append(
+            Segment(self.sequence, name, duration, self.init_name, self.discontinuity)
+        )
+        self.discontinuity = False
+        self.target_duration = max(self.target_duration, math.ceil(duration))
+        while len(self.segments) > self.writer.playlist_length:
+            segment = self.segments.popleft()
+            if segment.discontinuity:
+                self.discontinuity_sequence += 1
+            self.expired.append(segment.name)
+        while len(self.expired) > self.writer.playlist_length:
+            self.writer.delete(os.path.join(self.directory, self.expired.popleft()))
+        self.write_playlist()
+
+    def playlist(self, ended=False):
+        version = 7 if self.writer.format == FORMAT_FMP4 else 3
+        lines = [
+            "#EXTM3U",
+            f"#EXT-X-VERSION:{version}",
+            f"#EXT-X-TARGETDURATION:{self.target_duration}",
+            f"#EXT-X-MEDIA-SEQUENCE:"
+            f"{self.segments[0].sequence if self.segments else self.sequence}",
+        ]
+        if self.discontinuity_sequence:
+            lines.append(f"#EXT-X-DISCONTINUITY-SEQUENCE:{self.discontinuity_sequence}")
+        init_name = None
+        for segment in self.segments:
+            if segment.discontinuity:
+                lines.append("#EXT-X-DISCONTINUITY")
+            if segment.init_name is not None and segment.init_name != init_name:
+                init_name = segment.init_name
+                lines.append(f'#EXT-X-MAP:URI="{init_name}"')
+            lines.append(f"#EXTINF:{segment.duration:.3f},")
+            lines.append(segment.name)
+        if ended:
+            lines.append("#EXT-X-ENDLIST")
+        lines.append("")
+        return "\n".join(lines).encode()
+
+    def write_playlist(self, ended=False):
+        self.writer.write(
+            os.path.join(self.directory, PLAYLIST_NAME),
+            self.playlist(ended),
+            force=True,
+        )
+
+    def close(self):
+        """Ends the playlist with the segment in progress."""
+        if self.segmenter is not None:
+            self.finish_segment()
+            self.segmenter = None
+        self.write_playlist(ended=True)
+
+
+class HLSWriter:
+    """
+    Writes every stream's HLS files from one background thread.
+
+    Each file is written next to its final name and renamed over it, so
+    an HTTP server reading the directory never sees a partial playlist or
+    segment.
+    """
+
+    def __init__(
+        self,
+        directory,
+        segment_format,
+        segment_seconds,
+        playlist_length,
+        max_queued_bytes,
+    ):
+        if segment_format not in SEGMENTERS:
+            raise ValueError(f"Unknown HLS format {segment_format!r}")
+        self.directory = directory
+        self.format = segment_format
+        self.segment_seconds = segment_seconds
+        self.playlist_length = playlist_length
+        self.max_queued_bytes = max_queued_bytes
+        # Each counter is only updated by one thread: their difference is the
+        # backlog without a lock
+        self.queued_bytes = 0
+        self.written_bytes = 0
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.run, name="rtmp-hls", daemon=True)
+        os.makedirs(directory, exist_ok=True)
+        self.thread.start()
+
+    def open(self, stream):
+        """Starts packaging a LiveStream; feed it with the packager's `write`."""
+        return HLSPackager(self, stream)
+
+    def write(self, path, data, force=False):
+        """Queues a file write; returns False if dropped for falling behind."""
+        if not force and self.queued_bytes - self.written_bytes > self.max_queued_bytes:
+            return False
+        self.queued_bytes += len(data)
+        self.queue.put((_WRITE, path, data))
+        return True
+
+    def delete(self, path):
+        self.queue.put((_DELETE, path, None))
+
+    def path(self, stream_name, file_name):
+        """The file an HTTP request for `stream_name/file_name` maps to, or None."""
+        if (
+            _UNSAFE_NAME.search(stream_name)
+            or stream_name.startswith(".")
+            or not HLS_FILE.match(file_name)
+        ):
+            return None
+        return os.path.join(self.directory, stream_name, file_name)
+
+    def close(self):
+        """Writes out everything queued, then stops the thread."""
+        self.queue.put((_STOP, None, None))
+        self.thread.join()
+
+    def run(self):
+        while True:
+            op, path, data = self.queue.get()
+            try:
+                if op == _WRITE:
+                    self.written_bytes += len(data)
+                    temporary = path + ".tmp"
+                    with open(temporary, "wb") as f:
+                        f.write(data)
+                    os.replace(temporary, path)
+                elif op == _DELETE:
+                    os.remove(path)
+                elif op == _CLEAR:
+                    os.makedirs(path, exist_ok=True)
+                    for name in os.listdir(path):
+                        if HLS_FILE.match(name) or name.endswith(".tmp"):
+                            os.remove(os.path.join(path, name))
+                else:
+                    return
+            except OSError as e:
+                logging.error(f"❌ HLS write of {path} failed: {e}")
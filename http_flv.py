@@ -0,0 +1,257 @@
+import asyncio
+import base64
+import hashlib
+import logging
+import struct
+
+import flv
+from rtmp_live import Subscriber
+
+WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+WS_OPCODE_BINARY = 0x2
+WS_OPCODE_CLOSE = 0x8
+WS_OPCODE_PING = 0x9
+WS_OPCODE_PONG = 0xA
+WS_FINAL = 0x80
+WS_MASKED = 0x80
+# Players only send control frames; anything bigger ends the connection
+WS_MAX_CLIENT_FRAME = 64 * 1024
+
+# Bytes of a viewer's request side read at a time, only to notice it closing
+READ_SIZE = 4096
+
+
+class SharedTag:
+    """
+    One stream message as an FLV tag: its header and PreviousTagSize built
+    once, the body the publisher's own payload. Every viewer queues the
+    same object. `msg_type` and `payload` let the Subscriber policies read
+    it like the message itself.
+    """
+
+    __slots__ = ("message", "msg_type", "payload", "header", "trailer")
+
+    def __init__(self, message):
+        self.message = message
+        self.msg_type = message.msg_type
+        self.payload = message.payload
+        size = len(message.payload)
+        self.header = flv.encode_tag_header(message.msg_type, message.timestamp, size)
+        self.trailer = flv.encode_previous_tag_size(size)
+
+
+class TagCache:
+    """
+    The SharedTags of one LiveStream, shared by its HTTP viewers.
+
+    The tag of the message being broadcast is built by the first viewer to
+    queue it and reused by the rest. Tags of the stream's cached start-up
+    burst (metadata, sequence headers, current GOP) are kept while the
+    stream caches their messages, so late joiners reuse them too.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.last = None  # Most recent tag built or looked up
+        self.cached = {}  # id(message) -> SharedTag of the stream's cached messages
+        for message in self.startup_messages():
+            self.cached[id(message)] = SharedTag(message)
+
+    def startup_messages(self):
+        stream = self.stream
+        headers = (
+            stream.metadata,
+            stream.avc_sequence_header,
+            stream.aac_sequence_header,
+        )
+        return [message for message in headers if message is not None] + list(
+            stream.gop_cache
+        )
+
+    def tag(self, message):
+        last = self.last
+        if last is not None and last.message is message:
+            return last
+        tag = self.cached.get(id(message))
+        if tag is None or tag.message is not message:
+            tag = SharedTag(message)
+            self.remember(tag)
+        self.last = tag
+        return tag
+
+    def remember(self, tag):
+        """Keeps a new tag if the stream cached its message."""
+        stream = self.stream
+        message = tag.message
+        gop = stream.gop_cache
+        if gop and gop[-1] is message:
+            if len(gop) == 1:  # A keyframe started a new GOP
+                self.forget_gop()
+            self.cached[id(message)] = tag
+        elif (
+            message is stream.metadata
+            or message is stream.avc_sequence_header
+            or message is stream.aac_sequence_header
+        ):
+            self.cached[id(message)] = tag
+        elif not gop and len(self.cached) > 3:
+            self.forget_gop()  # The GOP cache overflowed or was cleared
+
+    def forget_gop(self):
+        stream = self.stream
+        self.cached = {
+            id(message): self.cached[id(message)]
+            for message in (
+                stream.metadata,
+                stream.avc_sequence_header,
+                stream.aac_sequence_header,
+            )
+            if message is not None
+            and id(message) in self.cached
+            and self.cached[id(message)].message is message
+        }
+
+
+def websocket_frame_header(size, opcode=WS_OPCODE_BINARY):
+    """The header of an unmasked, final server frame with a `size`-byte payload."""
+    if size < 126:
+        return bytes((WS_FINAL | opcode, size))
+    if size < 0x10000:
+        return struct.pack(">BBH", WS_FINAL | opcode, 126, size)
+    return struct.pack(">BBQ", WS_FINAL | opcode, 127, size)
+
+
+def websocket_accept(key):
+    """Sec-WebSocket-Accept for a client's Sec-WebSocket-Key."""
+    digest = hashlib.sha1(key.encode("latin-1") + WEBSOCKET_GUID).digest()
+    return base64.b64encode(digest).decode()
+
+
+class FLVViewer(Subscriber):
+    """
+    An HTTP-FLV or WebSocket-FLV player attached to a LiveStream.
+
+    Queues SharedTags from the stream's TagCache under the same byte limit
+    and slow consumer policy as RTMP players, and writes everything queued
+    as one HTTP chunk or WebSocket message, starting with the FLV header.
+    """
+
+    def __init__(
+        self, stream, tags, writer, websocket, max_queue_bytes, policy, budget=None
+    ):
+        self.tags = tags
+        self.writer = writer
+        self.websocket = websocket
+        properties = stream.metadata_properties
+        has_audio = (
+            stream.aac_sequence_header is not None or "audiocodecid" in properties
+        )
+        has_video = (
+            stream.avc_sequence_header is not None or "videocodecid" in properties
+        )
+        if not has_audio and not has_video:
+            # Not published yet: players wait for either
+            has_audio = has_video = True
+        self.flv_header = flv.encode_header(has_audio, has_video)
+        super().__init__(None, 0, max_queue_bytes, policy, budget)
+
+    def enqueue(self, message):
+        super().enqueue(self.tags.tag(message))
+
+    def frame(self, pieces, size):
+        """Wraps `pieces` (`size` bytes) in an HTTP chunk or WebSocket frame."""
+        if self.websocket:
+            return [websocket_frame_header(size), *pieces]
+        return [f"{size:x}\r\n".encode(), *pieces, b"\r\n"]
+
+    async def run(self):
+        writer = self.writer
+        try:
+            writer.writelines(self.frame([self.flv_header], len(self.flv_header)))
+            while not self.closed:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+
+                queue = self.queue
+                if not queue:
+                    continue
+                pieces = []
+                size = 0
+                while queue:
+                    tag = queue.popleft()
+                    payload_size = len(tag.payload)
+                    self.queued_bytes -= payload_size
+                    self.budget.release(payload_size)
+                    pieces += (tag.header, tag.payload, tag.trailer)
+                    size += flv.TAG_HEADER_SIZE + payload_size + flv.PREVIOUS_TAG_SIZE
+                writer.writelines(self.frame(pieces, size))
+                await writer.drain()
+        except (ConnectionError, OSError) as e:
+            logging.info(f"HTTP-FLV viewer connection lost: {e}")
+        finally:
+            self.closed = True
+            self.clear_queue()
+
+    def disconnect(self):
+        logging.warning(
+            f"HTTP-FLV viewer too slow ({self.queued_bytes} bytes queued), "
+            "disconnecting."
+        )
+        self.close()
+        self.writer.close()
+
+
+async def read_websocket(reader, writer):
+    """Answers a WebSocket player's pings until it closes; ignores its data."""
+    while True:
+        head = await reader.readexactly(2)
+        opcode = head[0] & 0x0F
+        size = head[1] & 0x7F
+        if size == 126:
+            size = struct.unpack(">H", await reader.readexactly(2))[0]
+        elif size == 127:
+            size = struct.unpack(">Q", await reader.readexactly(8))[0]
+        if size > WS_MAX_CLIENT_FRAME:
+            return
+        mask = await reader.readexactly(4) if head[1] & WS_MASKED else bytes(4)
+        data = await reader.readexactly(size)
+        payload = bytes(byte ^ mask[i & 3] for i, byte in enumerate(data))
+        if opcode == WS_OPCODE_CLOSE:
+            # Echo the status code, then hang up
+            writer.write(websocket_frame_header(len(payload[:2]), WS_OPCODE_CLOSE))
+            writer.write(payload[:2])
+            return
+        if opcode == WS_OPCODE_PING:
+            writer.write(websocket_frame_header(size, WS_OPCODE_PONG) + payload)
+
+
+async def read_until_closed(reader):
+    """Discards an HTTP-FLV player's input until it hangs up."""
+    while await reader.read(READ_SIZE):
+        pass
+
+
+def attach_viewer(stream, writer, websocket, max_queue_bytes, policy, budget=None):
+    """
+    Attaches an FLVViewer writing to `writer` to `stream`, sharing the
+    TagCache of the stream's other HTTP viewers.
+    """
+    tags = next(
+        (
+            subscriber.tags
+            for subscriber in stream.subscribers
+            if isinstance(subscriber, FLVViewer)
+        ),
+        None,
+    )
+    viewer = FLVViewer(
+        stream,
+        TagCache(stream) if tags is None else tags,
+        writer,
+        websocket,
+        max_queue_bytes,
+        policy,
+        budget,
+    )
+    stream.add_subscriber(viewer)
+    return viewer
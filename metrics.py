@@ -0,0 +1,586 @@
+import asyncio
+import bisect
+import logging
+import time
+
+from aac import AACInspector
+from h264 import H264Inspector
+
+# Histogram bucket upper bounds (seconds)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+# Seconds of per-second buckets kept by a RateWindow, and the spans reported
+RATE_WINDOW_SECONDS = 60
+RATE_SPANS = (5, 60)
+
+# RTMP message type IDs fit in one byte, so per-type counters are a flat list
+MESSAGE_TYPES = 256
+MESSAGE_TYPE_NAMES = {
+    0x01: "set_chunk_size",
+    0x02: "abort",
+    0x03: "ack",
+    0x04: "user_control",
+    0x05: "window_ack_size",
+    0x06: "set_peer_bandwidth",
+    0x08: "audio",
+    0x09: "video",
+    0x0F: "data_amf3",
+    0x11: "command_amf3",
+    0x12: "data",
+    0x13: "shared_object",
+    0x14: "command",
+    0x16: "aggregate",
+}
+
+VIDEO_KEYFRAME = 1  # FLV frame type, high nibble of a video tag's first byte
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense."""
+
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def render(self, lines, name, labels=""):
+        cumulative = 0
+        separator = "," if labels else ""
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            lines.append(
+                f'{name}_bucket{{{labels}{separator}le="{bound}"}} {cumulative}'
+            )
+        lines.append(f'{name}_bucket{{{labels}{separator}le="+Inf"}} {self.count}')
+        labels = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{labels} {self.sum}")
+        lines.append(f"{name}_count{labels} {self.count}")
+
+
+class RateWindow:
+    """
+    Event and byte counts over the last `size` seconds, in per-second buckets.
+
+    The buckets are preallocated and indexed by second modulo `size`; a
+    bucket whose stamp is stale is reset on first use, so `add` is O(1) and
+    allocates nothing. Rates are summed over complete seconds only.
+    """
+
+    __slots__ = ("size", "stamps", "events", "bytes")
+
+    def __init__(self, size=RATE_WINDOW_SECONDS):
+        self.size = size
+        self.stamps = [-1] * size
+        self.events = [0] * size
+        self.bytes = [0] * size
+
+    def add(self, second, nbytes):
+        index = second % self.size
+        if self.stamps[index] != second:
+            self.stamps[index] = second
+            self.events[index] = 0
+            self.bytes[index] = 0
+        self.events[index] += 1
+        self.bytes[index] += nbytes
+
+    def rates(self, second, span):
+        """Returns (events/s, bytes/s) over the `span` seconds before `second`."""
+        events = nbytes = 0
+        for past in range(second - span, second):
+            index = past % self.size
+            if self.stamps[index] == past:
+                events += self.events[index]
+                nbytes += self.bytes[index]
+        return events / span, nbytes / span
+
+
+class SessionMetrics:
+    """Counters of one connection, bumped inline on its ingest path."""
+
+    __slots__ = ("started", "messages", "busy_seconds")
+
+    def __init__(self, started):
+        self.started = started  # time.monotonic() at accept
+        self.messages = [0] * MESSAGE_TYPES  # Received messages by type ID
+        self.busy_seconds = 0.0  # Time spent parsing and handling its reads
+
+
+class StreamMetrics:
+    """
+    Ingest health of one published stream.
+
+    Reads the coarse `clock.second` maintained by ServerMetrics rather than
+    calling a clock per packet.
+    """
+
+    __slots__ = (
+        "clock",
+        "video",
+        "audio",
+        "keyframes",
+        "last_keyframe_timestamp",
+        "keyframe_interval",
+        "h264",
+        "aac",
+    )
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.video = RateWindow()
+        self.audio = RateWindow()
+        self.keyframes = 0
+        self.last_keyframe_timestamp = None
+        self.keyframe_interval = 0  # Between the last two keyframes (ms)
+        self.h264 = H264Inspector()  # Fed by the server before add_video
+        self.aac = AACInspector()  # Fed by the server before add_audio
+
+    def add_video(self, timestamp, payload):
+        self.video.add(self.clock.second, len(payload))
+        self.aac.video_timestamp = timestamp
+        if payload and payload[0] >> 4 == VIDEO_KEYFRAME:
+            self.keyframes += 1
+            if self.last_keyframe_timestamp is not None:
+                self.keyframe_interval = timestamp - self.last_keyframe_timestamp
+            self.last_keyframe_timestamp = timestamp
+
+    def add_audio(self, payload):
+        self.audio.add(self.clock.second, len(payload))
+
+
+class ServerMetrics:
+    """
+    Server-wide histograms, plus the coarse clock StreamMetrics read.
+
+    `monitor` runs for the server's lifetime: every `interval` seconds it
+    advances `second` and records how late the event loop woke it up.
+    """
+
+    def __init__(self, interval=0.25):
+        self.interval = interval
+        self.second = int(time.monotonic())
+        self.connections = 0
+        self.handshake_seconds = Histogram(LATENCY_BUCKETS)
+        self.handshake_c0c1_seconds = Histogram(LATENCY_BUCKETS)
+        self.handshake_c2_seconds = Histogram(LATENCY_BUCKETS)
+        self.handshakes_rejected = 0
+        self.handshake_timeouts = 0
+        self.handshake_failures = 0  # Timeouts included
+        self.digest_handshakes = 0
+        self.connect_seconds = Histogram(LATENCY_BUCKETS)
+        self.loop_lag_seconds = Histogram(LAG_BUCKETS)
+        self.loop_lag = 0.0
+
+    def session(self, started=None):
+        self.connections += 1
+        return SessionMetrics(time.monotonic() if started is None else started)
+
+    def stream(self):
+        return StreamMetrics(self)
+
+    async def monitor(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.second = int(now)
+            self.loop_lag = max(0.0, now - expected)
+            self.loop_lag_seconds.observe(self.loop_lag)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_peer(peer):
+    if isinstance(peer, tuple) and len(peer) >= 2:
+        return f"{peer[0]}:{peer[1]}"
+    return str(peer)
+
+
+def write_buffer_size(session):
+    transport = getattr(session.writer, "transport", None)
+    if transport is None:
+        return 0
+    return transport.get_write_buffer_size()
+
+
+def render(server):
+    """Returns the server's metrics in the Prometheus text exposition format."""
+    metrics = server.metrics
+    lines = []
+
+    def metric(name, kind, help_text):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    metric("rtmp_connections_total", "counter", "Connections accepted.")
+    lines.append(f"rtmp_connections_total {metrics.connections}")
+    metric("rtmp_sessions", "gauge", "Open RTMP sessions.")
+    lines.append(f"rtmp_sessions {len(server.sessions)}")
+    metric("rtmp_streams", "gauge", "Live stream keys.")
+    lines.append(f"rtmp_streams {len(server.streams)}")
+
+    metric("rtmp_handshake_seconds", "histogram", "Accept to handshake complete.")
+    metrics.handshake_seconds.render(lines, "rtmp_handshake_seconds")
+    metric("rtmp_handshake_c0c1_seconds", "histogram", "Accept to C0 + C1 received.")
+    metrics.handshake_c0c1_seconds.render(lines, "rtmp_handshake_c0c1_seconds")
+    metric("rtmp_handshake_c2_seconds", "histogram", "S1 sent to C2 received.")
+    metrics.handshake_c2_seconds.render(lines, "rtmp_handshake_c2_seconds")
+    metric("rtmp_handshakes_in_flight", "gauge", "Accepted connections handshaking.")
+    lines.append(f"rtmp_handshakes_in_flight {server.pending_handshakes}")
+    metric("rtmp_handshakes_rejected_total", "counter", "Rejected: too many in flight.")
+    lines.append(f"rtmp_handshakes_rejected_total {metrics.handshakes_rejected}")
+    metric("rtmp_handshake_timeouts_total", "counter", "Handshakes timed out.")
+    lines.append(f"rtmp_handshake_timeouts_total {metrics.handshake_timeouts}")
+    metric("rtmp_handshake_failures_total", "counter", "Handshakes not completed.")
+    lines.append(f"rtmp_handshake_failures_total {metrics.handshake_failures}")
+    metric("rtmp_digest_handshakes_total", "counter", "Digest (FP9) handshakes.")
+    lines.append(f"rtmp_digest_handshakes_total {metrics.digest_handshakes}")
+    metric("rtmp_s1_pool_misses_total", "counter", "S1 packets generated inline.")
+    lines.append(f"rtmp_s1_pool_misses_total {server.s1_pool.misses}")
+    metric("rtmp_connect_seconds", "histogram", "Accept to connect _result sent.")
+    metrics.connect_seconds.render(lines, "rtmp_connect_seconds")
+    metric("rtmp_event_loop_lag_seconds", "histogram", "Event loop wakeup delay.")
+    metrics.loop_lag_seconds.render(lines, "rtmp_event_loop_lag_seconds")
+    metric("rtmp_event_loop_lag_last_seconds", "gauge", "Latest event loop lag.")
+    lines.append(f"rtmp_event_loop_lag_last_seconds {metrics.loop_lag}")
+
+    memory = server.memory
+    metric("rtmp_memory_buffered_bytes", "gauge", "Bytes charged to the budget.")
+    lines.append(f"rtmp_memory_buffered_bytes {memory.used}")
+    metric("rtmp_memory_buffered_peak_bytes", "gauge", "Peak bytes charged.")
+    lines.append(f"rtmp_memory_buffered_peak_bytes {memory.peak}")
+    metric("rtmp_memory_reads_paused", "gauge", "1 while above the high-water mark.")
+    lines.append(f"rtmp_memory_reads_paused {int(memory.paused)}")
+    metric("rtmp_memory_shed_connections_total", "counter", "Connections shed.")
+    lines.append(f"rtmp_memory_shed_connections_total {server.shed_connections}")
+
+    sessions = []
+    for session in server.sessions:
+        labels = (
+            f'session="{session.trace.session_id}",'
+            f'peer="{escape_label(format_peer(session.peer))}",'
+            f'stream="{escape_label(session.stream_key or "")}"'
+        )
+        sessions.append((labels, session))
+
+    metric("rtmp_session_bytes_in_total", "counter", "Bytes received.")
+    for labels, session in sessions:
+        lines.append(
+            f"rtmp_session_bytes_in_total{{{labels}}} {session.bytes_received}"
+        )
+    metric("rtmp_session_bytes_out_total", "counter", "Bytes sent.")
+    for labels, session in sessions:
+        lines.append(f"rtmp_session_bytes_out_total{{{labels}}} {session.bytes_sent}")
+    metric("rtmp_session_messages_total", "counter", "Messages received by type.")
+    for labels, session in sessions:
+        for msg_type, count in enumerate(session.metrics.messages):
+            if count:
+                name = MESSAGE_TYPE_NAMES.get(msg_type, hex(msg_type))
+                lines.append(
+                    f'rtmp_session_messages_total{{{labels},type="{name}"}} {count}'
+                )
+    metric(
+        "rtmp_session_busy_seconds_total",
+        "counter",
+        "Time spent parsing and handling the session's input.",
+    )
+    for labels, session in sessions:
+        lines.append(
+            f"rtmp_session_busy_seconds_total{{{labels}}} "
+            f"{session.metrics.busy_seconds}"
+        )
+    metric(
+        "rtmp_session_unacknowledged_bytes",
+        "gauge",
+        "Bytes sent that the peer has not acknowledged yet.",
+    )
+    for labels, session in sessions:
+        lines.append(
+            f"rtmp_session_unacknowledged_bytes{{{labels}}} "
+            f"{session.unacknowledged_bytes()}"
+        )
+    metric(
+        "rtmp_session_partial_message_bytes",
+        "gauge",
+        "Bytes allocated for messages still being received.",
+    )
+    for labels, session in sessions:
+        lines.append(
+            f"rtmp_session_partial_message_bytes{{{labels}}} "
+            f"{session.demuxer.partial_bytes}"
+        )
+    metric("rtmp_session_write_buffer_bytes", "gauge", "Bytes the transport holds.")
+    for labels, session in sessions:
+        lines.append(
+            f"rtmp_session_write_buffer_bytes{{{labels}}} {write_buffer_size(session)}"
+        )
+
+    subscribers = [
+        (labels, session.subscriber)
+        for labels, session in sessions
+        if session.subscriber is not None
+    ]
+    metric("rtmp_subscriber_queue_bytes", "gauge", "Bytes queued for a player.")
+    for labels, subscriber in subscribers:
+        lines.append(
+            f"rtmp_subscriber_queue_bytes{{{labels}}} {subscriber.queued_bytes}"
+        )
+    metric("rtmp_subscriber_queue_messages", "gauge", "Messages queued for a player.")
+    for labels, subscriber in subscribers:
+        lines.append(
+            f"rtmp_subscriber_queue_messages{{{labels}}} {len(subscriber.queue)}"
+        )
+    metric("rtmp_subscriber_dropped_total", "counter", "Messages a player missed.")
+    for labels, subscriber in subscribers:
+        lines.append(
+            f"rtmp_subscriber_dropped_total{{{labels}}} {subscriber.dropped_messages}"
+        )
+
+    streams = [
+        (f'stream="{escape_label(stream_key)}"', stream.metrics)
+        for stream_key, stream in server.streams.items()
+        if stream.publisher is not None
+    ]
+    second = metrics.second
+    metric("rtmp_stream_subscribers", "gauge", "Players attached to the stream.")
+    for stream_key, stream in server.streams.items():
+        lines.append(
+            f'rtmp_stream_subscribers{{stream="{escape_label(stream_key)}"}} '
+            f"{len(stream.subscribers)}"
+        )
+    rates = []
+    for labels, stream_metrics in streams:
+        for span in RATE_SPANS:
+            fps, video_bytes = stream_metrics.video.rates(second, span)
+            audio_bytes = stream_metrics.audio.rates(second, span)[1]
+            window = f'{labels},window="{span}s"'
+            rates.append((window, fps, video_bytes * 8, audio_bytes * 8))
+    metric("rtmp_stream_video_fps", "gauge", "Video frames per second.")
+    for window, fps, _, _ in rates:
+        lines.append(f"rtmp_stream_video_fps{{{window}}} {fps}")
+    metric("rtmp_stream_video_bitrate", "gauge", "Video bits per second.")
+    for window, _, video_bits, _ in rates:
+        lines.append(f"rtmp_stream_video_bitrate{{{window}}} {video_bits}")
+    metric("rtmp_stream_audio_bitrate", "gauge", "Audio bits per second.")
+    for window, _, _, audio_bits in rates:
+        lines.append(f"rtmp_stream_audio_bitrate{{{window}}} {audio_bits}")
+    metric("rtmp_stream_keyframes_total", "counter", "Video keyframes received.")
+    for labels, stream_metrics in streams:
+        lines.append(
+            f"rtmp_stream_keyframes_total{{{labels}}} {stream_metrics.keyframes}"
+        )
+    metric(
+        "rtmp_stream_keyframe_interval_seconds",
+        "gauge",
+        "Media time between the last two keyframes.",
+    )
+    for labels, stream_metrics in streams:
+        lines.append(
+            f"rtmp_stream_keyframe_interval_seconds{{{labels}}} "
+            f"{stream_metrics.keyframe_interval / 1000}"
+        )
+
+    inspectors = [
+        (labels, stream_metrics.h264)
+        for labels, stream_metrics in streams
+        if stream_metrics.h264.config is not None
+    ]
+    metric(
+        "rtmp_stream_video_info",
+        "gauge",
+        "H.264 profile, level and coded size from the SPS (always 1).",
+    )
+    for labels, inspector in inspectors:
+        sps = inspector.config.sps
+        lines.append(
+            f'rtmp_stream_video_info{{{labels},profile="{sps.profile}",'
+            f'level="{sps.level}",width="{sps.width}",height="{sps.height}"}} 1'
+        )
+    metric("rtmp_stream_video_sps_fps", "gauge", "Frame rate the SPS declares.")
+    for labels, inspector in inspectors:
+        if inspector.config.sps.frame_rate is not None:
+            lines.append(
+                f"rtmp_stream_video_sps_fps{{{labels}}} "
+                f"{inspector.config.sps.frame_rate}"
+            )
+    metric(
+        "rtmp_stream_video_reorder_frames",
+        "gauge",
+        "Frames the SPS allows to be reordered (B-frame depth).",
+    )
+    for labels, inspector in inspectors:
+        if inspector.config.sps.reorder_frames is not None:
+            lines.append(
+                f"rtmp_stream_video_reorder_frames{{{labels}}} "
+                f"{inspector.config.sps.reorder_frames}"
+            )
+    metric(
+        "rtmp_stream_video_max_composition_offset_seconds",
+        "gauge",
+        "Largest composition time offset seen.",
+    )
+    for labels, inspector in inspectors:
+        lines.append(
+            f"rtmp_stream_video_max_composition_offset_seconds{{{labels}}} "
+            f"{inspector.max_composition_offset / 1000}"
+        )
+    metric(
+        "rtmp_stream_video_malformed_frames_total",
+        "counter",
+        "Frames whose NAL unit lengths overrun them.",
+    )
+    for labels, inspector in inspectors:
+        lines.append(
+            f"rtmp_stream_video_malformed_frames_total{{{labels}}} "
+            f"{inspector.malformed_frames}"
+        )
+    metric(
+        "rtmp_stream_video_keyframe_mismatches_total",
+        "counter",
+        "Frames whose keyframe flag disagrees with their IDR slices.",
+    )
+    for labels, inspector in inspectors:
+        lines.append(
+            f"rtmp_stream_video_keyframe_mismatches_total{{{labels}}} "
+            f"{inspector.keyframe_mismatches}"
+        )
+
+    timelines = [
+        (labels, stream_metrics.aac)
+        for labels, stream_metrics in streams
+        if stream_metrics.aac.config is not None
+    ]
+    metric(
+        "rtmp_stream_audio_info",
+        "gauge",
+        "AAC object type, sampling rate and channels from the sequence header "
+        "(always 1).",
+    )
+    for labels, timeline in timelines:
+        config = timeline.config
+        lines.append(
+            f'rtmp_stream_audio_info{{{labels},profile="{config.profile}",'
+            f'sample_rate="{config.sample_rate}",channels="{config.channels}"}} 1'
+        )
+    metric(
+        "rtmp_stream_audio_drift_seconds",
+        "gauge",
+        "Audio timestamp progression minus the duration of the frames received, "
+        "since the last gap.",
+    )
+    for labels, timeline in timelines:
+        lines.append(
+            f"rtmp_stream_audio_drift_seconds{{{labels}}} {timeline.drift / 1000}"
+        )
+    metric(
+        "rtmp_stream_audio_max_drift_seconds",
+        "gauge",
+        "Largest absolute audio drift seen.",
+    )
+    for labels, timeline in timelines:
+        lines.append(
+            f"rtmp_stream_audio_max_drift_seconds{{{labels}}} "
+            f"{timeline.max_drift / 1000}"
+        )
+    metric(
+        "rtmp_stream_audio_jitter_seconds",
+        "gauge",
+        "Smoothed deviation of audio timestamp steps from a frame's duration.",
+    )
+    for labels, timeline in timelines:
+        lines.append(
+            f"rtmp_stream_audio_jitter_seconds{{{labels}}} {timeline.jitter / 1000}"
+        )
+    metric(
+        "rtmp_stream_audio_gaps_total",
+        "counter",
+        "Audio timestamp steps longer than a frame and a half.",
+    )
+    for labels, timeline in timelines:
+        lines.append(f"rtmp_stream_audio_gaps_total{{{labels}}} {timeline.gaps}")
+    metric(
+        "rtmp_stream_audio_gap_seconds_total",
+        "counter",
+        "Audio missing in those gaps.",
+    )
+    for labels, timeline in timelines:
+        lines.append(
+            f"rtmp_stream_audio_gap_seconds_total{{{labels}}} "
+            f"{timeline.gap_time / 1000}"
+        )
+    metric(
+        "rtmp_stream_audio_discontinuities_total",
+        "counter",
+        "Audio timestamps stepping backwards.",
+    )
+    for labels, timeline in timelines:
+        lines.append(
+            f"rtmp_stream_audio_discontinuities_total{{{labels}}} "
+            f"{timeline.discontinuities}"
+        )
+    metric(
+        "rtmp_stream_av_offset_seconds",
+        "gauge",
+        "Smoothed audio timestamp minus the latest video timestamp on arrival.",
+    )
+    for labels, timeline in timelines:
+        if timeline.av_offset is not None:
+            lines.append(
+                f"rtmp_stream_av_offset_seconds{{{labels}}} "
+                f"{timeline.av_offset / 1000}"
+            )
+
+    lines.append("")
+    return "\n".join(lines)
+
+
+async def handle_http(server, reader, writer):
+    """Answers one HTTP request: GET /metrics, or 404."""
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (
+            b"\r\n",
+            b"\n",
+            b"",
+        ):
+            pass  # Headers are not needed
+
+        parts = request_line.split()
+        if (
+            len(parts) >= 2
+            and parts[0] == b"GET"
+            and parts[1].split(b"?")[0] == b"/metrics"
+        ):
+            status, body = "200 OK", render(server).encode()
+        else:
+            status, body = "404 Not Found", b"Not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError) as e:
+        logging.debug(f"Metrics request failed: {e}")
+    finally:
+        writer.close()
+
+
+async def start_http_server(server, host, port):
+    """Serves `render(server)` at http://host:port/metrics."""
+    http_server = await asyncio.start_server(
+        lambda reader, writer: handle_http(server, reader, writer), host, port
+    )
+    logging.info(f"Metrics endpoint on http://{host}:{port}/metrics")
+    return http_server
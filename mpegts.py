@@ -0,0 +1,230 @@
+import struct
+
+# MPEG-2 transport stream (ISO/IEC 13818-1), as HLS uses it: one program
+# with an H.264 and/or an ADTS AAC elementary stream
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+TS_PAYLOAD_SIZE = TS_PACKET_SIZE - 4
+
+PAT_PID = 0x0000
+PMT_PID = 0x1000
+VIDEO_PID = 0x0100
+AUDIO_PID = 0x0101
+PROGRAM_NUMBER = 1
+TRANSPORT_STREAM_ID = 1
+
+STREAM_TYPE_H264 = 0x1B
+STREAM_TYPE_AAC_ADTS = 0x0F
+PES_STREAM_ID_VIDEO = 0xE0
+PES_STREAM_ID_AUDIO = 0xC0
+
+# 90 kHz PTS/DTS/PCR clock
+CLOCK_RATE = 90000
+TIMESTAMP_MASK = (1 << 33) - 1
+
+_PID_FLAG_START = 0x4000  # payload_unit_start_indicator
+_AF_PAYLOAD_ONLY = 0x10
+_AF_ADAPTATION_AND_PAYLOAD = 0x30
+_AF_FLAG_RANDOM_ACCESS = 0x40
+_AF_FLAG_PCR = 0x10
+
+_PACKET_HEADER = struct.Struct(">BHB")
+
+
+def _crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else crc << 1
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+
+_CRC_TABLE = _crc_table()
+
+
+def crc32_mpeg2(data):
+    """CRC-32/MPEG-2 of a PSI section: non-reflected, no final XOR."""
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ _CRC_TABLE[(crc >> 24) ^ byte]
+    return crc
+
+
+def encode_timestamp(prefix, timestamp):
+    """A 33-bit PTS or DTS field with its 4-bit `prefix` and marker bits."""
+    timestamp &= TIMESTAMP_MASK
+    return bytes(
+        (
+            (prefix << 4) | ((timestamp >> 29) & 0x0E) | 1,
+            (timestamp >> 22) & 0xFF,
+            ((timestamp >> 14) & 0xFE) | 1,
+            (timestamp >> 7) & 0xFF,
+            ((timestamp << 1) & 0xFE) | 1,
+        )
+    )
+
+
+def encode_pcr(timestamp):
+    """A PCR field: 33-bit 90 kHz base, reserved bits, zero extension."""
+    base = timestamp & TIMESTAMP_MASK
+    return bytes(
+        (
+            (base >> 25) & 0xFF,
+            (base >> 17) & 0xFF,
+            (base >> 9) & 0xFF,
+            (base >> 1) & 0xFF,
+            ((base & 1) << 7) | 0x7E,
+            0,
+        )
+    )
+
+
+def pes_header(stream_id, pts, dts=None, payload_size=None):
+    """
+    A PES packet header. `payload_size` None leaves the packet length 0
+    (unbounded), as video PES packets over 64 KiB need.
+    """
+    if dts is None or dts == pts:
+        fields = encode_timestamp(0x2, pts)
+        flags = 0x80
+    else:
+        fields = encode_timestamp(0x3, pts) + encode_timestamp(0x1, dts)
+        flags = 0xC0
+    length = 0
+    if payload_size is not None:
+        length = 3 + len(fields) + payload_size
+        if length > 0xFFFF:
+            length = 0
+    return (
+        b"\x00\x00\x01"
+        + bytes((stream_id,))
+        + length.to_bytes(2, "big")
+        + bytes((0x80, flags, len(fields)))
+        + fields
+    )
+
+
+class TSMuxer:
+    """
+    Packetizes elementary stream frames into 188-byte TS packets.
+
+    Continuity counters run across calls, so one muxer serves a whole
+    stream; `write_tables` starts each segment with the PAT and PMT. The
+    PCR rides on the video PID if there is video, else on the audio PID.
+    """
+
+    def __init__(self, has_video, has_audio):
+        self.has_video = has_video
+        self.has_audio = has_audio
+        self.pcr_pid = VIDEO_PID if has_video else AUDIO_PID
+        self.continuity = {}
+        self.pat = self.section_packet(PAT_PID, self.pat_section())
+        self.pmt = self.section_packet(PMT_PID, self.pmt_section())
+
+    def next_continuity(self, pid):
+        counter = self.continuity.get(pid, -1) + 1 & 0x0F
+        self.continuity[pid] = counter
+        return counter
+
+    def pat_section(self):
+        body = struct.pack(
+            ">HBBBHH",
+            TRANSPORT_STREAM_ID,
+            0xC1,  # Version 0, current
+            0,
+            0,
+            PROGRAM_NUMBER,
+            0xE000 | PMT_PID,
+        )
+        return self.section(0x00, body)
+
+    def pmt_section(self):
+        body = struct.pack(
+            ">HBBBHH", PROGRAM_NUMBER, 0xC1, 0, 0, 0xE000 | self.pcr_pid, 0xF000
+        )
+        if self.has_video:
+            body += struct.pack(">BHH", STREAM_TYPE_H264, 0xE000 | VIDEO_PID, 0xF000)
+        if self.has_audio:
+            body += struct.pack(
+                ">BHH", STREAM_TYPE_AAC_ADTS, 0xE000 | AUDIO_PID, 0xF000
+            )
+        return self.section(0x02, body)
+
+    def section(self, table_id, body):
+        """A PSI section: header, `body`, CRC."""
+        # Section length counts the body and the CRC; syntax indicator set
+        header = struct.pack(">BH", table_id, 0xB000 | (len(body) + 4))
+        section = header + body
+        return section + crc32_mpeg2(section).to_bytes(4, "big")
+
+    def section_packet(self, pid, section):
+        """One packet: pointer field, the section, 0xFF stuffing."""
+        payload = b"\x00" + section
+        return (
+            _PACKET_HEADER.pack(TS_SYNC_BYTE, _PID_FLAG_START | pid, _AF_PAYLOAD_ONLY)
+            + payload
+            + b"\xff" * (TS_PAYLOAD_SIZE - len(payload))
+        )
+
+    def write_tables(self, out):
+        """Appends the PAT and PMT, with their continuity counters, to `out`."""
+        for pid, packet in ((PAT_PID, self.pat), (PMT_PID, self.pmt)):
+            out += packet[:3]
+            out.append(packet[3] | self.next_continuity(pid))
+            out += packet[4:]
+
+    def write_pes(self, out, pid, pes, pcr=None, random_access=False):
+        """
+        Splits one PES packet (header and payload, a bytes-like) into TS
+        packets appended to `out`. The first packet carries the PCR and
+        random access flag, if given; the last is padded through its
+        adaptation field.
+        """
+        view = memoryview(pes)
+        pos = 0
+        end = len(view)
+        first = True
+        while pos < end:
+            header_pid = pid | _PID_FLAG_START if first else pid
+            adaptation = b""
+            if first and (pcr is not None or random_access):
+                flags = (_AF_FLAG_PCR if pcr is not None else 0) | (
+                    _AF_FLAG_RANDOM_ACCESS if random_access else 0
+                )
+                fields = bytes((flags,)) + (encode_pcr(pcr) if pcr is not None else b"")
+                adaptation = bytes((len(fields),)) + fields
+            size = min(end - pos, TS_PAYLOAD_SIZE - len(adaptation))
+            stuffing = TS_PAYLOAD_SIZE - len(adaptation) - size
+            if stuffing:
+                if adaptation:
+                    adaptation = (
+                        bytes((adaptation[0] + stuffing,))
+                        + adaptation[1:]
+                        + b"\xff" * stuffing
+                    )
+                elif stuffing == 1:
+                    adaptation = b"\x00"  # Adaptation field of length 0
+                else:
+                    adaptation = bytes((stuffing - 1, 0)) + b"\xff" * (stuffing - 2)
+            control = _AF_ADAPTATION_AND_PAYLOAD if adaptation else _AF_PAYLOAD_ONLY
+            out += _PACKET_HEADER.pack(
+                TS_SYNC_BYTE, header_pid, control | self.next_continuity(pid)
+            )
+            out += adaptation
+            out += view[pos : pos + size]
+            pos += size
+            first = False
+
+    def write_video(self, out, dts, pts, frame, keyframe):
+        """Appends one Annex-B access unit (90 kHz `dts`/`pts`) to `out`."""
+        pcr = dts if self.pcr_pid == VIDEO_PID else None
+        pes = pes_header(PES_STREAM_ID_VIDEO, pts, dts) + frame
+        self.write_pes(out, VIDEO_PID, pes, pcr, random_access=keyframe)
+
+    def write_audio(self, out, pts, frame):
+        """Appends ADTS frames (90 kHz `pts`) as one PES packet to `out`."""
+        pcr = pts if self.pcr_pid == AUDIO_PID else None
+        pes = pes_header(PES_STREAM_ID_AUDIO, pts, payload_size=len(frame)) + frame
+        self.write_pes(out, AUDIO_PID, pes, pcr, random_access=pcr is not None)
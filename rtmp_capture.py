@@ -0,0 +1,139 @@
+import itertools
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+
+# Capture file: magic, then one record per socket read: seconds since the
+# connection was accepted (float64), byte count, then the bytes as received
+CAPTURE_MAGIC = b"RTMPCAP\x01"
+CAPTURE_SUFFIX = ".rtmpcap"
+_RECORD = struct.Struct(">dI")
+
+_OPEN, _WRITE, _CLOSE, _STOP = range(4)
+
+
+class SessionCapture:
+    """
+    Records the raw inbound bytes of one connection.
+
+    `write` copies the data and queues it for the CaptureWriter's thread, so
+    the event loop never touches the disk. If that thread falls behind by
+    more than the writer's `max_queued_bytes`, the capture is cut short
+    (with a warning) rather than letting the backlog grow.
+    """
+
+    __slots__ = ("writer", "path", "started", "dropped")
+
+    def __init__(self, writer, path, started):
+        self.writer = writer
+        self.path = path
+        self.started = started
+        self.dropped = False
+
+    def write(self, data):
+        if self.dropped:
+            return
+        writer = self.writer
+        if writer.queued_bytes - writer.written_bytes > writer.max_queued_bytes:
+            logging.warning(f"Capture {self.path} falling behind, truncating it.")
+            self.close()
+            return
+        writer.queued_bytes += len(data)
+        writer.queue.put((_WRITE, self, (time.monotonic() - self.started, bytes(data))))
+
+    def close(self):
+        if not self.dropped:
+            self.dropped = True
+            self.writer.queue.put((_CLOSE, self, None))
+
+
+class CaptureWriter:
+    """Writes every session's capture file from one background thread."""
+
+    def __init__(self, directory, max_queued_bytes):
+        self.directory = directory
+        self.max_queued_bytes = max_queued_bytes
+        # Each counter is only updated by one thread: their difference is the
+        # backlog without a lock
+        self.queued_bytes = 0
+        self.written_bytes = 0
+        self.queue = queue.SimpleQueue()
+        self.capture_ids = itertools.count(1)
+        self.thread = threading.Thread(
+            target=self.run, name="rtmp-capture", daemon=True
+        )
+        os.makedirs(directory, exist_ok=True)
+        self.thread.start()
+
+    def open(self, peer, started=None):
+        """Starts a capture for a connection from `peer` accepted at `started`."""
+        host, port = peer[:2] if peer else ("unknown", 0)
+        name = (
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-"
+            f"{next(self.capture_ids)}-{host}_{port}{CAPTURE_SUFFIX}"
+        )
+        capture = SessionCapture(
+            self, os.path.join(self.directory, name), started or time.monotonic()
+        )
+        self.queue.put((_OPEN, capture, None))
+        return capture
+
+    def close(self):
+        """Writes out everything queued, then stops the thread."""
+        self.queue.put((_STOP, None, None))
+        self.thread.join()
+
+    def run(self):
+        files = {}
+        while True:
+            op, capture, item = self.queue.get()
+            try:
+                if op == _WRITE:
+                    f = files.get(capture)
+                    offset, data = item
+                    if f is not None:
+                        f.write(_RECORD.pack(offset, len(data)))
+                        f.write(data)
+                    self.written_bytes += len(data)
+                elif op == _OPEN:
+                    f = files[capture] = open(capture.path, "wb")
+                    f.write(CAPTURE_MAGIC)
+                elif op == _CLOSE:
+                    f = files.pop(capture, None)
+                    if f is not None:
+                        f.close()
+                else:
+                    for f in files.values():
+                        f.close()
+                    return
+            except OSError as e:
+                logging.error(f"❌ Capture {capture.path} failed: {e}")
+                f = files.pop(capture, None)
+                if f is not None:
+                    f.close()
+
+
+def read_capture(path):
+    """Returns a capture's records as a list of `(seconds, bytes)`."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(CAPTURE_MAGIC):
+        raise ValueError(f"{path} is not an RTMP capture")
+    records = []
+    pos = len(CAPTURE_MAGIC)
+    while pos + _RECORD.size <= len(data):
+        offset, length = _RECORD.unpack_from(data, pos)
+        pos += _RECORD.size
+        if pos + length > len(data):
+            break  # Cut off mid-record, e.g. by a crash
+        records.append((offset, data[pos : pos + length]))
+        pos += length
+    return records
+
+
+def is_capture(path):
+    with open(path, "rb") as f:
+        return f.read(len(CAPTURE_MAGIC)) == CAPTURE_MAGIC
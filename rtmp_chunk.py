@@ -0,0 +1,484 @@
+import logging
+import struct
+
+# Default RTMP Chunk Size (modifiable by either peer)
+DEFAULT_CHUNK_SIZE = 128
+MIN_CHUNK_SIZE = 1
+MAX_CHUNK_SIZE = 65536
+
+# Chunk Basic Header formats
+CHUNK_FORMAT_FULL_HEADER = 0
+CHUNK_FORMAT_TIMESTAMP_ONLY = 1
+CHUNK_FORMAT_NO_STREAM_ID = 2
+CHUNK_FORMAT_NO_HEADER = 3
+
+# Chunk Stream ID escape values in the basic header
+CHUNK_STREAM_ID_2_BYTE = 0
+CHUNK_STREAM_ID_3_BYTE = 1
+
+# Message header size for each chunk format (0, 1, 2, 3)
+MESSAGE_HEADER_SIZES = (11, 7, 3, 0)
+
+# Timestamps at or above this value are carried in the Extended Timestamp field
+EXTENDED_TIMESTAMP = 0xFFFFFF
+
+RTMP_MSG_TYPE_SET_CHUNK_SIZE = 0x01
+RTMP_MSG_TYPE_ABORT = 0x02
+
+_UINT32_BE = struct.Struct(">I")
+_UINT32_LE = struct.Struct("<I")
+
+
+class ChunkProtocolError(ValueError):
+    """Raised when a peer's chunk stream breaks a limit or the protocol."""
+
+
+class RTMPMessage:
+    """A fully reassembled RTMP message."""
+
+    __slots__ = ("csid", "msg_type", "stream_id", "timestamp", "payload")
+
+    def __init__(self, csid, msg_type, stream_id, timestamp, payload):
+        self.csid = csid
+        self.msg_type = msg_type
+        self.stream_id = stream_id
+        self.timestamp = timestamp
+        self.payload = payload
+
+    def __repr__(self):
+        return (
+            f"RTMPMessage(csid={self.csid}, type={hex(self.msg_type)}, "
+            f"stream_id={self.stream_id}, timestamp={self.timestamp}, "
+            f"size={len(self.payload)})"
+        )
+
+
+class ChunkStreamState:
+    """Header state and partial message buffer for a single chunk stream ID."""
+
+    __slots__ = (
+        "timestamp",
+        "ts_field",
+        "length",
+        "msg_type",
+        "stream_id",
+        "extended",
+        "payload",
+        "view",
+        "received",
+    )
+
+    def __init__(self):
+        self.timestamp = 0  # Absolute timestamp of the current/last message
+        self.ts_field = 0  # Timestamp or delta carried by the last header
+        self.length = 0
+        self.msg_type = 0
+        self.stream_id = 0
+        self.extended = False  # Last header used an Extended Timestamp
+        self.payload = None  # Preallocated bytearray of the message in progress
+        self.view = None  # Writable memoryview over `payload`
+        self.received = 0  # Bytes of the message in progress received so far
+
+
+class ChunkDemuxer:
+    """
+    Reassembles RTMP messages from a chunked byte stream.
+
+    Keeps one header/buffer slot per chunk stream ID so interleaved audio,
+    video and command chunk streams are assembled independently. Each message
+    is copied exactly once, into a bytearray preallocated from the message
+    length. The demuxer never does I/O: callers hand it whatever bytes they
+    have and it reports how many it consumed.
+
+    If `header_log` is given (typically a bounded deque), every parsed chunk
+    header is appended to it as `(fmt, csid, timestamp, length, msg_type,
+    stream_id, chunk payload size)` for post-mortem tracing.
+
+    Set Chunk Size and Abort messages take effect before the next chunk is
+    parsed, since both change how the rest of the buffer is read; they are
+    still returned to the caller like any other message.
+
+    A message's buffer is allocated from the length its first header
+    announces, before its data arrives, so the demuxer bounds what a peer
+    can make it hold: messages longer than `max_message_size`, more than
+    `max_partial_messages` messages in progress at once, or more than
+    `max_partial_bytes` allocated for them raise ChunkProtocolError. The
+    bytes allocated for messages in progress are charged to `budget` (a
+    MemoryBudget), if given, until the message completes or is discarded.
+    """
+
+    def __init__(
+        self,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        header_log=None,
+        max_message_size=None,
+        max_partial_messages=None,
+        max_partial_bytes=None,
+        budget=None,
+    ):
+        self.chunk_size = chunk_size
+        self.chunk_streams = {}
+        self.header_log = header_log
+        self.max_message_size = max_message_size
+        self.max_partial_messages = max_partial_messages
+        self.max_partial_bytes = max_partial_bytes
+        self.budget = budget
+        self.partial_messages = 0  # Messages allocated but not yet complete
+        self.partial_bytes = 0  # Bytes allocated for them
+
+    def parse(self, data):
+        """
+        Parses every complete chunk in `data`.
+
+        Returns `(consumed, messages)` where `consumed` is the number of bytes
+        that were fully processed; the caller must keep the remaining bytes
+        and pass them again, followed by new data, on the next call.
+        """
+        messages = []
+        chunk_streams = self.chunk_streams
+        header_log = self.header_log
+
+        with memoryview(data) as view:
+            end = len(view)
+            pos = 0
+
+            while pos < end:
+                start = pos
+
+                # Basic Header (1-3 bytes)
+                first = view[pos]
+                chunk_format = first >> 6
+                csid = first & 0x3F
+                pos += 1
+
+                if csid == CHUNK_STREAM_ID_2_BYTE:
+                    if pos + 1 > end:
+                        pos = start
+                        break
+                    csid = 64 + view[pos]
+                    pos += 1
+                elif csid == CHUNK_STREAM_ID_3_BYTE:
+                    if pos + 2 > end:
+                        pos = start
+                        break
+                    csid = 64 + view[pos] + (view[pos + 1] << 8)
+                    pos += 2
+
+                header_size = MESSAGE_HEADER_SIZES[chunk_format]
+                if pos + header_size > end:
+                    pos = start
+                    break
+
+                state = chunk_streams.get(csid)
+                if state is None:
+                    state = chunk_streams[csid] = ChunkStreamState()
+
+                # Message Header (0, 3, 7 or 11 bytes). The 24-bit fields are
+                # read as the low bytes of a 32-bit word ending on the field.
+                length = state.length
+                msg_type = state.msg_type
+                stream_id = state.stream_id
+                if chunk_format == CHUNK_FORMAT_NO_HEADER:
+                    ts_field = state.ts_field
+                    extended = state.extended
+                else:
+                    ts_field = _UINT32_BE.unpack_from(view, pos - 1)[0] & 0xFFFFFF
+                    if chunk_format <= CHUNK_FORMAT_TIMESTAMP_ONLY:
+                        length = _UINT32_BE.unpack_from(view, pos + 2)[0] & 0xFFFFFF
+                        msg_type = view[pos + 6]
+                        if chunk_format == CHUNK_FORMAT_FULL_HEADER:
+                            stream_id = _UINT32_LE.unpack_from(view, pos + 7)[0]
+                    extended = ts_field == EXTENDED_TIMESTAMP
+                pos += header_size
+
+                # Extended Timestamp (0 or 4 bytes), repeated on type 3 chunks
+                if extended:
+                    if pos + 4 > end:
+                        pos = start
+                        break
+                    if chunk_format != CHUNK_FORMAT_NO_HEADER:
+                        ts_field = _UINT32_BE.unpack_from(view, pos)[0]
+                    pos += 4
+
+                new_message = chunk_format != CHUNK_FORMAT_NO_HEADER or (
+                    state.payload is None
+                )
+                received = 0 if new_message else state.received
+                size = min(self.chunk_size, length - received)
+                if pos + size > end:
+                    pos = start
+                    break
+
+                # The whole chunk is available; commit the header state.
+                if new_message:
+                    if state.payload is not None:
+                        logging.warning(
+                            "Chunk stream %d: new header before message completed "
+                            "(%d/%d bytes), discarding partial message.",
+                            csid,
+                            state.received,
+                            state.length,
+                        )
+                        self.discard_partial(state)
+                    if length > size:
+                        # Spans chunks: held as a partial message until complete
+                        self.reserve_partial(csid, length)
+                    if chunk_format == CHUNK_FORMAT_FULL_HEADER:
+                        timestamp = ts_field
+                    else:
+                        timestamp = (state.timestamp + ts_field) & 0xFFFFFFFF
+                    state.timestamp = timestamp
+                    state.ts_field = ts_field
+                    state.length = length
+                    state.msg_type = msg_type
+                    state.stream_id = stream_id
+                    state.extended = extended
+                    state.payload = bytearray(length)
+                    state.view = memoryview(state.payload)
+                    state.received = 0
+
+                if header_log is not None:
+                    header_log.append(
+                        (
+                            chunk_format,
+                            csid,
+                            state.timestamp,
+                            length,
+                            msg_type,
+                            stream_id,
+                            size,
+                        )
+                    )
+
+                if size:
+                    state.view[received : received + size] = view[pos : pos + size]
+                    pos += size
+                    received += size
+                state.received = received
+
+                if received < length:
+                    continue
+
+                # Message complete
+                payload = state.payload
+                state.view.release()
+                state.payload = None
+                state.view = None
+                state.received = 0
+                if length > size:
+                    self.release_partial(length)
+
+                if msg_type == RTMP_MSG_TYPE_SET_CHUNK_SIZE:
+                    # Must apply before parsing the next chunk in this buffer
+                    self.apply_set_chunk_size(payload)
+                elif msg_type == RTMP_MSG_TYPE_ABORT:
+                    self.apply_abort(payload)
+
+                messages.append(
+                    RTMPMessage(csid, msg_type, stream_id, state.timestamp, payload)
+                )
+
+        return pos, messages
+
+    def apply_set_chunk_size(self, payload):
+        """Updates the inbound chunk size from a Set Chunk Size payload."""
+        if len(payload) < 4:
+            logging.warning("Invalid Set Chunk Size message received.")
+            return
+
+        new_chunk_size = _UINT32_BE.unpack_from(payload)[0] & 0x7FFFFFFF
+        if MIN_CHUNK_SIZE <= new_chunk_size <= MAX_CHUNK_SIZE:
+            self.chunk_size = new_chunk_size
+        else:
+            logging.warning("Invalid chunk size: %d", new_chunk_size)
+
+    def apply_abort(self, payload):
+        """Discards the partial message of the chunk stream an Abort names."""
+        if len(payload) < 4:
+            logging.warning("Invalid Abort message received.")
+            return
+
+        csid = _UINT32_BE.unpack_from(payload)[0]
+        state = self.chunk_streams.get(csid)
+        if state is not None and state.payload is not None:
+            logging.info(
+                "Chunk stream %d aborted (%d/%d bytes), discarding partial message.",
+                csid,
+                state.received,
+                state.length,
+            )
+            self.discard_partial(state)
+
+    def reserve_partial(self, csid, length):
+        """Accounts for a new message in progress; raises if over a limit."""
+        if self.max_message_size is not None and length > self.max_message_size:
+            raise ChunkProtocolError(
+                f"Chunk stream {csid}: message of {length} bytes exceeds "
+                f"the {self.max_message_size} byte limit"
+            )
+        if (
+            self.max_partial_messages is not None
+            and self.partial_messages >= self.max_partial_messages
+        ):
+            raise ChunkProtocolError(
+                f"Too many partially received messages ({self.partial_messages})"
+            )
+        if (
+            self.max_partial_bytes is not None
+            and self.partial_bytes + length > self.max_partial_bytes
+        ):
+            raise ChunkProtocolError(
+                f"Partially received messages would hold "
+                f"{self.partial_bytes + length} bytes, over the "
+                f"{self.max_partial_bytes} byte limit"
+            )
+        self.partial_messages += 1
+        self.partial_bytes += length
+        if self.budget is not None:
+            self.budget.charge(length)
+
+    def release_partial(self, length):
+        self.partial_messages -= 1
+        self.partial_bytes -= length
+        if self.budget is not None:
+            self.budget.release(length)
+
+    def discard_partial(self, state):
+        """Drops a chunk stream's message in progress."""
+        state.view.release()
+        state.payload = None
+        state.view = None
+        state.received = 0
+        self.release_partial(state.length)
+
+    def close(self):
+        """Drops every message in progress, releasing their memory."""
+        for state in self.chunk_streams.values():
+            if state.payload is not None:
+                self.discard_partial(state)
+
+
+class OutboundChunkStreamState:
+    """Header of the last message sent on a chunk stream ID."""
+
+    __slots__ = ("timestamp", "ts_field", "length", "msg_type", "stream_id", "delta")
+
+    def __init__(self, timestamp, ts_field, length, msg_type, stream_id, delta):
+        self.timestamp = timestamp
+        self.ts_field = ts_field
+        self.length = length
+        self.msg_type = msg_type
+        self.stream_id = stream_id
+        self.delta = delta  # `ts_field` is a delta (fmt 1/2), not absolute (fmt 0)
+
+
+def encode_basic_header(chunk_format, csid):
+    """Encodes a 1-3 byte Chunk Basic Header."""
+    if csid < 64:
+        return bytes(((chunk_format << 6) | csid,))
+    if csid < 320:
+        return bytes((chunk_format << 6, csid - 64))
+    csid -= 64
+    return bytes(((chunk_format << 6) | 1, csid & 0xFF, csid >> 8))
+
+
+class ChunkMuxer:
+    """
+    Splits outbound RTMP messages into chunks at the negotiated chunk size.
+
+    Picks the smallest header (fmt 0-3) the previous message on the same chunk
+    stream allows, and returns the chunks as a list of header bytes and
+    memoryview slices of the caller's payload, ready for `writelines`. The
+    payload is never copied, so it must not be mutated after muxing.
+    `bytes_out` counts the chunk bytes (headers included) muxed so far.
+    """
+
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.chunk_streams = {}
+        self._continuation_headers = {}
+        self.bytes_out = 0
+
+    def mux(self, csid, msg_type, stream_id, timestamp, payload):
+        """Returns the chunks of one message as a list of bytes-like objects."""
+        length = len(payload)
+        timestamp &= 0xFFFFFFFF
+        state = self.chunk_streams.get(csid)
+
+        if state is None or state.stream_id != stream_id or timestamp < state.timestamp:
+            chunk_format = CHUNK_FORMAT_FULL_HEADER
+            ts_field = timestamp
+        else:
+            ts_field = timestamp - state.timestamp
+            if state.length != length or state.msg_type != msg_type:
+                chunk_format = CHUNK_FORMAT_TIMESTAMP_ONLY
+            elif not state.delta or state.ts_field != ts_field:
+                chunk_format = CHUNK_FORMAT_NO_STREAM_ID
+            else:
+                chunk_format = CHUNK_FORMAT_NO_HEADER
+
+        extended = ts_field >= EXTENDED_TIMESTAMP
+        header = bytearray(encode_basic_header(chunk_format, csid))
+        if chunk_format != CHUNK_FORMAT_NO_HEADER:
+            header += min(ts_field, EXTENDED_TIMESTAMP).to_bytes(3, "big")
+            if chunk_format <= CHUNK_FORMAT_TIMESTAMP_ONLY:
+                header += length.to_bytes(3, "big")
+                header.append(msg_type)
+                if chunk_format == CHUNK_FORMAT_FULL_HEADER:
+                    header += _UINT32_LE.pack(stream_id)
+        if extended:
+            header += _UINT32_BE.pack(ts_field)
+
+        if state is None:
+            self.chunk_streams[csid] = OutboundChunkStreamState(
+                timestamp,
+                ts_field,
+                length,
+                msg_type,
+                stream_id,
+                chunk_format != CHUNK_FORMAT_FULL_HEADER,
+            )
+        else:
+            state.timestamp = timestamp
+            state.ts_field = ts_field
+            state.length = length
+            state.msg_type = msg_type
+            state.stream_id = stream_id
+            state.delta = chunk_format != CHUNK_FORMAT_FULL_HEADER
+
+        chunk_size = self.chunk_size
+        if length <= chunk_size:
+            chunks = [header, payload]
+            self.bytes_out += len(header) + length
+        else:
+            continuation = self.continuation_header(
+                csid, ts_field if extended else None
+            )
+            view = memoryview(payload)
+            chunks = [header, view[:chunk_size]]
+            for offset in range(chunk_size, length, chunk_size):
+                chunks.append(continuation)
+                chunks.append(view[offset : offset + chunk_size])
+            self.bytes_out += (
+                len(header) + length + (len(chunks) // 2 - 1) * len(continuation)
+            )
+
+        if msg_type == RTMP_MSG_TYPE_SET_CHUNK_SIZE and length >= 4:
+            # Applies to every message after this one
+            self.chunk_size = _UINT32_BE.unpack_from(payload)[0] & 0x7FFFFFFF
+
+        return chunks
+
+    def continuation_header(self, csid, extended_timestamp=None):
+        """Returns the (cached) fmt 3 header for continuation chunks."""
+        if extended_timestamp is not None:
+            return encode_basic_header(CHUNK_FORMAT_NO_HEADER, csid) + _UINT32_BE.pack(
+                extended_timestamp
+            )
+
+        header = self._continuation_headers.get(csid)
+        if header is None:
+            header = self._continuation_headers[csid] = encode_basic_header(
+                CHUNK_FORMAT_NO_HEADER, csid
+            )
+        return header
@@ -0,0 +1,151 @@
+import asyncio
+import struct
+
+import amf0
+from rtmp_chunk import ChunkDemuxer, ChunkMuxer
+from rtmp_handshake import generate_c1, generate_c2, verify_digest_response
+
+RTMP_VERSION = 3
+RTMP_HANDSHAKE_SIZE = 1536
+
+RTMP_MSG_TYPE_SET_CHUNK_SIZE = 0x01
+RTMP_MSG_TYPE_WINDOW_ACK_SIZE = 0x05
+RTMP_MSG_TYPE_AUDIO = 0x08
+RTMP_MSG_TYPE_VIDEO = 0x09
+RTMP_MSG_TYPE_DATA = 0x12
+RTMP_MSG_TYPE_COMMAND = 0x14
+
+CSID_PROTOCOL_CONTROL = 2
+CSID_COMMAND = 3
+CSID_AUDIO = 4
+CSID_VIDEO = 6
+
+READ_BUFFER_SIZE = 65536
+
+
+class RTMPClient:
+    """
+    Minimal asyncio RTMP client, enough to publish and play against this server.
+
+    Used by the benchmarks; it speaks the simple handshake, or the digest
+    one with `open(..., digest=True)`, and decodes only the command messages
+    it waits for.
+    """
+
+    def __init__(self):
+        self.reader = None
+        self.writer = None
+        self.muxer = ChunkMuxer()
+        self.demuxer = ChunkDemuxer()
+        self.buffer = bytearray()
+        self.messages = []
+        self.transaction_id = 0
+
+    async def open(self, host, port, digest=False):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        c1 = generate_c1(digest)
+        self.writer.write(bytes((RTMP_VERSION,)) + c1)
+        s0s1s2 = await self.reader.readexactly(1 + 2 * RTMP_HANDSHAKE_SIZE)
+        s1 = s0s1s2[1 : 1 + RTMP_HANDSHAKE_SIZE]
+        if digest:
+            if not verify_digest_response(c1, s1, s0s1s2[1 + RTMP_HANDSHAKE_SIZE :]):
+                raise ConnectionError(
+                    "Server didn't answer with a valid digest handshake"
+                )
+            self.writer.write(generate_c2(s1))
+        else:
+            self.writer.write(s1)  # C2 echoes S1
+        await self.writer.drain()
+
+    def send_message(self, csid, msg_type, stream_id, timestamp, payload):
+        self.writer.writelines(
+            self.muxer.mux(csid, msg_type, stream_id, timestamp, payload)
+        )
+
+    def set_chunk_size(self, size):
+        self.send_message(
+            CSID_PROTOCOL_CONTROL,
+            RTMP_MSG_TYPE_SET_CHUNK_SIZE,
+            0,
+            0,
+            struct.pack(">I", size),
+        )
+
+    def send_command(self, name, *args, stream_id=0):
+        """Sends an AMF0 command with the next transaction ID; returns that ID."""
+        self.transaction_id += 1
+        payload = amf0.encode(name, float(self.transaction_id), *args)
+        self.send_message(CSID_COMMAND, RTMP_MSG_TYPE_COMMAND, stream_id, 0, payload)
+        return self.transaction_id
+
+    async def read_message(self):
+        """Returns the next message from the server."""
+        while not self.messages:
+            data = await self.reader.read(READ_BUFFER_SIZE)
+            if not data:
+                raise ConnectionResetError("Server closed the connection")
+            self.buffer += data
+            consumed, messages = self.demuxer.parse(self.buffer)
+            del self.buffer[:consumed]
+            self.messages.extend(messages)
+        return self.messages.pop(0)
+
+    async def wait_command(self, predicate):
+        """Reads until a command whose decoded values satisfy `predicate`."""
+        while True:
+            message = await self.read_message()
+            if message.msg_type != RTMP_MSG_TYPE_COMMAND:
+                continue
+            try:
+                values = amf0.decode_all(message.payload)
+            except amf0.AMF0DecodeError:
+                continue  # Not a command this client understands
+            if predicate(values):
+                return values
+
+    async def wait_result(self, transaction_id):
+        return await self.wait_command(
+            lambda values: values[0] == "_result" and values[1] == transaction_id
+        )
+
+    async def wait_status(self, code):
+        return await self.wait_command(
+            lambda values: values[0] == "onStatus"
+            and any(isinstance(v, dict) and v.get("code") == code for v in values)
+        )
+
+    async def connect(self, app, tc_url):
+        transaction_id = self.send_command(
+            "connect",
+            {"app": app, "type": "nonprivate", "flashVer": "FMLE/3.0", "tcUrl": tc_url},
+        )
+        await self.writer.drain()
+        await self.wait_result(transaction_id)
+
+    async def publish(self, stream_key):
+        """FFmpeg's publish sequence: returns the message stream ID once publishing."""
+        self.send_command("releaseStream", None, stream_key)
+        self.send_command("FCPublish", None, stream_key)
+        transaction_id = self.send_command("createStream", None)
+        await self.writer.drain()
+        stream_id = int((await self.wait_result(transaction_id))[3])
+        self.send_command("publish", None, stream_key, "live", stream_id=stream_id)
+        await self.writer.drain()
+        await self.wait_status("NetStream.Publish.Start")
+        return stream_id
+
+    async def play(self, stream_key):
+        transaction_id = self.send_command("createStream", None)
+        await self.writer.drain()
+        stream_id = int((await self.wait_result(transaction_id))[3])
+        self.send_command("play", None, stream_key, stream_id=stream_id)
+        await self.writer.drain()
+        await self.wait_status("NetStream.Play.Start")
+        return stream_id
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
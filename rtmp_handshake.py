@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+import hmac
+import os
+
+RTMP_VERSION = 3
+RTMP_HANDSHAKE_SIZE = 1536
+# S1: 4-byte time, 4 zero bytes, then random data
+S1_HEADER = bytes(8)
+S1_RANDOM_SIZE = RTMP_HANDSHAKE_SIZE - len(S1_HEADER)
+
+# FP9 digest ("complex") handshake. C1 and S1 carry a version in bytes 4-7
+# and an HMAC-SHA256 digest of the rest of the packet at an offset picked by
+# 4 bytes at the scheme's base: 8 (scheme 0) or 772 (scheme 1). C1 is signed
+# with the text part of the Flash Player key, S1 with that of the FMS key;
+# S2 ends with a digest of its random part keyed by an HMAC of C1's digest
+# under the full FMS key.
+_KEY_SUFFIX = bytes.fromhex(
+    "f0eec24a8068bee82e00d0d1029e7e576eec5d2d29806fab93b8e636cfeb31ae"
+)
+GENUINE_FMS_KEY = b"Genuine Adobe Flash Media Server 001" + _KEY_SUFFIX
+GENUINE_FP_KEY = b"Genuine Adobe Flash Player 001" + _KEY_SUFFIX
+DIGEST_SIZE = 32
+DIGEST_SCHEME_BASES = (8, 772)
+DIGEST_OFFSET_MODULO = 728
+S1_DIGEST_VERSION = bytes((4, 5, 0, 1))  # FMS 4.5.0.1
+C1_DIGEST_VERSION = bytes((9, 0, 124, 2))  # Flash Player 9.0.124.2
+S2_RANDOM_SIZE = RTMP_HANDSHAKE_SIZE - DIGEST_SIZE
+
+# Keyed HMAC states, computed once and copied per digest: copying skips
+# hashing the key pads again
+FP_DIGEST = hmac.new(GENUINE_FP_KEY[:30], digestmod=hashlib.sha256)
+FMS_DIGEST = hmac.new(GENUINE_FMS_KEY[:36], digestmod=hashlib.sha256)
+FP_RESPONSE_KEY = hmac.new(GENUINE_FP_KEY, digestmod=hashlib.sha256)
+FMS_RESPONSE_KEY = hmac.new(GENUINE_FMS_KEY, digestmod=hashlib.sha256)
+
+_S0 = bytes((RTMP_VERSION,))
+
+
+def generate_s1_blobs(count):
+    """`count` S1 packets with a zero timestamp and a random payload."""
+    data = os.urandom(count * S1_RANDOM_SIZE)
+    return [
+        S1_HEADER + data[offset : offset + S1_RANDOM_SIZE]
+        for offset in range(0, len(data), S1_RANDOM_SIZE)
+    ]
+
+
+class S1Pool:
+    """
+    Pre-generated S1 packets, so a handshake doesn't pay for os.urandom.
+
+    Once half the pool is used, it is refilled by a thread of the event
+    loop's default executor. A handshake that finds the pool empty (a
+    connection storm outrunning the refill) generates its S1 inline and
+    counts a miss.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.blobs = generate_s1_blobs(size)
+        self.refilling = False
+        self.misses = 0
+
+    def take(self):
+        if self.blobs:
+            blob = self.blobs.pop()
+        else:
+            self.misses += 1
+            blob = generate_s1_blobs(1)[0]
+        if not self.refilling and len(self.blobs) < self.size // 2:
+            self.refill()
+        return blob
+
+    def refill(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:  # Outside the event loop: nothing to block
+            self.blobs.extend(generate_s1_blobs(self.size - len(self.blobs)))
+            return
+        self.refilling = True
+        future = loop.run_in_executor(
+            None, generate_s1_blobs, self.size - len(self.blobs)
+        )
+        future.add_done_callback(self.refilled)
+
+    def refilled(self, future):
+        self.refilling = False
+        if not future.cancelled() and future.exception() is None:
+            self.blobs.extend(future.result())
+
+
+def digest_offset(packet, scheme):
+    """Where the digest of a C1/S1 `packet` (a memoryview) sits under `scheme`."""
+    base = DIGEST_SCHEME_BASES[scheme]
+    return sum(packet[base : base + 4]) % DIGEST_OFFSET_MODULO + base + 4
+
+
+def packet_digest(key, packet, offset):
+    """HMAC of a C1/S1 `packet` (a memoryview) minus the digest at `offset`."""
+    h = key.copy()
+    h.update(packet[:offset])
+    h.update(packet[offset + DIGEST_SIZE :])
+    return h.digest()
+
+
+def find_digest(packet, key):
+    """
+    Returns `(scheme, offset)` of `packet`'s valid digest, trying both
+    schemes, or None.
+    """
+    view = memoryview(packet)
+    for scheme in range(len(DIGEST_SCHEME_BASES)):
+        offset = digest_offset(view, scheme)
+        digest = packet_digest(key, view, offset)
+        if hmac.compare_digest(digest, view[offset : offset + DIGEST_SIZE]):
+            return scheme, offset
+    return None
+
+
+def sign_packet(packet, key, scheme):
+    """Writes the digest into a C1/S1 bytearray; returns its offset."""
+    view = memoryview(packet)
+    offset = digest_offset(view, scheme)
+    view[offset : offset + DIGEST_SIZE] = packet_digest(key, view, offset)
+    return offset
+
+
+def response_digest(response_key, peer_digest, random):
+    """The digest closing S2 (or C2), keyed by the peer's C1 (or S1) digest."""
+    key = response_key.copy()
+    key.update(peer_digest)
+    return hmac.new(key.digest(), random, hashlib.sha256).digest()
+
+
+def handshake_response(c1, s1_pool, digest=False):
+    """
+    Returns S0, S1 and S2 answering `c1`, as a list for `writelines`, and
+    whether they follow the digest handshake.
+
+    With `digest`, a C1 carrying a version and a valid digest (either
+    scheme) gets a signed S1 and a digest S2; any other C1 gets the simple
+    handshake, S2 echoing C1. C2 isn't validated, as most servers don't.
+    """
+    if digest and any(memoryview(c1)[4:8]):
+        found = find_digest(c1, FP_DIGEST)
+        if found is not None:
+            scheme, offset = found
+            s1 = bytearray(s1_pool.take())
+            s1[4:8] = S1_DIGEST_VERSION
+            sign_packet(s1, FMS_DIGEST, scheme)
+            s2_random = s1_pool.take()[len(S1_HEADER) : len(S1_HEADER) + S2_RANDOM_SIZE]
+            c1_digest = memoryview(c1)[offset : offset + DIGEST_SIZE]
+            return [
+                _S0,
+                s1,
+                s2_random,
+                response_digest(FMS_RESPONSE_KEY, c1_digest, s2_random),
+            ], True
+    return [_S0, s1_pool.take(), c1], False
+
+
+def generate_c1(digest=False, scheme=0):
+    """A client's C1: simple, or signed for the digest handshake."""
+    c1 = bytearray(S1_HEADER) + os.urandom(S1_RANDOM_SIZE)
+    if digest:
+        c1[4:8] = C1_DIGEST_VERSION
+        sign_packet(c1, FP_DIGEST, scheme)
+    return bytes(c1)
+
+
+def verify_digest_response(c1, s1, s2):
+    """Client side: whether S1 and S2 are a valid digest answer to `c1`."""
+    found = find_digest(c1, FP_DIGEST)
+    if found is None or find_digest(s1, FMS_DIGEST) is None:
+        return False
+    c1_offset = found[1]
+    view = memoryview(s2)
+    expected = response_digest(
+        FMS_RESPONSE_KEY,
+        memoryview(c1)[c1_offset : c1_offset + DIGEST_SIZE],
+        view[:S2_RANDOM_SIZE],
+    )
+    return hmac.compare_digest(expected, view[S2_RANDOM_SIZE:])
+
+
+def generate_c2(s1):
+    """Client side: the digest C2 answering a signed `s1`."""
+    _, offset = find_digest(s1, FMS_DIGEST)
+    random = os.urandom(S2_RANDOM_SIZE)
+    s1_digest = memoryview(s1)[offset : offset + DIGEST_SIZE]
+    return random + response_digest(FP_RESPONSE_KEY, s1_digest, random)
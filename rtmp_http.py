@@ -0,0 +1,199 @@
+import asyncio
+import logging
+
+import http_flv
+
+# Seconds a client gets to send its request line and headers
+REQUEST_TIMEOUT = 5
+MAX_HEADER_LINES = 64
+
+CONTENT_TYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".ts": "video/mp2t",
+    ".m4s": "video/iso.segment",
+    ".mp4": "video/mp4",
+}
+
+# Live streams are played from /live/<stream key>.flv
+FLV_EXTENSION = ".flv"
+
+
+class HTTPRequest:
+    __slots__ = ("method", "path", "query", "headers")
+
+    def __init__(self, method, path, query, headers):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers  # Lower-cased names
+
+
+async def read_request(reader):
+    """Reads a request line and headers; returns an HTTPRequest or None."""
+    request_line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+    headers = {}
+    for _ in range(MAX_HEADER_LINES):
+        line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    parts = request_line.decode("latin-1").split()
+    if len(parts) < 2:
+        return None
+    path, _, query = parts[1].partition("?")
+    return HTTPRequest(parts[0], path, query, headers)
+
+
+def response_head(status, content_type, length=None, extra=()):
+    """Status line and headers of a response to a browser player."""
+    lines = [
+        f"HTTP/1.1 {status}",
+        f"Content-Type: {content_type}",
+        "Access-Control-Allow-Origin: *",  # Players are served from elsewhere
+        "Connection: close",
+        *extra,
+    ]
+    if length is not None:
+        lines.append(f"Content-Length: {length}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+
+def read_file(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+async def serve_hls(server, request, reader, writer):
+    """GET /hls/<stream>/<file>: a playlist or segment from the HLS directory."""
+    parts = request.path.split("/")
+    path = None
+    if server.hls is not None and len(parts) == 4:
+        path = server.hls.path(parts[2], parts[3])
+    # Off the event loop: the disk may be slow
+    body = None if path is None else await asyncio.to_thread(read_file, path)
+    if body is None:
+        return False
+    extension = path[path.rfind(".") :]
+    # Playlists change with every segment; segments never change
+    cache = "no-cache" if extension == ".m3u8" else "max-age=3600"
+    writer.write(
+        response_head(
+            "200 OK",
+            CONTENT_TYPES[extension],
+            len(body),
+            (f"Cache-Control: {cache}",),
+        )
+    )
+    writer.write(body)
+    await writer.drain()
+    return True
+
+
+async def serve_flv(server, request, reader, writer):
+    """
+    GET /live/<stream>.flv: plays the live stream as chunked HTTP-FLV, or
+    as WebSocket-FLV on a WebSocket upgrade, until the player disconnects.
+    """
+    parts = request.path.split("/", 2)
+    if len(parts) < 3 or not parts[2].endswith(FLV_EXTENSION):
+        return False
+    name = parts[2]
+    stream_key = server.normalize_stream_key(name[: -len(FLV_EXTENSION)])
+    if not stream_key:
+        return False
+
+    websocket = request.headers.get("upgrade", "").lower() == "websocket"
+    if websocket:
+        key = request.headers.get("sec-websocket-key")
+        if key is None:
+            return False
+        writer.write(
+            (
+                "HTTP/1.1 101 Switching Protocols\r\n"
+                "Upgrade: websocket\r\n"
+                "Connection: Upgrade\r\n"
+                f"Sec-WebSocket-Accept: {http_flv.websocket_accept(key)}\r\n\r\n"
+            ).encode()
+        )
+    else:
+        writer.write(
+            response_head(
+                "200 OK",
+                "video/x-flv",
+                extra=("Transfer-Encoding: chunked", "Cache-Control: no-cache"),
+            )
+        )
+
+    stream = server.get_stream(stream_key)
+    viewer = http_flv.attach_viewer(
+        stream,
+        writer,
+        websocket,
+        server.subscriber_queue_bytes,
+        server.slow_consumer_policy,
+        server.memory,
+    )
+    logging.info(
+        f"✅ {'WebSocket' if websocket else 'HTTP'}-FLV player attached to "
+        f"'{stream_key}' ({len(stream.subscribers)} subscriber(s))."
+    )
+    try:
+        if websocket:
+            await http_flv.read_websocket(reader, writer)
+        else:
+            await http_flv.read_until_closed(reader)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        server.stop_http_playing(stream, viewer)
+    return True
+
+
+ROUTES = {"hls": serve_hls, "live": serve_flv}
+
+
+async def send_error(writer, status, body):
+    writer.write(response_head(status, "text/plain", len(body)) + body)
+    await writer.drain()
+
+
+async def handle_http(server, reader, writer):
+    """Answers one HTTP request by its first path component, or 404."""
+    try:
+        try:
+            request = await read_request(reader)
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            # A request line or header over the reader's limit, or cut short
+            logging.debug(f"Bad HTTP request: {e}")
+            await send_error(writer, "400 Bad Request", b"Bad request\n")
+            return
+        handler = None
+        if (
+            request is not None
+            and request.method == "GET"
+            and request.path.startswith("/")
+        ):
+            handler = ROUTES.get(request.path.split("/")[1])
+        if handler is None or not await handler(server, request, reader, writer):
+            await send_error(writer, "404 Not Found", b"Not found\n")
+    except (asyncio.TimeoutError, ConnectionError) as e:
+        logging.debug(f"HTTP request failed: {e}")
+    finally:
+        writer.close()
+
+
+async def start_media_http_server(server, host, port):
+    """
+    Serves the server's live streams at http://host:port/live/<stream>.flv
+    (HTTP-FLV and WebSocket-FLV) and its HLS output at
+    http://host:port/hls/<stream>/index.m3u8.
+    """
+    http_server = await asyncio.start_server(
+        lambda reader, writer: handle_http(server, reader, writer), host, port
+    )
+    logging.info(f"Media HTTP endpoint on http://{host}:{port}/")
+    return http_server
@@ -0,0 +1,328 @@
+import asyncio
+import collections
+import logging
+
+import amf0
+from rtmp_chunk import RTMPMessage
+from rtmp_memory import MemoryBudget
+
+# Media message types relayed from publishers to players
+RTMP_MSG_TYPE_AUDIO = 0x08
+RTMP_MSG_TYPE_VIDEO = 0x09
+RTMP_MSG_TYPE_DATA = 0x12
+
+# Outbound chunk stream IDs used for relayed media
+CSID_AUDIO = 4
+CSID_DATA = 5
+CSID_VIDEO = 6
+MEDIA_CHUNK_STREAMS = {
+    RTMP_MSG_TYPE_AUDIO: CSID_AUDIO,
+    RTMP_MSG_TYPE_VIDEO: CSID_VIDEO,
+    RTMP_MSG_TYPE_DATA: CSID_DATA,
+}
+
+# FLV video tag: frame type 1 in the high nibble of the first byte
+VIDEO_KEYFRAME = 1
+# FLV codec IDs / sound formats whose second byte is a packet type where
+# 0 marks a sequence header (AVCDecoderConfigurationRecord / AudioSpecificConfig)
+VIDEO_CODEC_AVC = 7
+SOUND_FORMAT_AAC = 10
+SEQUENCE_HEADER = 0
+
+# AMF0-encoded "@setDataFrame" string that prefixes metadata sent by encoders;
+# players expect the bare "onMetaData" data message that follows it
+SET_DATA_FRAME = b"\x02\x00\x0d@setDataFrame"
+ON_METADATA = b"\x02\x00\x0aonMetaData"
+
+# What to do when a subscriber's send queue is full
+SLOW_CONSUMER_DROP = "drop"  # Drop the new message
+SLOW_CONSUMER_DISCONNECT = "disconnect"  # Close the subscriber's connection
+SLOW_CONSUMER_SKIP = "skip"  # Flush the queue and resume at the next keyframe
+SLOW_CONSUMER_POLICIES = (
+    SLOW_CONSUMER_DROP,
+    SLOW_CONSUMER_DISCONNECT,
+    SLOW_CONSUMER_SKIP,
+)
+
+
+def is_video_keyframe(message):
+    payload = message.payload
+    return (
+        message.msg_type == RTMP_MSG_TYPE_VIDEO
+        and len(payload) > 0
+        and payload[0] >> 4 == VIDEO_KEYFRAME
+    )
+
+
+def is_avc_sequence_header(message):
+    payload = message.payload
+    return (
+        message.msg_type == RTMP_MSG_TYPE_VIDEO
+        and len(payload) > 1
+        and payload[0] & 0x0F == VIDEO_CODEC_AVC
+        and payload[1] == SEQUENCE_HEADER
+    )
+
+
+def is_aac_sequence_header(message):
+    payload = message.payload
+    return (
+        message.msg_type == RTMP_MSG_TYPE_AUDIO
+        and len(payload) > 1
+        and payload[0] >> 4 == SOUND_FORMAT_AAC
+        and payload[1] == SEQUENCE_HEADER
+    )
+
+
+def is_sequence_header(message):
+    return is_avc_sequence_header(message) or is_aac_sequence_header(message)
+
+
+class Subscriber:
+    """
+    A player attached to a LiveStream.
+
+    Queued messages are the publisher's RTMPMessage objects themselves, so
+    every subscriber references the same payload buffer; only the few bytes
+    of chunk headers are built per subscriber. The queue is bounded in bytes
+    and `policy` decides what happens when it overflows. Sending pauses
+    while the player's flow control window is full, so a player that
+    acknowledges slowly fills its queue like any other slow consumer.
+    Queued bytes are charged to `budget`.
+    """
+
+    def __init__(self, session, stream_id, max_queue_bytes, policy, budget=None):
+        self.session = session
+        self.stream_id = stream_id
+        self.max_queue_bytes = max_queue_bytes
+        self.policy = policy
+        self.budget = MemoryBudget() if budget is None else budget
+        self.queue = collections.deque()
+        self.queued_bytes = 0
+        self.dropped_messages = 0
+        self.waiting_for_keyframe = False
+        self.closed = False
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    def enqueue(self, message):
+        """Queues one message for sending; never blocks and never copies."""
+        if self.closed:
+            return
+
+        if self.waiting_for_keyframe:
+            if message.msg_type == RTMP_MSG_TYPE_DATA or is_sequence_header(message):
+                pass
+            elif is_video_keyframe(message):
+                self.waiting_for_keyframe = False
+            else:
+                self.dropped_messages += 1
+                return
+
+        size = len(message.payload)
+        if self.queued_bytes + size > self.max_queue_bytes:
+            if self.policy == SLOW_CONSUMER_DISCONNECT:
+                self.disconnect()
+                return
+
+            if self.policy == SLOW_CONSUMER_SKIP:
+                self.dropped_messages += len(self.queue)
+                self.clear_queue()
+                if is_sequence_header(message) or not is_video_keyframe(message):
+                    self.waiting_for_keyframe = True
+                    if not is_sequence_header(message):
+                        self.dropped_messages += 1
+                        return
+            else:
+                self.dropped_messages += 1
+                return
+
+        self.queue.append(message)
+        self.queued_bytes += size
+        self.budget.charge(size)
+        self.wakeup.set()
+
+    async def run(self):
+        """Writes queued messages in batches, then waits for the socket to drain."""
+        session = self.session
+        try:
+            while not self.closed:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+
+                queue = self.queue
+                while queue:
+                    if session.send_window_full():
+                        # Honor the player's window: wait for its Acknowledgement
+                        await session.wait_send_window()
+                        continue
+                    message = queue.popleft()
+                    size = len(message.payload)
+                    self.queued_bytes -= size
+                    self.budget.release(size)
+                    session.send_message(
+                        MEDIA_CHUNK_STREAMS[message.msg_type],
+                        message.msg_type,
+                        self.stream_id,
+                        message.timestamp,
+                        message.payload,
+                    )
+                await session.drain()
+        except (ConnectionError, OSError) as e:
+            logging.info(f"Subscriber connection lost: {e}")
+        finally:
+            self.closed = True
+            self.clear_queue()
+
+    def disconnect(self):
+        """Closes the player's connection: it can't keep up."""
+        logging.warning(
+            "Subscriber on stream %d too slow (%d bytes queued), disconnecting.",
+            self.stream_id,
+            self.queued_bytes,
+        )
+        self.close()
+        self.session.close()
+
+    def clear_queue(self):
+        self.queue.clear()
+        self.budget.release(self.queued_bytes)
+        self.queued_bytes = 0
+
+    def close(self):
+        self.closed = True
+        self.clear_queue()
+        self.task.cancel()
+
+
+class LiveStream:
+    """
+    One published stream key: its publisher (if any) and its subscribers.
+
+    Also caches what a new player needs to start decoding immediately: the
+    latest onMetaData, AVC and AAC sequence headers, and every message since
+    the most recent keyframe (the current GOP). Cached entries are the
+    publisher's own message objects, so the cache adds no payload copies.
+    The GOP cache is bounded by `gop_cache_bytes`; a GOP that outgrows it is
+    dropped and caching resumes at the next keyframe. Cached bytes are
+    charged to `budget`. Its `sinks` (recorders, packagers) are fed every
+    message after caching, so they can start segments from the cached
+    headers.
+    """
+
+    def __init__(self, stream_key, gop_cache_bytes, metrics=None, budget=None):
+        self.stream_key = stream_key
+        self.metrics = metrics  # Ingest health counters (metrics.StreamMetrics)
+        self.publisher = None
+        self.subscribers = set()
+        self.gop_cache_bytes = gop_cache_bytes
+        self.budget = MemoryBudget() if budget is None else budget
+        self.metadata = None
+        self.metadata_properties = {}  # Decoded onMetaData (width, framerate, ...)
+        self.avc_sequence_header = None
+        self.aac_sequence_header = None
+        self.gop_cache = []
+        self.gop_cached_bytes = 0
+        self.sinks = []  # Objects with write(message) and close() while published
+
+    def broadcast(self, message):
+        """Caches one publisher message and fans it out to every subscriber."""
+        if message.msg_type == RTMP_MSG_TYPE_DATA:
+            message = self.cache_data_message(message)
+        else:
+            self.cache_media_message(message)
+        for sink in self.sinks:
+            sink.write(message)
+
+        # A snapshot: side effects of enqueuing may detach players
+        for subscriber in tuple(self.subscribers):
+            subscriber.enqueue(message)
+
+    def cache_data_message(self, message):
+        """Caches onMetaData; returns the message as players should see it."""
+        payload = message.payload
+        if payload[: len(SET_DATA_FRAME)] == SET_DATA_FRAME:
+            message = RTMPMessage(
+                message.csid,
+                message.msg_type,
+                message.stream_id,
+                message.timestamp,
+                bytes(payload[len(SET_DATA_FRAME) :]),
+            )
+            payload = message.payload
+        if payload[: len(ON_METADATA)] == ON_METADATA:
+            self.metadata = message
+            self.metadata_properties = self.decode_metadata(payload)
+        return message
+
+    def decode_metadata(self, payload):
+        """Returns the properties of an onMetaData payload (object or ECMA array)."""
+        try:
+            values = amf0.decode_all(payload)
+        except amf0.AMF0DecodeError as e:
+            logging.warning(f"Stream '{self.stream_key}': bad onMetaData: {e}")
+            return {}
+        if len(values) > 1 and isinstance(values[1], dict):
+            logging.info(f"Stream '{self.stream_key}' metadata: {values[1]}")
+            return values[1]
+        return {}
+
+    def cache_media_message(self, message):
+        if is_avc_sequence_header(message):
+            self.avc_sequence_header = message
+            return
+        if is_aac_sequence_header(message):
+            self.aac_sequence_header = message
+            return
+
+        if is_video_keyframe(message):
+            self.clear_gop_cache()
+        elif not self.gop_cache:
+            # Overflowed, or no keyframe seen yet: wait for the next GOP
+            return
+
+        size = len(message.payload)
+        if self.gop_cached_bytes + size > self.gop_cache_bytes:
+            self.clear_gop_cache()
+            return
+
+        self.gop_cache.append(message)
+        self.gop_cached_bytes += size
+        self.budget.charge(size)
+
+    def clear_gop_cache(self):
+        self.gop_cache = []
+        self.budget.release(self.gop_cached_bytes)
+        self.gop_cached_bytes = 0
+
+    def clear_cache(self):
+        self.metadata = None
+        self.metadata_properties = {}
+        self.avc_sequence_header = None
+        self.aac_sequence_header = None
+        self.clear_gop_cache()
+
+    def add_subscriber(self, subscriber):
+        """Attaches a player, first sending it the cached start-up burst."""
+        for message in (
+            self.metadata,
+            self.avc_sequence_header,
+            self.aac_sequence_header,
+        ):
+            if message is not None:
+                subscriber.enqueue(message)
+
+        if self.gop_cache:
+            for message in self.gop_cache:
+                subscriber.enqueue(message)
+        else:
+            subscriber.waiting_for_keyframe = True
+
+        self.subscribers.add(subscriber)
+
+    def remove_subscriber(self, subscriber):
+        self.subscribers.discard(subscriber)
+        subscriber.close()
+
+    def is_idle(self):
+        return self.publisher is None and not self.subscribers
@@ -0,0 +1,75 @@
+import logging
+
+
+class MemoryBudget:
+    """
+    Bytes held, across every session, by buffers that grow with client input.
+
+    Partially received messages, player send queues and GOP caches charge
+    their size here as they grow and release it as they shrink, so `used`
+    is maintained in O(1). Payloads are shared between those holders, so a
+    payload held by several of them is counted once per holder: `used` is an
+    upper bound on the memory really held.
+
+    Crossing `high_water` calls `on_pressure(True)`, and falling back to
+    `low_water` calls `on_pressure(False)`; the server pauses and resumes
+    reading on every connection. Crossing `limit` calls `on_limit()`, which
+    sheds connections; it is called again only after `used` has fallen
+    back to the limit. A limit of None disables the corresponding check.
+    """
+
+    __slots__ = (
+        "high_water",
+        "low_water",
+        "limit",
+        "on_pressure",
+        "on_limit",
+        "used",
+        "peak",
+        "paused",
+        "over_limit",
+    )
+
+    def __init__(
+        self,
+        high_water=None,
+        low_water=None,
+        limit=None,
+        on_pressure=None,
+        on_limit=None,
+    ):
+        self.high_water = high_water
+        self.low_water = high_water if low_water is None else low_water
+        self.limit = limit
+        self.on_pressure = on_pressure
+        self.on_limit = on_limit
+        self.used = 0
+        self.peak = 0
+        self.paused = False  # Above the high-water mark, reads paused
+        self.over_limit = False  # Above the limit, `on_limit` called
+
+    def charge(self, nbytes):
+        used = self.used = self.used + nbytes
+        if used > self.peak:
+            self.peak = used
+        if not self.paused and self.high_water is not None and used > self.high_water:
+            self.paused = True
+            logging.warning(
+                f"Buffered memory above high-water mark ({used} bytes), pausing reads."
+            )
+            if self.on_pressure is not None:
+                self.on_pressure(True)
+        if not self.over_limit and self.limit is not None and used > self.limit:
+            self.over_limit = True
+            if self.on_limit is not None:
+                self.on_limit()
+
+    def release(self, nbytes):
+        used = self.used = self.used - nbytes
+        if self.over_limit and used <= self.limit:
+            self.over_limit = False
+        if self.paused and used <= self.low_water:
+            self.paused = False
+            logging.info(f"Buffered memory down to {used} bytes, resuming reads.")
+            if self.on_pressure is not None:
+                self.on_pressure(False)
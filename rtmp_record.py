@@ -0,0 +1,297 @@
+import itertools
+import logging
+import os
+import queue
+import re
+import struct
+import threading
+import time
+
+import amf0
+import flv
+from rtmp_live import (
+    RTMP_MSG_TYPE_AUDIO,
+    RTMP_MSG_TYPE_VIDEO,
+    is_sequence_header,
+    is_video_keyframe,
+)
+
+# Tags are collected per stream and handed to the writer thread in batches
+# of this many bytes, or at every keyframe, whichever comes first
+RECORD_BATCH_BYTES = 256 * 1024
+
+# onMetaData properties patched when a segment is closed; written first so
+# their offsets in the file are known
+PATCHED_PROPERTIES = ("duration", "filesize")
+
+_DOUBLE = struct.Struct(">d")
+_UNSAFE_NAME = re.compile(r"[^A-Za-z0-9_.-]")
+
+_OPEN, _WRITE, _CLOSE, _STOP = range(4)
+
+
+def segment_metadata(properties):
+    """
+    The onMetaData script tag body opening a segment, and the offsets within
+    it of the `duration` and `filesize` numbers to patch at close.
+    """
+    array = amf0.ECMAArray((name, 0.0) for name in PATCHED_PROPERTIES)
+    for name, value in properties.items():
+        if name not in array:
+            array[name] = value
+    try:
+        payload = amf0.encode("onMetaData", array)
+    except TypeError:  # A property decoded from the publisher we can't re-encode
+        payload = amf0.encode(
+            "onMetaData", amf0.ECMAArray((name, 0.0) for name in PATCHED_PROPERTIES)
+        )
+    offsets = []
+    for name in PATCHED_PROPERTIES:
+        # Property name (16-bit length + UTF-8), then the number's marker
+        key = len(name).to_bytes(2, "big") + name.encode() + bytes((amf0.AMF0_NUMBER,))
+        offsets.append(payload.index(key) + len(key))
+    return payload, offsets
+
+
+class StreamRecorder:
+    """
+    Records one published stream into FLV segments.
+
+    A segment starts on a video keyframe (on any audio frame for streams
+    without video) with the file header, an onMetaData tag and the
+    stream's sequence headers, and tag timestamps counted from that frame.
+    Segments are rotated at the first keyframe after `segment_bytes` or
+    `segment_seconds`; the header flags and the onMetaData duration and
+    filesize are patched in when a segment is closed. Tags are batched and
+    written by the RecordingWriter's thread; if it falls behind by more
+    than the writer's `max_queued_bytes`, the recorder drops batches until
+    the next keyframe after the backlog clears, leaving a gap.
+    """
+
+    __slots__ = (
+        "writer",
+        "stream",
+        "name",
+        "recording_id",
+        "path",
+        "segments",
+        "batch",
+        "flushed_bytes",
+        "base_timestamp",
+        "last_timestamp",
+        "has_audio",
+        "has_video",
+        "metadata_offsets",
+        "waiting_for_keyframe",
+        "dropped_bytes",
+    )
+
+    def __init__(self, writer, stream):
+        self.writer = writer
+        self.stream = stream  # LiveStream: its cached metadata and sequence headers
+        self.name = _UNSAFE_NAME.sub("_", stream.stream_key)
+        self.recording_id = next(writer.recording_ids)
+        self.path = None  # Of the open segment, if any
+        self.segments = 0
+        self.batch = bytearray()
+        self.flushed_bytes = 0
+        self.base_timestamp = 0
+        self.last_timestamp = 0
+        self.has_audio = False
+        self.has_video = False
+        self.metadata_offsets = ()
+        self.waiting_for_keyframe = False
+        self.dropped_bytes = 0
+
+    def expects_video(self):
+        stream = self.stream
+        return (
+            stream.avc_sequence_header is not None
+            or "videocodecid" in stream.metadata_properties
+        )
+
+    def write(self, message):
+        """Records one of the stream's messages (after LiveStream caching)."""
+        msg_type = message.msg_type
+        if msg_type == RTMP_MSG_TYPE_VIDEO:
+            boundary = is_video_keyframe(message) and not is_sequence_header(message)
+        elif msg_type == RTMP_MSG_TYPE_AUDIO:
+            boundary = not is_sequence_header(message) and not self.expects_video()
+        else:
+            boundary = False
+
+        if boundary:
+            if self.path is not None and self.segment_full(message.timestamp):
+                self.close_segment()
+            if self.path is None:
+                self.open_segment(message.timestamp)
+            else:
+                self.flush()
+            if self.waiting_for_keyframe and not self.falling_behind():
+                self.waiting_for_keyframe = False
+        elif self.path is None:
+            # Sequence headers and metadata go into the next segment's start
+            return
+
+        if self.waiting_for_keyframe:
+            self.dropped_bytes += len(message.payload)
+            return
+        if msg_type == RTMP_MSG_TYPE_VIDEO:
+            self.has_video = True
+        elif msg_type == RTMP_MSG_TYPE_AUDIO:
+            self.has_audio = True
+        self.add_tag(msg_type, message.timestamp, message.payload)
+        if len(self.batch) >= RECORD_BATCH_BYTES:
+            self.flush()
+
+    def add_tag(self, tag_type, timestamp, data):
+        # Audio a few ms ahead of the keyframe that opened the segment clamps to 0
+        delta = (timestamp - self.base_timestamp) & 0xFFFFFFFF
+        if delta > 0x7FFFFFFF:
+            delta = 0
+        self.last_timestamp = max(self.last_timestamp, delta)
+        flv.write_tag(self.batch, tag_type, delta, data)
+
+    def segment_full(self, timestamp):
+        writer = self.writer
+        elapsed = ((timestamp - self.base_timestamp) & 0xFFFFFFFF) / 1000
+        return (
+            writer.segment_bytes
+            and self.flushed_bytes + len(self.batch) >= writer.segment_bytes
+        ) or (writer.segment_seconds and elapsed >= writer.segment_seconds)
+
+    def open_segment(self, timestamp):
+        self.segments += 1
+        self.path = self.writer.segment_path(self, self.segments)
+        self.base_timestamp = timestamp
+        self.last_timestamp = 0
+        self.flushed_bytes = 0
+
+        stream = self.stream
+        self.has_audio = stream.aac_sequence_header is not None
+        self.has_video = stream.avc_sequence_header is not None
+        metadata, offsets = segment_metadata(stream.metadata_properties)
+        header = flv.encode_header(False, False)
+        # Script tag body starts after the file header and the tag header
+        start = len(header) + flv.TAG_HEADER_SIZE
+        self.metadata_offsets = [start + offset for offset in offsets]
+        self.batch = bytearray(header)
+        flv.write_tag(self.batch, flv.TAG_SCRIPT_DATA, 0, metadata)
+        for message in (stream.avc_sequence_header, stream.aac_sequence_header):
+            if message is not None:
+                flv.write_tag(self.batch, message.msg_type, 0, message.payload)
+        self.writer.queue.put((_OPEN, self.path, None))
+        logging.info(f"⏺️ Recording '{stream.stream_key}' to {self.path}")
+        # The header must reach the file even while dropping media
+        self.flush(force=True)
+
+    def falling_behind(self):
+        writer = self.writer
+        return writer.queued_bytes - writer.written_bytes > writer.max_queued_bytes
+
+    def flush(self, force=False):
+        """Hands the batch to the writer thread."""
+        batch = self.batch
+        if not batch:
+            return
+        self.batch = bytearray()
+        if not force and self.falling_behind():
+            if not self.waiting_for_keyframe:
+                logging.warning(
+                    f"Recording {self.path} falling behind, "
+                    "dropping media until the next keyframe."
+                )
+                self.waiting_for_keyframe = True
+            self.dropped_bytes += len(batch)
+            return
+        self.flushed_bytes += len(batch)
+        self.writer.queued_bytes += len(batch)
+        self.writer.queue.put((_WRITE, self.path, batch))
+
+    def close_segment(self):
+        """Writes out the open segment and patches its header and metadata."""
+        self.flush(force=True)
+        patches = [
+            (
+                flv.FLV_FLAGS_OFFSET,
+                bytes((flv.header_flags(self.has_audio, self.has_video),)),
+            )
+        ]
+        duration, filesize = self.metadata_offsets
+        patches.append((duration, _DOUBLE.pack(self.last_timestamp / 1000)))
+        patches.append((filesize, _DOUBLE.pack(float(self.flushed_bytes))))
+        self.writer.queue.put((_CLOSE, self.path, patches))
+        self.path = None
+
+    def close(self):
+        if self.path is not None:
+            self.close_segment()
+        if self.dropped_bytes:
+            logging.warning(
+                f"Recording of '{self.stream.stream_key}' dropped "
+                f"{self.dropped_bytes} bytes while falling behind."
+            )
+
+
+class RecordingWriter:
+    """Writes every stream's FLV segments from one background thread."""
+
+    def __init__(self, directory, segment_bytes, segment_seconds, max_queued_bytes):
+        self.directory = directory
+        self.segment_bytes = segment_bytes  # 0: no size limit
+        self.segment_seconds = segment_seconds  # 0: no duration limit
+        self.max_queued_bytes = max_queued_bytes
+        # Each counter is only updated by one thread: their difference is the
+        # backlog without a lock
+        self.queued_bytes = 0
+        self.written_bytes = 0
+        self.queue = queue.SimpleQueue()
+        self.recording_ids = itertools.count(1)
+        self.thread = threading.Thread(target=self.run, name="rtmp-record", daemon=True)
+        os.makedirs(directory, exist_ok=True)
+        self.thread.start()
+
+    def open(self, stream):
+        """Starts recording a LiveStream; feed it with the recorder's `write`."""
+        return StreamRecorder(self, stream)
+
+    def segment_path(self, recorder, segment):
+        return os.path.join(
+            self.directory,
+            f"{recorder.name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-"
+            f"{recorder.recording_id}-{segment:04d}.flv",
+        )
+
+    def close(self):
+        """Writes out everything queued, then stops the thread."""
+        self.queue.put((_STOP, None, None))
+        self.thread.join()
+
+    def run(self):
+        files = {}
+        while True:
+            op, path, item = self.queue.get()
+            try:
+                if op == _WRITE:
+                    self.written_bytes += len(item)
+                    f = files.get(path)
+                    if f is not None:
+                        f.write(item)
+                elif op == _OPEN:
+                    files[path] = open(path, "wb")
+                elif op == _CLOSE:
+                    f = files.pop(path, None)
+                    if f is not None:
+                        for offset, data in item:
+                            f.seek(offset)
+                            f.write(data)
+                        f.close()
+                else:
+                    for f in files.values():
+                        f.close()
+                    return
+            except OSError as e:
+                logging.error(f"❌ Recording {path} failed: {e}")
+                f = files.pop(path, None)
+                if f is not None:
+                    f.close()
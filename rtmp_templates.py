@@ -0,0 +1,125 @@
+import struct
+
+import amf0
+
+_DOUBLE = struct.Struct(">d")
+
+# Kinds of template field
+NUMBER = "number"
+STRING = "string"
+
+# Numbers no response ever carries, encoded in place of number fields so their
+# offsets can be found in the built payload
+_NUMBER_PLACEHOLDER = -1.2345678901234567e-301
+
+
+class PacketTemplate:
+    """
+    A response payload built once, with the positions of its variable fields.
+
+    Number fields (AMF0 doubles) have a fixed size and are patched in place
+    into a copy of the piece that holds them. String fields change the
+    payload length, so they split the payload into pieces and are encoded
+    between them. A template without fields renders its shared payload.
+    """
+
+    __slots__ = ("pieces", "numbers", "strings")
+
+    def __init__(self, pieces, numbers, strings):
+        self.pieces = pieces  # Static bytes around the string fields
+        self.numbers = numbers  # name -> (piece index, offset of the double)
+        self.strings = strings  # String field names, in payload order
+
+    def render(self, values):
+        pieces = self.pieces
+        if self.numbers:
+            pieces = list(pieces)
+            for name, (index, offset) in self.numbers.items():
+                piece = pieces[index]
+                if type(piece) is bytes:
+                    piece = pieces[index] = bytearray(piece)
+                _DOUBLE.pack_into(piece, offset, values[name])
+        if not self.strings:
+            return pieces[0]
+
+        parts = [pieces[0]]
+        for name, piece in zip(self.strings, pieces[1:]):
+            parts.append(amf0.encode(values[name]))
+            parts.append(piece)
+        return b"".join(parts)
+
+
+def compile_template(encode, fields):
+    """
+    Builds a template by calling `encode` once with placeholder field values.
+
+    `fields` maps each field name to its kind, NUMBER or STRING; every
+    placeholder must land in the payload exactly once.
+    """
+    placeholders = {}
+    number_names = []
+    for index, (name, kind) in enumerate(fields.items()):
+        if kind == STRING:
+            placeholders[name] = f"\x00{{{name}}}\x00"
+        elif kind == NUMBER:
+            placeholders[name] = _NUMBER_PLACEHOLDER * (index + 1)
+            number_names.append(name)
+        else:
+            raise ValueError(f"Template field {name!r} has unknown kind {kind!r}")
+    payload = encode(**placeholders)
+
+    splits = []
+    for name, placeholder in placeholders.items():
+        if name not in number_names:
+            encoded = amf0.encode(placeholder)
+            offset = payload.find(encoded)
+            if offset < 0 or payload.find(encoded, offset + 1) >= 0:
+                raise ValueError(f"Template field {name!r} not found exactly once")
+            splits.append((offset, len(encoded), name))
+    splits.sort()
+
+    pieces = []
+    strings = []
+    start = 0
+    for offset, size, name in splits:
+        pieces.append(payload[start:offset])
+        strings.append(name)
+        start = offset + size
+    pieces.append(payload[start:])
+
+    numbers = {}
+    for name in number_names:
+        encoded = _DOUBLE.pack(placeholders[name])
+        found = [
+            (index, piece.find(encoded))
+            for index, piece in enumerate(pieces)
+            if encoded in piece
+        ]
+        if len(found) != 1 or pieces[found[0][0]].count(encoded) != 1:
+            raise ValueError(f"Template field {name!r} not found exactly once")
+        numbers[name] = found[0]
+
+    return PacketTemplate(tuple(bytes(piece) for piece in pieces), numbers, strings)
+
+
+class TemplateCache:
+    """
+    Response payload templates, built on first use and shared by all sessions.
+
+    `key` must identify everything the payload depends on except the field
+    `values`; `encode` builds the payload from those values the first time,
+    with `fields` giving each field's kind. A template is only kept once it
+    has rendered, so a failed first use is retried on the next.
+    """
+
+    def __init__(self):
+        self.templates = {}
+
+    def render(self, key, encode, fields=None, **values):
+        template = self.templates.get(key)
+        if template is not None:
+            return template.render(values)
+        template = compile_template(encode, fields or {})
+        payload = template.render(values)
+        self.templates[key] = template
+        return payload
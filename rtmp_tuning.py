@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import os
+import socket
+
+
+class TuningSettings:
+    """
+    Event loop and socket settings the server applies when it starts.
+
+    `uvloop`: True to require uvloop, False for asyncio's own loop, None to
+    use uvloop when it is installed. `tcp_nodelay` disables Nagle's
+    algorithm on every accepted connection, so small writes (commands,
+    acknowledgements, audio) don't wait up to a delayed-ACK timeout (~40 ms)
+    behind unacknowledged data. `recv_buffer` and `send_buffer` set
+    SO_RCVBUF/SO_SNDBUF on the listening socket, which accepted connections
+    inherit; None keeps the kernel's defaults and autotuning. `backlog` is
+    the listen() backlog. `write_high_water` and `write_low_water` are the
+    transport write buffer limits at which a connection's writer is paused
+    and resumed; None keeps asyncio's (64 KiB and 16 KiB).
+    """
+
+    __slots__ = (
+        "uvloop",
+        "tcp_nodelay",
+        "recv_buffer",
+        "send_buffer",
+        "backlog",
+        "write_high_water",
+        "write_low_water",
+    )
+
+    def __init__(
+        self,
+        uvloop=None,
+        tcp_nodelay=True,
+        recv_buffer=None,
+        send_buffer=None,
+        backlog=1024,
+        write_high_water=None,
+        write_low_water=None,
+    ):
+        self.uvloop = uvloop
+        self.tcp_nodelay = tcp_nodelay
+        self.recv_buffer = recv_buffer
+        self.send_buffer = send_buffer
+        self.backlog = backlog
+        self.write_high_water = write_high_water
+        self.write_low_water = write_low_water
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"TuningSettings({fields})"
+
+
+def select_event_loop(settings):
+    """
+    Installs uvloop's event loop policy if the settings pick it, before
+    `asyncio.run`; returns the name of the loop that will be used.
+    """
+    if settings.uvloop is False:
+        return "asyncio"
+    try:
+        import uvloop
+    except ImportError:
+        if settings.uvloop:
+            logging.warning("⚠️ uvloop isn't installed, using asyncio's event loop.")
+        return "asyncio"
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return "uvloop"
+
+
+def create_listen_socket(host, port, settings, reuse_port=False):
+    """Binds a non-blocking listening socket with the settings' buffers and backlog."""
+    family, sock_type, proto, _, address = socket.getaddrinfo(
+        host,
+        port,
+        type=socket.SOCK_STREAM,
+        proto=socket.IPPROTO_TCP,
+        flags=socket.AI_PASSIVE,
+    )[0]
+    sock = socket.socket(family, sock_type, proto)
+    try:
+        if os.name != "nt":  # On Windows, SO_REUSEADDR allows port hijacking
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        # Set before listen(): the receive buffer fixes the TCP window scale
+        if settings.recv_buffer:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, settings.recv_buffer)
+        if settings.send_buffer:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, settings.send_buffer)
+        sock.bind(address)
+        sock.listen(settings.backlog)
+        sock.setblocking(False)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def tune_connection(transport, settings):
+    """Applies TCP_NODELAY and the write buffer limits to an accepted connection."""
+    sock = transport.get_extra_info("socket")
+    if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            sock.setsockopt(
+                socket.IPPROTO_TCP, socket.TCP_NODELAY, int(settings.tcp_nodelay)
+            )
+        except OSError:
+            pass  # Already reset by the peer
+    if settings.write_high_water is not None:
+        transport.set_write_buffer_limits(
+            settings.write_high_water, settings.write_low_water
+        )
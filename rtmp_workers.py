@@ -0,0 +1,310 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import sys
+import time
+
+import RTMPServer as rtmp
+from rtmp_tuning import TuningSettings, create_listen_socket, select_event_loop
+
+# How often each worker reports its stats to the supervisor (seconds)
+WORKER_STATS_INTERVAL = 5.0
+# How often the supervisor logs the aggregated stats (seconds)
+SUPERVISOR_LOG_INTERVAL = 30.0
+# How often the supervisor checks for dead workers (seconds)
+SUPERVISOR_POLL_INTERVAL = 1.0
+
+# Restart backoff: doubles while a worker keeps dying young, up to the max
+RESTART_DELAY_MIN = 1.0
+RESTART_DELAY_MAX = 30.0
+# A worker that ran at least this long resets its restart backoff (seconds)
+WORKER_STABLE_AFTER = 60.0
+
+
+def has_reuse_port():
+    """SO_REUSEPORT load-balances accepted connections only on Linux."""
+    return hasattr(socket, "SO_REUSEPORT") and sys.platform.startswith("linux")
+
+
+async def serve_worker(worker_id, server, stats_queue, sock, reuse_port):
+    """Runs one worker's RTMP server and reports its stats periodically."""
+    serve_task = asyncio.create_task(
+        server.start(sock=sock, reuse_port=reuse_port, launch_stream=False)
+    )
+    started = time.monotonic()
+
+    while not serve_task.done():
+        await asyncio.wait({serve_task}, timeout=WORKER_STATS_INTERVAL)
+        stats = server.stats()
+        stats["worker"] = worker_id
+        stats["pid"] = os.getpid()
+        stats["uptime"] = time.monotonic() - started
+        try:
+            stats_queue.put_nowait(stats)
+        except queue.Full:
+            pass
+
+    await serve_task
+
+
+def worker_main(
+    worker_id,
+    host,
+    port,
+    stats_queue,
+    sock=None,
+    reuse_port=False,
+    log_level=rtmp.LOG_LEVEL,
+    trace_sample_rate=rtmp.TRACE_SAMPLE_RATE,
+    metrics_port=rtmp.METRICS_PORT,
+    capture_dir=rtmp.CAPTURE_DIR,
+    record_dir=rtmp.RECORD_DIR,
+    record_segment_bytes=rtmp.RECORD_SEGMENT_BYTES,
+    record_segment_seconds=rtmp.RECORD_SEGMENT_SECONDS,
+    hls_dir=rtmp.HLS_DIR,
+    hls_format=rtmp.HLS_FORMAT,
+    hls_segment_seconds=rtmp.HLS_SEGMENT_SECONDS,
+    hls_playlist_length=rtmp.HLS_PLAYLIST_LENGTH,
+    http_port=rtmp.HTTP_PORT,
+    h264_profiles=rtmp.H264_PROFILES,
+    digest_handshake=rtmp.DIGEST_HANDSHAKE,
+    tuning=None,
+):
+    """Entry point of a worker process."""
+    # Spawned (non-forked) workers don't inherit the supervisor's logging setup
+    logging.basicConfig(level=log_level)
+    tuning = TuningSettings() if tuning is None else tuning
+    select_event_loop(tuning)
+    server = rtmp.RTMPServer(
+        host,
+        port,
+        trace_sample_rate=trace_sample_rate,
+        metrics_port=metrics_port,
+        capture_dir=capture_dir,
+        record_dir=record_dir,
+        record_segment_bytes=record_segment_bytes,
+        record_segment_seconds=record_segment_seconds,
+        hls_dir=hls_dir,
+        hls_format=hls_format,
+        hls_segment_seconds=hls_segment_seconds,
+        hls_playlist_length=hls_playlist_length,
+        http_port=http_port,
+        h264_profiles=h264_profiles,
+        digest_handshake=digest_handshake,
+        tuning=tuning,
+    )
+    try:
+        asyncio.run(serve_worker(worker_id, server, stats_queue, sock, reuse_port))
+    except KeyboardInterrupt:
+        pass
+
+
+class WorkerProcess:
+    """Supervisor-side bookkeeping for one worker slot."""
+
+    def __init__(self, worker_id):
+        self.worker_id = worker_id
+        self.process = None
+        self.started_at = 0.0
+        self.restart_at = None
+        self.restart_delay = RESTART_DELAY_MIN
+        self.restarts = 0
+
+
+class WorkerSupervisor:
+    """
+    Runs N RTMPServer worker processes on one port and keeps them alive.
+
+    On Linux every worker binds its own listener with SO_REUSEPORT and the
+    kernel spreads connections across them. Elsewhere the supervisor binds
+    one listening socket and hands it to every worker, which then compete
+    in accept(). Dead workers are restarted with backoff, and the stats each
+    worker reports are aggregated and logged.
+
+    Streams are per worker: a player only sees publishers that landed on the
+    same worker process. SIGUSR1 is forwarded to every worker, which dumps
+    its sessions' chunk header traces. Each worker serves its own metrics
+    and media HTTP endpoints, on `metrics_port` and `http_port` + its
+    worker ID.
+    """
+
+    def __init__(
+        self,
+        workers,
+        host=rtmp.localhost,
+        port=rtmp.localport,
+        reuse_port=None,
+        log_level=rtmp.LOG_LEVEL,
+        trace_sample_rate=rtmp.TRACE_SAMPLE_RATE,
+        metrics_port=rtmp.METRICS_PORT,
+        capture_dir=rtmp.CAPTURE_DIR,
+        record_dir=rtmp.RECORD_DIR,
+        record_segment_bytes=rtmp.RECORD_SEGMENT_BYTES,
+        record_segment_seconds=rtmp.RECORD_SEGMENT_SECONDS,
+        hls_dir=rtmp.HLS_DIR,
+        hls_format=rtmp.HLS_FORMAT,
+        hls_segment_seconds=rtmp.HLS_SEGMENT_SECONDS,
+        hls_playlist_length=rtmp.HLS_PLAYLIST_LENGTH,
+        http_port=rtmp.HTTP_PORT,
+        h264_profiles=rtmp.H264_PROFILES,
+        digest_handshake=rtmp.DIGEST_HANDSHAKE,
+        tuning=None,
+    ):
+        self.host = host
+        self.port = port
+        self.reuse_port = has_reuse_port() if reuse_port is None else reuse_port
+        self.log_level = log_level
+        self.trace_sample_rate = trace_sample_rate
+        self.metrics_port = metrics_port
+        self.capture_dir = capture_dir
+        self.record_dir = record_dir
+        self.record_segment_bytes = record_segment_bytes
+        self.record_segment_seconds = record_segment_seconds
+        self.hls_dir = hls_dir
+        self.hls_format = hls_format
+        self.hls_segment_seconds = hls_segment_seconds
+        self.hls_playlist_length = hls_playlist_length
+        self.http_port = http_port
+        self.h264_profiles = h264_profiles
+        self.digest_handshake = digest_handshake
+        self.tuning = TuningSettings() if tuning is None else tuning
+        self.context = multiprocessing.get_context()
+        self.stats_queue = self.context.Queue()
+        self.workers = [WorkerProcess(worker_id) for worker_id in range(workers)]
+        self.worker_stats = {}  # worker id -> latest stats dict
+        self.sock = None
+
+    def start_worker(self, worker):
+        worker.process = self.context.Process(
+            target=worker_main,
+            args=(
+                worker.worker_id,
+                self.host,
+                self.port,
+                self.stats_queue,
+                self.sock,
+                self.reuse_port,
+                self.log_level,
+                self.trace_sample_rate,
+                self.metrics_port and self.metrics_port + worker.worker_id,
+                self.capture_dir,
+                self.record_dir,
+                self.record_segment_bytes,
+                self.record_segment_seconds,
+                self.hls_dir,
+                self.hls_format,
+                self.hls_segment_seconds,
+                self.hls_playlist_length,
+                self.http_port and self.http_port + worker.worker_id,
+                self.h264_profiles,
+                self.digest_handshake,
+                self.tuning,
+            ),
+            name=f"rtmp-worker-{worker.worker_id}",
+            daemon=True,
+        )
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        worker.restart_at = None
+        logging.info(f"Started worker {worker.worker_id} (pid {worker.process.pid})")
+
+    def check_workers(self):
+        """Schedules restarts for dead workers and starts the ones that are due."""
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.restart_at is not None:
+                if now >= worker.restart_at:
+                    worker.restarts += 1
+                    self.start_worker(worker)
+                continue
+
+            if worker.process.is_alive():
+                continue
+
+            if now - worker.started_at >= WORKER_STABLE_AFTER:
+                worker.restart_delay = RESTART_DELAY_MIN
+            delay = worker.restart_delay
+            worker.restart_delay = min(delay * 2, RESTART_DELAY_MAX)
+            worker.restart_at = now + delay
+            self.worker_stats.pop(worker.worker_id, None)
+            logging.error(
+                f"Worker {worker.worker_id} (pid {worker.process.pid}) exited with "
+                f"code {worker.process.exitcode}; restarting in {delay:.0f}s."
+            )
+
+    def collect_stats(self, timeout):
+        """Drains worker stats from the queue, waiting up to `timeout` for the first."""
+        try:
+            stats = self.stats_queue.get(timeout=timeout)
+            while True:
+                self.worker_stats[stats["worker"]] = stats
+                stats = self.stats_queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def aggregate_stats(self):
+        totals = {"workers": len(self.worker_stats)}
+        for stats in self.worker_stats.values():
+            for key, value in stats.items():
+                if key not in ("worker", "pid", "uptime"):
+                    totals[key] = totals.get(key, 0) + value
+        totals["restarts"] = sum(worker.restarts for worker in self.workers)
+        return totals
+
+    def stop(self):
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                worker.process.terminate()
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.process.join(timeout=5)
+                if worker.process.is_alive():
+                    worker.process.kill()
+        if self.sock is not None:
+            self.sock.close()
+
+    def run(self):
+        """Starts the workers and supervises them until interrupted."""
+
+        def handle_sigterm(signum, frame):
+            raise SystemExit(0)
+
+        def forward_sigusr1(signum, frame):
+            for worker in self.workers:
+                if worker.process is not None and worker.process.is_alive():
+                    os.kill(worker.process.pid, signal.SIGUSR1)
+
+        signal.signal(signal.SIGTERM, handle_sigterm)
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, forward_sigusr1)
+
+        if not self.reuse_port:
+            self.sock = create_listen_socket(self.host, self.port, self.tuning)
+
+        mode = "SO_REUSEPORT" if self.reuse_port else "shared socket"
+        logging.info(
+            f"Starting {len(self.workers)} RTMP workers on "
+            f"{self.host}:{self.port} ({mode})"
+        )
+        for worker in self.workers:
+            self.start_worker(worker)
+
+        if rtmp.launchStreamWithFFMPEG == True:
+            rtmp.RTMPServer(self.host, self.port).launch_audiovideostream()
+
+        last_log = time.monotonic()
+        try:
+            while True:
+                self.collect_stats(SUPERVISOR_POLL_INTERVAL)
+                self.check_workers()
+                if time.monotonic() - last_log >= SUPERVISOR_LOG_INTERVAL:
+                    last_log = time.monotonic()
+                    logging.info(f"Worker stats: {self.aggregate_stats()}")
+        except KeyboardInterrupt:
+            logging.info("Shutting down workers...")
+        finally:
+            self.stop()
@@ -0,0 +1,94 @@
+import asyncio
+
+import RTMPServer as rtmp
+from rtmp_chunk import ChunkDemuxer
+
+PEER = ("127.0.0.1", 50000)
+
+
+class FakeTransport:
+    """A transport that keeps everything written to it."""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.closing = False
+        self.reading = True
+
+    def write(self, data):
+        self.data += data
+
+    def writelines(self, data):
+        for chunk in data:
+            self.data += chunk
+
+    def get_extra_info(self, name, default=None):
+        return PEER if name == "peername" else default
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        pass
+
+    def is_closing(self):
+        return self.closing
+
+    def close(self):
+        self.closing = True
+
+    def pause_reading(self):
+        self.reading = False
+
+    def resume_reading(self):
+        self.reading = True
+
+
+class FakeWriter:
+    """A StreamWriter stand-in over a FakeTransport."""
+
+    def __init__(self):
+        self.transport = FakeTransport()
+
+    @property
+    def data(self):
+        return self.transport.data
+
+    def write(self, data):
+        self.transport.write(data)
+
+    def writelines(self, data):
+        self.transport.writelines(data)
+
+    def get_extra_info(self, name, default=None):
+        return self.transport.get_extra_info(name, default)
+
+    async def drain(self):
+        pass
+
+    def is_closing(self):
+        return self.transport.closing
+
+    def close(self):
+        self.transport.close()
+
+    async def wait_closed(self):
+        pass
+
+
+def new_server(**options):
+    """An RTMPServer that opens no metrics or media HTTP ports."""
+    options.setdefault("metrics_port", 0)
+    options.setdefault("http_port", 0)
+    options.setdefault("trace_sample_rate", 0.0)
+    return rtmp.RTMPServer("127.0.0.1", 0, **options)
+
+
+def read_messages(data):
+    """The RTMP messages in chunks a server wrote (after its handshake)."""
+    consumed, messages = ChunkDemuxer().parse(bytes(data))
+    assert consumed == len(data)
+    return messages
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
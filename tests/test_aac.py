@@ -0,0 +1,250 @@
+import logging
+
+import pytest
+
+import aac
+import metrics
+from rtmp_chunk import RTMPMessage
+from rtmp_live import RTMP_MSG_TYPE_AUDIO
+from support import FakeWriter, new_server, run
+
+LC_44100_STEREO = bytes.fromhex("1210")
+FRAME_DURATION = 1024000 / 44100  # ms
+
+
+def config_bits(bits):
+    """An AudioSpecificConfig from a string of bits, zero padded."""
+    bits += "0" * (-len(bits) % 8)
+    return bytes(int(bits[i : i + 8], 2) for i in range(0, len(bits), 8))
+
+
+def sequence_header(config=LC_44100_STEREO):
+    return b"\xaf\x00" + config
+
+
+def frame(size=10):
+    return b"\xaf\x01" + bytes(size)
+
+
+def inspector_after(timestamps, video_timestamp=None):
+    """An AACInspector fed an LC 44.1 kHz sequence header, then frames."""
+    inspector = aac.AACInspector()
+    inspector.inspect(0, sequence_header())
+    for timestamp in timestamps:
+        if video_timestamp is not None:
+            inspector.video_timestamp = video_timestamp(timestamp)
+        inspector.inspect(timestamp & 0xFFFFFFFF, frame())
+    return inspector
+
+
+def steady(count, start=0, step=FRAME_DURATION):
+    return [start + round(i * step) for i in range(count)]
+
+
+@pytest.mark.parametrize(
+    "config, profile, core, rates, channels, frame_samples, adts",
+    [
+        (LC_44100_STEREO, "lc", 2, (44100, 44100), 2, 1024, True),
+        (bytes.fromhex("1190"), "lc", 2, (48000, 48000), 2, 1024, True),
+        (bytes.fromhex("1388"), "lc", 2, (22050, 22050), 1, 1024, True),
+        (bytes.fromhex("11b0"), "lc", 2, (48000, 48000), 6, 1024, True),
+        # Explicit HE-AAC: timed at the core rate, output at twice that
+        (bytes.fromhex("2b920800"), "he-aac", 2, (22050, 44100), 2, 1024, True),
+        (bytes.fromhex("eb098800"), "he-aacv2", 2, (24000, 48000), 1, 1024, True),
+        # frameLengthFlag: 960-sample frames, which ADTS can't carry
+        (bytes.fromhex("1214"), "lc", 2, (44100, 44100), 2, 960, False),
+        # An explicit sampling rate isn't in ADTS's table
+        (
+            config_bits("00010" "1111" + format(44056, "024b") + "0010"),
+            "lc",
+            2,
+            (44056, 44056),
+            2,
+            1024,
+            False,
+        ),
+        # Escaped object type 33
+        (
+            config_bits("11111" "000001" "0011" "0001"),
+            "33",
+            33,
+            (48000,) * 2,
+            1,
+            1024,
+            False,
+        ),
+        # AAC-LD: 480 samples with frameLengthFlag
+        (config_bits("10111" "0011" "0001" "1"), "ld", 23, (48000,) * 2, 1, 480, False),
+    ],
+)
+def test_audio_specific_config(
+    config, profile, core, rates, channels, frame_samples, adts
+):
+    parsed = aac.AudioSpecificConfig(config)
+    assert parsed.config == config
+    assert parsed.profile == profile
+    assert parsed.core_object_type == core
+    assert (parsed.sample_rate, parsed.output_sample_rate) == rates
+    assert parsed.channels == channels
+    assert parsed.frame_samples == frame_samples
+    assert parsed.frame_duration == pytest.approx(1000 * frame_samples / rates[0])
+    assert parsed.adts == adts
+
+
+@pytest.mark.parametrize(
+    "config",
+    [
+        b"",
+        b"\x12",  # No channel configuration
+        config_bits("00010" "1101" "0010"),  # Reserved sampling frequency index
+        config_bits("00010" "1111" + "0" * 24 + "0010"),  # Zero sampling rate
+        config_bits("00101" "0111" "0010"),  # HE-AAC without its core type
+    ],
+)
+def test_audio_specific_config_errors(config):
+    with pytest.raises(aac.AACError):
+        aac.AudioSpecificConfig(config)
+
+
+def test_adts_header():
+    header = aac.AudioSpecificConfig(LC_44100_STEREO).adts_header(100)
+    assert header == bytes.fromhex("fff150800d7ffc")
+    value = int.from_bytes(header, "big")
+    assert value >> 44 == 0xFFF  # Syncword
+    assert (value >> 38) & 0x03 == 1  # Profile: object type - 1
+    assert (value >> 34) & 0x0F == 4  # 44100 Hz
+    assert (value >> 13) & 0x1FFF == aac.ADTS_HEADER_SIZE + 100
+
+    # HE-AAC goes in as its core profile and rate
+    header = aac.AudioSpecificConfig(bytes.fromhex("2b920800")).adts_header(100)
+    assert header[2] >> 6 == 1
+    assert (header[2] >> 2) & 0x0F == 7  # 22050 Hz
+
+
+def test_signed_timestamp_difference():
+    assert aac._signed(5) == 5
+    assert aac._signed(-5 & 0xFFFFFFFF) == -5
+    assert aac._signed(0x10 - 0xFFFFFFF0) == 0x20  # Across wraparound
+
+
+def test_inspector_steady_stream():
+    inspector = inspector_after(steady(1000))
+
+    assert inspector.frames == 1000
+    assert inspector.frame_duration == pytest.approx(FRAME_DURATION)
+    assert inspector.span_frames == 999
+    assert abs(inspector.drift) < 1
+    assert inspector.max_drift <= 1
+    assert inspector.jitter < 0.5
+    assert (inspector.gaps, inspector.discontinuities) == (0, 0)
+    assert inspector.av_offset is None  # No video
+
+
+def test_inspector_ignores_other_tags():
+    inspector = aac.AACInspector()
+    assert inspector.inspect(0, frame()) is None  # Before any sequence header
+    assert inspector.inspect(0, b"\x2f\x01\x00") is None  # MP3
+    assert inspector.inspect(0, b"\xaf") is None
+    assert inspector.frames == 0
+
+    config = inspector.inspect(0, sequence_header())
+    assert config.sample_rate == 44100
+    assert inspector.config is config
+    with pytest.raises(aac.AACError):
+        inspector.inspect(0, sequence_header(b"\x12"))
+
+
+def test_inspector_measures_drift():
+    # Timestamps running 25 ms per 23.2 ms frame
+    inspector = inspector_after(steady(101, step=25))
+    assert inspector.drift == pytest.approx(100 * (25 - FRAME_DURATION))
+    assert inspector.max_drift == inspector.drift
+    assert inspector.jitter > 1
+    assert inspector.gaps == 0
+
+
+def test_inspector_gaps_restart_the_timeline():
+    gap = 10 * FRAME_DURATION
+    timestamps = steady(100, step=25)
+    timestamps += steady(11, start=round(timestamps[-1] + gap))
+    inspector = inspector_after(timestamps)
+
+    assert inspector.gaps == 1
+    assert inspector.gap_time == pytest.approx(gap - FRAME_DURATION, abs=1)
+    assert inspector.span_frames == 10
+    assert abs(inspector.drift) < 1
+    assert inspector.max_drift > 100  # Kept from before the gap
+
+
+def test_inspector_backward_steps_restart_the_timeline():
+    timestamps = steady(50) + steady(5, start=500)
+    inspector = inspector_after(timestamps)
+    assert inspector.discontinuities == 1
+    assert inspector.gaps == 0
+    assert inspector.span_frames == 4
+
+
+def test_inspector_follows_timestamps_across_wraparound():
+    inspector = inspector_after(steady(100, start=0xFFFFFF00))
+    assert (inspector.discontinuities, inspector.gaps) == (0, 0)
+    assert inspector.span_frames == 99
+    assert abs(inspector.drift) < 1
+
+
+def test_inspector_sequence_header_restarts_the_timeline():
+    inspector = inspector_after(steady(50, step=25))
+    inspector.drift_warned = True
+    inspector.inspect(2000, sequence_header(bytes.fromhex("1190")))
+    assert inspector.frame_duration == pytest.approx(1024000 / 48000)
+    assert (inspector.span_frames, inspector.drift) == (0, 0.0)
+    assert not inspector.drift_warned
+
+    inspector.inspect(5000, frame())  # Starts the new timeline: not a gap
+    assert inspector.gaps == 0
+
+
+def test_inspector_smooths_the_av_offset():
+    inspector = inspector_after(steady(100), lambda timestamp: timestamp - 40)
+    assert inspector.av_offset == pytest.approx(40)
+
+    inspector.video_timestamp = 0
+    inspector.inspect(aac.SMOOTHING * 10, frame())
+    assert inspector.av_offset == pytest.approx(40 + (160 - 40) / aac.SMOOTHING)
+
+    # Audio just past wraparound, video just before it
+    inspector = inspector_after([5], lambda timestamp: 0xFFFFFFFF)
+    assert inspector.av_offset == 6
+
+
+def test_server_logs_config_and_drift_once(caplog):
+    async def main():
+        server = new_server()
+        stream = server.get_stream("cam")
+        stream.publisher = server.open_session(FakeWriter())
+        timestamps = [0] + steady(30, step=30)
+        payloads = [sequence_header()] + [frame()] * 30
+        for timestamp, payload in zip(timestamps, payloads):
+            message = RTMPMessage(4, RTMP_MSG_TYPE_AUDIO, 1, timestamp, payload)
+            server.inspect_audio(stream, message)
+        server.inspect_audio(
+            stream, RTMPMessage(4, RTMP_MSG_TYPE_AUDIO, 1, 0, sequence_header(b"\x12"))
+        )
+        return server, stream
+
+    with caplog.at_level(logging.INFO):
+        server, stream = run(main())
+    messages = [record.getMessage() for record in caplog.records]
+    assert "Stream 'cam' audio: AAC lc, 44100 Hz, 2 channel(s)" in "\n".join(messages)
+    drift = [text for text in messages if "drifted" in text]
+    assert len(drift) == 1
+    assert any("bad AAC sequence header" in text for text in messages)
+
+    text = metrics.render(server)
+    labels = 'stream="cam"'
+    assert (
+        f'rtmp_stream_audio_info{{{labels},profile="lc",sample_rate="44100",'
+        'channels="2"} 1'
+    ) in text
+    drift_seconds = stream.metrics.aac.drift / 1000
+    assert f"rtmp_stream_audio_drift_seconds{{{labels}}} {drift_seconds}" in text
+    assert f"rtmp_stream_audio_gaps_total{{{labels}}} 0" in text
@@ -0,0 +1,83 @@
+import datetime
+
+import pytest
+
+import amf0
+
+VALUES = [
+    0.0,
+    -1.5,
+    True,
+    False,
+    "",
+    "stream",
+    "x" * 70000,  # Long string
+    None,
+    amf0.UNDEFINED,
+    amf0.UNSUPPORTED,
+    {"app": "live", "nested": {"flag": True}},
+    amf0.ECMAArray(duration=0.0, width=1280.0),
+    amf0.TypedObject("flex.Class", {"id": 1.0}),
+    [1.0, "two", None, [3.0]],
+    amf0.XMLDocument("<a/>"),
+    datetime.datetime(2024, 5, 6, 7, 8, 9, 250000, tzinfo=datetime.timezone.utc),
+]
+
+
+@pytest.mark.parametrize("value", VALUES, ids=lambda value: type(value).__name__)
+def test_round_trip(value):
+    (decoded,) = amf0.decode_all(amf0.encode(value))
+    assert decoded == value and type(decoded) is type(value)
+    if isinstance(value, amf0.TypedObject):
+        assert decoded.class_name == value.class_name
+
+
+def test_known_encodings():
+    assert amf0.encode("connect", 1.0, None) == (
+        b"\x02\x00\x07connect" + b"\x00?\xf0\x00\x00\x00\x00\x00\x00" + b"\x05"
+    )
+    assert amf0.encode({}) == b"\x03\x00\x00\x09"
+    assert amf0.encode(amf0.ECMAArray(a=True)) == (
+        b"\x08\x00\x00\x00\x01" + b"\x00\x01a\x01\x01" + b"\x00\x00\x09"
+    )
+    assert amf0.encode(3) == amf0.encode(3.0)
+
+
+def test_references_resolve_to_the_same_object():
+    data = amf0.encode({"a": 1.0}) + b"\x0a\x00\x00\x00\x02\x07\x00\x00\x07\x00\x00"
+    first, array = amf0.decode_all(data)
+    assert array == [first, first] and array[0] is first
+
+
+def test_latin1_strings_still_decode():
+    assert amf0.decode_all(b"\x02\x00\x04caf\xe9") == ["caf\xe9"]
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"\x00\x3f\xf0",  # Truncated number
+        b"\x02\x00\x10abc",  # String longer than the data
+        b"\x03\x00\x01a",  # Object without a value or end marker
+        b"\x0a\xff\xff\xff\xff",  # Strict array count past the end
+        b"\x07\x00\x00",  # Reference to nothing decoded yet
+        b"\x09",  # Object end outside an object
+        b"\x11",  # AMF3 switch
+        b"\x42",  # Unknown marker
+    ],
+)
+def test_malformed_data_raises(data):
+    with pytest.raises(amf0.AMF0DecodeError):
+        amf0.decode_all(data)
+
+
+def test_values_before_malformed_data_are_yielded():
+    values = amf0.iter_values(amf0.encode("publish", 5.0) + b"\x42")
+    assert next(values) == "publish" and next(values) == 5.0
+    with pytest.raises(amf0.AMF0DecodeError):
+        next(values)
+
+
+def test_unencodable_values_raise_type_error():
+    with pytest.raises(TypeError):
+        amf0.encode(object())
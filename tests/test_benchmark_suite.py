@@ -0,0 +1,65 @@
+import argparse
+import json
+
+import pytest
+
+import amf0
+import RTMPServer as rtmp
+import suite
+from rtmp_chunk import ChunkDemuxer
+
+
+@pytest.fixture(scope="module")
+def workload():
+    return suite.build_workload(argparse.Namespace(input=None, messages=60))
+
+
+def test_synthetic_workload_is_a_publish_session(workload):
+    setup = ChunkDemuxer().parse(b"".join(workload["setup_reads"]))[1]
+    commands = [
+        amf0.decode_all(m.payload)[0]
+        for m in setup
+        if m.msg_type == rtmp.RTMP_MSG_TYPE_COMMAND
+    ]
+    assert commands == [
+        "connect",
+        "releaseStream",
+        "FCPublish",
+        "createStream",
+        "publish",
+    ]
+    assert len(workload["reads"]) == workload["count"] == 60
+    assert workload["media"][0].payload[:2] == b"\x17\x01"  # Starts on a keyframe
+
+
+@pytest.mark.parametrize("name", sorted(suite.BENCHMARKS))
+def test_every_benchmark_runs(workload, name):
+    result = suite.measure(suite.BENCHMARKS[name], workload)
+    assert set(suite.COMPARED_METRICS) <= set(result)
+    assert result["messages"] > 0 and result["messages_per_sec"] > 0
+
+
+def write_report(path, results):
+    path.write_text(json.dumps({"results": results}))
+    return str(path)
+
+
+def test_compare_fails_only_on_regressions(tmp_path, capsys):
+    metrics = dict.fromkeys(suite.COMPARED_METRICS, 100.0)
+    baseline = write_report(tmp_path / "baseline.json", {"demux": metrics})
+    faster = write_report(
+        tmp_path / "faster.json", {"demux": dict(metrics, messages_per_sec=150.0)}
+    )
+    slower = write_report(
+        tmp_path / "slower.json", {"demux": dict(metrics, p99_us=120.0)}
+    )
+
+    suite.compare(argparse.Namespace(baseline=baseline, current=faster, threshold=0.1))
+    with pytest.raises(SystemExit) as exit_info:
+        suite.compare(
+            argparse.Namespace(baseline=baseline, current=slower, threshold=0.1)
+        )
+    assert exit_info.value.code == 1
+    out = capsys.readouterr().out
+    (regression,) = [line for line in out.splitlines() if "REGRESSION" in line]
+    assert regression.split()[1] == "p99_us"
@@ -0,0 +1,71 @@
+import asyncio
+
+import RTMPServer as rtmp
+import replay
+import suite
+from rtmp_capture import CaptureWriter, is_capture, read_capture
+from support import FakeTransport, new_server, run
+
+C0C1 = bytes((rtmp.RTMP_VERSION,)) + bytes(rtmp.RTMP_HANDSHAKE_SIZE)
+C2 = bytes(rtmp.RTMP_HANDSHAKE_SIZE)
+CONNECT = suite.mux_reads([suite.command("connect", 1, {"app": "live"})])[0]
+
+
+def test_reads_round_trip_through_a_capture_file(tmp_path):
+    writer = CaptureWriter(str(tmp_path), max_queued_bytes=1 << 20)
+    capture = writer.open(("10.0.0.1", 51000), started=0.0)
+    capture.write(b"\x03" + bytes(10))
+    capture.write(memoryview(b"chunk"))
+    capture.close()
+    capture.write(b"after close")
+    writer.close()
+
+    assert capture.path.endswith("-10.0.0.1_51000.rtmpcap")
+    assert is_capture(capture.path)
+    records = read_capture(capture.path)
+    assert [data for _, data in records] == [b"\x03" + bytes(10), b"chunk"]
+    assert 0 < records[0][0] <= records[1][0]
+
+    # A file cut off mid-record keeps the records before it
+    with open(capture.path, "r+b") as f:
+        f.truncate(f.seek(0, 2) - 1)
+    assert [data for _, data in read_capture(capture.path)] == [b"\x03" + bytes(10)]
+
+
+def test_a_capture_falling_behind_is_truncated(tmp_path):
+    writer = CaptureWriter(str(tmp_path), max_queued_bytes=100)
+    capture = writer.open(None)
+    capture.write(bytes(50))
+    writer.queued_bytes += 1000  # As if the thread were 1000 bytes behind
+    capture.write(bytes(50))
+    assert capture.dropped
+    writer.close()
+    assert [len(data) for _, data in read_capture(capture.path)] == [50]
+
+
+def test_a_captured_session_replays_the_same_way(tmp_path):
+    async def main():
+        server = new_server(capture_dir=str(tmp_path))
+        transport = FakeTransport()
+        protocol = rtmp.RTMPProtocol(server)
+        protocol.connection_made(transport)
+        for data in (C0C1, C2, CONNECT):
+            buffer = protocol.get_buffer(len(data))
+            buffer[: len(data)] = data
+            protocol.buffer_updated(len(data))
+            await asyncio.sleep(0)
+        while protocol.command_task is not None:
+            await asyncio.sleep(0)
+        protocol.connection_lost(None)
+        server.capture.close()
+
+        (path,) = tmp_path.iterdir()
+        records = read_capture(path)
+        assert b"".join(data for _, data in records) == C0C1 + C2 + CONNECT
+        counts, commands, error = replay.summarize(records)
+        assert commands == ["connect"] and error is None
+        consumed, written = await replay.replay_protocol(records, paced=False)
+        assert consumed == len(records)
+        assert written > rtmp.HANDSHAKE_RESPONSE_SIZE  # Answered the connect
+
+    run(main())
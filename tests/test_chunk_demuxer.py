@@ -0,0 +1,123 @@
+import struct
+
+import pytest
+
+from rtmp_chunk import ChunkDemuxer, ChunkProtocolError
+
+
+def chunk(fmt, csid, timestamp=0, length=0, msg_type=0, stream_id=0, data=b""):
+    """One chunk with a 1-byte basic header and the fmt's message header."""
+    header = bytes(((fmt << 6) | csid,))
+    extended = timestamp >= 0xFFFFFF
+    if fmt < 3:
+        header += min(timestamp, 0xFFFFFF).to_bytes(3, "big")
+    if fmt < 2:
+        header += length.to_bytes(3, "big") + bytes((msg_type,))
+    if fmt == 0:
+        header += struct.pack("<I", stream_id)
+    if extended:
+        header += struct.pack(">I", timestamp)
+    return header + data
+
+
+def parse_all(demuxer, data):
+    consumed, messages = demuxer.parse(data)
+    assert consumed == len(data)
+    return messages
+
+
+def test_single_chunk_message():
+    (message,) = parse_all(ChunkDemuxer(), chunk(0, 3, 1000, 5, 0x14, 1, b"hello"))
+    assert (message.csid, message.msg_type, message.stream_id) == (3, 0x14, 1)
+    assert message.timestamp == 1000
+    assert bytes(message.payload) == b"hello"
+
+
+def test_message_split_across_chunks():
+    payload = bytes(range(200))
+    data = chunk(0, 4, 0, 200, 9, 1, payload[:128]) + chunk(3, 4, data=payload[128:])
+    (message,) = parse_all(ChunkDemuxer(), data)
+    assert bytes(message.payload) == payload
+
+
+def test_interleaved_chunk_streams_assemble_independently():
+    video = b"v" * 200
+    audio = b"a" * 10
+    data = (
+        chunk(0, 6, 0, 200, 9, 1, video[:128])
+        + chunk(0, 4, 0, 10, 8, 1, audio)
+        + chunk(3, 6, data=video[128:])
+    )
+    messages = parse_all(ChunkDemuxer(), data)
+    assert [(m.msg_type, bytes(m.payload)) for m in messages] == [
+        (8, audio),
+        (9, video),
+    ]
+
+
+def test_partial_input_is_left_unconsumed():
+    data = chunk(0, 3, 0, 200, 9, 1, bytes(128)) + chunk(3, 3, data=bytes(72))
+    demuxer = ChunkDemuxer()
+    buffer = bytearray()
+    messages = []
+    for byte in data:
+        buffer.append(byte)
+        consumed, parsed = demuxer.parse(buffer)
+        del buffer[:consumed]
+        messages += parsed
+    assert not buffer
+    assert len(messages) == 1 and len(messages[0].payload) == 200
+
+
+def test_compressed_headers_reuse_previous_fields():
+    data = (
+        chunk(0, 5, 100, 3, 8, 1, b"abc")
+        + chunk(1, 5, 20, 2, 9, data=b"de")  # New length and type
+        + chunk(2, 5, 30, data=b"fg")  # Timestamp delta only
+        + chunk(3, 5, data=b"hi")  # Everything, delta included
+    )
+    messages = parse_all(ChunkDemuxer(), data)
+    assert [(m.timestamp, m.msg_type, m.stream_id) for m in messages] == [
+        (100, 8, 1),
+        (120, 9, 1),
+        (150, 9, 1),
+        (180, 9, 1),
+    ]
+
+
+def test_extended_timestamp_on_every_chunk():
+    timestamp = 0x1000000
+    data = chunk(0, 3, timestamp, 130, 9, 1, bytes(128)) + chunk(3, 3, data=b"")
+    # fmt 3 continuations repeat the extended timestamp
+    data += struct.pack(">I", timestamp) + bytes(2)
+    (message,) = parse_all(ChunkDemuxer(), data)
+    assert message.timestamp == timestamp
+    assert len(message.payload) == 130
+
+
+def test_two_and_three_byte_chunk_stream_ids():
+    two = bytes((0, 100)) + bytes(3) + (1).to_bytes(3, "big") + b"\x14" + bytes(4)
+    three = bytes((1, 0x10, 0x01)) + bytes(3) + (1).to_bytes(3, "big") + b"\x14"
+    three += bytes(4)
+    messages = parse_all(ChunkDemuxer(), two + b"x" + three + b"y")
+    assert [m.csid for m in messages] == [164, 64 + 0x10 + 0x100]
+
+
+def test_set_chunk_size_applies_to_the_rest_of_the_buffer():
+    payload = bytes(300)
+    data = chunk(0, 2, 0, 4, 1, 0, struct.pack(">I", 4096))
+    data += chunk(0, 6, 0, 300, 9, 1, payload)
+    demuxer = ChunkDemuxer()
+    messages = parse_all(demuxer, data)
+    assert demuxer.chunk_size == 4096
+    assert [len(m.payload) for m in messages] == [4, 300]
+
+
+def test_abort_discards_partial_message():
+    data = chunk(0, 6, 0, 200, 9, 1, bytes(128))
+    data += chunk(0, 2, 0, 4, 2, 0, struct.pack(">I", 6))
+    demuxer = ChunkDemuxer()
+    messages = parse_all(demuxer, data)
+    assert [m.msg_type for m in messages] == [2]
+    assert demuxer.chunk_streams[6].payload is None
+    assert demuxer.partial_messages == 0
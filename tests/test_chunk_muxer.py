@@ -0,0 +1,100 @@
+import struct
+
+from rtmp_chunk import (
+    CHUNK_FORMAT_FULL_HEADER,
+    CHUNK_FORMAT_NO_HEADER,
+    CHUNK_FORMAT_NO_STREAM_ID,
+    CHUNK_FORMAT_TIMESTAMP_ONLY,
+    ChunkDemuxer,
+    ChunkMuxer,
+    encode_basic_header,
+)
+
+
+def joined(chunks):
+    return b"".join(bytes(chunk) for chunk in chunks)
+
+
+def round_trip(muxer, messages):
+    data = b"".join(joined(muxer.mux(*message)) for message in messages)
+    consumed, parsed = ChunkDemuxer().parse(data)
+    assert consumed == len(data)
+    assert muxer.bytes_out == len(data)
+    return [
+        (m.csid, m.msg_type, m.stream_id, m.timestamp, bytes(m.payload)) for m in parsed
+    ]
+
+
+def test_header_compression_picks_the_smallest_format():
+    muxer = ChunkMuxer()
+    formats = []
+    for timestamp, msg_type, payload in (
+        (0, 9, b"aaaa"),
+        (40, 9, b"bbbbbb"),  # New length: fmt 1
+        (70, 9, b"cccccc"),  # New delta only: fmt 2
+        (100, 9, b"dddddd"),  # Same delta and header: fmt 3
+        (90, 9, b"eeeeee"),  # Timestamp went back: fmt 0
+    ):
+        chunks = muxer.mux(6, msg_type, 1, timestamp, payload)
+        formats.append(chunks[0][0] >> 6)
+    assert formats == [
+        CHUNK_FORMAT_FULL_HEADER,
+        CHUNK_FORMAT_TIMESTAMP_ONLY,
+        CHUNK_FORMAT_NO_STREAM_ID,
+        CHUNK_FORMAT_NO_HEADER,
+        CHUNK_FORMAT_FULL_HEADER,
+    ]
+
+
+def test_round_trip_through_the_demuxer():
+    messages = [
+        (4, 8, 1, 0, b"a" * 10),
+        (6, 9, 1, 0, bytes(range(256)) * 3),  # Split into 128-byte chunks
+        (4, 8, 1, 23, b"b" * 10),
+        (6, 9, 1, 33, b"c" * 700),
+        (6, 9, 1, 66, b"d" * 700),
+        (3, 0x14, 0, 0, b"command"),
+        (6, 9, 2, 99, b"other stream"),  # New stream ID: fmt 0
+    ]
+    assert round_trip(ChunkMuxer(), messages) == [
+        (csid, msg_type, stream_id, timestamp, payload)
+        for csid, msg_type, stream_id, timestamp, payload in messages
+    ]
+
+
+def test_extended_timestamps_round_trip():
+    messages = [
+        (6, 9, 1, 0xFFFFFF, b"x" * 300),
+        (6, 9, 1, 0x1FFFFFE, b"y" * 300),  # Delta 0xFFFFFF, extended too
+    ]
+    assert [m[3] for m in round_trip(ChunkMuxer(), messages)] == [
+        0xFFFFFF,
+        0x1FFFFFE,
+    ]
+
+
+def test_payload_is_sliced_not_copied():
+    payload = bytearray(1000)
+    chunks = ChunkMuxer().mux(6, 9, 1, 0, payload)
+    slices = chunks[1::2]
+    assert all(isinstance(piece, memoryview) for piece in slices)
+    assert all(piece.obj is payload for piece in slices)
+    assert [len(piece) for piece in slices] == [128] * 7 + [104]
+
+
+def test_set_chunk_size_applies_to_later_messages():
+    muxer = ChunkMuxer()
+    muxer.mux(2, 1, 0, 0, struct.pack(">I", 4096))
+    assert muxer.chunk_size == 4096
+    assert len(muxer.mux(6, 9, 1, 0, bytes(4000))) == 2  # One chunk
+
+
+def test_basic_header_sizes():
+    assert encode_basic_header(0, 63) == b"\x3f"
+    assert encode_basic_header(1, 64) == b"\x40\x00"
+    assert encode_basic_header(0, 319) == b"\x00\xff"
+    assert encode_basic_header(3, 320) == b"\xc1\x00\x01"
+    assert round_trip(ChunkMuxer(), [(320, 9, 1, 0, b"a"), (65599, 9, 1, 0, b"b")]) == [
+        (320, 9, 1, 0, b"a"),
+        (65599, 9, 1, 0, b"b"),
+    ]
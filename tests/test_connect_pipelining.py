@@ -0,0 +1,100 @@
+import asyncio
+import time
+
+import amf0
+import RTMPServer as rtmp
+from rtmp_chunk import ChunkMuxer
+from support import FakeWriter, new_server, read_messages, run
+
+C0C1 = bytes((rtmp.RTMP_VERSION,)) + bytes(rtmp.RTMP_HANDSHAKE_SIZE)
+C2 = bytes(rtmp.RTMP_HANDSHAKE_SIZE)
+HANDSHAKE_RESPONSE_SIZE = 1 + 2 * rtmp.RTMP_HANDSHAKE_SIZE
+
+
+class CountingWriter(FakeWriter):
+    """Records the size of every write the server makes."""
+
+    def __init__(self):
+        super().__init__()
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(len(data))
+        super().write(data)
+
+    def writelines(self, data):
+        data = list(data)
+        self.writes.append(sum(map(len, data)))
+        super().writelines(data)
+
+
+def commands(*calls):
+    muxer = ChunkMuxer()
+    data = bytearray()
+    for stream_id, values in calls:
+        for chunk in muxer.mux(
+            3, rtmp.RTMP_MSG_TYPE_COMMAND, stream_id, 0, amf0.encode(*values)
+        ):
+            data += chunk
+    return bytes(data)
+
+
+def test_pipelined_publish_is_answered_in_one_write_without_sleeping():
+    async def main():
+        server = new_server()
+        reader = asyncio.StreamReader()
+        writer = CountingWriter()
+        reader.feed_data(C0C1 + C2)
+        reader.feed_data(
+            commands(
+                (0, ("connect", 1.0, {"app": "live", "tcUrl": "rtmp://host/live"})),
+                (0, ("releaseStream", 2.0, None, "cam")),
+                (0, ("FCPublish", 3.0, None, "cam")),
+                (0, ("createStream", 4.0, None)),
+                (1, ("publish", 5.0, None, "cam", "live")),
+            )
+        )
+        reader.feed_eof()
+        started = time.monotonic()
+        await server.handle_client(reader, writer)
+        assert time.monotonic() - started < 0.1
+
+        assert writer.writes[0] == HANDSHAKE_RESPONSE_SIZE
+        assert len(writer.writes) == 2
+        messages = read_messages(writer.data[HANDSHAKE_RESPONSE_SIZE:])
+        assert [m.msg_type for m in messages[:3]] == [
+            rtmp.RTMP_MSG_TYPE_SET_CHUNK_SIZE,
+            rtmp.RTMP_MSG_TYPE_WINDOW_ACK_SIZE,
+            rtmp.RTMP_MSG_TYPE_SET_PEER_BANDWIDTH,
+        ]
+        replies = [
+            amf0.decode_all(m.payload)
+            for m in messages
+            if m.msg_type == rtmp.RTMP_MSG_TYPE_COMMAND
+        ]
+        assert replies[0][:2] == ["_result", 1.0]
+        assert ["_result", 4.0, None, 1.0] in replies
+        assert replies[-1][3]["code"] == "NetStream.Publish.Start"
+
+    run(main())
+
+
+def test_a_null_tc_url_does_not_break_later_connects():
+    async def main():
+        server = new_server()
+        results = []
+        for tc_url in (None, "rtmp://host/live"):
+            writer = FakeWriter()
+            session = server.open_session(writer)
+            await server.handle_connect(1.0, {"app": "live", "tcUrl": tc_url}, session)
+            assert not writer.is_closing()
+            replies = [
+                amf0.decode_all(m.payload)
+                for m in read_messages(writer.data)
+                if m.msg_type == rtmp.RTMP_MSG_TYPE_COMMAND
+            ]
+            results.append(replies[0])
+        assert [r[:2] for r in results] == [["_result", 1.0]] * 2
+        assert [r[3]["tcUrl"] for r in results] == ["", "rtmp://host/live"]
+
+    run(main())
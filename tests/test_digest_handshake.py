@@ -0,0 +1,64 @@
+import hashlib
+import hmac
+
+import pytest
+
+import rtmp_handshake as handshake
+from rtmp_handshake import S1Pool, generate_c1, handshake_response
+from support import new_server
+
+
+@pytest.mark.parametrize("scheme", [0, 1])
+def test_a_signed_c1_gets_a_digest_answer(scheme):
+    c1 = generate_c1(digest=True, scheme=scheme)
+    (s0, s1, s2_random, s2_digest), digest = handshake_response(c1, S1Pool(4), True)
+    s1, s2 = bytes(s1), bytes(s2_random) + s2_digest
+    assert digest and s0 == b"\x03" and len(s1) == len(s2) == 1536
+    assert s1[4:8] == handshake.S1_DIGEST_VERSION
+    assert handshake.find_digest(s1, handshake.FMS_DIGEST)[0] == scheme
+    assert handshake.verify_digest_response(c1, s1, s2)
+
+    # Check S2 against the key derivation spelled out in full
+    offset = handshake.find_digest(c1, handshake.FP_DIGEST)[1]
+    key = hmac.new(
+        handshake.GENUINE_FMS_KEY, c1[offset : offset + 32], hashlib.sha256
+    ).digest()
+    assert s2[-32:] == hmac.new(key, s2[:-32], hashlib.sha256).digest()
+
+
+def test_the_client_side_answers_a_signed_s1():
+    s1 = bytearray(S1Pool(1).take())
+    s1[4:8] = handshake.S1_DIGEST_VERSION
+    handshake.sign_packet(s1, handshake.FMS_DIGEST, 1)
+    c2 = handshake.generate_c2(s1)
+    offset = handshake.find_digest(s1, handshake.FMS_DIGEST)[1]
+    expected = handshake.response_digest(
+        handshake.FP_RESPONSE_KEY, s1[offset : offset + 32], c2[:-32]
+    )
+    assert len(c2) == 1536 and c2[-32:] == expected
+
+
+def tampered(c1):
+    c1 = bytearray(c1)
+    c1[1000] ^= 0xFF
+    return bytes(c1)
+
+
+@pytest.mark.parametrize(
+    "c1, enabled",
+    [
+        (generate_c1(), True),  # Zero version: simple handshake
+        (generate_c1(digest=True), False),  # Digest handshake disabled
+        (tampered(generate_c1(digest=True)), True),  # Digest doesn't match
+    ],
+)
+def test_other_c1s_get_the_simple_handshake(c1, enabled):
+    (s0, s1, s2), digest = handshake_response(c1, S1Pool(4), enabled)
+    assert not digest and s2 == c1 and s1[:8] == bytes(8)
+
+
+def test_the_server_counts_digest_handshakes():
+    server = new_server(digest_handshake=True)
+    server.handshake_response(generate_c1())
+    server.handshake_response(generate_c1(digest=True))
+    assert server.metrics.digest_handshakes == 1
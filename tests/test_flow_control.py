@@ -0,0 +1,91 @@
+import asyncio
+import struct
+
+import RTMPServer as rtmp
+from support import FakeWriter, new_server, read_messages, run
+
+
+def new_session():
+    session = new_server().open_session(FakeWriter())
+    session.sent_ack_window = rtmp.WINDOW_ACK_SIZE  # As after connect
+    return session
+
+
+def sent(session):
+    return [
+        (message.msg_type, bytes(message.payload))
+        for message in read_messages(session.writer.data)
+    ]
+
+
+def control(session, msg_type, payload):
+    rtmp.CONTROL_MESSAGE_HANDLERS[msg_type](session, payload)
+
+
+def test_acknowledges_every_window_of_bytes_received():
+    async def main():
+        session = new_session()
+        control(session, rtmp.RTMP_MSG_TYPE_WINDOW_ACK_SIZE, struct.pack(">I", 1000))
+        for _ in range(6):
+            session.received(400)
+        ack = rtmp.RTMP_MSG_TYPE_ACK
+        assert sent(session) == [
+            (ack, struct.pack(">I", 1200)),
+            (ack, struct.pack(">I", 2400)),
+        ]
+
+    run(main())
+
+
+def test_peer_bandwidth_is_echoed_only_when_it_changes_our_window():
+    async def main():
+        session = new_session()
+        was = rtmp.RTMP_MSG_TYPE_WINDOW_ACK_SIZE
+        bandwidth = rtmp.RTMP_MSG_TYPE_SET_PEER_BANDWIDTH
+        control(session, bandwidth, struct.pack(">IB", rtmp.WINDOW_ACK_SIZE, 2))
+        assert session.send_window is None  # Dynamic without a hard limit
+        control(session, bandwidth, struct.pack(">IB", rtmp.WINDOW_ACK_SIZE, 0))
+        assert sent(session) == []
+        control(session, bandwidth, struct.pack(">IB", 5000000, 1))
+        assert session.send_window == rtmp.WINDOW_ACK_SIZE  # Soft: the smaller
+        control(session, bandwidth, struct.pack(">IB", 1000000, 0))
+        control(session, bandwidth, struct.pack(">IB", 1000000, 0))
+        assert sent(session) == [(was, struct.pack(">I", 1000000))]
+        assert session.send_window == session.sent_ack_window == 1000000
+
+    run(main())
+
+
+def test_relaying_waits_for_the_peer_to_acknowledge():
+    async def main():
+        session = new_session()
+        control(
+            session,
+            rtmp.RTMP_MSG_TYPE_SET_PEER_BANDWIDTH,
+            struct.pack(">IB", 5000, 0),
+        )
+        assert not session.send_window_full()  # Nothing acknowledged yet
+        control(session, rtmp.RTMP_MSG_TYPE_ACK, struct.pack(">I", 0))
+        session.send_message(6, rtmp.RTMP_MSG_TYPE_VIDEO, 1, 0, bytes(6000))
+        assert session.send_window_full()
+
+        waiter = asyncio.create_task(session.wait_send_window())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        acked = session.bytes_sent - 1000
+        control(session, rtmp.RTMP_MSG_TYPE_ACK, struct.pack(">I", acked))
+        await asyncio.wait_for(waiter, 1)
+        assert session.unacknowledged_bytes() == 1000
+
+    run(main())
+
+
+def test_ping_requests_are_answered():
+    async def main():
+        session = new_session()
+        ping = struct.pack(">HI", rtmp.USER_CONTROL_PING_REQUEST, 123456)
+        control(session, rtmp.RTMP_MSG_TYPE_USER_CONTROL, ping)
+        pong = struct.pack(">HI", rtmp.USER_CONTROL_PING_RESPONSE, 123456)
+        assert sent(session) == [(rtmp.RTMP_MSG_TYPE_USER_CONTROL, pong)]
+
+    run(main())
@@ -0,0 +1,88 @@
+import amf0
+from rtmp_chunk import RTMPMessage
+from rtmp_live import (
+    RTMP_MSG_TYPE_AUDIO,
+    RTMP_MSG_TYPE_DATA,
+    RTMP_MSG_TYPE_VIDEO,
+    LiveStream,
+)
+from rtmp_memory import MemoryBudget
+
+AVC_HEADER = b"\x17\x00" + bytes(10)
+AAC_HEADER = b"\xaf\x00\x12\x10"
+KEYFRAME = b"\x17\x01" + bytes(98)
+INTERFRAME = b"\x27\x01" + bytes(98)
+AUDIO = b"\xaf\x01" + bytes(8)
+
+
+def video(timestamp, payload):
+    return RTMPMessage(6, RTMP_MSG_TYPE_VIDEO, 1, timestamp, payload)
+
+
+def audio(timestamp, payload=AUDIO):
+    return RTMPMessage(4, RTMP_MSG_TYPE_AUDIO, 1, timestamp, payload)
+
+
+class Player:
+    """Records what a LiveStream queues for it."""
+
+    def __init__(self):
+        self.messages = []
+        self.waiting_for_keyframe = False
+
+    def enqueue(self, message):
+        self.messages.append(message)
+
+
+def publish(stream, messages):
+    for message in messages:
+        stream.broadcast(message)
+
+
+def test_late_joiner_gets_headers_and_current_gop():
+    stream = LiveStream("key", 10**6)
+    metadata = amf0.encode("@setDataFrame", "onMetaData", amf0.ECMAArray(width=1280.0))
+    first_gop = [video(0, KEYFRAME), audio(10), video(33, INTERFRAME)]
+    second_gop = [video(66, KEYFRAME), audio(76), video(99, INTERFRAME)]
+    publish(
+        stream,
+        [
+            RTMPMessage(5, RTMP_MSG_TYPE_DATA, 1, 0, metadata),
+            video(0, AVC_HEADER),
+            audio(0, AAC_HEADER),
+            *first_gop,
+            *second_gop,
+        ],
+    )
+    player = Player()
+    stream.add_subscriber(player)
+
+    cached_metadata, avc, aac, *gop = player.messages
+    # @setDataFrame is stripped: players expect a bare onMetaData
+    assert amf0.decode_all(cached_metadata.payload)[0] == "onMetaData"
+    assert stream.metadata_properties == {"width": 1280.0}
+    assert (avc.payload, aac.payload) == (AVC_HEADER, AAC_HEADER)
+    assert gop == second_gop
+    assert not player.waiting_for_keyframe
+
+
+def test_joiner_before_any_keyframe_waits_for_one():
+    stream = LiveStream("key", 10**6)
+    publish(stream, [video(0, AVC_HEADER), audio(0)])
+    player = Player()
+    stream.add_subscriber(player)
+    assert [m.payload for m in player.messages] == [AVC_HEADER]
+    assert player.waiting_for_keyframe
+
+
+def test_gop_outgrowing_the_cache_is_dropped_until_the_next_keyframe():
+    budget = MemoryBudget()
+    stream = LiveStream("key", 250, budget=budget)
+    publish(stream, [video(0, KEYFRAME), video(33, INTERFRAME)])
+    assert stream.gop_cached_bytes == budget.used == 200
+    publish(stream, [video(66, INTERFRAME), video(99, INTERFRAME)])
+    assert stream.gop_cache == [] and budget.used == 0
+    publish(stream, [video(132, KEYFRAME)])
+    assert [m.timestamp for m in stream.gop_cache] == [132]
+    stream.clear_cache()
+    assert budget.used == 0 and stream.avc_sequence_header is None
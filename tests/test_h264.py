@@ -0,0 +1,400 @@
+import struct
+
+import pytest
+
+import h264
+
+# High 3.1, 1280x720 at 30 fps (an x264 SPS, with an emulation prevention byte)
+HIGH_SPS = bytes.fromhex("6764001facd9405005bb0110000003001000000303c0f1831960")
+# Constrained Baseline 3.1, 1280x720, no VUI
+BASELINE_SPS = bytes.fromhex("6742c01feca02802dc80")
+PPS = bytes.fromhex("68ce3c80")
+
+
+class BitWriter:
+    """Builds an RBSP from bit fields and Exp-Golomb codes."""
+
+    def __init__(self):
+        self.bits = []
+
+    def u(self, count, value):
+        self.bits += [(value >> (count - 1 - i)) & 1 for i in range(count)]
+
+    def ue(self, value):
+        value += 1
+        self.bits += [0] * (value.bit_length() - 1)
+        self.u(value.bit_length(), value)
+
+    def se(self, value):
+        self.ue(2 * value - 1 if value > 0 else -2 * value)
+
+    def nal(self, header=0x67):
+        """The NAL unit: trailing bits added, emulation prevention applied."""
+        bits = self.bits + [1]
+        bits += [0] * (-len(bits) % 8)
+        rbsp = bytes(
+            int("".join(map(str, bits[i : i + 8])), 2) for i in range(0, len(bits), 8)
+        )
+        out = bytearray((header,))
+        zeros = 0
+        for byte in rbsp:
+            if zeros >= 2 and byte <= 3:
+                out.append(3)
+                zeros = 0
+            out.append(byte)
+            zeros = zeros + 1 if byte == 0 else 0
+        return bytes(out)
+
+
+def build_sps(
+    profile_idc=100,
+    constraint_flags=0,
+    chroma_format_idc=1,
+    scaling_lists=False,
+    pic_order_cnt_type=0,
+    width_mbs=120,
+    height_map_units=68,
+    frame_mbs_only=True,
+    crop=(0, 0, 0, 4),
+    vui=True,
+    aspect_ratio=None,
+    timing=(1001, 60000),
+    hrd=False,
+    reorder_frames=None,
+):
+    """A 1920x1080 High profile SPS at 29.97 fps, unless told otherwise."""
+    w = BitWriter()
+    w.u(8, profile_idc)
+    w.u(8, constraint_flags)
+    w.u(8, 40)  # level_idc
+    w.ue(0)  # seq_parameter_set_id
+    if profile_idc in (100, 110, 122, 244):
+        w.ue(chroma_format_idc)
+        if chroma_format_idc == 3:
+            w.u(1, 0)  # separate_colour_plane_flag
+        w.ue(2)  # bit_depth_luma_minus8
+        w.ue(2)  # bit_depth_chroma_minus8
+        w.u(1, 0)
+        w.u(1, scaling_lists)
+        if scaling_lists:
+            for i in range(8):
+                w.u(1, i in (0, 6))
+                if i in (0, 6):
+                    for k in range(16 if i < 6 else 64):
+                        w.se(1 if k < 10 else 0)
+    w.ue(0)  # log2_max_frame_num_minus4
+    w.ue(pic_order_cnt_type)
+    if pic_order_cnt_type == 0:
+        w.ue(2)
+    elif pic_order_cnt_type == 1:
+        w.u(1, 0)
+        w.se(-3)
+        w.se(2)
+        w.ue(2)
+        w.se(1)
+        w.se(-1)
+    w.ue(4)  # max_num_ref_frames
+    w.u(1, 0)
+    w.ue(width_mbs - 1)
+    w.ue(height_map_units - 1)
+    w.u(1, frame_mbs_only)
+    if not frame_mbs_only:
+        w.u(1, 1)
+    w.u(1, 1)
+    w.u(1, any(crop))
+    if any(crop):
+        for offset in crop:
+            w.ue(offset)
+    w.u(1, vui)
+    if vui:
+        w.u(1, aspect_ratio is not None)
+        if isinstance(aspect_ratio, tuple):
+            w.u(8, 255)
+            w.u(16, aspect_ratio[0])
+            w.u(16, aspect_ratio[1])
+        elif aspect_ratio is not None:
+            w.u(8, aspect_ratio)
+        w.u(1, 0)  # overscan_info_present_flag
+        w.u(1, 1)  # video_signal_type_present_flag
+        w.u(4, 0b1010)
+        w.u(1, 1)
+        w.u(24, 0x010101)
+        w.u(1, 0)  # chroma_loc_info_present_flag
+        w.u(1, timing is not None)
+        if timing is not None:
+            w.u(32, timing[0])
+            w.u(32, timing[1])
+            w.u(1, 1)
+        for _ in range(2):  # NAL and VCL HRD parameters
+            w.u(1, hrd)
+            if hrd:
+                w.ue(1)
+                w.u(8, 0x23)
+                for _ in range(2):
+                    w.ue(1000)
+                    w.ue(2000)
+                    w.u(1, 0)
+                w.u(20, 0xABCDE)
+        if hrd:
+            w.u(1, 0)
+        w.u(1, 0)  # pic_struct_present_flag
+        w.u(1, reorder_frames is not None)
+        if reorder_frames is not None:
+            w.u(1, 1)
+            w.ue(2)
+            w.ue(1)
+            w.ue(16)
+            w.ue(16)
+            w.ue(reorder_frames)
+            w.ue(4)
+    return w.nal()
+
+
+def decoder_config(sps_units=(HIGH_SPS,), pps_units=(PPS,), length_size=4):
+    record = bytearray((1, 100, 0, 31, 0xFC | (length_size - 1)))
+    for units, flags in ((sps_units, 0xE0), (pps_units, 0)):
+        record.append(flags | len(units))
+        for nal in units:
+            record += struct.pack(">H", len(nal)) + nal
+    return bytes(record)
+
+
+def avcc(*nals, length_size=4):
+    return b"".join(len(nal).to_bytes(length_size, "big") + nal for nal in nals)
+
+
+def video_tag(nals, keyframe=True, composition_offset=0, packet_type=1):
+    first = 0x17 if keyframe else 0x27
+    offset = (composition_offset & 0xFFFFFF).to_bytes(3, "big")
+    return bytes((first, packet_type)) + offset + nals
+
+
+IDR = b"\x65\x88\x84"
+SLICE = b"\x41\x9a\x02"
+SEI = b"\x06\x05\x01"
+
+
+def test_bit_reader_fields_and_exp_golomb_codes():
+    w = BitWriter()
+    w.u(3, 0b101)
+    for value in (0, 1, 2, 7, 300):
+        w.ue(value)
+    for value in (0, 1, -1, 5, -40):
+        w.se(value)
+    reader = h264.BitReader(w.nal()[1:])
+
+    assert reader.bits(3) == 0b101
+    assert [reader.ue() for _ in range(5)] == [0, 1, 2, 7, 300]
+    assert [reader.se() for _ in range(5)] == [0, 1, -1, 5, -40]
+    assert reader.flag()  # rbsp_stop_one_bit
+
+    with pytest.raises(h264.H264Error):
+        reader.bits(8)
+    with pytest.raises(h264.H264Error):
+        h264.BitReader(b"\x00\x00").ue()  # No terminating 1
+    with pytest.raises(h264.H264Error):
+        h264.BitReader(bytes(5) + b"\xff").ue()  # Over 31 leading zeros
+
+
+def test_unescape_rbsp_drops_emulation_prevention_bytes():
+    assert h264.unescape_rbsp(b"\x67\x00\x00\x03\x01\x00\x00\x03\x00") == (
+        b"\x00\x00\x01\x00\x00\x00"
+    )
+    assert h264.unescape_rbsp(b"\x67\x00\x03\x01") == b"\x00\x03\x01"
+
+
+def test_real_sps():
+    sps = h264.SPS(HIGH_SPS)
+    assert (sps.profile, sps.level) == ("high", "3.1")
+    assert (sps.width, sps.height) == (1280, 720)
+    assert sps.frame_rate == 30.0
+    assert (sps.max_num_ref_frames, sps.reorder_frames) == (4, 2)
+
+    sps = h264.SPS(BASELINE_SPS)
+    assert (sps.profile, sps.level) == ("constrained baseline", "3.1")
+    assert (sps.width, sps.height) == (1280, 720)
+    assert sps.frame_rate is None
+    assert sps.reorder_frames == 0  # Baseline has no B slices
+
+
+@pytest.mark.parametrize(
+    "options, size",
+    [
+        ({}, (1920, 1080)),
+        ({"scaling_lists": True, "pic_order_cnt_type": 1}, (1920, 1080)),
+        ({"pic_order_cnt_type": 2}, (1920, 1080)),
+        # Interlaced: map units are field pairs, cropping counts field rows
+        ({"frame_mbs_only": False, "height_map_units": 34}, (1920, 1072)),
+        ({"profile_idc": 122, "chroma_format_idc": 2}, (1920, 1084)),
+        (
+            {"profile_idc": 244, "chroma_format_idc": 3, "crop": (2, 2, 0, 0)},
+            (1916, 1088),
+        ),
+        (
+            {"profile_idc": 100, "chroma_format_idc": 0, "crop": (4, 0, 0, 8)},
+            (1916, 1080),
+        ),
+        ({"profile_idc": 77, "crop": (0, 0, 0, 0)}, (1920, 1088)),
+    ],
+)
+def test_sps_coded_size_after_cropping(options, size):
+    sps = h264.SPS(build_sps(**options))
+    assert (sps.width, sps.height) == size
+    assert sps.frame_rate == pytest.approx(29.97, abs=0.01)
+
+
+def test_sps_high_profile_fields():
+    sps = h264.SPS(build_sps(profile_idc=110, chroma_format_idc=2))
+    assert sps.profile == "high10"
+    assert sps.chroma_format_idc == 2
+    assert sps.bit_depth == 10
+    assert sps.level == "4.0"
+    # Main profile: no chroma format or bit depth fields
+    sps = h264.SPS(build_sps(profile_idc=77))
+    assert (sps.chroma_format_idc, sps.bit_depth) == (1, 8)
+
+
+def test_sps_vui():
+    sps = h264.SPS(build_sps(aspect_ratio=14, hrd=True, reorder_frames=3))
+    assert sps.sar == (4, 3)
+    assert sps.frame_rate == pytest.approx(60000 / 2002)
+    assert sps.reorder_frames == 3
+
+    sps = h264.SPS(build_sps(aspect_ratio=(64, 45), timing=None))
+    assert sps.sar == (64, 45)
+    assert sps.frame_rate is None
+    assert sps.reorder_frames is None  # High profile may reorder up to the DPB
+
+    assert h264.SPS(build_sps(vui=False)).sar == (1, 1)
+
+
+def test_sps_reorder_frames_without_bitstream_restriction():
+    intra = h264.SPS(build_sps(constraint_flags=h264.CONSTRAINT_SET3))
+    assert intra.reorder_frames == 0
+    main = h264.SPS(build_sps(profile_idc=77, constraint_flags=h264.CONSTRAINT_SET3))
+    assert main.reorder_frames is None  # constraint_set3 isn't intra-only there
+    baseline = h264.SPS(build_sps(profile_idc=66, vui=False))
+    assert (baseline.profile, baseline.reorder_frames) == ("baseline", 0)
+
+
+def test_sps_errors():
+    with pytest.raises(h264.H264Error):
+        h264.SPS(PPS)
+    with pytest.raises(h264.H264Error):
+        h264.SPS(b"")
+    with pytest.raises(h264.H264Error):
+        h264.SPS(HIGH_SPS[:8])
+
+
+def test_avc_decoder_config():
+    second_sps = build_sps()
+    config = h264.AVCDecoderConfig(decoder_config((HIGH_SPS, second_sps)))
+
+    assert (config.profile_idc, config.level_idc) == (100, 31)
+    assert config.nal_length_size == 4
+    assert config.sps_units == [HIGH_SPS, second_sps]
+    assert config.pps_units == [PPS]
+    assert (config.sps.width, config.sps.height) == (1280, 720)  # The first SPS
+    assert config.annexb_parameter_sets == (
+        b"\x00\x00\x00\x01"
+        + HIGH_SPS
+        + b"\x00\x00\x00\x01"
+        + second_sps
+        + b"\x00\x00\x00\x01"
+        + PPS
+    )
+    assert h264.AVCDecoderConfig(decoder_config(length_size=2)).nal_length_size == 2
+
+
+@pytest.mark.parametrize(
+    "record",
+    [
+        b"\x01\x64\x00\x1f",  # Too short
+        b"\x02" + decoder_config()[1:],  # configurationVersion 2
+        decoder_config(length_size=3),
+        decoder_config(sps_units=()),
+        decoder_config()[:-2],  # PPS cut short
+        decoder_config(pps_units=())[:-1],  # PPS count missing
+    ],
+)
+def test_avc_decoder_config_errors(record):
+    with pytest.raises(h264.H264Error):
+        h264.AVCDecoderConfig(record)
+
+
+def test_nal_index():
+    index = h264.NALIndex()
+    payload = video_tag(avcc(SEI, b"", IDR), composition_offset=-40)
+
+    assert index.index(payload, 4) == 2  # The empty NAL unit is skipped
+    assert list(index.types[:2]) == [h264.NAL_TYPE_SEI, h264.NAL_TYPE_IDR]
+    assert payload[index.offsets[1] : index.offsets[1] + index.sizes[1]] == IDR
+    assert index.composition_offset == -40
+    assert index.has_type(h264.NAL_TYPE_IDR)
+    assert not index.has_type(h264.NAL_TYPE_SLICE)
+
+    # Reused for the next frame, with 2-byte lengths
+    assert index.index(video_tag(avcc(SLICE, length_size=2), False, 80), 2) == 1
+    assert index.composition_offset == 80
+    assert not index.has_type(h264.NAL_TYPE_IDR)  # Stale entries aren't counted
+
+
+def test_nal_index_grows_past_its_capacity():
+    index = h264.NALIndex(capacity=2)
+    payload = video_tag(avcc(*[SLICE] * 5))
+    assert index.index(payload, 4) == 5
+    assert list(index.offsets[:5]) == [5 + 4 + 7 * i for i in range(5)]
+    assert list(index.sizes[:5]) == [len(SLICE)] * 5
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        b"\x17\x01\x00",  # Truncated tag header
+        video_tag(avcc(IDR)[:-1]),  # NAL unit overruns the frame
+        video_tag(avcc(IDR) + b"\x00\x00"),  # Truncated length
+    ],
+)
+def test_nal_index_errors(payload):
+    with pytest.raises(h264.H264Error):
+        h264.NALIndex().index(payload, 4)
+
+
+def test_h264_inspector():
+    inspector = h264.H264Inspector()
+    assert inspector.inspect(video_tag(avcc(IDR))) is None  # No config yet
+    assert inspector.frames == 0
+
+    config = inspector.inspect(video_tag(decoder_config(), packet_type=0))
+    assert isinstance(config, h264.AVCDecoderConfig)
+    assert inspector.config is config
+
+    for payload in (
+        video_tag(avcc(SEI, IDR)),
+        video_tag(avcc(SLICE), False, 66),
+        video_tag(avcc(SLICE), False, 33),
+        video_tag(avcc(SLICE)),  # Keyframe flag on a non-IDR frame
+        video_tag(avcc(IDR), False),  # And the reverse
+        video_tag(avcc(IDR)[:-1]),  # Malformed
+        video_tag(b"", packet_type=2),  # End of sequence
+        b"\x12" + bytes(10),  # Not AVC
+    ):
+        assert inspector.inspect(payload) is None
+
+    assert inspector.frames == 6
+    assert inspector.malformed_frames == 1
+    assert inspector.keyframe_mismatches == 2
+    assert inspector.nal_counts[h264.NAL_TYPE_IDR] == 2
+    assert inspector.nal_counts[h264.NAL_TYPE_SLICE] == 3
+    assert inspector.nal_counts[h264.NAL_TYPE_SEI] == 1
+    assert (inspector.reordered_frames, inspector.max_composition_offset) == (2, 66)
+
+    with pytest.raises(h264.H264Error):
+        inspector.inspect(video_tag(b"\x01\x64", packet_type=0))
+
+
+def test_parse_profiles():
+    assert h264.parse_profiles("baseline, Main,high,77") == {66, 77, 100}
+    assert h264.parse_profiles("") == frozenset()
+    with pytest.raises(ValueError):
+        h264.parse_profiles("high,ultra")
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+import RTMPServer as rtmp
+from rtmp_handshake import S1_HEADER, S1Pool
+from support import FakeTransport, FakeWriter, new_server, run
+
+C0C1 = bytes((rtmp.RTMP_VERSION,)) + bytes(rtmp.RTMP_HANDSHAKE_SIZE)
+C2 = bytes(rtmp.RTMP_HANDSHAKE_SIZE)
+
+
+def connect(server):
+    transport = FakeTransport()
+    protocol = rtmp.RTMPProtocol(server)
+    protocol.connection_made(transport)
+    return protocol, transport
+
+
+def feed(protocol, data):
+    buffer = protocol.get_buffer(len(data))
+    buffer[: len(data)] = data
+    protocol.buffer_updated(len(data))
+
+
+def test_s1_pool_refills_in_the_background():
+    async def main():
+        pool = S1Pool(4)
+        blobs = [pool.take() for _ in range(3)]
+        assert pool.refilling and pool.misses == 0
+        assert all(len(blob) == rtmp.RTMP_HANDSHAKE_SIZE for blob in blobs)
+        assert all(blob.startswith(S1_HEADER) for blob in blobs)
+        assert len(set(blobs)) == 3
+        pool.take()
+        pool.take()  # Empty until the refill lands
+        assert pool.misses == 1
+        while pool.refilling:
+            await asyncio.sleep(0.01)
+        assert len(pool.blobs) == 3
+
+    run(main())
+
+
+@pytest.mark.parametrize("sent, phase", [(b"", "C0"), (C0C1, "C2")])
+def test_stream_handshake_times_out_per_phase(sent, phase, caplog):
+    async def main():
+        server = new_server(handshake_c0c1_timeout=0.05, handshake_c2_timeout=0.05)
+        reader = asyncio.StreamReader()
+        reader.feed_data(sent)
+        writer = FakeWriter()
+        await asyncio.wait_for(server.handle_client(reader, writer), 1)
+        metrics = server.metrics
+        assert writer.is_closing() and server.pending_handshakes == 0
+        assert metrics.handshake_timeouts == metrics.handshake_failures == 1
+        assert server.sessions == set()
+
+    run(main())
+    assert f"timed out waiting for {phase}" in caplog.text
+
+
+def test_protocol_handshake_timer_is_rearmed_for_c2():
+    async def main():
+        server = new_server(handshake_c0c1_timeout=0.05, handshake_c2_timeout=0.2)
+        protocol, transport = connect(server)
+        feed(protocol, C0C1)
+        await asyncio.sleep(0.1)  # Past the C0 + C1 deadline, not the C2 one
+        assert not transport.closing
+        await asyncio.sleep(0.2)
+        assert transport.closing and server.metrics.handshake_timeouts == 1
+        protocol.connection_lost(None)
+        assert server.pending_handshakes == 0
+        assert server.metrics.handshake_failures == 1
+
+    run(main())
+
+
+def test_connections_over_the_handshake_limit_are_rejected():
+    async def main():
+        server = new_server(max_pending_handshakes=1)
+        first, _ = connect(server)
+        second, rejected = connect(server)
+        assert rejected.closing and second.session is None
+        assert server.metrics.handshakes_rejected == 1
+        second.connection_lost(None)
+
+        feed(first, C0C1 + C2)
+        assert server.pending_handshakes == 0
+        third, admitted = connect(server)
+        assert not admitted.closing and len(server.sessions) == 2
+        for protocol in (first, third):
+            protocol.connection_lost(None)
+
+    run(main())
@@ -0,0 +1,211 @@
+import struct
+
+import pytest
+
+import amf0
+import mpegts
+from hls import FORMAT_FMP4, FORMAT_MPEGTS, HLSWriter
+from rtmp_chunk import RTMPMessage
+from rtmp_live import (
+    RTMP_MSG_TYPE_AUDIO,
+    RTMP_MSG_TYPE_DATA,
+    RTMP_MSG_TYPE_VIDEO,
+    LiveStream,
+)
+
+SPS = bytes.fromhex("6764001facd9405005bb0110000003001000000303c0f1831960")
+PPS = bytes.fromhex("68ebe3cb22c0")
+AVC_HEADER = (
+    b"\x17\x00\x00\x00\x00"
+    + bytes((1, 0x64, 0, 0x1F, 0xFF, 0xE1))
+    + struct.pack(">H", len(SPS))
+    + SPS
+    + b"\x01"
+    + struct.pack(">H", len(PPS))
+    + PPS
+)
+AAC_HEADER = b"\xaf\x00\x12\x10"  # LC, 44.1 kHz, stereo
+
+
+def nal_units(*nals):
+    return b"".join(struct.pack(">I", len(nal)) + nal for nal in nals)
+
+
+def media(seconds, fps=30, gop=30):
+    """Video with a keyframe every `gop` frames and 44.1 kHz AAC, in send order."""
+    messages = [
+        RTMPMessage(
+            5,
+            RTMP_MSG_TYPE_DATA,
+            1,
+            0,
+            amf0.encode("@setDataFrame", "onMetaData", amf0.ECMAArray(width=1280.0)),
+        ),
+        RTMPMessage(6, RTMP_MSG_TYPE_VIDEO, 1, 0, AVC_HEADER),
+        RTMPMessage(4, RTMP_MSG_TYPE_AUDIO, 1, 0, AAC_HEADER),
+    ]
+    frame = samples = 0
+    while frame * 1000 // fps < seconds * 1000:
+        video_ms = frame * 1000 // fps
+        audio_ms = samples * 1000 // 44100
+        if video_ms <= audio_ms:
+            keyframe = frame % gop == 0
+            header = b"\x17\x01\x00\x00\x00" if keyframe else b"\x27\x01\x00\x00\x42"
+            nal = (b"\x65" if keyframe else b"\x41") + bytes([frame % 256]) * 700
+            payload = header + nal_units(b"\x06\x05\x01\x00", nal)
+            messages.append(RTMPMessage(6, RTMP_MSG_TYPE_VIDEO, 1, video_ms, payload))
+            frame += 1
+        else:
+            payload = b"\xaf\x01" + bytes([samples // 1024 % 256]) * 300
+            messages.append(RTMPMessage(4, RTMP_MSG_TYPE_AUDIO, 1, audio_ms, payload))
+            samples += 1024
+    return messages
+
+
+def package(tmp_path, segment_format, messages, playlist_length=10):
+    writer = HLSWriter(str(tmp_path), segment_format, 1.0, playlist_length, 1 << 24)
+    stream = LiveStream("live/cam", 1 << 24)
+    stream.sinks.append(writer.open(stream))
+    for message in messages:
+        stream.broadcast(message)
+    for sink in stream.sinks:
+        sink.close()
+    writer.close()
+    return tmp_path / "live_cam"
+
+
+def playlist_segments(directory):
+    lines = (directory / "index.m3u8").read_text().splitlines()
+    return [line for line in lines if line and not line.startswith("#")], lines
+
+
+def ts_packets(data, continuity):
+    """(pid, payload_unit_start, payload) of each packet, checking the framing."""
+    assert len(data) % mpegts.TS_PACKET_SIZE == 0
+    for pos in range(0, len(data), mpegts.TS_PACKET_SIZE):
+        packet = data[pos : pos + mpegts.TS_PACKET_SIZE]
+        assert packet[0] == mpegts.TS_SYNC_BYTE
+        pid = struct.unpack_from(">H", packet, 1)[0] & 0x1FFF
+        counter = packet[3] & 0x0F
+        if pid in continuity:
+            assert counter == (continuity[pid] + 1) & 0x0F
+        continuity[pid] = counter
+        start = 4 + (1 + packet[4] if packet[3] & 0x20 else 0)
+        yield pid, bool(packet[1] & 0x40), packet[start:]
+
+
+def pes_packets(data, continuity):
+    """{pid: [PES packet bytes]} of a segment, after checking PSI CRCs."""
+    packets = {}
+    for pid, unit_start, payload in ts_packets(data, continuity):
+        if pid in (mpegts.PAT_PID, mpegts.PMT_PID):
+            length = struct.unpack_from(">H", payload, 2)[0] & 0x0FFF
+            assert mpegts.crc32_mpeg2(payload[1 : 4 + length]) == 0
+        elif unit_start:
+            packets.setdefault(pid, []).append(bytearray(payload))
+        else:
+            packets[pid][-1] += payload
+    return packets
+
+
+def boxes(data):
+    pos = 0
+    while pos < len(data):
+        size, box_type = struct.unpack_from(">I4s", data, pos)
+        assert size >= 8
+        yield box_type, pos + 8, pos + size
+        pos += size
+    assert pos == len(data)
+
+
+def test_crc32_mpeg2_check_value():
+    assert mpegts.crc32_mpeg2(b"123456789") == 0x0376E6E7
+
+
+def test_mpegts_segments_cut_at_keyframes_with_annexb_video(tmp_path):
+    directory = package(tmp_path, FORMAT_MPEGTS, media(3.5))
+    names, lines = playlist_segments(directory)
+    assert names == ["segment1.ts", "segment2.ts", "segment3.ts", "segment4.ts"]
+    assert lines[:4] == [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        "#EXT-X-TARGETDURATION:1",
+        "#EXT-X-MEDIA-SEQUENCE:1",
+    ]
+    assert lines.count("#EXTINF:1.000,") == 3 and lines[-1] == "#EXT-X-ENDLIST"
+
+    continuity = {}  # Counters run on across segments
+    for name in names:
+        pes = pes_packets((directory / name).read_bytes(), continuity)
+        video = pes[mpegts.VIDEO_PID]
+        first = bytes(video[0])
+        header_size = 9 + first[8]
+        body = first[header_size:]
+        assert body.startswith(b"\x00\x00\x00\x01\x09\xf0\x00\x00\x00\x01" + SPS)
+        assert b"\x00\x00\x00\x01\x06\x05\x01\x00\x00\x00\x00\x01\x65" in body
+        # Inter frames carry a 66 ms composition offset: PTS and DTS both sent
+        assert video[1][7] & 0xC0 == 0xC0
+        audio = bytes(pes[mpegts.AUDIO_PID][0])
+        assert audio[9 + audio[8] :][:2] == b"\xff\xf1"  # ADTS
+
+
+def test_fmp4_segments_carry_the_frames_unchanged(tmp_path):
+    messages = media(2.5)
+    directory = package(tmp_path, FORMAT_FMP4, messages)
+    names, lines = playlist_segments(directory)
+    assert '#EXT-X-MAP:URI="init1.mp4"' in lines and "#EXT-X-VERSION:7" in lines
+
+    init = (directory / "init1.mp4").read_bytes()
+    assert [box for box, _, _ in boxes(init)] == [b"ftyp", b"moov"]
+    assert b"avcC" in init and b"esds" in init and b"mvex" in init
+
+    mdat = b""
+    for name in names:
+        data = (directory / name).read_bytes()
+        assert [box for box, _, _ in boxes(data)] == [b"moof", b"mdat"]
+        _, start, end = list(boxes(data))[1]
+        mdat += data[start:end]
+    frames = [m.payload for m in messages[3:] if m.msg_type == RTMP_MSG_TYPE_VIDEO]
+    assert all(frame[5:] in mdat for frame in frames)  # AVCC as published
+
+
+def test_playlist_slides_and_old_segments_are_deleted(tmp_path):
+    directory = package(tmp_path, FORMAT_MPEGTS, media(8), playlist_length=2)
+    names, lines = playlist_segments(directory)
+    assert names == ["segment7.ts", "segment8.ts"]
+    assert "#EXT-X-MEDIA-SEQUENCE:7" in lines
+    # Segments stay for a playlist's length after leaving it
+    files = sorted(path.name for path in directory.iterdir())
+    assert files == ["index.m3u8"] + [f"segment{n}.ts" for n in range(5, 9)]
+
+
+def test_a_codec_change_starts_a_discontinuity(tmp_path):
+    messages = media(2)
+    changed = AAC_HEADER[:2] + bytes.fromhex("1190")  # 48 kHz
+    messages.append(RTMPMessage(4, RTMP_MSG_TYPE_AUDIO, 1, 2000, changed))
+    messages += [
+        RTMPMessage(m.csid, m.msg_type, 1, m.timestamp + 2000, m.payload)
+        for m in media(2)[3:]
+    ]
+    directory = package(tmp_path, FORMAT_FMP4, messages)
+    names, lines = playlist_segments(directory)
+    assert lines.count("#EXT-X-DISCONTINUITY") == 1
+    assert '#EXT-X-MAP:URI="init2.mp4"' in lines
+    assert (directory / "init2.mp4").exists()
+
+
+@pytest.mark.parametrize(
+    "stream, name, allowed",
+    [
+        ("cam", "index.m3u8", True),
+        ("cam", "segment3.ts", True),
+        ("..", "index.m3u8", False),
+        ("cam", "../index.m3u8", False),
+        ("cam", "secrets.txt", False),
+        ("a/b", "index.m3u8", False),
+    ],
+)
+def test_only_hls_files_are_served(tmp_path, stream, name, allowed):
+    writer = HLSWriter(str(tmp_path), FORMAT_MPEGTS, 1.0, 3, 1 << 20)
+    assert (writer.path(stream, name) is not None) == allowed
+    writer.close()
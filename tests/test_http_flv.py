@@ -0,0 +1,284 @@
+import asyncio
+import struct
+
+import flv
+import http_flv
+import rtmp_http
+from rtmp_chunk import RTMPMessage
+from rtmp_live import RTMP_MSG_TYPE_AUDIO, RTMP_MSG_TYPE_VIDEO, LiveStream
+from support import FakeWriter, new_server, run
+
+AVC_HEADER = b"\x17\x00" + bytes(10)
+AAC_HEADER = b"\xaf\x00\x12\x10"
+KEYFRAME = b"\x17\x01" + bytes(98)
+INTERFRAME = b"\x27\x01" + bytes(98)
+AUDIO = b"\xaf\x01" + bytes(8)
+
+
+def video(timestamp, payload):
+    return RTMPMessage(6, RTMP_MSG_TYPE_VIDEO, 1, timestamp, payload)
+
+
+def audio(timestamp, payload=AUDIO):
+    return RTMPMessage(4, RTMP_MSG_TYPE_AUDIO, 1, timestamp, payload)
+
+
+def request_reader(*lines):
+    reader = asyncio.StreamReader()
+    reader.feed_data(("\r\n".join(lines) + "\r\n\r\n").encode())
+    return reader
+
+
+def split_response(data):
+    head, _, body = bytes(data).partition(b"\r\n\r\n")
+    return head.decode().split("\r\n"), body
+
+
+def dechunk(body):
+    """The content of a chunked HTTP body, however far it got."""
+    content = bytearray()
+    pos = 0
+    while pos < len(body):
+        end = body.index(b"\r\n", pos)
+        size = int(body[pos:end], 16)
+        content += body[end + 2 : end + 2 + size]
+        pos = end + 2 + size + 2
+    return bytes(content)
+
+
+def websocket_frames(data):
+    """(opcode, payload) of each unmasked server frame in `data`."""
+    frames = []
+    pos = 0
+    while pos < len(data):
+        opcode = data[pos] & 0x0F
+        size = data[pos + 1] & 0x7F
+        pos += 2
+        if size == 126:
+            size = struct.unpack_from(">H", data, pos)[0]
+            pos += 2
+        elif size == 127:
+            size = struct.unpack_from(">Q", data, pos)[0]
+            pos += 8
+        frames.append((opcode, bytes(data[pos : pos + size])))
+        pos += size
+    return frames
+
+
+def client_frame(opcode, payload, mask=b"\x01\x02\x03\x04"):
+    masked = bytes(byte ^ mask[i & 3] for i, byte in enumerate(payload))
+    head = bytes((http_flv.WS_FINAL | opcode, http_flv.WS_MASKED | len(payload)))
+    return head + mask + masked
+
+
+def test_websocket_accept_matches_rfc_6455_example():
+    accept = http_flv.websocket_accept("dGhlIHNhbXBsZSBub25jZQ==")
+    assert accept == "s3pPLMBiTxaQ9kYGzzhZRbK+xOo="
+
+
+def test_websocket_frame_header_lengths():
+    assert http_flv.websocket_frame_header(125) == b"\x82\x7d"
+    assert http_flv.websocket_frame_header(126) == b"\x82\x7e\x00\x7e"
+    assert http_flv.websocket_frame_header(0xFFFF) == b"\x82\x7e\xff\xff"
+    assert http_flv.websocket_frame_header(0x10000) == (
+        b"\x82\x7f" + struct.pack(">Q", 0x10000)
+    )
+    pong = http_flv.websocket_frame_header(4, http_flv.WS_OPCODE_PONG)
+    assert pong == b"\x8a\x04"
+
+
+def test_shared_tag_is_the_message_as_an_flv_tag():
+    message = video(0x01234567, KEYFRAME)
+    tag = http_flv.SharedTag(message)
+
+    assert tag.payload is message.payload
+    assert tag.msg_type == RTMP_MSG_TYPE_VIDEO
+    data = flv.encode_header(False, True) + tag.header + tag.payload + tag.trailer
+    (parsed,) = flv.iter_tags(data)
+    assert parsed.tag_type == RTMP_MSG_TYPE_VIDEO
+    assert parsed.timestamp == 0x01234567
+    assert bytes(parsed.data) == KEYFRAME
+    assert tag.trailer == struct.pack(">I", flv.TAG_HEADER_SIZE + len(KEYFRAME))
+
+
+def test_tag_cache_reuses_tags_of_cached_messages():
+    stream = LiveStream("cam", 10**6)
+    headers = [video(0, AVC_HEADER), audio(0, AAC_HEADER)]
+    gop = [video(0, KEYFRAME), audio(10), video(33, INTERFRAME)]
+    for message in headers + gop:
+        stream.broadcast(message)
+
+    tags = http_flv.TagCache(stream)
+    startup = [tags.tag(message) for message in tags.startup_messages()]
+    assert [tag.message for tag in startup] == headers + gop
+    # Late joiners get the very same tag objects
+    assert [tags.tag(message) for message in headers + gop] == startup
+
+    # The message being broadcast is built once for every viewer
+    live = video(66, INTERFRAME)
+    stream.broadcast(live)
+    assert tags.tag(live) is tags.tag(live)
+    assert len(tags.cached) == len(headers + gop) + 1
+
+    # A new GOP drops the old one's tags but keeps the sequence headers'
+    keyframe = video(99, KEYFRAME)
+    stream.broadcast(keyframe)
+    tags.tag(keyframe)
+    assert {tag.message for tag in tags.cached.values()} == {*headers, keyframe}
+    assert tags.tag(headers[0]) is startup[0]
+
+
+def test_read_request_parses_path_query_and_headers():
+    async def main():
+        reader = request_reader(
+            "GET /live/cam.flv?token=x HTTP/1.1",
+            "Host: example.com",
+            "Upgrade:  WebSocket ",
+        )
+        return await rtmp_http.read_request(reader)
+
+    request = run(main())
+    assert request.method == "GET"
+    assert request.path == "/live/cam.flv"
+    assert request.query == "token=x"
+    assert request.headers == {"host": "example.com", "upgrade": "WebSocket"}
+
+
+def test_bad_paths_are_not_found():
+    async def main(request_line):
+        writer = FakeWriter()
+        await rtmp_http.handle_http(new_server(), request_reader(request_line), writer)
+        return writer
+
+    for request_line in (
+        "GET /live HTTP/1.1",
+        "GET /live/ HTTP/1.1",
+        "GET /live/cam.mp4 HTTP/1.1",
+        "GET /hls/cam/index.m3u8 HTTP/1.1",  # HLS is off
+        "GET /other HTTP/1.1",
+        "POST /live/cam.flv HTTP/1.1",
+        "nonsense",
+    ):
+        writer = run(main(request_line))
+        head, body = split_response(writer.data)
+        assert head[0] == "HTTP/1.1 404 Not Found", request_line
+        assert body == b"Not found\n"
+        assert writer.is_closing()
+
+
+def test_oversized_request_lines_and_headers_are_bad_requests():
+    async def main(*lines):
+        reader = asyncio.StreamReader(limit=256)
+        reader.feed_data(("\r\n".join(lines) + "\r\n\r\n").encode())
+        writer = FakeWriter()
+        await rtmp_http.handle_http(new_server(), reader, writer)
+        return writer
+
+    for lines in (
+        ("GET /live/" + "x" * 300 + ".flv HTTP/1.1",),
+        ("GET /live/cam.flv HTTP/1.1", "Cookie: " + "x" * 300),
+    ):
+        writer = run(main(*lines))
+        head, body = split_response(writer.data)
+        assert head[0] == "HTTP/1.1 400 Bad Request"
+        assert body == b"Bad request\n"
+        assert writer.is_closing()
+
+
+async def play(server, reader, writer, *messages):
+    """Starts playing /live/cam.flv, then publishes `messages` to it."""
+    task = asyncio.create_task(rtmp_http.handle_http(server, reader, writer))
+    await asyncio.sleep(0.01)
+    stream = server.streams["cam"]
+    for message in messages:
+        stream.broadcast(message)
+    await asyncio.sleep(0.01)
+    return task, stream
+
+
+def test_http_flv_viewer_gets_header_and_tags():
+    server = new_server()
+    writer = FakeWriter()
+    published = [
+        video(0, AVC_HEADER),
+        audio(0, AAC_HEADER),
+        video(10, INTERFRAME),  # Before any keyframe: skipped
+        video(40, KEYFRAME),
+        audio(50),
+    ]
+
+    async def main():
+        reader = request_reader("GET /live/cam.flv HTTP/1.1")
+        task, stream = await play(server, reader, writer, *published)
+        (viewer,) = stream.subscribers
+        assert isinstance(viewer, http_flv.FLVViewer)
+        reader.feed_eof()
+        await task
+        assert viewer.closed
+        await asyncio.wait([viewer.task])
+        assert viewer.task.cancelled()  # Cancellation isn't swallowed
+
+    run(main())
+    head, body = split_response(writer.data)
+    assert head[0] == "HTTP/1.1 200 OK"
+    assert "Content-Type: video/x-flv" in head
+    assert "Transfer-Encoding: chunked" in head
+
+    content = dechunk(body)
+    assert flv.parse_header(content)[:2] == (True, True)
+    assert body.endswith(b"\r\n")
+    tags = [
+        (tag.tag_type, tag.timestamp, bytes(tag.data)) for tag in flv.iter_tags(content)
+    ]
+    expected = [published[i] for i in (0, 1, 3, 4)]
+    assert tags == [(m.msg_type, m.timestamp, m.payload) for m in expected]
+    assert "cam" not in server.streams  # Idle once the viewer left
+
+
+def test_websocket_flv_viewer_answers_pings_and_closes():
+    server = new_server()
+    writer = FakeWriter()
+
+    async def main():
+        reader = request_reader(
+            "GET /live/cam.flv HTTP/1.1",
+            "Upgrade: websocket",
+            "Connection: Upgrade",
+            "Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==",
+        )
+        task, stream = await play(
+            server, reader, writer, video(0, AVC_HEADER), video(0, KEYFRAME)
+        )
+        reader.feed_data(client_frame(http_flv.WS_OPCODE_PING, b"hi"))
+        reader.feed_data(client_frame(http_flv.WS_OPCODE_CLOSE, b"\x03\xe8bye"))
+        await task
+
+    run(main())
+    head, body = split_response(writer.data)
+    assert head[0] == "HTTP/1.1 101 Switching Protocols"
+    assert "Sec-WebSocket-Accept: s3pPLMBiTxaQ9kYGzzhZRbK+xOo=" in head
+
+    frames = websocket_frames(body)
+    assert frames[-2:] == [
+        (http_flv.WS_OPCODE_PONG, b"hi"),
+        (http_flv.WS_OPCODE_CLOSE, b"\x03\xe8"),
+    ]
+    media = frames[:-2]
+    assert {opcode for opcode, _ in media} == {http_flv.WS_OPCODE_BINARY}
+    content = b"".join(payload for _, payload in media)
+    # Attached before the stream was published: announces both
+    assert flv.parse_header(content)[:2] == (True, True)
+    tags = [bytes(tag.data) for tag in flv.iter_tags(content)]
+    assert tags == [AVC_HEADER, KEYFRAME]
+    assert "cam" not in server.streams
+
+
+def test_websocket_upgrade_without_key_is_not_found():
+    async def main():
+        writer = FakeWriter()
+        reader = request_reader("GET /live/cam.flv HTTP/1.1", "Upgrade: websocket")
+        await rtmp_http.handle_http(new_server(), reader, writer)
+        return writer
+
+    head, _ = split_response(run(main()).data)
+    assert head[0] == "HTTP/1.1 404 Not Found"
@@ -0,0 +1,146 @@
+import asyncio
+
+from rtmp_chunk import RTMPMessage
+from rtmp_live import (
+    RTMP_MSG_TYPE_AUDIO,
+    RTMP_MSG_TYPE_VIDEO,
+    SLOW_CONSUMER_DISCONNECT,
+    SLOW_CONSUMER_DROP,
+    SLOW_CONSUMER_SKIP,
+    LiveStream,
+    Subscriber,
+)
+from rtmp_memory import MemoryBudget
+from support import run
+
+AVC_HEADER = b"\x17\x00" + bytes(10)
+KEYFRAME = b"\x17\x01" + bytes(98)
+INTERFRAME = b"\x27\x01" + bytes(98)
+
+
+def video(timestamp, payload):
+    return RTMPMessage(6, RTMP_MSG_TYPE_VIDEO, 1, timestamp, payload)
+
+
+class FakeSession:
+    """What a Subscriber uses of an RTMPSession, recording sent messages."""
+
+    def __init__(self):
+        self.sent = []
+        self.window_open = asyncio.Event()
+        self.window_open.set()
+        self.closed = False
+
+    def send_window_full(self):
+        return not self.window_open.is_set()
+
+    async def wait_send_window(self):
+        await self.window_open.wait()
+
+    def send_message(self, csid, msg_type, stream_id, timestamp, payload):
+        self.sent.append((csid, msg_type, stream_id, timestamp, payload))
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def test_every_subscriber_sends_the_publishers_payload():
+    async def main():
+        stream = LiveStream("key", 10**6)
+        sessions = [FakeSession() for _ in range(3)]
+        for stream_id, session in enumerate(sessions, 1):
+            stream.add_subscriber(
+                Subscriber(session, stream_id, 10**6, SLOW_CONSUMER_DROP)
+            )
+        message = video(0, KEYFRAME)
+        stream.broadcast(message)
+        await asyncio.sleep(0)
+        for stream_id, session in enumerate(sessions, 1):
+            ((csid, msg_type, sent_stream_id, timestamp, payload),) = session.sent
+            assert (csid, msg_type, sent_stream_id) == (6, 9, stream_id)
+            assert payload is message.payload
+
+    run(main())
+
+
+def test_drop_policy_drops_what_does_not_fit():
+    async def main():
+        budget = MemoryBudget()
+        subscriber = Subscriber(FakeSession(), 1, 250, SLOW_CONSUMER_DROP, budget)
+        subscriber.task.cancel()  # Nothing is sent: the queue only fills
+        for timestamp in range(3):
+            subscriber.enqueue(video(timestamp, INTERFRAME))
+        assert len(subscriber.queue) == 2
+        assert subscriber.dropped_messages == 1
+        assert budget.used == subscriber.queued_bytes == 200
+        subscriber.close()
+        assert budget.used == 0
+
+    run(main())
+
+
+def test_disconnect_policy_closes_the_session():
+    async def main():
+        session = FakeSession()
+        subscriber = Subscriber(session, 1, 150, SLOW_CONSUMER_DISCONNECT)
+        subscriber.task.cancel()
+        subscriber.enqueue(video(0, INTERFRAME))
+        subscriber.enqueue(video(1, INTERFRAME))
+        assert subscriber.closed and session.closed
+        assert subscriber.queued_bytes == 0
+
+    run(main())
+
+
+def test_skip_policy_resumes_at_the_next_keyframe():
+    async def main():
+        subscriber = Subscriber(FakeSession(), 1, 250, SLOW_CONSUMER_SKIP)
+        subscriber.task.cancel()
+        for timestamp in range(3):
+            subscriber.enqueue(video(timestamp, INTERFRAME))
+        # The overflow flushed the queue; inter frames wait for a keyframe
+        assert not subscriber.queue and subscriber.waiting_for_keyframe
+        subscriber.enqueue(video(3, INTERFRAME))
+        subscriber.enqueue(video(4, AVC_HEADER))  # Sequence headers still pass
+        subscriber.enqueue(RTMPMessage(4, RTMP_MSG_TYPE_AUDIO, 1, 4, b"\xaf\x01"))
+        subscriber.enqueue(video(5, KEYFRAME))
+        assert [m.timestamp for m in subscriber.queue] == [4, 5]
+        assert not subscriber.waiting_for_keyframe
+        assert subscriber.dropped_messages == 5
+
+    run(main())
+
+
+def test_sending_waits_for_the_players_window():
+    async def main():
+        session = FakeSession()
+        session.window_open.clear()
+        subscriber = Subscriber(session, 1, 10**6, SLOW_CONSUMER_DROP)
+        subscriber.enqueue(video(0, KEYFRAME))
+        await asyncio.sleep(0.01)
+        assert not session.sent and len(subscriber.queue) == 1
+        session.window_open.set()
+        await asyncio.sleep(0.01)
+        assert len(session.sent) == 1 and subscriber.queued_bytes == 0
+        subscriber.close()
+
+    run(main())
+
+
+def test_cancelling_a_subscriber_propagates_after_cleanup():
+    async def main():
+        session = FakeSession()
+        session.window_open.clear()  # Sending stalls: the queue holds on
+        budget = MemoryBudget()
+        subscriber = Subscriber(session, 1, 10**6, SLOW_CONSUMER_DROP, budget)
+        subscriber.enqueue(video(0, KEYFRAME))
+        await asyncio.sleep(0)
+        subscriber.task.cancel()
+        await asyncio.wait([subscriber.task])
+        assert subscriber.task.cancelled()
+        assert subscriber.closed and budget.used == 0
+
+    run(main())
@@ -0,0 +1,58 @@
+import itertools
+
+import aac
+import flv
+import h264
+import loadgen
+from loadgen import RTMP_MSG_TYPE_AUDIO, RTMP_MSG_TYPE_DATA, RTMP_MSG_TYPE_VIDEO
+
+
+def first_second(media):
+    """The messages of the first second of a timeline, after its set-up."""
+    return list(itertools.takewhile(lambda m: m[1] < 1000, media.timeline()))
+
+
+def test_synthetic_media_decodes_as_h264_and_aac():
+    media = loadgen.SyntheticMedia(video_kbps=2000, audio_kbps=128, fps=30, gop=60)
+    messages = first_second(media)
+    assert [m[0] for m in messages[:3]] == [
+        RTMP_MSG_TYPE_DATA,
+        RTMP_MSG_TYPE_VIDEO,
+        RTMP_MSG_TYPE_AUDIO,
+    ]
+
+    video = h264.H264Inspector()
+    sps = video.inspect(messages[1][2]).sps
+    assert (sps.width, sps.height) == (1280, 720)
+    audio = aac.AACInspector()
+    assert audio.inspect(0, messages[2][2]).sample_rate == loadgen.AAC_SAMPLE_RATE
+    for msg_type, timestamp, payload in messages[3:]:
+        if msg_type == RTMP_MSG_TYPE_VIDEO:
+            video.inspect(payload)
+        else:
+            audio.inspect(timestamp, payload)
+    assert video.frames == 30 and video.malformed_frames == 0
+    assert video.keyframe_mismatches == 0
+    assert video.nal_counts[h264.NAL_TYPE_IDR] == 1
+    assert audio.gaps == audio.discontinuities == 0
+
+
+def test_synthetic_media_sends_its_bitrate():
+    media = loadgen.SyntheticMedia(video_kbps=2000, audio_kbps=128, fps=30, gop=30)
+    media_bytes = sum(len(m[2]) for m in first_second(media)[3:])
+    assert abs(media_bytes * 8 - media.bitrate) / media.bitrate < 0.02
+
+
+def test_flv_media_loops_with_continuous_timestamps(tmp_path):
+    data = bytearray(flv.encode_header(has_audio=True, has_video=True))
+    flv.write_tag(data, flv.TAG_SCRIPT_DATA, 1000, b"\x02\x00\x0aonMetaData")
+    for timestamp in (1000, 1033, 1066):
+        flv.write_tag(data, flv.TAG_VIDEO, timestamp, b"\x27\x01" + bytes(8))
+    path = tmp_path / "clip.flv"
+    path.write_bytes(data)
+
+    media = loadgen.FLVMedia(str(path))
+    timeline = list(itertools.islice(media.timeline(), 7))
+    assert [m[1] for m in timeline] == [0, 0, 33, 66, 99, 132, 165]
+    assert timeline[0][2].startswith(b"\x02\x00\x0d@setDataFrame")
+    assert RTMP_MSG_TYPE_DATA not in [m[0] for m in timeline[1:]]
@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+
+import RTMPServer as rtmp
+from rtmp_chunk import ChunkDemuxer, ChunkMuxer, ChunkProtocolError, RTMPMessage
+from rtmp_live import SLOW_CONSUMER_DROP, Subscriber
+from rtmp_memory import MemoryBudget
+from support import FakeTransport, new_server, run
+
+
+def first_chunks(*messages):
+    """The first chunk of each (csid, length) message: all of them in progress."""
+    muxer = ChunkMuxer()
+    data = b""
+    for csid, length in messages:
+        message = b"".join(
+            muxer.mux(csid, rtmp.RTMP_MSG_TYPE_VIDEO, 1, 0, bytes(length))
+        )
+        data += message[: 12 + muxer.chunk_size]  # Type 0 header, one chunk
+    return data
+
+
+def test_messages_in_progress_are_charged_until_complete_or_closed():
+    budget = MemoryBudget()
+    demuxer = ChunkDemuxer(budget=budget)
+    data = b"".join(ChunkMuxer().mux(6, rtmp.RTMP_MSG_TYPE_VIDEO, 1, 0, bytes(1000)))
+    consumed, messages = demuxer.parse(data[:-1])
+    assert messages == [] and demuxer.partial_bytes == budget.used == 1000
+    assert len(demuxer.parse(data[consumed:])[1]) == 1
+    assert demuxer.partial_bytes == budget.used == 0
+
+    demuxer.parse(first_chunks((6, 1000), (7, 500)))
+    assert budget.used == 1500
+    demuxer.close()
+    assert demuxer.partial_bytes == budget.used == 0
+    assert budget.peak == 1500
+
+
+@pytest.mark.parametrize(
+    "limits, messages",
+    [
+        ({"max_message_size": 999}, [(6, 1000)]),
+        ({"max_partial_messages": 2}, [(6, 1000), (7, 1000), (8, 1000)]),
+        ({"max_partial_bytes": 2500}, [(6, 1000), (7, 1000), (8, 1000)]),
+    ],
+)
+def test_demuxer_limits_close_the_connection(limits, messages):
+    demuxer = ChunkDemuxer(**limits)
+    demuxer.parse(first_chunks(*messages[:-1]))
+    with pytest.raises(ChunkProtocolError):
+        demuxer.parse(first_chunks(*messages))
+
+
+def test_budget_pauses_above_high_water_and_resumes_at_low_water():
+    events = []
+    budget = MemoryBudget(
+        high_water=100,
+        low_water=50,
+        limit=150,
+        on_pressure=events.append,
+        on_limit=lambda: events.append("limit"),
+    )
+    budget.charge(100)
+    budget.charge(1)
+    budget.charge(49)
+    assert events == [True]
+    budget.charge(1)
+    budget.charge(1)  # Still over: shedding is already under way
+    assert events == [True, "limit"]
+    budget.release(100)
+    budget.release(2)
+    assert events == [True, "limit", False] and not budget.paused
+    budget.charge(101)
+    assert events == [True, "limit", False, True, "limit"]
+
+
+def connect(server):
+    transport = FakeTransport()
+    protocol = rtmp.RTMPProtocol(server)
+    protocol.connection_made(transport)
+    return protocol, transport
+
+
+def test_pressure_pauses_reading_and_drops_gop_caches():
+    async def main():
+        server = new_server(memory_high_water=1000, memory_low_water=100)
+        protocol, transport = connect(server)
+        session = protocol.session
+        stream = server.get_stream("cam")
+        keyframe = b"\x17\x01" + bytes(598)
+        stream.cache_media_message(
+            RTMPMessage(6, rtmp.RTMP_MSG_TYPE_VIDEO, 1, 0, keyframe)
+        )
+        session.demuxer.parse(first_chunks((6, 600)))
+        assert not transport.reading and not server.ingest_open.is_set()
+        assert stream.gop_cache == [] and server.memory.used == 600
+        session.demuxer.close()
+        assert transport.reading and server.ingest_open.is_set()
+
+    run(main())
+
+
+def test_the_session_holding_most_is_shed_over_the_limit():
+    async def main():
+        server = new_server(memory_limit=1500)
+        small, small_transport = connect(server)
+        big, big_transport = connect(server)
+        small.session.demuxer.parse(first_chunks((6, 500)))
+        big.session.demuxer.parse(first_chunks((6, 1200)))
+        assert not big_transport.closing  # Shed from the event loop
+        await asyncio.sleep(0)
+        assert big_transport.closing and not small_transport.closing
+        assert server.sessions == {small.session} and server.shed_connections == 1
+        assert server.memory.used == 500
+        big.connection_lost(None)
+        assert server.memory.used == 500
+
+    run(main())
+
+
+def test_going_over_the_limit_during_a_fan_out_sheds_after_it():
+    async def main():
+        server = new_server(memory_limit=2200)
+        stream = server.get_stream("cam")
+        for _ in range(4):
+            protocol, _ = connect(server)
+            session = protocol.session
+            session.send_window, session.peer_acked = 1, 0  # A stalled player
+            session.subscriber = Subscriber(
+                session, 1, 1 << 20, SLOW_CONSUMER_DROP, server.memory
+            )
+            session.play_stream = stream
+            stream.add_subscriber(session.subscriber)
+        keyframe = b"\x17\x01" + bytes(498)
+        # Cached once and queued for every player: over the limit at the 4th
+        stream.broadcast(RTMPMessage(6, rtmp.RTMP_MSG_TYPE_VIDEO, 1, 0, keyframe))
+        assert server.memory.used == 2500 and len(stream.subscribers) == 4
+        await asyncio.sleep(0)
+        assert server.shed_connections == 1 and len(stream.subscribers) == 3
+        assert server.memory.used == 2000
+
+    run(main())
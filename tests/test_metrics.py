@@ -0,0 +1,74 @@
+import amf0
+import metrics
+from metrics import Histogram, RateWindow, ServerMetrics
+from rtmp_chunk import RTMPMessage
+from support import FakeWriter, new_server, run
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram((0.01, 0.1))
+    for value in (0.005, 0.01, 0.05, 3.0):
+        histogram.observe(value)
+    lines = []
+    histogram.render(lines, "x_seconds", 'a="b"')
+    assert lines == [
+        'x_seconds_bucket{a="b",le="0.01"} 2',
+        'x_seconds_bucket{a="b",le="0.1"} 3',
+        'x_seconds_bucket{a="b",le="+Inf"} 4',
+        'x_seconds_sum{a="b"} 3.065',
+        'x_seconds_count{a="b"} 4',
+    ]
+
+
+def test_rate_window_counts_complete_seconds_and_forgets_stale_ones():
+    window = RateWindow(size=10)
+    for second in (100, 100, 101, 104):
+        window.add(second, 1000)
+    assert window.rates(105, 5) == (4 / 5, 4000 / 5)
+    assert window.rates(104, 5) == (3 / 5, 3000 / 5)  # 104 is still running
+    window.add(110, 500)  # Reuses the bucket of second 100
+    assert window.rates(111, 10) == (3 / 10, 2500 / 10)
+
+
+def test_stream_metrics_track_keyframes_and_rates():
+    clock = ServerMetrics()
+    clock.second = 50
+    stream = clock.stream()
+    for timestamp, payload in (
+        (0, b"\x17\x01"),
+        (40, b"\x27\x01"),
+        (2000, b"\x17\x01"),
+    ):
+        stream.add_video(timestamp, payload + bytes(98))
+    stream.add_audio(b"\xaf\x01" + bytes(8))
+    assert (stream.keyframes, stream.keyframe_interval) == (2, 2000)
+    assert stream.aac.video_timestamp == 2000
+    clock.second = 51
+    assert stream.video.rates(51, 1) == (3.0, 300.0)
+    assert stream.audio.rates(51, 1) == (1.0, 10.0)
+
+
+def test_render_exposes_sessions_and_streams():
+    async def main():
+        server = new_server()
+        session = server.open_session(FakeWriter())
+        payload = amf0.encode("publish", 1.0, None, 'cam"1')
+        await server.handle_message(RTMPMessage(3, 0x14, 1, 0, payload), session)
+        session.metrics.messages[0x14] += 1
+        text = metrics.render(server)
+
+        declared = set()
+        for line in text.splitlines():
+            if line.startswith("# TYPE "):
+                declared.add(line.split()[2])
+            elif line and not line.startswith("#"):
+                name = line.split("{")[0].split(" ")[0]
+                base = name.rsplit("_", 1)[0]
+                assert name in declared or base in declared, line
+        labels = f'session="{session.trace.session_id}",peer="127.0.0.1:50000",'
+        labels += 'stream="cam\\"1"'
+        assert f'rtmp_session_messages_total{{{labels},type="command"}} 1' in text
+        assert 'rtmp_stream_subscribers{stream="cam\\"1"} 0' in text
+        assert "rtmp_sessions 1" in text
+
+    run(main())
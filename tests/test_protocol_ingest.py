@@ -0,0 +1,165 @@
+import asyncio
+import struct
+
+import pytest
+
+import amf0
+import RTMPServer as rtmp
+from rtmp_chunk import ChunkMuxer
+from support import FakeTransport, new_server, read_messages, run
+
+C0C1 = bytes((rtmp.RTMP_VERSION,)) + bytes(rtmp.RTMP_HANDSHAKE_SIZE)
+C2 = bytes(rtmp.RTMP_HANDSHAKE_SIZE)
+
+
+def client_chunks(*messages):
+    muxer = ChunkMuxer()
+    data = bytearray()
+    for msg_type, payload in messages:
+        for chunk in muxer.mux(4, msg_type, 1, 0, payload):
+            data += chunk
+    return bytes(data)
+
+
+def feed(protocol, data, step):
+    """Delivers `data` the way the event loop does, `step` bytes per read."""
+    for offset in range(0, len(data), step):
+        piece = data[offset : offset + step]
+        buffer = protocol.get_buffer(len(piece))
+        buffer[: len(piece)] = piece
+        protocol.buffer_updated(len(piece))
+
+
+def connect(server):
+    transport = FakeTransport()
+    protocol = rtmp.RTMPProtocol(server)
+    protocol.connection_made(transport)
+    return protocol, transport
+
+
+@pytest.mark.parametrize("step", [1, 7, 4096])
+def test_handshake_then_messages_in_any_read_sizes(step):
+    async def main():
+        server = new_server()
+        protocol, transport = connect(server)
+        video = b"\x27\x01" + bytes(5000)
+        data = C0C1 + C2
+        data += client_chunks(
+            (rtmp.RTMP_MSG_TYPE_SET_CHUNK_SIZE, struct.pack(">I", 1024)),
+            (rtmp.RTMP_MSG_TYPE_VIDEO, video),
+        )
+        feed(protocol, data, step)
+        session = protocol.session
+        assert len(transport.data) == 1 + 2 * rtmp.RTMP_HANDSHAKE_SIZE  # S0+S1+S2
+        assert protocol.handshake_state == rtmp.HANDSHAKE_DONE
+        assert session.in_chunk_size == 1024
+        assert session.metrics.messages[rtmp.RTMP_MSG_TYPE_VIDEO] == 1
+        assert protocol.read_pos == protocol.write_pos == 0
+        assert not transport.closing
+        protocol.connection_lost(None)
+
+    run(main())
+
+
+def test_receive_buffer_compacts_across_reads():
+    async def main():
+        protocol, transport = connect(new_server())
+        frames = 100
+        data = C0C1 + C2
+        data += client_chunks(
+            *[(rtmp.RTMP_MSG_TYPE_VIDEO, b"\x27\x01" + bytes(9000))] * frames
+        )
+        assert len(data) > 2 * rtmp.RECEIVE_BUFFER_SIZE
+        feed(protocol, data, 50001)  # Reads end mid-chunk
+        assert protocol.session.metrics.messages[rtmp.RTMP_MSG_TYPE_VIDEO] == frames
+        assert not transport.closing
+        protocol.connection_lost(None)
+
+    run(main())
+
+
+def test_bad_version_closes_the_connection():
+    async def main():
+        protocol, transport = connect(new_server())
+        feed(protocol, b"\x06" + bytes(rtmp.RTMP_HANDSHAKE_SIZE), 4096)
+        assert transport.closing
+        protocol.connection_lost(None)
+
+    run(main())
+
+
+def test_commands_received_during_a_flush_are_handled():
+    async def main():
+        protocol, transport = connect(new_server())
+        feed(protocol, C0C1 + C2, 4096)
+        protocol.pause_writing()
+        connect_command = amf0.encode("connect", 1.0, {"app": "live"})
+        feed(
+            protocol, client_chunks((rtmp.RTMP_MSG_TYPE_COMMAND, connect_command)), 4096
+        )
+        await asyncio.sleep(0.01)
+        assert protocol.command_task is not None  # Flushing, waiting to drain
+        create_stream = amf0.encode("createStream", 2.0, None)
+        feed(protocol, client_chunks((rtmp.RTMP_MSG_TYPE_COMMAND, create_stream)), 4096)
+        protocol.resume_writing()
+        await asyncio.sleep(0.01)
+        assert protocol.command_task is None and not protocol.pending
+        replies = [
+            amf0.decode_all(message.payload)[:2]
+            for message in read_messages(
+                transport.data[1 + 2 * rtmp.RTMP_HANDSHAKE_SIZE :]
+            )
+            if message.msg_type == rtmp.RTMP_MSG_TYPE_COMMAND
+        ]
+        assert ["_result", 2.0] in replies
+        protocol.connection_lost(None)
+
+    run(main())
+
+
+def test_drain_returns_at_once_unless_paused():
+    async def main():
+        writer = rtmp.TransportWriter(FakeTransport())
+        await asyncio.wait_for(writer.drain(), 1)
+
+    run(main())
+
+
+def test_resume_writing_wakes_every_drain():
+    async def main():
+        writer = rtmp.TransportWriter(FakeTransport())
+        writer.pause_writing()
+        drains = [asyncio.create_task(writer.drain()) for _ in range(2)]
+        await asyncio.sleep(0)
+        assert not any(drain.done() for drain in drains)
+        writer.resume_writing()
+        await asyncio.wait_for(asyncio.gather(*drains), 1)
+
+    run(main())
+
+
+def test_connection_lost_fails_every_drain():
+    async def main():
+        writer = rtmp.TransportWriter(FakeTransport())
+        writer.pause_writing()
+        drains = [asyncio.create_task(writer.drain()) for _ in range(2)]
+        await asyncio.sleep(0)
+        writer.connection_lost(None)
+        results = await asyncio.gather(*drains, return_exceptions=True)
+        assert all(isinstance(result, ConnectionResetError) for result in results)
+
+    run(main())
+
+
+def test_cancelled_drain_leaves_no_waiter():
+    async def main():
+        writer = rtmp.TransportWriter(FakeTransport())
+        writer.pause_writing()
+        drain = asyncio.create_task(writer.drain())
+        await asyncio.sleep(0)
+        drain.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await drain
+        assert not writer._drain_waiters
+
+    run(main())
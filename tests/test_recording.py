@@ -0,0 +1,130 @@
+import struct
+
+import amf0
+import flv
+from rtmp_chunk import RTMPMessage
+from rtmp_live import (
+    RTMP_MSG_TYPE_AUDIO,
+    RTMP_MSG_TYPE_DATA,
+    RTMP_MSG_TYPE_VIDEO,
+    LiveStream,
+)
+from rtmp_record import RecordingWriter
+
+AVC_HEADER = b"\x17\x00" + bytes(10)
+AAC_HEADER = b"\xaf\x00\x12\x10"
+KEYFRAME = b"\x17\x01" + bytes(98)
+INTERFRAME = b"\x27\x01" + bytes(48)
+AUDIO = b"\xaf\x01" + bytes(8)
+
+
+def video(timestamp, payload):
+    return RTMPMessage(6, RTMP_MSG_TYPE_VIDEO, 1, timestamp, payload)
+
+
+def audio(timestamp, payload=AUDIO):
+    return RTMPMessage(4, RTMP_MSG_TYPE_AUDIO, 1, timestamp, payload)
+
+
+def metadata(**properties):
+    payload = amf0.encode("@setDataFrame", "onMetaData", amf0.ECMAArray(properties))
+    return RTMPMessage(5, RTMP_MSG_TYPE_DATA, 1, 0, payload)
+
+
+def record(tmp_path, messages, segment_bytes=0, segment_seconds=0):
+    """Publishes `messages` with a recorder attached; returns the segments' bytes."""
+    writer = RecordingWriter(str(tmp_path), segment_bytes, segment_seconds, 1 << 20)
+    stream = LiveStream("live/cam 1", 1 << 20)
+    stream.sinks.append(writer.open(stream))
+    for message in messages:
+        stream.broadcast(message)
+    for sink in stream.sinks:
+        sink.close()
+    writer.close()
+    return [path.read_bytes() for path in sorted(tmp_path.iterdir())]
+
+
+def read_segment(data):
+    """The segment's tags, after checking every PreviousTagSize."""
+    tags = list(flv.iter_tags(data))
+    pos = flv.parse_header(data)[2]
+    for tag in tags:
+        pos += flv.TAG_HEADER_SIZE + len(tag.data)
+        assert struct.unpack_from(">I", data, pos)[0] == flv.TAG_HEADER_SIZE + len(
+            tag.data
+        )
+        pos += 4
+    assert pos == len(data)
+    return tags
+
+
+def test_a_segment_starts_at_a_keyframe_with_headers_and_metadata(tmp_path):
+    (segment,) = record(
+        tmp_path,
+        [
+            metadata(width=1280.0, encoder="obs"),
+            video(1000, AVC_HEADER),
+            audio(1000, AAC_HEADER),
+            video(1000, INTERFRAME),  # Before any keyframe: not recorded
+            video(5000, KEYFRAME),
+            audio(4990),  # Just ahead of the keyframe: clamped to 0
+            video(5040, INTERFRAME),
+            audio(5100),
+        ],
+    )
+    tags = read_segment(segment)
+    assert flv.parse_header(segment)[:2] == (True, True)  # Patched at close
+    assert [(t.tag_type, t.timestamp) for t in tags] == [
+        (flv.TAG_SCRIPT_DATA, 0),
+        (flv.TAG_VIDEO, 0),
+        (flv.TAG_AUDIO, 0),
+        (flv.TAG_VIDEO, 0),
+        (flv.TAG_AUDIO, 0),
+        (flv.TAG_VIDEO, 40),
+        (flv.TAG_AUDIO, 100),
+    ]
+    assert [bytes(t.data) for t in tags[1:4]] == [AVC_HEADER, AAC_HEADER, KEYFRAME]
+    name, properties = amf0.decode_all(tags[0].data)
+    assert name == "onMetaData" and properties["encoder"] == "obs"
+    assert properties["duration"] == 0.1 and properties["filesize"] == len(segment)
+
+
+def test_segments_rotate_at_the_first_keyframe_past_the_duration(tmp_path):
+    messages = [video(0, AVC_HEADER)]
+    for timestamp in range(0, 3000, 100):
+        keyframe = timestamp % 500 == 0
+        messages.append(video(timestamp, KEYFRAME if keyframe else INTERFRAME))
+    segments = record(tmp_path, messages, segment_seconds=1.2)
+    starts = []
+    for segment in segments:
+        tags = read_segment(segment)
+        assert bytes(tags[1].data) == AVC_HEADER and bytes(tags[2].data) == KEYFRAME
+        starts.append(len(tags) - 2)
+    assert starts == [15, 15]  # Rotated at 1500 ms, the first keyframe past 1.2 s
+
+
+def test_audio_only_streams_segment_on_audio_frames(tmp_path):
+    messages = [audio(0, AAC_HEADER)] + [audio(t) for t in range(0, 1000, 23)]
+    (segment,) = record(tmp_path, messages, segment_bytes=1 << 20)
+    assert flv.parse_header(segment)[:2] == (True, False)
+    assert len(read_segment(segment)) == 2 + len(messages) - 1
+
+
+def test_a_recorder_falling_behind_drops_until_a_keyframe(tmp_path):
+    writer = RecordingWriter(str(tmp_path), 0, 0, max_queued_bytes=1000)
+    stream = LiveStream("cam", 1 << 20)
+    recorder = writer.open(stream)
+    recorder.write(video(0, KEYFRAME))
+    writer.queued_bytes += 10000  # As if the thread were 10000 bytes behind
+    recorder.write(video(40, INTERFRAME))
+    recorder.write(video(80, KEYFRAME))  # Flushes frames 0 and 40: dropped
+    recorder.write(video(120, INTERFRAME))
+    assert recorder.waiting_for_keyframe
+    writer.queued_bytes -= 10000
+    recorder.write(video(160, KEYFRAME))
+    recorder.close()
+    writer.close()
+
+    (path,) = tmp_path.iterdir()
+    timestamps = [t.timestamp for t in read_segment(path.read_bytes())][1:]
+    assert timestamps == [160] and recorder.dropped_bytes > 0
@@ -0,0 +1,62 @@
+import struct
+
+import amf0
+import RTMPServer as rtmp
+from rtmp_chunk import ChunkMuxer, RTMPMessage
+from support import FakeWriter, new_server, read_messages, run
+
+
+def command(*values):
+    return RTMPMessage(3, rtmp.RTMP_MSG_TYPE_COMMAND, 0, 0, amf0.encode(*values))
+
+
+def test_each_connection_keeps_its_own_chunk_sizes_and_stream_ids():
+    async def main():
+        server = new_server()
+        first = server.open_session(FakeWriter())
+        second = server.open_session(FakeWriter())
+        muxer = ChunkMuxer()
+        set_chunk_size = b"".join(
+            muxer.mux(
+                2, rtmp.RTMP_MSG_TYPE_SET_CHUNK_SIZE, 0, 0, struct.pack(">I", 4096)
+            )
+        )
+        first.demuxer.parse(set_chunk_size)
+        await server.handle_message(command("connect", 1.0, {"app": "live"}), first)
+        for _ in range(2):
+            await server.handle_message(command("createStream", 2.0, None), first)
+        await server.handle_message(command("createStream", 2.0, None), second)
+
+        assert (first.in_chunk_size, second.in_chunk_size) == (4096, 128)
+        # connect raises our chunk size to 4096 and sets it back to 128
+        assert first.out_chunk_size == 128 and first.app == "live"
+        assert not second.connected and second.app is None
+        assert first.stream_ids == {1, 2} and second.stream_ids == {1}
+        results = [
+            amf0.decode_all(message.payload)
+            for message in read_messages(second.writer.data)
+        ]
+        assert results == [["_result", 2.0, None, 1.0]]
+
+        first.release_stream_id(1.0)
+        assert first.stream_ids == {2} and first.allocate_stream_id() == 3
+
+    run(main())
+
+
+def test_closing_a_session_drops_its_registrations():
+    async def main():
+        server = new_server()
+        publisher = server.open_session(FakeWriter())
+        await server.handle_message(
+            command("publish", 3.0, None, "cam?token=x"), publisher
+        )
+        stream = server.streams["cam"]
+        assert stream.publisher is publisher and publisher.stream_key == "cam"
+        assert server.sessions_by_stream_key == {"cam": {publisher}}
+
+        server.close_session(publisher)
+        assert publisher.publish_stream is None and stream.publisher is None
+        assert server.sessions == set() and server.sessions_by_stream_key == {}
+
+    run(main())
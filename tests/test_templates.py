@@ -0,0 +1,88 @@
+import struct
+
+import pytest
+
+import amf0
+from rtmp_templates import NUMBER, STRING, TemplateCache, compile_template
+
+CONNECT_FIELDS = {"transaction_id": NUMBER, "tc_url": STRING}
+
+
+def connect_result(transaction_id, tc_url):
+    return amf0.encode(
+        "_result", transaction_id, None, {"tcUrl": tc_url, "capabilities": 31.0}
+    )
+
+
+@pytest.mark.parametrize(
+    "transaction_id, tc_url",
+    [(1.0, "rtmp://a/live"), (7.0, ""), (2.5, "rtmp://" + "x" * 70000 + "/live")],
+)
+def test_rendering_matches_encoding_from_scratch(transaction_id, tc_url):
+    cache = TemplateCache()
+    cache.render(
+        "connect", connect_result, CONNECT_FIELDS, transaction_id=0.0, tc_url="warm"
+    )
+    rendered = cache.render(
+        "connect",
+        connect_result,
+        CONNECT_FIELDS,
+        transaction_id=transaction_id,
+        tc_url=tc_url,
+    )
+    assert rendered == connect_result(transaction_id, tc_url)
+    assert len(cache.templates) == 1
+
+
+def test_payload_without_fields_is_built_once_and_shared():
+    calls = []
+
+    def encode():
+        calls.append(1)
+        return amf0.encode("onBWDone", 0.0, None)
+
+    cache = TemplateCache()
+    first = cache.render("onBWDone", encode)
+    assert cache.render("onBWDone", encode) is first
+    assert calls == [1]
+
+
+def test_number_fields_are_patched_into_a_copy():
+    template = compile_template(
+        lambda transaction_id: amf0.encode("_result", transaction_id, None),
+        {"transaction_id": NUMBER},
+    )
+    assert template.render({"transaction_id": 3.0}) == amf0.encode("_result", 3.0, None)
+    assert template.render({"transaction_id": 4.0}) == amf0.encode("_result", 4.0, None)
+
+
+def test_a_field_the_payload_does_not_carry_is_an_error():
+    with pytest.raises(ValueError):
+        compile_template(lambda name: amf0.encode("_result"), {"name": STRING})
+    with pytest.raises(ValueError):
+        compile_template(lambda n: amf0.encode(n, n), {"n": NUMBER})
+
+
+def test_a_field_kind_does_not_depend_on_the_first_value():
+    cache = TemplateCache()
+    first = cache.render(
+        "connect", connect_result, CONNECT_FIELDS, transaction_id=1.0, tc_url=None
+    )
+    assert first == connect_result(1.0, None)
+    rendered = cache.render(
+        "connect", connect_result, CONNECT_FIELDS, transaction_id=2.0, tc_url="rtmp://a"
+    )
+    assert rendered == connect_result(2.0, "rtmp://a")
+
+
+def test_a_template_whose_first_render_failed_is_not_kept():
+    cache = TemplateCache()
+    with pytest.raises(struct.error):
+        cache.render(
+            "connect", connect_result, CONNECT_FIELDS, transaction_id="1", tc_url=""
+        )
+    assert cache.templates == {}
+    rendered = cache.render(
+        "connect", connect_result, CONNECT_FIELDS, transaction_id=1.0, tc_url=""
+    )
+    assert rendered == connect_result(1.0, "")
@@ -0,0 +1,48 @@
+import logging
+
+from rtmp_chunk import ChunkDemuxer, ChunkMuxer
+from tracing import TRACE, Tracer
+
+
+def test_sampling_decides_per_session():
+    assert not Tracer(sample_rate=0.0).session(None).sampled
+    tracer = Tracer(sample_rate=1.0)
+    first, second = tracer.session(None), tracer.session(None)
+    assert first.sampled and (first.session_id, second.session_id) == (1, 2)
+
+
+def test_fields_are_only_built_for_emitted_events(caplog):
+    calls = []
+
+    def head():
+        calls.append(1)
+        return "0102"
+
+    sampled = Tracer(sample_rate=1.0).session(None)
+    unsampled = Tracer(sample_rate=0.0).session(None)
+    with caplog.at_level(logging.DEBUG, logger="rtmp.trace"):
+        sampled.event("message", TRACE, head=head)  # Below the logger's level
+        unsampled.event("message", logging.DEBUG, head=head)
+        assert calls == [] and not caplog.records
+        assert not sampled.enabled(TRACE) and sampled.enabled(logging.DEBUG)
+        sampled.event("command", command="connect", head=head)
+    assert calls  # Once per handler that formatted the record
+    assert (
+        caplog.records[0].getMessage() == "session=1 command command=connect head=0102"
+    )
+
+
+def test_chunk_header_ring_keeps_the_latest_headers(caplog):
+    trace = Tracer(sample_rate=0.0, ring_size=3).session(("10.0.0.1", 1935))
+    demuxer = ChunkDemuxer(header_log=trace.headers)
+    muxer = ChunkMuxer()
+    for timestamp in range(5):
+        demuxer.parse(b"".join(muxer.mux(6, 9, 1, timestamp * 40, bytes(10))))
+    assert [header[2] for header in trace.headers] == [80, 120, 160]
+
+    # Dumped even though the session isn't sampled
+    with caplog.at_level(logging.WARNING, logger="rtmp.trace"):
+        trace.dump("protocol error: test")
+    message = caplog.records[0].getMessage()
+    assert "protocol error: test; last 3 chunk headers" in message
+    assert "csid=6 ts=160 len=10 type=0x9 stream=1 chunk=10" in message
@@ -0,0 +1,72 @@
+import importlib.util
+import socket
+
+from rtmp_tuning import (
+    TuningSettings,
+    create_listen_socket,
+    select_event_loop,
+    tune_connection,
+)
+from support import FakeTransport
+
+
+class SocketTransport(FakeTransport):
+    """A FakeTransport over a real socket, recording its write buffer limits."""
+
+    def __init__(self, sock):
+        super().__init__()
+        self.sock = sock
+        self.limits = None
+
+    def get_extra_info(self, name, default=None):
+        return self.sock if name == "socket" else super().get_extra_info(name, default)
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        self.limits = (high, low)
+
+
+def test_listen_socket_gets_the_buffers_and_backlog():
+    settings = TuningSettings(recv_buffer=256 * 1024, send_buffer=128 * 1024)
+    sock = create_listen_socket("127.0.0.1", 0, settings)
+    try:
+        assert not sock.getblocking()
+        # Linux doubles the requested size for its bookkeeping
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) >= 256 * 1024
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF) >= 128 * 1024
+        client = socket.create_connection(sock.getsockname())
+        client.close()
+    finally:
+        sock.close()
+
+
+def test_accepted_connections_get_nodelay_and_write_limits():
+    listener = create_listen_socket("127.0.0.1", 0, TuningSettings())
+    client = socket.create_connection(listener.getsockname())
+    listener.setblocking(True)
+    accepted, _ = listener.accept()
+    try:
+        transport = SocketTransport(accepted)
+        tune_connection(transport, TuningSettings())
+        assert accepted.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        assert transport.limits is None  # asyncio's defaults kept
+
+        settings = TuningSettings(
+            tcp_nodelay=False, write_high_water=1 << 20, write_low_water=1 << 18
+        )
+        tune_connection(transport, settings)
+        assert not accepted.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        assert transport.limits == (1 << 20, 1 << 18)
+    finally:
+        for sock in (accepted, client, listener):
+            sock.close()
+
+
+def test_transports_without_a_socket_are_left_alone():
+    tune_connection(FakeTransport(), TuningSettings())
+
+
+def test_uvloop_is_only_installed_when_picked_and_available():
+    assert select_event_loop(TuningSettings(uvloop=False)) == "asyncio"
+    if importlib.util.find_spec("uvloop") is None:
+        assert select_event_loop(TuningSettings(uvloop=None)) == "asyncio"
+        assert select_event_loop(TuningSettings(uvloop=True)) == "asyncio"
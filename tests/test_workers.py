@@ -0,0 +1,78 @@
+import rtmp_workers
+from rtmp_workers import RESTART_DELAY_MAX, RESTART_DELAY_MIN, WorkerSupervisor
+
+
+class DeadProcess:
+    pid = 4242
+    exitcode = 1
+
+    def is_alive(self):
+        return False
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def new_supervisor(monkeypatch, workers=1):
+    clock = Clock()
+    monkeypatch.setattr(rtmp_workers.time, "monotonic", clock)
+    supervisor = WorkerSupervisor(workers, reuse_port=False)
+    started = []
+
+    def start_worker(worker):
+        started.append(worker.worker_id)
+        worker.process = DeadProcess()
+        worker.started_at = clock.now
+        worker.restart_at = None
+
+    monkeypatch.setattr(supervisor, "start_worker", start_worker)
+    for worker in supervisor.workers:
+        start_worker(worker)
+    started.clear()
+    return supervisor, clock, started
+
+
+def test_a_worker_dying_young_is_restarted_with_doubling_backoff(monkeypatch):
+    supervisor, clock, started = new_supervisor(monkeypatch)
+    worker = supervisor.workers[0]
+    delays = []
+    for _ in range(8):
+        supervisor.check_workers()
+        delays.append(worker.restart_at - clock.now)
+        clock.now = worker.restart_at
+        supervisor.check_workers()
+    expected = [min(RESTART_DELAY_MIN * 2**n, RESTART_DELAY_MAX) for n in range(8)]
+    assert delays == expected and delays[-1] == RESTART_DELAY_MAX
+    assert started == [0] * 8 and worker.restarts == 8
+
+
+def test_a_worker_that_ran_long_enough_restarts_quickly(monkeypatch):
+    supervisor, clock, started = new_supervisor(monkeypatch)
+    worker = supervisor.workers[0]
+    worker.restart_delay = RESTART_DELAY_MAX
+    clock.now += rtmp_workers.WORKER_STABLE_AFTER
+    supervisor.check_workers()
+    assert worker.restart_at - clock.now == RESTART_DELAY_MIN
+
+
+def test_stats_are_summed_across_workers(monkeypatch):
+    supervisor, clock, started = new_supervisor(monkeypatch, workers=2)
+    supervisor.worker_stats = {
+        0: {"worker": 0, "pid": 10, "uptime": 5.0, "connections": 3, "streams": 1},
+        1: {"worker": 1, "pid": 11, "uptime": 7.0, "connections": 4, "streams": 2},
+    }
+    supervisor.workers[1].restarts = 2
+    assert supervisor.aggregate_stats() == {
+        "workers": 2,
+        "connections": 7,
+        "streams": 3,
+        "restarts": 2,
+    }
+    # A dead worker's stats stop counting as soon as it is noticed
+    supervisor.check_workers()
+    assert supervisor.aggregate_stats()["workers"] == 0
@@ -0,0 +1,94 @@
+import collections
+import itertools
+import logging
+import random
+
+# Below DEBUG: per-message events
+TRACE = 5
+logging.addLevelName(TRACE, "TRACE")
+
+logger = logging.getLogger("rtmp.trace")
+
+
+class LazyFields:
+    """
+    Event fields formatted only if a handler actually emits the record.
+
+    Callable values are called at that point too, so expensive fields (hex
+    dumps, decoded summaries) cost nothing for filtered-out events.
+    """
+
+    __slots__ = ("fields",)
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def __str__(self):
+        return " ".join(
+            f"{name}={value() if callable(value) else value}"
+            for name, value in self.fields.items()
+        )
+
+
+def format_chunk_header(header):
+    chunk_format, csid, timestamp, length, msg_type, stream_id, size = header
+    return (
+        f"fmt={chunk_format} csid={csid} ts={timestamp} len={length} "
+        f"type={hex(msg_type)} stream={stream_id} chunk={size}"
+    )
+
+
+class SessionTrace:
+    """
+    Tracing state of one connection.
+
+    Events are emitted only if the session was sampled and the level is
+    enabled on the `rtmp.trace` logger. `headers` is a ring of the last chunk
+    headers the demuxer parsed (see ChunkDemuxer's `header_log`), dumped
+    regardless of sampling when something goes wrong.
+    """
+
+    __slots__ = ("session_id", "peer", "sampled", "headers")
+
+    def __init__(self, session_id, peer, sampled, ring_size):
+        self.session_id = session_id
+        self.peer = peer
+        self.sampled = sampled
+        self.headers = collections.deque(maxlen=ring_size) if ring_size else None
+
+    def enabled(self, level=TRACE):
+        """Guard for hot paths, so not even the event's arguments are built."""
+        return self.sampled and logger.isEnabledFor(level)
+
+    def event(self, name, level=logging.DEBUG, /, **fields):
+        if self.sampled and logger.isEnabledFor(level):
+            logger.log(
+                level, "session=%d %s %s", self.session_id, name, LazyFields(fields)
+            )
+
+    def dump(self, reason, level=logging.WARNING):
+        """Logs the chunk header ring, oldest first."""
+        if not self.headers or not logger.isEnabledFor(level):
+            return
+        logger.log(
+            level,
+            "session=%d peer=%s %s; last %d chunk headers:\n  %s",
+            self.session_id,
+            self.peer,
+            reason,
+            len(self.headers),
+            "\n  ".join(map(format_chunk_header, self.headers)),
+        )
+
+
+class Tracer:
+    """Hands out SessionTraces, deciding per connection whether to sample it."""
+
+    def __init__(self, sample_rate=1.0, ring_size=64):
+        self.sample_rate = sample_rate
+        self.ring_size = ring_size
+        self.session_ids = itertools.count(1)
+
+    def session(self, peer):
+        sampled = self.sample_rate >= 1.0 or random.random() < self.sample_rate
+        return SessionTrace(next(self.session_ids), peer, sampled, self.ring_size)